@@ -0,0 +1,137 @@
+# iot_project/core_system/admin_tools.py
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Min, Max, QuerySet
+from django.utils import timezone
+from django.utils.functional import cached_property
+from datetime import datetime, time, timedelta
+import json
+
+from .db_router import is_pinned_to_primary, pin_to_primary, use_replica
+
+
+# ==============================================================================
+# CONTAGEM ESTIMADA (EVITA COUNT(*) EM TABELAS COM MILHÕES DE LINHAS)
+# ==============================================================================
+def estimate_count(queryset):
+    """
+    Número aproximado de linhas do queryset segundo o planejador do PostgreSQL:
+    - sem filtros: pg_class.reltuples (atualizado pelo ANALYZE/autovacuum);
+    - com filtros: estimativa de linhas do EXPLAIN.
+    Retorna None em outros bancos ou se não houver estatísticas.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            # reltuples = -1: tabela ainda não analisada
+            return row[0] if row and row[0] >= 0 else None
+
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator do Admin que troca o COUNT(*) pela estimativa do PostgreSQL quando
+    ela passa de ADMIN_ESTIMATED_COUNT_THRESHOLD. Abaixo do limite (e no SQLite)
+    a contagem continua exata.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list) if isinstance(self.object_list, QuerySet) else None
+        if estimate is None or estimate < settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+            return super().count
+        return estimate
+
+
+# ==============================================================================
+# DATE HIERARCHY SEM DISTINCT SOBRE A TABELA INTEIRA
+# ==============================================================================
+class IndexedDateHierarchyQuerySet(QuerySet):
+    """
+    QuerySet para listagens com date_hierarchy em tabelas grandes.
+
+    O Admin monta os links de ano/mês/dia com queryset.datetimes(), que faz um
+    SELECT DISTINCT date_trunc(...) varrendo todas as linhas do período. Aqui só o
+    primeiro e o último valor são lidos (MIN/MAX resolvidos pelo índice do campo)
+    e os períodos intermediários são gerados em Python; um período sem dados
+    aparece como link, mas abre uma página vazia.
+    """
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        date_range = self.aggregate(first=Min(field_name), last=Max(field_name))
+        first, last = date_range['first'], date_range['last']
+        if first is None or last is None:
+            return []
+
+        first, last = timezone.localtime(first, tzinfo), timezone.localtime(last, tzinfo)
+        periods = []
+        current = _truncate(first, kind)
+        while current <= last:
+            periods.append(current)
+            current = _next_period(current, kind)
+        return periods if order == 'ASC' else periods[::-1]
+
+
+def _truncate(value, kind):
+    if kind == 'year':
+        value = value.replace(month=1, day=1)
+    elif kind == 'month':
+        value = value.replace(day=1)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_period(value, kind):
+    if kind == 'year':
+        return value.replace(year=value.year + 1)
+    if kind == 'month':
+        return value.replace(year=value.year + value.month // 12, month=value.month % 12 + 1)
+    return datetime.combine(value.date() + timedelta(days=1), time.min, tzinfo=value.tzinfo)
+
+
+# ==============================================================================
+# LISTAGENS DO ADMIN NA RÉPLICA DE LEITURA
+# ==============================================================================
+class ReplicaChangelistMixin:
+    """
+    Mixin de ModelAdmin: a listagem (GET) consulta a réplica de leitura.
+    Ações (POST), formulários de edição e exclusões continuam no primário, e
+    quem acabou de gravar algo lê do primário por alguns segundos (pin_to_primary).
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET' or is_pinned_to_primary(request):
+            return super().changelist_view(request, extra_context)
+        with use_replica():
+            response = super().changelist_view(request, extra_context)
+            # O TemplateResponse só avalia os querysets ao renderizar: renderiza ainda na réplica
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+    def log_addition(self, request, obj, message):
+        pin_to_primary(request)
+        return super().log_addition(request, obj, message)
+
+    def log_change(self, request, obj, message):
+        pin_to_primary(request)
+        return super().log_change(request, obj, message)
+
+    def log_deletions(self, request, queryset):
+        pin_to_primary(request)
+        return super().log_deletions(request, queryset)
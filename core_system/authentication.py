@@ -6,11 +6,15 @@ from django.contrib.auth.models import User
 from devices.models import Device 
 from decouple import config
 
+from . import ratelimit
+
 # --- Classe que simula um usuário autenticado para o Celery/Sistema ---
 class CeleryUser:
     """Objeto que simula um usuário autenticado e com permissões (is_staff=True)."""
     # DRF Permissions geralmente verificam is_authenticated e is_staff/is_superuser
     is_staff = True
+    # Envia comandos a dispositivos de todos os sites (devices.sites.user_site_ids)
+    is_superuser = True
     is_active = True
     pk = -1 # Um PK inválido/não usado para o Celery
     
@@ -52,9 +56,16 @@ class TokenAuthentication(authentication.BaseAuthentication):
 
         # VERIFICAÇÃO 2: TOKEN DO DISPOSITIVO (ESP8266)
         try:
-            device = Device.objects.get(device_id=auth_token)
+            # Com o site: a ingestão precisa saber em qual banco gravar a telemetria (device.telemetry_db)
+            device = Device.objects.select_related('site').get(device_id=auth_token)
         except Device.DoesNotExist:
             raise exceptions.AuthenticationFailed('Token de dispositivo inválido.')
+
+        # Limite de requisições do tipo do dispositivo nas próximas requisições (core_system/ratelimit.py)
+        ratelimit.remember_device_type(auth_token, device.device_type)
+
+        # 3. Escopo: o Device autenticado só enxerga o próprio site (devices.sites.user_site_ids),
+        # e o DeviceSerializer recusa execuções (command_run) de tarefas de outro site
         
         # 4. Sucesso: retorna o objeto Device como o \"user\" para o DRF
         return (device, auth_token)
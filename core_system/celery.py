@@ -1,12 +1,20 @@
 # iot_project/core_system/celery.py
 
 import os
+import socket
+import sys
+import time
 from celery import Celery
+from celery.signals import task_prerun, task_postrun, worker_init, worker_ready
 from decouple import config
 
 # Define o módulo de settings padrão do Django para o Celery
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core_system.settings')
 
+# Tipo de processo para as configurações de conexão com o banco (DB_PROCESS_TYPE, ver settings.py)
+if os.path.basename(sys.argv[0]) == 'celery':
+    os.environ.setdefault('DB_PROCESS_TYPE', 'beat' if 'beat' in sys.argv else 'worker')
+
 # Cria a instância da aplicação Celery. O argumento principal é o nome do módulo.
 # O namespace='CELERY' fará com que todas as configurações relacionadas ao Celery
 # sejam prefixadas com CELERY_ no settings.py (ex: CELERY_BROKER_URL).
@@ -22,4 +30,57 @@ app.autodiscover_tasks()
 # Esta é uma tarefa de debug, você pode removê-la depois
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
+
+
+# ==============================================================================
+# MÉTRICAS DOS WORKERS (duração das tarefas, utilização e concorrência)
+# ==============================================================================
+# Início de cada tarefa em execução neste processo, por task_id
+_task_started = {}
+
+
+def _worker_name():
+    return socket.gethostname()
+
+
+@task_prerun.connect
+def _record_task_start(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _record_task_end(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is None:
+        return
+    from . import metrics
+
+    duration = time.perf_counter() - started
+    with metrics.record() as pipe:
+        metrics.CELERY_TASK_DURATION.observe(pipe, duration, task=task.name, state=state or 'UNKNOWN')
+        metrics.CELERY_WORKER_BUSY.inc(pipe, duration, worker=_worker_name())
+
+
+@worker_ready.connect
+def _record_worker_concurrency(sender=None, **kwargs):
+    from . import metrics
+
+    # sender é o Consumer; o WorkController (controller) conhece a concorrência efetiva
+    controller = getattr(sender, 'controller', None)
+    concurrency = getattr(controller, 'concurrency', None) or app.conf.worker_concurrency or os.cpu_count()
+    with metrics.record() as pipe:
+        metrics.CELERY_WORKER_CONCURRENCY.set(pipe, concurrency, worker=_worker_name())
+
+
+# ==============================================================================
+# POOL DE CONEXÕES x FORK DOS PROCESSOS FILHOS
+# ==============================================================================
+@worker_init.connect
+def _close_db_pools_before_fork(**kwargs):
+    # Um pool aberto no processo principal (ex: durante as verificações do Django)
+    # seria herdado pelos filhos com as threads de manutenção mortas; cada filho
+    # abre o seu ao executar a primeira tarefa.
+    from .db_pool import close_pools
+
+    close_pools()
@@ -0,0 +1,82 @@
+# iot_project/core_system/db_pool.py
+
+
+# ==============================================================================
+# CONEXÕES COM O BANCO: POOL / PERSISTENTES / PGBOUNCER
+# ==============================================================================
+# Modos (DB_CONNECTION_MODE, ver settings.py):
+#   none        -> uma conexão nova por requisição/tarefa (comportamento antigo)
+#   persistent  -> conexão reaproveitada por DB_CONN_MAX_AGE segundos, com health check
+#   pool        -> pool do psycopg 3 (psycopg_pool) por processo; conexões testadas
+#                  antes de serem entregues e recicladas após max_lifetime
+#   pgbouncer   -> DB_HOST aponta para um PgBouncer em modo transaction: conexões
+#                  persistentes até o PgBouncer, sem cursores no servidor e sem
+#                  prepared statements (o psycopg 3 já os desliga no Django)
+#
+# Cada tipo de processo (web, worker, beat) tem o seu padrão em PROCESS_DEFAULTS.
+
+CONNECTION_MODES = ('none', 'persistent', 'pool', 'pgbouncer')
+
+PROCESS_TYPES = ('web', 'worker', 'beat')
+
+PROCESS_DEFAULTS = {
+    # Gunicorn (um processo por worker): pool pequeno, sempre com 1 conexão pronta
+    'web': {'mode': 'pool', 'min_size': 1, 'max_size': 4},
+    # Cada processo filho do Celery executa uma tarefa por vez
+    'worker': {'mode': 'pool', 'min_size': 1, 'max_size': 2},
+    # O Beat é um único processo com poucas consultas: uma conexão persistente basta
+    'beat': {'mode': 'persistent', 'min_size': 1, 'max_size': 1},
+}
+
+
+def apply_connection_mode(database, mode, min_size=1, max_size=4, max_age=300,
+                          timeout=10, max_idle=300, max_lifetime=1800):
+    """Ajusta (no próprio dict) as configurações de um banco de DATABASES para o modo escolhido."""
+    if mode not in CONNECTION_MODES:
+        raise ValueError(f"DB_CONNECTION_MODE inválido: '{mode}' (use {', '.join(CONNECTION_MODES)}).")
+
+    if mode in ('pool', 'pgbouncer') and 'postgresql' not in database.get('ENGINE', ''):
+        # Pool e PgBouncer só existem no PostgreSQL (ex: SQLite em desenvolvimento)
+        mode = 'persistent'
+
+    options = database.setdefault('OPTIONS', {})
+    options.pop('pool', None)
+    database['DISABLE_SERVER_SIDE_CURSORS'] = False
+
+    if mode == 'none':
+        database['CONN_MAX_AGE'] = 0
+        database['CONN_HEALTH_CHECKS'] = False
+
+    elif mode in ('persistent', 'pgbouncer'):
+        database['CONN_MAX_AGE'] = max_age
+        # Testa a conexão reaproveitada no início de cada requisição (reconecta se caiu)
+        database['CONN_HEALTH_CHECKS'] = True
+        if mode == 'pgbouncer':
+            # Em modo transaction, um cursor nomeado não sobrevive ao fim da transação
+            database['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+    else:
+        from psycopg_pool import ConnectionPool
+
+        # O pool do Django exige CONN_MAX_AGE = 0: a conexão volta ao pool no fim da requisição
+        database['CONN_MAX_AGE'] = 0
+        database['CONN_HEALTH_CHECKS'] = False
+        options['pool'] = {
+            'min_size': min_size,
+            'max_size': max(min_size, max_size),
+            'timeout': timeout,                # espera máxima por uma conexão livre
+            'max_idle': max_idle,              # fecha conexões ociosas acima de min_size
+            'max_lifetime': max_lifetime,      # recicla conexões antigas
+            'check': ConnectionPool.check_connection,  # testa antes de entregar
+        }
+    return database
+
+
+def close_pools():
+    """Fecha os pools deste processo (ex: antes do fork dos processos filhos do Celery)."""
+    from django.db import connections
+
+    for connection in connections.all(initialized_only=True):
+        connection.close()
+        if hasattr(connection, 'close_pool'):
+            connection.close_pool()
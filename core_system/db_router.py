@@ -0,0 +1,182 @@
+# iot_project/core_system/db_router.py
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import itertools
+import logging
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# RÉPLICAS DE LEITURA (ROTEAMENTO POR CARGA DE TRABALHO)
+# ==============================================================================
+# As réplicas são configuradas em DB_REPLICA_HOSTS (ver settings.py) e recebem
+# apenas leituras marcadas explicitamente com use_replica()/@replica_reads:
+# dashboard, listagens do Admin e exportações. Todo o resto (autenticação dos
+# ESPs, ingestão de telemetria, envio de comandos pelo Celery) continua no
+# 'default', inclusive as leituras, para nunca ler um dado atrasado.
+#
+# Antes de usar uma réplica, o atraso de replicação é consultado (no máximo a
+# cada DB_REPLICA_LAG_CHECK_SECONDS por processo); réplicas com atraso acima de
+# DB_REPLICA_MAX_LAG_SECONDS, ou fora do ar, são puladas e, sem nenhuma
+# disponível, a leitura volta para o 'default'.
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+# alias -> (instante da verificação, réplica saudável?)
+_health = {}
+_round_robin = itertools.count()
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+def site_aliases():
+    """Bancos próprios de telemetria dos sites (DB_SITE_HOSTS, ver devices.models.Site)."""
+    return [alias for alias in settings.DATABASES if alias.startswith('site_')]
+
+
+@contextmanager
+def use_replica():
+    """Envia as leituras do bloco para uma réplica saudável (se houver)."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_reads(view_func):
+    """Decorator de views (funções ou métodos) somente leitura: consultas vão para a réplica."""
+    @wraps(view_func)
+    def wrapper(*args, **kwargs):
+        with use_replica():
+            return view_func(*args, **kwargs)
+    return wrapper
+
+
+# Depois de uma alteração feita pelo usuário (ex: salvar no Admin), as leituras
+# dele ficam no primário por DB_REPLICA_MAX_LAG_SECONDS, para que a listagem
+# seguinte já mostre o que acabou de ser gravado.
+PIN_SESSION_KEY = '_db_primary_until'
+
+
+def pin_to_primary(request):
+    if hasattr(request, 'session') and replica_aliases():
+        request.session[PIN_SESSION_KEY] = time.time() + settings.DB_REPLICA_MAX_LAG_SECONDS
+
+
+def is_pinned_to_primary(request):
+    return hasattr(request, 'session') and request.session.get(PIN_SESSION_KEY, 0) > time.time()
+
+
+def replica_lag(alias):
+    """Atraso de replicação (segundos) informado pela própria réplica."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+def is_replica_healthy(alias):
+    now = time.monotonic()
+    checked_at, healthy = _health.get(alias, (None, False))
+    if checked_at is not None and now - checked_at < settings.DB_REPLICA_LAG_CHECK_SECONDS:
+        return healthy
+
+    try:
+        lag = replica_lag(alias)
+        healthy = lag <= settings.DB_REPLICA_MAX_LAG_SECONDS
+        if not healthy:
+            logger.warning(f"Réplica '{alias}' com atraso de {lag:.1f}s; leituras voltam para o primário.")
+    except DatabaseError as e:
+        lag = None
+        healthy = False
+        logger.warning(f"Réplica '{alias}' indisponível: {e}")
+        connections[alias].close()
+
+    _health[alias] = (now, healthy)
+    with metrics.record() as pipe:
+        if lag is not None:
+            metrics.DB_REPLICA_LAG.set(pipe, lag, alias=alias)
+        metrics.DB_REPLICA_HEALTHY.set(pipe, int(healthy), alias=alias)
+    return healthy
+
+
+def get_read_replica():
+    """Uma réplica saudável (rodízio entre elas) ou None."""
+    aliases = replica_aliases()
+    if not aliases:
+        return None
+    start = next(_round_robin)
+    for i in range(len(aliases)):
+        alias = aliases[(start + i) % len(aliases)]
+        if is_replica_healthy(alias):
+            return alias
+    with metrics.record() as pipe:
+        metrics.DB_REPLICA_FALLBACK.inc(pipe)
+    return None
+
+
+# ==============================================================================
+# BANCOS POR SITE (TELEMETRIA ISOLADA)
+# ==============================================================================
+# Um site pode guardar a telemetria em um banco próprio (Site.database). Quem grava
+# ou consulta a telemetria escolhe o banco explicitamente (.using(device.telemetry_db));
+# o roteador só garante que, a partir de uma leitura vinda desse banco, os demais
+# modelos (dispositivo, site) continuem sendo buscados no 'default', e que salvar
+# a própria leitura não a grave no banco errado.
+# Os bancos de site recebem todas as migrações (mesmo esquema), mas só a tabela
+# de telemetria é usada neles.
+
+def _site_instance_db(hints):
+    """Banco de site de onde veio a instância da dica (hints['instance']), ou None."""
+    instance = hints.get('instance')
+    db = getattr(getattr(instance, '_state', None), 'db', None)
+    return db if db in site_aliases() else None
+
+
+class ReplicaRouter:
+    """
+    Roteador do Django: leituras marcadas vão para a réplica; escritas, para o 'default'
+    (ou para o banco de site de onde a instância veio); migrações, para o 'default' e os bancos de site.
+    """
+
+    def db_for_read(self, model, **hints):
+        site_db = _site_instance_db(hints)
+        if site_db:
+            return site_db if isinstance(hints['instance'], model) else 'default'
+        if not _replica_reads.get():
+            return 'default'
+        return get_read_replica() or 'default'
+
+    def db_for_write(self, model, **hints):
+        site_db = _site_instance_db(hints)
+        if site_db and isinstance(hints['instance'], model):
+            return site_db
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplicas têm os mesmos dados do primário; telemetria dos sites referencia o 'default'
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default' or db in site_aliases()
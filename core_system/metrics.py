@@ -0,0 +1,345 @@
+# iot_project/core_system/metrics.py
+
+from django.conf import settings
+from contextlib import contextmanager
+import logging
+import time
+
+import redis
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# MÉTRICAS NO FORMATO PROMETHEUS (ARMAZENADAS NO REDIS)
+# ==============================================================================
+# Os workers do Gunicorn e do Celery são processos separados; guardando os
+# valores no Redis, o endpoint /metrics de qualquer worker expõe a soma de todos.
+#
+# Cada métrica é um hash 'metrics:<nome>' cujos campos são as combinações de labels.
+# Histogramas guardam a contagem por bucket (não acumulada), a soma e o total;
+# a acumulação exigida pelo Prometheus é feita na renderização.
+
+KEY_PREFIX = 'metrics:'
+
+# Se o Redis falhar, as métricas ficam desligadas por alguns segundos para não
+# penalizar cada requisição com o timeout de conexão.
+_disabled_until = 0.0
+REDIS_RETRY_SECONDS = 30
+
+REGISTRY = {}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues))
+
+
+def _series(name, labels_str):
+    return f"{name}{{{labels_str}}}" if labels_str else name
+
+
+class Metric:
+    """Base das métricas: nome, descrição e nomes dos labels."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.key = KEY_PREFIX + name
+        REGISTRY[name] = self
+
+    def _labels(self, labels):
+        return _format_labels(self.labelnames, (labels.get(name, '') for name in self.labelnames))
+
+    def render(self, data):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, pipe, amount=1, **labels):
+        pipe.hincrbyfloat(self.key, self._labels(labels), amount)
+
+    def render(self, data):
+        for labels, value in sorted(data.items()):
+            yield f"{_series(self.name, labels)} {float(value)}"
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, pipe, value, **labels):
+        pipe.hset(self.key, self._labels(labels), value)
+
+    def render(self, data):
+        for labels, value in sorted(data.items()):
+            yield f"{_series(self.name, labels)} {float(value)}"
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, pipe, value, **labels):
+        labels_str = self._labels(labels)
+        # Apenas o primeiro bucket que comporta o valor (ou +Inf) é incrementado
+        bucket = next((str(b) for b in self.buckets if value <= b), '+Inf')
+        pipe.hincrby(self.key, f"bucket|{labels_str}|{bucket}", 1)
+        pipe.hincrbyfloat(self.key, f"sum|{labels_str}", value)
+        pipe.hincrby(self.key, f"count|{labels_str}", 1)
+
+    def render(self, data):
+        series = {}
+        for field, value in data.items():
+            kind, labels_str, *rest = field.split('|')
+            entry = series.setdefault(labels_str, {'buckets': {}, 'sum': 0.0, 'count': 0})
+            if kind == 'bucket':
+                entry['buckets'][rest[0]] = int(float(value))
+            elif kind == 'sum':
+                entry['sum'] = float(value)
+            else:
+                entry['count'] = int(float(value))
+
+        for labels_str, entry in sorted(series.items()):
+            prefix = f"{labels_str}," if labels_str else ''
+            cumulative = 0
+            for bucket in self.buckets:
+                cumulative += entry['buckets'].get(str(bucket), 0)
+                yield f'{self.name}_bucket{{{prefix}le="{bucket}"}} {cumulative}'
+            cumulative += entry['buckets'].get('+Inf', 0)
+            yield f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}'
+            yield f"{_series(self.name + '_sum', labels_str)} {entry['sum']}"
+            yield f"{_series(self.name + '_count', labels_str)} {entry['count']}"
+
+
+# ==============================================================================
+# GRAVAÇÃO EM LOTE (UM ROUND-TRIP AO REDIS POR REQUISIÇÃO/TAREFA)
+# ==============================================================================
+@contextmanager
+def record():
+    """
+    Agrupa as gravações de métricas em um único pipeline do Redis.
+
+        with metrics.record() as pipe:
+            HTTP_REQUESTS.inc(pipe, view='device-detail', method='GET', status=200)
+
+    Falhas do Redis nunca se propagam para quem está medindo.
+    """
+    global _disabled_until
+
+    if not settings.METRICS_ENABLED or time.monotonic() < _disabled_until:
+        yield _NullPipeline()
+        return
+
+    pipe = get_redis(settings.METRICS_REDIS_URL).pipeline(transaction=False)
+    yield pipe
+
+    try:
+        pipe.execute()
+    except redis.RedisError as e:
+        _disabled_until = time.monotonic() + REDIS_RETRY_SECONDS
+        logger.warning(f"Métricas desativadas por {REDIS_RETRY_SECONDS}s: falha ao gravar no Redis ({e}).")
+
+
+class _NullPipeline:
+    """Pipeline que descarta os comandos (métricas desligadas ou Redis indisponível)."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def render_metrics():
+    """Gera o texto no formato de exposição do Prometheus (text/plain; version=0.0.4)."""
+    client = get_redis(settings.METRICS_REDIS_URL)
+    pipe = client.pipeline(transaction=False)
+    metrics = sorted(REGISTRY.values(), key=lambda metric: metric.name)
+    for metric in metrics:
+        pipe.hgetall(metric.key)
+    results = pipe.execute()
+
+    lines = []
+    for metric, raw in zip(metrics, results):
+        data = {field.decode(): value.decode() for field, value in raw.items()}
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render(data))
+    return '\n'.join(lines) + '\n'
+
+
+# ==============================================================================
+# MÉTRICAS DAS REQUISIÇÕES HTTP (ver core_system.middleware)
+# ==============================================================================
+HTTP_REQUESTS = Counter(
+    'iot_http_requests_total', "Requisições HTTP por view, método e status.",
+    ('view', 'method', 'status'),
+)
+HTTP_LATENCY = Histogram(
+    'iot_http_request_duration_seconds', "Latência das requisições HTTP por view.",
+    ('view', 'method'),
+)
+HTTP_DB_QUERIES = Histogram(
+    'iot_http_request_db_queries', "Queries SQL executadas por requisição.",
+    ('view', 'method'), buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 89, 144),
+)
+HTTP_DB_TIME = Histogram(
+    'iot_http_request_db_duration_seconds', "Tempo gasto em queries SQL por requisição.",
+    ('view', 'method'),
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    'iot_http_response_size_bytes', "Tamanho da resposta HTTP por view.",
+    ('view', 'method'), buckets=(128, 512, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
+HTTP_BUDGET_EXCEEDED = Counter(
+    'iot_http_budget_exceeded_total', "Requisições que excederam o orçamento de latência ou queries.",
+    ('view', 'method', 'budget'),
+)
+DEVICE_RATE_LIMITED = Counter(
+    'iot_device_rate_limited_total', "Requisições da API recusadas (429) pelo limite por dispositivo.",
+    ('tier', 'device_type'),
+)
+
+
+# ==============================================================================
+# MÉTRICAS DO AGENDADOR (ScheduledTask / TaskRun) E DO CELERY
+# ==============================================================================
+LAG_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+SCHEDULER_DISPATCH_LAG = Histogram(
+    'iot_scheduler_dispatch_lag_seconds', "Atraso entre o horário agendado e o enfileiramento da tarefa.",
+    ('kind',), buckets=LAG_BUCKETS,
+)
+SCHEDULER_QUEUE_WAIT = Histogram(
+    'iot_scheduler_queue_wait_seconds', "Tempo da tarefa na fila do Celery até iniciar.",
+    buckets=LAG_BUCKETS,
+)
+SCHEDULER_RUN_DURATION = Histogram(
+    'iot_scheduler_run_duration_seconds', "Duração do envio de uma tarefa a todos os seus dispositivos.",
+    buckets=LAG_BUCKETS,
+)
+SCHEDULER_DUPLICATES_SKIPPED = Counter(
+    'iot_scheduler_duplicates_skipped_total', "Ticks repetidos (kind=tick) e ocorrências já enfileiradas (kind=task) ignorados.",
+    ('kind',),
+)
+SCHEDULER_RUNS = Counter(
+    'iot_scheduler_runs_total', "Execuções de tarefas agendadas por status final.",
+    ('status',),
+)
+SCHEDULER_DEVICE_DISPATCH = Histogram(
+    'iot_scheduler_device_dispatch_seconds', "Tempo para enviar o comando a um dispositivo.",
+    ('outcome',),
+)
+SCHEDULER_DELIVERY_LAG = Histogram(
+    'iot_scheduler_delivery_lag_seconds', "Atraso entre o horário agendado e a entrega do comando ao dispositivo.",
+    buckets=LAG_BUCKETS,
+)
+# Ciclo de vida dos comandos (devices/commands.py), por tipo e localização do dispositivo
+COMMAND_DELIVERY = Histogram(
+    'iot_command_delivery_seconds', "Tempo entre gravar o comando pendente e o dispositivo recebê-lo (GET).",
+    ('device_type', 'location'), buckets=LAG_BUCKETS,
+)
+COMMAND_ACK = Histogram(
+    'iot_command_ack_seconds', "Tempo entre a entrega do comando (GET) e a confirmação do dispositivo (PUT).",
+    ('device_type', 'location'), buckets=LAG_BUCKETS,
+)
+COMMAND_ROUNDTRIP = Histogram(
+    'iot_command_roundtrip_seconds', "Tempo entre gravar o comando pendente e a confirmação do dispositivo (PUT).",
+    ('device_type', 'location'), buckets=LAG_BUCKETS,
+)
+
+CELERY_QUEUE_DEPTH = Gauge(
+    'iot_celery_queue_depth', "Mensagens aguardando na fila do broker.",
+    ('queue',),
+)
+CELERY_TASK_DURATION = Histogram(
+    'iot_celery_task_duration_seconds', "Duração das tarefas do Celery por nome e estado final.",
+    ('task', 'state'),
+)
+CELERY_WORKER_BUSY = Counter(
+    'iot_celery_worker_busy_seconds_total', "Tempo acumulado executando tarefas (utilização = rate / concorrência).",
+    ('worker',),
+)
+CELERY_WORKER_CONCURRENCY = Gauge(
+    'iot_celery_worker_concurrency', "Processos de execução (concorrência) de cada worker.",
+    ('worker',),
+)
+
+
+# ==============================================================================
+# MÉTRICAS DAS RÉPLICAS DE LEITURA (core_system.db_router)
+# ==============================================================================
+DB_REPLICA_LAG = Gauge(
+    'iot_db_replica_lag_seconds', "Atraso de replicação medido na última verificação de cada réplica.",
+    ('alias',),
+)
+DB_REPLICA_HEALTHY = Gauge(
+    'iot_db_replica_healthy', "1 se a réplica está recebendo leituras, 0 se está atrasada ou fora do ar.",
+    ('alias',),
+)
+DB_REPLICA_FALLBACK = Counter(
+    'iot_db_replica_fallback_total', "Leituras destinadas às réplicas que voltaram para o primário.",
+)
+
+
+# ==============================================================================
+# MÉTRICAS DOS ALERTAS E AUTOMAÇÕES (devices/alerts.py, devices/automations.py)
+# ==============================================================================
+ALERTS_FIRED = Counter(
+    'iot_alerts_fired_total', "Alertas disparados por regra.",
+    ('rule',),
+)
+ALERTS_RESOLVED = Counter(
+    'iot_alerts_resolved_total', "Alertas resolvidos por regra.",
+    ('rule',),
+)
+AUTOMATIONS_FIRED = Counter(
+    'iot_automations_fired_total', "Automações disparadas (comando gravado no dispositivo de destino).",
+    ('automation',),
+)
+AUTOMATION_REACTION = Histogram(
+    'iot_automation_reaction_seconds', "Tempo entre a leitura que disparou a automação e a gravação do comando.",
+)
+
+
+# ==============================================================================
+# MÉTRICAS DE QUALIDADE DA TELEMETRIA (devices/anomalies.py)
+# ==============================================================================
+TELEMETRY_ANOMALIES = Counter(
+    'iot_telemetry_anomalies_total', "Leituras marcadas como anômalas na ingestão, por medida e tipo.",
+    ('metric', 'kind'),
+)
+
+
+# ==============================================================================
+# MÉTRICAS DO DASHBOARD WEB (devices/dashboard.py)
+# ==============================================================================
+DASHBOARD_CARDS = Counter(
+    'iot_dashboard_cards_total', "Cartões do dashboard servidos do cache ('cache') ou renderizados ('render').",
+    ('result',),
+)
+
+
+# ==============================================================================
+# MÉTRICAS DE PRESENÇA DOS DISPOSITIVOS (devices/presence.py)
+# ==============================================================================
+PRESENCE_TRANSITIONS = Counter(
+    'iot_presence_transitions_total', "Transições de presença registradas, por estado de destino.",
+    ('to_state',),
+)
+DEVICE_PRESENCE = Gauge(
+    'iot_device_presence', "Dispositivos em cada estado de presença (ONLINE, OFFLINE, FLAPPING).",
+    ('state',),
+)
@@ -0,0 +1,176 @@
+# iot_project/core_system/middleware.py
+
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+import logging
+import time
+
+from . import metrics, ratelimit
+from .authentication import CELERY_MASTER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+
+def get_request_budget(view_name, method=None):
+    """
+    Orçamento (latência em ms e número de queries) de uma view.
+    Procura 'MÉTODO view', depois 'view' e, por fim, 'default' em REQUEST_BUDGETS.
+    """
+    budgets = settings.REQUEST_BUDGETS
+    budget = dict(budgets.get('default', {}))
+    budget.update(budgets.get(view_name, {}))
+    if method:
+        budget.update(budgets.get(f"{method} {view_name}", {}))
+    return budget
+
+
+# ==============================================================================
+# INSTRUMENTAÇÃO POR REQUISIÇÃO (Latência, Queries, Tamanho da Resposta)
+# ==============================================================================
+class RequestMetricsMiddleware:
+    """
+    Mede cada requisição: latência, número e tempo das queries SQL e tamanho da
+    resposta, rotulados pelo nome da view (ex: 'device-detail', 'telemetry-post').
+
+    - Grava as métricas no Redis (expostas em /metrics, formato Prometheus);
+    - Registra no log as requisições que excedem o orçamento (REQUEST_BUDGETS);
+    - Se QUERY_COUNT_HEADER estiver habilitado, devolve o total de queries no
+      cabeçalho 'X-DB-Query-Count' (usado pelo simulador de frota).
+
+    Deve ser o primeiro middleware, para medir também os demais.
+    Funciona com DEBUG=False (não depende de connection.queries).
+    """
+
+    HEADER = 'X-DB-Query-Count'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.query_count_header = getattr(settings, 'QUERY_COUNT_HEADER', False)
+
+    def __call__(self, request):
+        counter = {'count': 0, 'time': 0.0}
+
+        def count_queries(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                counter['count'] += 1
+                counter['time'] += time.perf_counter() - started
+
+        # Instala o contador em todas as conexões de banco configuradas
+        wrapped = []
+        for conn in connections.all(initialized_only=False):
+            conn.execute_wrappers.append(count_queries)
+            wrapped.append(conn)
+
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            for conn in wrapped:
+                conn.execute_wrappers.remove(count_queries)
+        latency = time.perf_counter() - started
+
+        if self.query_count_header:
+            response[self.HEADER] = str(counter['count'])
+
+        self.record(request, response, latency, counter['count'], counter['time'])
+        return response
+
+    def record(self, request, response, latency, query_count, query_time):
+        view = self.view_name(request)
+        method = request.method
+        size = self.response_size(response)
+
+        budget = get_request_budget(view, method)
+        exceeded = []
+        if 'latency_ms' in budget and latency * 1000 > budget['latency_ms']:
+            exceeded.append('latency')
+        if 'queries' in budget and query_count > budget['queries']:
+            exceeded.append('queries')
+
+        if exceeded:
+            logger.warning(
+                f"Orçamento excedido ({', '.join(exceeded)}) em {method} {request.path} [{view}]: "
+                f"{latency * 1000:.1f} ms, {query_count} queries ({query_time * 1000:.1f} ms em SQL), "
+                f"status {response.status_code}."
+            )
+
+        with metrics.record() as pipe:
+            metrics.HTTP_REQUESTS.inc(pipe, view=view, method=method, status=response.status_code)
+            metrics.HTTP_LATENCY.observe(pipe, latency, view=view, method=method)
+            metrics.HTTP_DB_QUERIES.observe(pipe, query_count, view=view, method=method)
+            metrics.HTTP_DB_TIME.observe(pipe, query_time, view=view, method=method)
+            if size is not None:
+                metrics.HTTP_RESPONSE_SIZE.observe(pipe, size, view=view, method=method)
+            for budget_name in exceeded:
+                metrics.HTTP_BUDGET_EXCEEDED.inc(pipe, view=view, method=method, budget=budget_name)
+
+    @staticmethod
+    def view_name(request):
+        """Nome da rota; requisições sem rota (404, estáticos) são agrupadas para limitar os labels."""
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            return match.view_name
+        if request.path.startswith('/' + settings.STATIC_URL.lstrip('/')):
+            return 'static'
+        # Respondida antes da resolução da URL (ex: 429 do DeviceRateLimitMiddleware): resolve aqui
+        try:
+            return resolve(request.path_info).view_name
+        except Resolver404:
+            return 'unresolved'
+
+    @staticmethod
+    def response_size(response):
+        if response.streaming:
+            length = response.get('Content-Length')
+            return int(length) if length else None
+        return len(response.content)
+
+
+# ==============================================================================
+# LIMITE DE REQUISIÇÕES POR DISPOSITIVO (ver core_system/ratelimit.py)
+# ==============================================================================
+class DeviceRateLimitMiddleware:
+    """
+    Recusa com 429 (e Retry-After) as requisições da API de um token acima do seu
+    limite, antes da autenticação e de qualquer acesso ao banco. O token mestre do
+    Celery não é limitado.
+
+    Deve vir logo após o RequestMetricsMiddleware, para que as recusas apareçam nas métricas.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.DEVICE_RATE_LIMIT_ENABLED
+
+    def __call__(self, request):
+        if self.enabled and request.path.startswith(settings.DEVICE_RATE_LIMIT_PATH_PREFIX):
+            token = self.device_token(request)
+            if token:
+                rejected = ratelimit.check(token)
+                if rejected:
+                    return self.reject(token, *rejected)
+        return self.get_response(request)
+
+    @staticmethod
+    def device_token(request):
+        auth_type, _, token = request.headers.get('Authorization', '').partition(' ')
+        token = token.strip()
+        if auth_type.lower() != 'token' or not token or token == CELERY_MASTER_TOKEN:
+            return None
+        return token
+
+    @staticmethod
+    def reject(token, retry_after, tier):
+        with metrics.record() as pipe:
+            metrics.DEVICE_RATE_LIMITED.inc(pipe, tier=tier, device_type=ratelimit.device_type_of(token))
+        response = JsonResponse(
+            {'detail': 'Limite de requisições excedido para este dispositivo.', 'retry_after': round(retry_after, 1)},
+            status=429,
+        )
+        response['Retry-After'] = ratelimit.retry_after_header(retry_after)
+        return response
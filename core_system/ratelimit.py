@@ -0,0 +1,156 @@
+# iot_project/core_system/ratelimit.py
+
+from django.conf import settings
+import logging
+import math
+import threading
+import time
+
+import redis
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# LIMITE DE REQUISIÇÕES POR DISPOSITIVO (TOKEN BUCKET EM DUAS CAMADAS)
+# ==============================================================================
+# Chave: o token do cabeçalho 'Authorization: Token <token>' (o device_id do ESP).
+# Cada dispositivo tem um balde com 'burst' fichas, reposto a 'rate' fichas/segundo;
+# os valores vêm de DEVICE_RATE_LIMITS pelo device_type ('default' se não houver).
+#
+#   1. Camada local (dicionário do processo): um processo nunca atende mais que o
+#      limite total, então o que ela recusa também seria recusado no Redis. Depois
+#      de uma recusa do Redis, o token fica bloqueado localmente até o Retry-After,
+#      e a rajada de um ESP em loop não chega nem ao Redis.
+#   2. Camada compartilhada (Redis, script Lua atômico): soma as requisições de
+#      todos os workers do Gunicorn e de todos os servidores.
+#
+# Tudo roda antes da autenticação (nenhuma query ao banco). O device_type de cada
+# token é aprendido pela TokenAuthentication na primeira requisição aceita; até lá
+# vale o limite 'default'. Com o Redis fora do ar, só a camada local é aplicada.
+
+# Balde no Redis: hash {tokens, ts}; o relógio é o do próprio Redis (TIME)
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry_after)
+"""
+
+KEY_PREFIX = 'ratelimit:device:'
+
+# Buckets locais por token: [fichas, último instante, bloqueado até]
+_local_buckets = {}
+_device_types = {}
+_lock = threading.Lock()
+_scripts = {}
+
+# Redis fora do ar: camada compartilhada desligada por alguns segundos
+_shared_disabled_until = 0.0
+REDIS_RETRY_SECONDS = 30
+
+
+def remember_device_type(token, device_type):
+    """Chamado pela autenticação: associa o token ao device_type para escolher o limite."""
+    _device_types[token] = device_type or ''
+
+
+def device_type_of(token):
+    return _device_types.get(token, '')
+
+
+def get_limit(device_type):
+    """(rate, burst) do device_type em DEVICE_RATE_LIMITS, ou o 'default'."""
+    limits = settings.DEVICE_RATE_LIMITS
+    limit = limits.get(device_type) or limits['default']
+    return float(limit['rate']), float(limit['burst'])
+
+
+def check(token):
+    """
+    Consome uma ficha do token. Retorna None se a requisição pode seguir ou
+    (retry_after_segundos, camada) se deve ser recusada com 429.
+    """
+    rate, burst = get_limit(device_type_of(token))
+
+    retry_after = _take_local(token, rate, burst)
+    if retry_after:
+        return retry_after, 'local'
+
+    retry_after = _take_shared(token, rate, burst)
+    if retry_after:
+        # Bloqueia localmente até a reposição: as próximas recusas não vão ao Redis
+        with _lock:
+            bucket = _local_buckets.get(token)
+            if bucket is not None:
+                bucket[2] = time.monotonic() + retry_after
+        return retry_after, 'redis'
+    return None
+
+
+def _take_local(token, rate, burst):
+    now = time.monotonic()
+    with _lock:
+        bucket = _local_buckets.get(token)
+        if bucket is None:
+            if len(_local_buckets) >= settings.DEVICE_RATE_LIMIT_LOCAL_MAX_KEYS:
+                _prune(now, rate, burst)
+            bucket = _local_buckets[token] = [burst, now, 0.0]
+
+        if bucket[2] > now:
+            return bucket[2] - now
+
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+
+def _prune(now, rate, burst):
+    # Descarta os baldes ociosos (já cheios de novo); se nenhum estiver, recomeça do zero
+    idle = [token for token, (tokens, updated, blocked_until) in _local_buckets.items()
+            if blocked_until <= now and tokens + (now - updated) * rate >= burst]
+    for token in idle:
+        del _local_buckets[token]
+    if not idle:
+        _local_buckets.clear()
+
+
+def _take_shared(token, rate, burst):
+    global _shared_disabled_until
+
+    if time.monotonic() < _shared_disabled_until:
+        return 0.0
+    url = settings.RATE_LIMIT_REDIS_URL
+    try:
+        script = _scripts.get(url)
+        if script is None:
+            script = _scripts[url] = get_redis(url).register_script(TOKEN_BUCKET_SCRIPT)
+        return float(script(keys=[KEY_PREFIX + token], args=[rate, burst]))
+    except redis.RedisError as e:
+        # Como nas métricas: não paga o timeout do Redis em cada requisição enquanto ele estiver fora
+        _shared_disabled_until = time.monotonic() + REDIS_RETRY_SECONDS
+        logger.warning(f"Limite de requisições só na camada local por {REDIS_RETRY_SECONDS}s: falha no Redis ({e}).")
+        return 0.0
+
+
+def retry_after_header(seconds):
+    """Valor do cabeçalho Retry-After (segundos inteiros, no mínimo 1)."""
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,24 @@
+# iot_project/core_system/redis_client.py
+
+from django.conf import settings
+import redis
+
+# Um cliente (pool de conexões) por URL e por processo
+_clients = {}
+
+
+def get_redis(url=None):
+    """
+    Retorna um cliente Redis compartilhado pelo processo.
+    Usa timeouts curtos: o Redis é auxiliar (métricas, contadores) e não pode
+    travar uma requisição do ESP se estiver fora do ar.
+    """
+    url = url or settings.REDIS_URL
+    client = _clients.get(url)
+    if client is None:
+        client = _clients[url] = redis.Redis.from_url(
+            url,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return client
@@ -2,10 +2,13 @@
 
 from pathlib import Path
 from decouple import config, Csv
+from django.core.exceptions import ImproperlyConfigured
 from django.utils import timezone
 from datetime import timedelta
 import os
 
+from core_system.db_pool import PROCESS_DEFAULTS, PROCESS_TYPES, apply_connection_mode
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -42,6 +45,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Latência, queries e tamanho de resposta por view (métricas em /metrics). Deve ser o primeiro.
+    'core_system.middleware.RequestMetricsMiddleware',
+    # Limite de requisições por dispositivo na API (429 antes de qualquer query)
+    'core_system.middleware.DeviceRateLimitMiddleware',
+
     'django.middleware.security.SecurityMiddleware',
 
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -91,6 +99,73 @@ DATABASES = {
     }
 }
 
+# Réplicas de leitura (streaming replication do PostgreSQL), ex:
+#   DB_REPLICA_HOSTS=db-replica-1,db-replica-2:5433
+# Cada uma vira DATABASES['replica1'], ['replica2']... com as mesmas credenciais
+# do primário. Só recebem as leituras marcadas com core_system.db_router.use_replica()
+# (dashboard, listagens e exportações do Admin); ver core_system/db_router.py.
+for index, replica_host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+    replica_host, _, replica_port = replica_host.partition(':')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Bancos próprios para a telemetria de sites (campi) grandes, ex:
+#   DB_SITE_HOSTS=norte=db-norte,sul=db-sul:5433
+# Cada um vira DATABASES['site_norte'], ['site_sul']... (mesmas credenciais e nome do
+# banco) e é escolhido no cadastro do site (Site.database). Criar o esquema com
+#   python manage.py migrate --database site_norte
+for site_entry in config('DB_SITE_HOSTS', default='', cast=Csv()):
+    site_slug, _, site_host = site_entry.partition('=')
+    site_host, _, site_port = site_host.partition(':')
+    DATABASES[f'site_{site_slug.strip()}'] = {
+        **DATABASES['default'],
+        'HOST': site_host.strip(),
+        'PORT': site_port or DATABASES['default']['PORT'],
+    }
+
+DATABASE_ROUTERS = ['core_system.db_router.ReplicaRouter']
+
+# Conexões: pool do psycopg 3, persistentes ou via PgBouncer (ver core_system/db_pool.py).
+# O tipo de processo (web, worker, beat) define os padrões; o Celery o detecta sozinho
+# (core_system/celery.py) e o docker-compose o informa em DB_PROCESS_TYPE.
+# Qualquer opção pode ser ajustada para todos (DB_POOL_MAX_SIZE) ou só para um
+# tipo de processo (DB_WORKER_POOL_MAX_SIZE).
+# Total de conexões no PostgreSQL ~ processos x bancos (primário + réplicas + sites) x DB_POOL_MAX_SIZE.
+DB_PROCESS_TYPE = config('DB_PROCESS_TYPE', default='web')
+if DB_PROCESS_TYPE not in PROCESS_TYPES:
+    raise ImproperlyConfigured(f"DB_PROCESS_TYPE inválido: '{DB_PROCESS_TYPE}' (use {', '.join(PROCESS_TYPES)}).")
+
+
+def _db_connection_option(name, default, cast=str):
+    return config(
+        f'DB_{DB_PROCESS_TYPE.upper()}_{name}',
+        default=config(f'DB_{name}', default=default, cast=cast),
+        cast=cast,
+    )
+
+
+_db_defaults = PROCESS_DEFAULTS[DB_PROCESS_TYPE]
+DB_CONNECTION_MODE = _db_connection_option('CONNECTION_MODE', _db_defaults['mode'])
+DB_CONNECTION_OPTIONS = {
+    'min_size': _db_connection_option('POOL_MIN_SIZE', _db_defaults['min_size'], int),
+    'max_size': _db_connection_option('POOL_MAX_SIZE', _db_defaults['max_size'], int),
+    'timeout': _db_connection_option('POOL_TIMEOUT', 10, float),
+    'max_idle': _db_connection_option('POOL_MAX_IDLE', 300, float),
+    'max_lifetime': _db_connection_option('POOL_MAX_LIFETIME', 1800, float),
+    'max_age': _db_connection_option('CONN_MAX_AGE', 300, int),
+}
+for _database in DATABASES.values():
+    apply_connection_mode(_database, DB_CONNECTION_MODE, **DB_CONNECTION_OPTIONS)
+
+# Réplica com atraso maior que isto (segundos) deixa de receber leituras até se recuperar
+DB_REPLICA_MAX_LAG_SECONDS = config('DB_REPLICA_MAX_LAG_SECONDS', default=10, cast=float)
+# Intervalo mínimo entre verificações do atraso de cada réplica (por processo)
+DB_REPLICA_LAG_CHECK_SECONDS = config('DB_REPLICA_LAG_CHECK_SECONDS', default=5, cast=float)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -148,6 +223,101 @@ STORAGES = {
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# ==============================================================================
+# TELEMETRIA
+# ==============================================================================
+# Número máximo de leituras aceitas em um único POST /api/telemetry/batch/
+TELEMETRY_BATCH_MAX_SIZE = config('TELEMETRY_BATCH_MAX_SIZE', default=500, cast=int)
+
+# Importação de histórico pelo Admin (devices/importers.py): o upload é gravado neste
+# diretório (compartilhado entre o web e os workers) e importado pela tarefa
+# import_telemetry_file na fila 'maintenance'. Uma importação em execução sem bloco
+# gravado há TELEMETRY_IMPORT_STALL_SECONDS (worker reiniciado) pode ser retomada.
+TELEMETRY_IMPORT_DIR = config('TELEMETRY_IMPORT_DIR', default=os.path.join(BASE_DIR, 'media', 'telemetry_imports'))
+TELEMETRY_IMPORT_CHUNK_SIZE = config('TELEMETRY_IMPORT_CHUNK_SIZE', default=50000, cast=int)
+TELEMETRY_IMPORT_STALL_SECONDS = config('TELEMETRY_IMPORT_STALL_SECONDS', default=600, cast=int)
+
+# Detecção de leituras anômalas na ingestão (devices/anomalies.py). As leituras
+# marcadas em TelemetryData.anomaly_flags continuam gravadas, mas ficam fora do
+# dashboard, dos alertas e das automações.
+ANOMALY_DETECTION_ENABLED = config('ANOMALY_DETECTION_ENABLED', default=True, cast=bool)
+ANOMALY_DETECTION = {
+    'STUCK_READINGS': 60,   # Leituras seguidas com exatamente o mesmo valor = sensor travado
+    'MIN_SAMPLES': 30,      # Leituras aceitas antes de procurar picos
+    'SPIKE_SIGMA': 4.0,     # Pico: desvio da EWMA maior que SPIKE_SIGMA desvios-padrão...
+    'SPIKE_MAX_RUN': 5,     # ...a menos que se repita por N leituras (mudança real de patamar)
+    'EWMA_ALPHA': 0.1,      # Peso da leitura nova na média móvel exponencial
+    'WINDOW': 500,          # Limite do contador de Welford (as estatísticas esquecem o passado distante)
+    'STATE_TTL_SECONDS': 7 * 86400,
+    # Faixa física do sensor (DHT22) e desvio mínimo para um pico, por medida
+    'METRICS': {
+        'temperature_celsius': {'MIN': -40.0, 'MAX': 80.0, 'SPIKE_MIN_DELTA': 3.0},
+        'humidity_percent': {'MIN': 0.0, 'MAX': 100.0, 'SPIKE_MIN_DELTA': 10.0},
+    },
+}
+
+# ==============================================================================
+# INTERVALO ADAPTATIVO DE CONSULTA DOS DISPOSITIVOS (next_poll_in)
+# ==============================================================================
+# O GET /api/devices/<id>/ devolve 'next_poll_in' (segundos) e o ESP respeita o valor.
+DEVICE_POLL = {
+    'DEFAULT_SECONDS': config('DEVICE_POLL_DEFAULT_SECONDS', default=10, cast=int), # Intervalo padrão (dia)
+    'NIGHT_SECONDS': config('DEVICE_POLL_NIGHT_SECONDS', default=30, cast=int),     # Intervalo na madrugada
+    'NIGHT_START_HOUR': 22,   # Início da janela noturna (hora local)
+    'NIGHT_END_HOUR': 6,      # Fim da janela noturna (hora local)
+    'DUE_SOON_SECONDS': 3,    # Intervalo quando há ScheduledTask prestes a disparar
+    'DUE_SOON_WINDOW_SECONDS': 120, # Antecedência considerada "prestes a disparar"
+    'LOAD_THRESHOLD': 0.75,   # Carga (loadavg / CPUs) a partir da qual o intervalo é alongado
+    'LOAD_MAX_FACTOR': 4,     # Alongamento máximo por carga
+    'JITTER': 0.2,            # Variação aleatória (+/- 20%) para evitar consultas sincronizadas
+    'MIN_SECONDS': 2,
+    'MAX_SECONDS': 120,
+}
+# GET /api/devices/<id>/ do ESP atendido sem o DRF (devices.views.device_poll); False = DeviceViewSet.retrieve
+DEVICE_POLL_FAST_PATH = config('DEVICE_POLL_FAST_PATH', default=True, cast=bool)
+
+# ==============================================================================
+# PRESENÇA DOS DISPOSITIVOS (ONLINE/OFFLINE/INSTÁVEL, ver devices/presence.py)
+# ==============================================================================
+# Avaliada a cada minuto pela tarefa check_device_status; as requisições dos ESPs só
+# atualizam o last_seen. Histerese: sai de ONLINE após OFFLINE_AFTER_SECONDS sem
+# heartbeat, mas só volta após ONLINE_HOLD_SECONDS de heartbeats recentes.
+PRESENCE = {
+    'OFFLINE_AFTER_SECONDS': 300,
+    # Heartbeat "recente": acima do maior intervalo de consulta (DEVICE_POLL['MAX_SECONDS'])
+    'FRESH_SECONDS': DEVICE_POLL['MAX_SECONDS'] + 30,
+    'ONLINE_HOLD_SECONDS': 60,
+    # Amortecimento (como o route flap damping do BGP): cada transição soma FLAP_PENALTY;
+    # acima de FLAP_SUPPRESS o dispositivo fica INSTÁVEL, sem novas transições, até a
+    # penalidade decair abaixo de FLAP_REUSE (meia-vida de FLAP_HALF_LIFE_SECONDS)
+    'FLAP_PENALTY': 1000,
+    'FLAP_SUPPRESS': 2500,
+    'FLAP_REUSE': 750,
+    'FLAP_HALF_LIFE_SECONDS': 900,
+}
+
+# ==============================================================================
+# AUTOMAÇÕES E ALERTAS (regras avaliadas na ingestão, ver devices/ingest.py)
+# ==============================================================================
+AUTOMATIONS_ENABLED = config('AUTOMATIONS_ENABLED', default=True, cast=bool)
+ALERTS_ENABLED = config('ALERTS_ENABLED', default=True, cast=bool)
+# Intervalo entre duas leituras acima do qual a janela "por N segundos" de um alerta recomeça
+ALERT_MAX_GAP_SECONDS = config('ALERT_MAX_GAP_SECONDS', default=600, cast=int)
+# Estado de uma regra/automação sem leituras por este tempo é descartado do Redis
+RULES_STATE_TTL_SECONDS = config('RULES_STATE_TTL_SECONDS', default=86400, cast=int)
+
+# ==============================================================================
+# ADMIN (tabelas grandes)
+# ==============================================================================
+# Acima deste número de linhas (estimado pelo PostgreSQL), as listagens do Admin
+# usam a contagem estimada (pg_class.reltuples / EXPLAIN) no lugar de COUNT(*).
+ADMIN_ESTIMATED_COUNT_THRESHOLD = config('ADMIN_ESTIMATED_COUNT_THRESHOLD', default=100000, cast=int)
+
+# Devolve o número de queries SQL de cada requisição no cabeçalho X-DB-Query-Count
+# (core_system.middleware.RequestMetricsMiddleware). Usado pelo simulador de frota (python manage.py simulate_fleet). Padrão: ligado só em DEBUG.
+QUERY_COUNT_HEADER = config('QUERY_COUNT_HEADER', default=DEBUG, cast=bool)
+
+
 # ==============================================================================
 # CELERY CONFIGURATION (Para Agendamento de Tarefas)
 # ==============================================================================
@@ -161,16 +331,118 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TIMEZONE = TIME_ZONE # Reusa a configuração de TimeZone do Django
 
+# Filas dedicadas: um envio grande (commands) não atrasa o tick do agendador nem a
+# varredura de presença (scheduler). Cada fila tem o seu worker (ver os perfis no
+# docker-compose.yml); tarefas sem rota vão para 'maintenance'.
+CELERY_TASK_DEFAULT_QUEUE = 'maintenance'
+CELERY_TASK_ROUTES = {
+    'devices.tasks.check_scheduled_tasks': {'queue': 'scheduler', 'priority': 0},
+    'devices.tasks.check_device_status': {'queue': 'scheduler', 'priority': 0},
+    # Comando de um alerta passa à frente dos envios agendados na mesma fila
+    'devices.tasks.dispatch_alert_command': {'queue': 'commands', 'priority': 2},
+    'devices.tasks.process_scheduled_task': {'queue': 'commands', 'priority': 6},
+    'devices.tasks.dispatch_chunk': {'queue': 'commands', 'priority': 6},
+    # Fechamento da execução é curto: não espera atrás dos lotes de outras execuções
+    'devices.tasks.finalize_task_run': {'queue': 'commands', 'priority': 3},
+}
+# Prioridades no Redis: 0 (mais alta) a 9, cada uma em uma lista própria da fila
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'queue_order_strategy': 'priority',
+    'priority_steps': list(range(10)),
+    'sep': ':',
+}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+# Envios de comando são longos: cada processo reserva só a próxima mensagem. O worker
+# do agendador (tarefas curtas) sobrescreve com --prefetch-multiplier
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# ==============================================================================
+# REDIS (Uso auxiliar: métricas, contadores)
+# ==============================================================================
+# Por padrão, o mesmo Redis do broker do Celery
+REDIS_URL = config('REDIS_URL', default=CELERY_BROKER_URL)
+# Timeout curto: o Redis auxiliar fora do ar não pode travar as requisições dos ESPs
+REDIS_SOCKET_TIMEOUT = config('REDIS_SOCKET_TIMEOUT', default=0.25, cast=float)
+# Estado da ingestão: regras (alertas e automações) e estatísticas de anomalias
+RULES_REDIS_URL = config('RULES_REDIS_URL', default=REDIS_URL)
+
+# Cache do Django (django.core.cache) no mesmo Redis: dashboard web (devices/dashboard.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_REDIS_URL', default=REDIS_URL),
+        'KEY_PREFIX': 'iot',
+        'OPTIONS': {
+            'socket_timeout': REDIS_SOCKET_TIMEOUT,
+            'socket_connect_timeout': REDIS_SOCKET_TIMEOUT,
+        },
+    }
+}
+DASHBOARD_CACHE_ENABLED = config('DASHBOARD_CACHE_ENABLED', default=True, cast=bool)
+# Lista de dispositivos do dashboard (status e último heartbeat) compartilhada pelas abas abertas
+DASHBOARD_DATA_CACHE_SECONDS = 10
+# Cartões já renderizados; a chave muda com a versão de estado do dispositivo
+DASHBOARD_CARD_CACHE_SECONDS = 3600
+
+# ==============================================================================
+# LIMITE DE REQUISIÇÕES POR DISPOSITIVO (ver core_system/ratelimit.py)
+# ==============================================================================
+DEVICE_RATE_LIMIT_ENABLED = config('DEVICE_RATE_LIMIT_ENABLED', default=True, cast=bool)
+DEVICE_RATE_LIMIT_PATH_PREFIX = '/api/'
+RATE_LIMIT_REDIS_URL = config('RATE_LIMIT_REDIS_URL', default=REDIS_URL)
+# Por device_type: 'rate' = requisições/segundo sustentadas, 'burst' = rajada permitida.
+# O firmware faz ~1 requisição a cada 10s (polling) e a telemetria a cada minuto; a
+# rajada cobre o reenvio em lote após uma queda de Wi-Fi.
+DEVICE_RATE_LIMITS = {
+    'default': {
+        'rate': config('DEVICE_RATE_LIMIT_RATE', default=1.0, cast=float),
+        'burst': config('DEVICE_RATE_LIMIT_BURST', default=30, cast=int),
+    },
+    # Simulador de frota (simulate_fleet) e testes de carga
+    'Simulador': {'rate': 20.0, 'burst': 200},
+}
+# Tokens distintos mantidos na camada local de cada processo
+DEVICE_RATE_LIMIT_LOCAL_MAX_KEYS = 50000
+
+# ==============================================================================
+# MÉTRICAS (Prometheus em /metrics) E ORÇAMENTO DAS REQUISIÇÕES
+# ==============================================================================
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_REDIS_URL = config('METRICS_REDIS_URL', default=REDIS_URL)
+# O /metrics exige 'Authorization: Bearer <METRICS_TOKEN>'; sem o token, só responde com DEBUG=True
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Requisições acima do orçamento são registradas no log (WARNING) e contadas em
+# iot_http_budget_exceeded_total. Chaves: 'default', '<view>' ou '<MÉTODO> <view>'.
+REQUEST_BUDGETS = {
+    'default': {'latency_ms': 1000, 'queries': 30},
+    # Endpoints quentes (ESP)
+    'telemetry-post': {'latency_ms': 200, 'queries': 4},
+    'telemetry-batch': {'latency_ms': 500, 'queries': 5},
+    'GET device-detail': {'latency_ms': 150, 'queries': 5},  # DRF; o caminho rápido do ESP faz 1 query
+    'PUT device-detail': {'latency_ms': 200, 'queries': 4},
+}
+
 # ==============================================================================
 # CONFIGURAÇÃO CELERY BEAT (Agendador Recorrente)
 # ==============================================================================
+# Mais de uma instância do Beat é suportada (ver devices/tasks.py: tick deduplicado no
+# Redis e ocorrências reivindicadas no banco). Cada tick é dividido em uma tarefa do
+# Celery por site e por shard (pk % SCHEDULER_SHARDS) para crescer com os workers.
+SCHEDULER_SHARDS = config('SCHEDULER_SHARDS', default=1, cast=int)
+
+# Envio em lotes: cada execução é dividida em subtarefas de N dispositivos (TaskRunChunk).
+# Um lote sem pulso do worker há mais de SCHEDULER_CHUNK_STALL_SECONDS é reenfileirado.
+SCHEDULER_DISPATCH_CHUNK = config('SCHEDULER_DISPATCH_CHUNK', default=200, cast=int)
+SCHEDULER_CHUNK_STALL_SECONDS = config('SCHEDULER_CHUNK_STALL_SECONDS', default=300, cast=int)
+
 CELERY_BEAT_SCHEDULE = {
     'check-scheduled-tasks-every-minute': {
         # O caminho completo para a função da tarefa agendadora
         'task': 'devices.tasks.check_scheduled_tasks',
         # Agendar para rodar a cada 60 segundos
         'schedule': timedelta(seconds=60), 
-        # Argumentos vazios para a função (ela não aceita argumentos)
+        # Sem argumentos: a tarefa enfileira uma verificação para cada site
         'args': (), 
     },
     'check-device-status-every-minute': { 
@@ -178,8 +450,21 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': timedelta(seconds=60), 
         'args': (), 
     },
+    'resume-stalled-chunks-every-2-minutes': {
+        'task': 'devices.tasks.resume_stalled_chunks',
+        'schedule': timedelta(seconds=120),
+        'args': (),
+    },
+    'refresh-fleet-summary-every-minute': {
+        'task': 'devices.tasks.refresh_fleet_summary',
+        'schedule': timedelta(seconds=60),
+        'args': (),
+    },
 }
 
+# Resumo da frota (devices/fleet.py): janela da temperatura média por localização
+FLEET_SUMMARY_TEMPERATURE_MINUTES = config('FLEET_SUMMARY_TEMPERATURE_MINUTES', default=15, cast=int)
+
 
 # ==============================================================================
 # CONFIGURAÇÃO JAZZMIN (Tema para o Admin do Django)
@@ -264,6 +549,15 @@ JAZZMIN_SETTINGS = {
         "devices.device": "fas fa-microchip",
         "devices.telemetrydata": "fa-solid fa-book",
         "devices.scheduledtask": "fas fa-clock",
+        "devices.taskrun": "fas fa-history",
+        "devices.alertrule": "fas fa-bell",
+        "devices.alert": "fas fa-exclamation-triangle",
+        "devices.automation": "fas fa-magic",
+        "devices.site": "fas fa-building",
+        "devices.commanddelivery": "fas fa-paper-plane",
+        "devices.presencetransition": "fas fa-exchange-alt",
+        "devices.deviceavailability": "fas fa-chart-line",
+        "devices.telemetryimport": "fas fa-file-import",
     },
 
     #Necessário esconder o rodapé completo e messagem do loggout
@@ -0,0 +1,39 @@
+# iot_project/core_system/testing.py
+
+from contextlib import contextmanager
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+from .middleware import get_request_budget
+
+
+# ==============================================================================
+# AUXILIARES DE TESTE: ORÇAMENTO DE QUERIES DOS ENDPOINTS QUENTES
+# ==============================================================================
+# Os endpoints mais chamados pelos ESPs e seus nomes de rota (REQUEST_BUDGETS)
+HOT_ENDPOINTS = (
+    ('POST', 'telemetry-post'),   # POST /api/telemetry/
+    ('POST', 'telemetry-batch'),  # POST /api/telemetry/batch/
+    ('GET', 'device-detail'),     # GET  /api/devices/<id>/ (consulta de comandos)
+    ('PUT', 'device-detail'),     # PUT  /api/devices/<id>/ (confirmação do comando)
+)
+
+
+@contextmanager
+def assert_query_budget(view_name, method=None, using='default'):
+    """
+    Falha (AssertionError) se o bloco executar mais queries do que o orçamento
+    configurado em REQUEST_BUDGETS para a view. Exemplo em um TestCase:
+
+        with assert_query_budget('device-detail', 'GET'):
+            self.client.get('/api/devices/ESP_01/', HTTP_AUTHORIZATION='Token ESP_01')
+    """
+    budget = get_request_budget(view_name, method).get('queries')
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+
+    if budget is not None and len(context) > budget:
+        queries = '\n'.join(f"  {i}. {query['sql']}" for i, query in enumerate(context.captured_queries, start=1))
+        raise AssertionError(
+            f"{method or ''} {view_name}: {len(context)} queries executadas, orçamento de {budget}.\n{queries}"
+        )
@@ -4,7 +4,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from django.views.generic.base import RedirectView
 
-from devices.views import DeviceViewSet, TelemetryDataViewSet, device_dashboard
+from devices.views import DeviceViewSet, FleetSummaryView, TelemetryDataViewSet, device_dashboard, device_poll
+from core_system.views import metrics_view
 
 # O DefaultRouter do DRF registra automaticamente os ViewSets
 router = DefaultRouter()
@@ -29,6 +30,12 @@ urlpatterns = [
     # Rotas da Interface Web (Admin e Futuras Páginas)
     path('admin/', admin.site.urls),
     
+    # Consulta de comandos do ESP (GET) sem o DRF; PUT/PATCH e outros clientes seguem para o DeviceViewSet.
+    # Antes do router e com o mesmo nome da rota dele, para manter métricas e orçamentos ('device-detail').
+    path('api/devices/<str:device_id>/', device_poll, name='device-detail'),
+    # Resumo da frota (online/offline, temperatura média e tarefas do dia) para os operadores
+    path('api/fleet/summary/', FleetSummaryView.as_view(), name='fleet-summary'),
+
     # Rotas da API REST (Dispositivos/Telemetria)
     # Rota principal da API REST (inclui o /devices/ e /devices/{id}/)
     path('api/', include(router.urls)),
@@ -39,7 +46,12 @@ urlpatterns = [
     # Adicionamos uma rota específica para o POST de telemetria
     # Usaremos o TelemetryDataViewSet apenas para o POST (criação de registro)
     path('api/telemetry/', TelemetryDataViewSet.as_view({'post': 'create'}), name='telemetry-post'),
+    # POST em lote: várias leituras acumuladas pelo ESP gravadas em uma única transação
+    path('api/telemetry/batch/', TelemetryDataViewSet.as_view({'post': 'batch'}), name='telemetry-batch'),
     
+    # Métricas no formato Prometheus (latência/queries por view, scheduler, etc.)
+    path('metrics', metrics_view, name='metrics'),
+
     # Rota opcional do DRF para login via browser (útil para debug)
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
@@ -47,5 +59,6 @@ urlpatterns = [
 # Nota de Ajuda ao ESP: 
 # O ESP fará:
 # 1. POST (Telemetria): http://[IP_DO_SERVIDOR]:8000/api/telemetry/
+#    POST em lote (Telemetria acumulada): http://[IP_DO_SERVIDOR]:8000/api/telemetry/batch/
 # 2. GET (Comandos): http://[IP_DO_SERVIDOR]:8000/api/devices/ESP8266_002/
 # 3. PUT (Confirmação): http://[IP_DO_SERVIDOR]:8000/api/devices/ESP8266_002/
\ No newline at end of file
@@ -0,0 +1,40 @@
+# iot_project/core_system/views.py
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+import hmac
+import logging
+
+import redis
+
+from .metrics import render_metrics
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# ENDPOINT /metrics (Prometheus)
+# ==============================================================================
+@require_GET
+def metrics_view(request):
+    """
+    Expõe as métricas no formato de texto do Prometheus.
+    Exige o cabeçalho 'Authorization: Bearer <METRICS_TOKEN>'. Sem METRICS_TOKEN
+    configurado, o endpoint só responde com DEBUG=True (desenvolvimento).
+    """
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            return HttpResponseForbidden("Token de métricas inválido.")
+    elif not settings.DEBUG:
+        # Labels por dispositivo, filas e latências não ficam públicos por esquecimento
+        return HttpResponseForbidden("Métricas desativadas: defina METRICS_TOKEN.")
+
+    try:
+        body = render_metrics()
+    except redis.RedisError as e:
+        logger.error(f"Não foi possível ler as métricas do Redis: {e}")
+        return HttpResponse("Métricas indisponíveis (Redis).", status=503, content_type='text/plain')
+
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,28 +1,91 @@
 # iot_project/devices/admin.py
-from django.contrib import admin
-from .models import Device, TelemetryData, ScheduledTask, DAY_OF_WEEK_CHOICES
-from django.db import models
+from django.conf import settings
+from django.contrib import admin, messages
+from .models import Device, TelemetryData, ScheduledTask, TaskRun, TaskRunDevice, AlertRule, Alert, Automation, Site, CommandDelivery, DAY_OF_WEEK_CHOICES
+from .models import DeviceAvailability, PresenceTransition, TelemetryImport
+from django.db import DEFAULT_DB_ALIAS, models, transaction
 from django.forms import ModelForm, MultipleChoiceField, CheckboxSelectMultiple
 from django.utils import timezone 
 from datetime import timedelta
 import csv
-from django.http import HttpResponse
+from django.db.models import Avg, Count, F, Max, Q
+from django.http import HttpResponse, HttpResponseRedirect, QueryDict
+from django.shortcuts import render
+from django.urls import path, reverse
+from django import forms
+from .tasks import import_telemetry_file, retry_failed_devices
+from core_system.admin_tools import EstimatedCountPaginator, IndexedDateHierarchyQuerySet, ReplicaChangelistMixin
+from core_system.db_router import use_replica
+from .importers import FORMATS, detect_format, is_stalled, resume_import, save_uploaded_file
+from .sites import scope_queryset, user_site_ids
+from .presence import availability_percent
 #from django.forms import ModelMultipleChoiceField # Import necessário para o campo personalizado 
 
 
+# ==============================================================================
+# ESCOPO POR SITE (USUÁRIOS ASSOCIADOS A SITES SÓ VEEM OS DADOS DELES)
+# ==============================================================================
+class SiteScopedAdminMixin:
+    """
+    Mixin de ModelAdmin: listagem, edição e opções dos formulários (sites e dispositivos)
+    limitadas aos sites do usuário (devices/sites.py). site_lookup é o caminho do modelo
+    até o site; None mantém a listagem completa e limita apenas os formulários.
+    """
+    site_lookup = 'site'
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.site_lookup is None:
+            return queryset
+        return scope_queryset(queryset, request.user, self.site_lookup)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        self.limit_choices(db_field, request, kwargs)
+        if db_field.related_model is Site and user_site_ids(request.user) is not None:
+            # Sem site, o registro ficaria invisível para o próprio usuário
+            kwargs['required'] = True
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        self.limit_choices(db_field, request, kwargs)
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
+    def limit_choices(self, db_field, request, kwargs):
+        if db_field.related_model is Site:
+            kwargs['queryset'] = scope_queryset(Site.objects.all(), request.user, 'pk')
+        elif db_field.related_model is Device:
+            kwargs['queryset'] = scope_queryset(Device.objects.all(), request.user)
+
+
+class SiteScopedRelatedFilter(admin.RelatedFieldListFilter):
+    """Filtro por site ou dispositivo que só oferece as opções dos sites do usuário."""
+
+    def field_choices(self, field, request, model_admin):
+        site_ids = user_site_ids(request.user)
+        if site_ids is None:
+            return super().field_choices(field, request, model_admin)
+        lookup = 'pk__in' if field.related_model is Site else 'site__in'
+        return field.get_choices(
+            include_blank=False,
+            ordering=self.field_admin_ordering(field, request, model_admin),
+            limit_choices_to={lookup: site_ids},
+        )
+
+
 # ==============================================================================
 # 1. ADMIN DE DISPOSITIVOS
 # ==============================================================================
-class DeviceAdmin(admin.ModelAdmin):
+class DeviceAdmin(SiteScopedAdminMixin, ReplicaChangelistMixin, admin.ModelAdmin):
     # Usando métodos customizados para tradução das colunas
     list_display = (
         'display_device_id', 'display_name', 'display_device_type', 
-        'display_location', 'display_ip_address', 'display_is_active', 
-        'display_last_seen'
+        'display_location', 'display_site', 'display_ip_address', 'display_is_active', 
+        'display_presence', 'display_last_seen'
     )
     search_fields = ('device_id', 'name', 'location')
-    list_filter = ('is_active', 'device_type')
-    readonly_fields = ('last_seen', 'ip_address')
+    list_filter = ('is_active', 'presence__state', 'device_type', ('site', SiteScopedRelatedFilter))
+    list_select_related = ('site', 'presence')
+    readonly_fields = ('last_seen', 'ip_address', 'command_run', 'command_issued_at', 'command_delivered_at', 'command_delivery')
     
     # Métodos de tradução para DeviceAdmin
     def display_device_id(self, obj): return obj.device_id
@@ -40,47 +103,50 @@ class DeviceAdmin(admin.ModelAdmin):
     def display_location(self, obj): return obj.location
     display_location.short_description = 'Localização'
     display_location.admin_order_field = 'location'
+
+    def display_site(self, obj): return obj.site or '-'
+    display_site.short_description = 'Site'
+    display_site.admin_order_field = 'site__name'
     
     def display_ip_address(self, obj): return obj.ip_address
     display_ip_address.short_description = 'Endereço IP'
     display_ip_address.admin_order_field = 'ip_address'
 
-    def display_is_active(self, obj): return obj.is_active
+    def display_is_active(self, obj):
+        # Somente leitura: um ativo sem heartbeat dentro do timeout já é exibido como inativo
+        # (o is_active é gravado pela máquina de estados de presença, na tarefa check_device_status)
+        return obj.is_active and obj.last_seen is not None and obj.last_seen >= self.heartbeat_threshold()
     display_is_active.short_description = 'Ativo'
     display_is_active.admin_order_field = 'is_active'
     display_is_active.boolean = True # Para mostrar o ícone de check/X
 
+    def display_presence(self, obj):
+        presence = getattr(obj, 'presence', None)
+        if presence is None:
+            return '-'
+        return f"{presence.get_state_display()} desde {timezone.localtime(presence.since).strftime('%d/%m %H:%M')}"
+    display_presence.short_description = 'Presença'
+    display_presence.admin_order_field = 'presence__state'
+
     def display_last_seen(self, obj): return obj.last_seen
     display_last_seen.short_description = 'Última conexão'
     display_last_seen.admin_order_field = 'last_seen'
 
-    # Sobrescreve a view de lista (admin/devices/device/) para forçar o Heartbeat/Timeout
-    def changelist_view(self, request, extra_context=None):
-        
-        now = timezone.now() 
-        timeout_minutes = 5
-        timeout_threshold = now - timedelta(minutes=timeout_minutes)
-        
-        devices = Device.objects.all()
-        
-        # Lógica de Heartbeat (Inativação por Timeout)
-        for device in devices:
-            if device.last_seen and device.last_seen < timeout_threshold and device.is_active:
-                device.is_active = False
-                device.save(update_fields=['is_active']) 
-                print(f"Dispositivo {device.device_id} inativado por timeout ({timeout_minutes} minutos).")
-        
-        # Chama a view de lista original do Admin
-        return super().changelist_view(request, extra_context=extra_context)
+    def heartbeat_threshold(self):
+        # Mesmo timeout da máquina de estados de presença (PRESENCE['OFFLINE_AFTER_SECONDS'])
+        return timezone.now() - timedelta(seconds=settings.PRESENCE['OFFLINE_AFTER_SECONDS'])
     
     # Campo para entrada de comandos no formato JSON
     fieldsets = (
         ('Informações Básicas', {
-            'fields': ('device_id', 'name', 'device_type', 'location', 'is_active')
+            'fields': ('device_id', 'name', 'device_type', 'location', 'site', 'is_active')
         }),
         ('Comunicação e Status', {
             'fields': ('pending_command', 'last_command', 'ip_address', 'last_seen')
         }),
+        ('Entrega do Comando', {
+            'fields': ('command_run', 'command_issued_at', 'command_delivered_at', 'command_delivery')
+        }),
     )
 
     class Media:
@@ -91,8 +157,88 @@ class DeviceAdmin(admin.ModelAdmin):
 # ==============================================================================
 # 2. ADMIN DE DADOS DE TELEMETRIA
 # ==============================================================================
+class TelemetryImportForm(forms.Form):
+    file = forms.FileField(
+        label="Arquivo",
+        help_text="CSV (com cabeçalho) ou NDJSON. Colunas: device_id, timestamp, temperature_celsius, "
+                  "humidity_percent, relay_state_D1, last_button_action, raw_data."
+    )
+    file_format = forms.ChoiceField(
+        label="Formato",
+        choices=[('auto', 'Pela extensão')] + [(name, name.upper()) for name in FORMATS],
+        initial='auto',
+    )
+    create_devices = forms.BooleanField(
+        label="Cadastrar dispositivos desconhecidos", required=False,
+    )
+
+
+class AnomalyListFilter(admin.SimpleListFilter):
+    """Filtra leituras normais ou marcadas pela detecção de anomalias (anomaly_flags)."""
+    title = 'Qualidade'
+    parameter_name = 'qualidade'
+
+    def lookups(self, request, model_admin):
+        return (('normal', 'Normais'), ('anomala', 'Anômalas'))
+
+    def queryset(self, request, queryset):
+        if self.value() == 'normal':
+            return queryset.filter(anomaly_flags=0)
+        if self.value() == 'anomala':
+            return queryset.filter(anomaly_flags__gt=0)
+        return queryset
+
+
 @admin.register(TelemetryData) # <--- Usando o decorator para registrar
-class TelemetryDataAdmin(admin.ModelAdmin):
+class TelemetryDataAdmin(SiteScopedAdminMixin, ReplicaChangelistMixin, admin.ModelAdmin):
+    change_list_template = 'admin/devices/telemetrydata/change_list.html'
+
+    # --- IMPORTAÇÃO DE HISTÓRICO (CSV/NDJSON VIA COPY, EM SEGUNDO PLANO) ---
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path('import/', self.admin_site.admin_view(self.import_view), name='devices_telemetrydata_import'),
+        ]
+        return custom_urls + urls
+
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            return HttpResponseRedirect(reverse('admin:devices_telemetrydata_changelist'))
+
+        form = TelemetryImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            uploaded = form.cleaned_data['file']
+            file_format = form.cleaned_data['file_format']
+            if file_format == 'auto':
+                file_format = detect_format(uploaded.name)
+
+            # A requisição só grava o arquivo; a importação roda no worker de manutenção
+            file_path, file_size = save_uploaded_file(uploaded)
+            job = TelemetryImport.objects.create(
+                original_name=uploaded.name,
+                file_path=file_path,
+                file_format=file_format,
+                file_size=file_size,
+                create_devices=form.cleaned_data['create_devices'],
+                created_by=request.user,
+            )
+            transaction.on_commit(lambda: import_telemetry_file.delay(job.pk))
+            self.message_user(
+                request,
+                f"Arquivo '{uploaded.name}' recebido ({file_size} bytes); a importação foi enfileirada. "
+                f"Acompanhe o progresso nesta página.",
+            )
+            return HttpResponseRedirect(reverse('admin:devices_telemetryimport_change', args=[job.pk]))
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Importar histórico de telemetria",
+            'form': form,
+        }
+        return render(request, 'admin/devices/telemetrydata/import_form.html', context)
+    # --- FIM DA IMPORTAÇÃO ---
+
     # --- AÇÃO DE EXPORTAÇÃO CSV ---
     actions = ['export_to_csv'] # Adiciona a ação ao menu dropdown
 
@@ -108,22 +254,26 @@ class TelemetryDataAdmin(admin.ModelAdmin):
         ]
         writer.writerow(header)
 
-        for obj in queryset:
-            # Usa timezone.localtime() para formatar com o fuso horário correto do projeto
-            timestamp_str = timezone.localtime(obj.timestamp).strftime('%Y-%m-%d %H:%M:%S')
-            
-            row = [
-                obj.pk,
-                obj.device.device_id if obj.device else 'N/A',
-                obj.device.name if obj.device else 'N/A',
-                timestamp_str, 
-                obj.temperature_celsius if obj.temperature_celsius is not None else '',
-                obj.humidity_percent if obj.humidity_percent is not None else '',
-                obj.relay_state_D1,
-                obj.last_button_action if obj.last_button_action else '',
-                str(obj.raw_data) if obj.raw_data else ''
-            ]
-            writer.writerow(row)
+        # Leitura em blocos (sem carregar toda a seleção na memória), com os dispositivos de cada
+        # bloco buscados no banco principal, na réplica de leitura para não disputar o primário
+        # com a ingestão
+        with use_replica():
+            for obj in queryset.iterator(chunk_size=2000):
+                # Usa timezone.localtime() para formatar com o fuso horário correto do projeto
+                timestamp_str = timezone.localtime(obj.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+                row = [
+                    obj.pk,
+                    obj.device.device_id if obj.device else 'N/A',
+                    obj.device.name if obj.device else 'N/A',
+                    timestamp_str,
+                    obj.temperature_celsius if obj.temperature_celsius is not None else '',
+                    obj.humidity_percent if obj.humidity_percent is not None else '',
+                    obj.relay_state_D1,
+                    obj.last_button_action if obj.last_button_action else '',
+                    str(obj.raw_data) if obj.raw_data else ''
+                ]
+                writer.writerow(row)
 
         return response
 
@@ -133,11 +283,52 @@ class TelemetryDataAdmin(admin.ModelAdmin):
     # Usando métodos customizados para tradução das colunas
     list_display = (
         'display_device', 'display_temperature_celsius', 'display_humidity_percent', 
-        'display_relay_state_D1', 'raw_data', 'display_timestamp',
+        'display_relay_state_D1', 'raw_data', 'display_timestamp', 'display_anomaly',
     )
-    list_filter = ('device__name', 'timestamp') # Filtra por nome do dispositivo e data
+    # Filtra por site, dispositivo e data. 'device' (e não 'device__name') lista as opções
+    # a partir da tabela de dispositivos, sem um DISTINCT sobre toda a telemetria.
+    list_filter = (('site', SiteScopedRelatedFilter), ('device', SiteScopedRelatedFilter), 'timestamp', AnomalyListFilter)
     search_fields = ('device__device_id', 'device__name')
-    readonly_fields = ('timestamp', 'raw_data')
+    readonly_fields = ('timestamp', 'raw_data', 'anomaly_flags', 'site')
+
+    # --- LISTAGEM EFICIENTE PARA MILHÕES DE REGISTROS ---
+    # Sem JOIN com o dispositivo: nos bancos de site a tabela de dispositivos não existe.
+    # A coluna do dispositivo vem de um prefetch no banco principal (uma query por página).
+    list_select_related = False
+    paginator = EstimatedCountPaginator     # Contagem estimada acima de ADMIN_ESTIMATED_COUNT_THRESHOLD
+    show_full_result_count = False          # Evita um segundo COUNT(*) da tabela inteira ao filtrar
+    date_hierarchy = 'timestamp'            # Navegação por ano/mês/dia usando o índice de timestamp
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        database = self.get_telemetry_db(request)
+        if database != DEFAULT_DB_ALIAS:
+            queryset = queryset.using(database)
+        queryset = IndexedDateHierarchyQuerySet(model=queryset.model, query=queryset.query, using=queryset.db)
+        return queryset.prefetch_related('device')
+
+    def get_telemetry_db(self, request):
+        """Banco da listagem: o do site filtrado ou, se o usuário tem um único site, o dele."""
+        params = request.GET
+        if '_changelist_filters' in params:
+            # Edição/exclusão de uma leitura: os filtros da listagem vêm preservados neste parâmetro
+            params = QueryDict(params['_changelist_filters'])
+        site_id = params.get('site__id__exact', '')
+        if not site_id.isdigit():
+            site_ids = user_site_ids(request.user)
+            site_id = next(iter(site_ids)) if site_ids and len(site_ids) == 1 else None
+        site = Site.objects.filter(pk=site_id).first() if site_id else None
+        return site.telemetry_db if site else DEFAULT_DB_ALIAS
+
+    def get_search_results(self, request, queryset, search_term):
+        # Dispositivos buscados no banco principal e telemetria filtrada pelos ids (sem JOIN)
+        if not search_term:
+            return queryset, False
+        devices = scope_queryset(
+            Device.objects.filter(Q(device_id__icontains=search_term) | Q(name__icontains=search_term)),
+            request.user,
+        )
+        return queryset.filter(device_id__in=list(devices.values_list('pk', flat=True))), False
 
     class Media:
         js = (
@@ -166,6 +357,63 @@ class TelemetryDataAdmin(admin.ModelAdmin):
     display_timestamp.short_description = 'Data/Hora'
     display_timestamp.admin_order_field = 'timestamp'
 
+    def display_anomaly(self, obj): return ', '.join(obj.anomaly_labels()) or '-'
+    display_anomaly.short_description = 'Anomalias'
+
+
+# --- IMPORTAÇÕES DE HISTÓRICO: PROGRESSO E RETOMADA ---
+@admin.register(TelemetryImport)
+class TelemetryImportAdmin(admin.ModelAdmin):
+    actions = ['resume']
+    list_display = (
+        'original_name', 'display_status', 'display_progress', 'imported', 'invalid',
+        'created_devices', 'created_by', 'created_at', 'updated_at',
+    )
+    list_filter = ('status', 'created_at')
+    search_fields = ('original_name',)
+    list_select_related = ('created_by',)
+    readonly_fields = [field.name for field in TelemetryImport._meta.fields if field.name != 'errors'] + ['display_progress', 'display_errors']
+
+    # Criadas pelo formulário de importação da telemetria; só o progresso é exibido
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    # --- AÇÃO DE RETOMADA (A PARTIR DO ÚLTIMO BLOCO GRAVADO) ---
+    def resume(self, request, queryset):
+        resumed = [job for job in queryset if resume_import(job)]
+        if resumed:
+            self.message_user(request, f"{len(resumed)} importação(ões) reenfileirada(s) a partir do último bloco gravado.")
+        else:
+            self.message_user(
+                request,
+                "Nenhuma das importações selecionadas pode ser retomada (concluídas ou ainda em execução).",
+                level=messages.WARNING,
+            )
+
+    resume.short_description = "Retomar importação"
+    # --- FIM DA AÇÃO DE RETOMADA ---
+
+    class Media:
+        js = (
+            'admin/js/auto_refresh.js', # Caminho para o script de auto refresh
+        )
+
+    def display_status(self, obj):
+        if is_stalled(obj):
+            return "Parada (worker sem resposta)"
+        return obj.get_status_display()
+    display_status.short_description = 'Status'
+    display_status.admin_order_field = 'status'
+
+    def display_progress(self, obj): return f"{obj.progress_percent:.1f}% ({obj.offset}/{obj.file_size} bytes)"
+    display_progress.short_description = 'Progresso'
+
+    def display_errors(self, obj): return '\n'.join(obj.errors) or '-'
+    display_errors.short_description = 'Registros Inválidos'
+
 # ==============================================================================
 # 3. REGISTRO DOS MODELOS
 # ==============================================================================
@@ -203,6 +451,17 @@ class ScheduledTaskForm(ModelForm):
     def clean_recurrent_days(self):
         return ",".join(self.cleaned_data['recurrent_days']) if self.cleaned_data['recurrent_days'] else ''
 
+    # Tarefa de um site só pode ter dispositivos desse site
+    def clean(self):
+        cleaned_data = super().clean()
+        site = cleaned_data.get('site')
+        devices = cleaned_data.get('devices')
+        if site and devices:
+            others = [device.device_id for device in devices if device.site_id != site.pk]
+            if others:
+                self.add_error('devices', f"Dispositivos de outro site: {', '.join(others)}.")
+        return cleaned_data
+
     # Converte a string '1,3,5' para a lista ['1', '3', '5'] ao carregar
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -210,7 +469,7 @@ class ScheduledTaskForm(ModelForm):
             self.initial['recurrent_days'] = self.instance.recurrent_days.split(',')
 
 @admin.register(ScheduledTask)
-class ScheduledTaskAdmin(admin.ModelAdmin):
+class ScheduledTaskAdmin(SiteScopedAdminMixin, admin.ModelAdmin):
     form = ScheduledTaskForm
     
     # Todas as colunas traduzidas
@@ -225,12 +484,18 @@ class ScheduledTaskAdmin(admin.ModelAdmin):
         'display_created_at'
     )
     
-    list_filter = ('status', 'is_recurrent', 'created_at')
+    list_filter = ('status', 'is_recurrent', ('site', SiteScopedRelatedFilter), 'created_at')
     search_fields = ('name', 'devices__device_id')
     #raw_id_fields = ('devices',)
     readonly_fields = ('last_run_at',)
     filter_horizontal = ('devices',) 
 
+    def save_model(self, request, obj, form, change):
+        # Reagendada (status, data ou horário alterados): a ocorrência pode ser enfileirada de novo
+        if change and {'status', 'execution_time', 'recurrent_time'} & set(form.changed_data):
+            obj.dispatched_for = None
+        super().save_model(request, obj, form, change)
+
     class Media:
         js = (
             'admin/js/auto_refresh.js', # Caminho para o script de auto refresh
@@ -281,7 +546,7 @@ class ScheduledTaskAdmin(admin.ModelAdmin):
     
     fieldsets = (
         ('Informação Básica', {
-            'fields': ('name', 'devices', 'command_json', 'status')
+            'fields': ('name', 'site', 'devices', 'command_json', 'status')
         }),
         ('Agendamento Único', {
             'fields': ('execution_time',)
@@ -295,3 +560,435 @@ class ScheduledTaskAdmin(admin.ModelAdmin):
     )
 
 
+# ==============================================================================
+# 5. ADMIN DO HISTÓRICO DE EXECUÇÕES (SOMENTE LEITURA)
+# ==============================================================================
+def format_lag(delta):
+    """Formata um timedelta em segundos (ex: '12.3 s') ou '-' se ausente."""
+    return f"{delta.total_seconds():.1f} s" if delta is not None else '-'
+
+
+class TaskRunDeviceInline(admin.TabularInline):
+    model = TaskRunDevice
+    fields = ('device', 'outcome', 'status_code', 'error', 'dispatched_at', 'duration_ms')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+    show_change_link = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('device')
+
+
+@admin.register(TaskRun)
+class TaskRunAdmin(SiteScopedAdminMixin, ReplicaChangelistMixin, admin.ModelAdmin):
+    site_lookup = 'task__site'
+    inlines = [TaskRunDeviceInline]
+    actions = ['retry_failed']
+    list_display = (
+        'display_task', 'display_status', 'display_scheduled_for',
+        'display_dispatch_lag', 'display_queue_wait', 'display_duration', 'display_delivery_lag',
+        'devices_total', 'devices_failed', 'devices_delivered', 'display_chunks', 'display_retry_of',
+    )
+    list_filter = ('status', 'scheduled_for')
+    search_fields = ('task__name',)
+    list_select_related = ('task',)
+    date_hierarchy = 'scheduled_for'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = [field.name for field in TaskRun._meta.fields]
+
+    # Registros gerados pelo agendador: não são criados nem editados manualmente
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    # --- AÇÃO DE REENVIO (APENAS DISPOSITIVOS COM FALHA) ---
+    def retry_failed(self, request, queryset):
+        retried = 0
+        for run in queryset:
+            try:
+                retry_run = retry_failed_devices(run)
+            except Exception as e:
+                self.message_user(request, f"Falha ao enfileirar o reenvio da execução {run.pk}: {e}", level=messages.ERROR)
+                continue
+            if retry_run is not None:
+                retried += 1
+        if retried:
+            self.message_user(request, f"Reenvio enfileirado para {retried} execução(ões), apenas dispositivos com falha.")
+        else:
+            self.message_user(request, "Nenhuma das execuções selecionadas possui dispositivos com falha.", level=messages.WARNING)
+
+    retry_failed.short_description = "Reenviar aos dispositivos com falha"
+    # --- FIM DA AÇÃO DE REENVIO ---
+
+    class Media:
+        js = (
+            'admin/js/auto_refresh.js', # Caminho para o script de auto refresh
+        )
+
+    def display_task(self, obj): return obj.task.name
+    display_task.short_description = 'Tarefa'
+    display_task.admin_order_field = 'task__name'
+
+    def display_status(self, obj): return obj.get_status_display()
+    display_status.short_description = 'Status'
+    display_status.admin_order_field = 'status'
+
+    def display_scheduled_for(self, obj): return obj.scheduled_for
+    display_scheduled_for.short_description = 'Agendada para'
+    display_scheduled_for.admin_order_field = 'scheduled_for'
+
+    def display_dispatch_lag(self, obj): return format_lag(obj.dispatch_lag)
+    display_dispatch_lag.short_description = 'Atraso (Beat)'
+
+    def display_queue_wait(self, obj): return format_lag(obj.queue_wait)
+    display_queue_wait.short_description = 'Espera na Fila'
+
+    def display_duration(self, obj): return format_lag(obj.duration)
+    display_duration.short_description = 'Duração do Envio'
+
+    def display_delivery_lag(self, obj): return format_lag(obj.delivery_lag)
+    display_delivery_lag.short_description = 'Atraso até Entrega'
+
+    def display_chunks(self, obj):
+        if not obj.chunks_total:
+            return '-'
+        return f"{obj.chunks_done}/{obj.chunks_total}"
+    display_chunks.short_description = 'Lotes'
+
+    def display_retry_of(self, obj): return obj.retry_of_id or '-'
+    display_retry_of.short_description = 'Reenvio de'
+
+
+# ==============================================================================
+# 6. ADMIN DAS REGRAS DE ALERTA E DOS ALERTAS
+# ==============================================================================
+@admin.register(AlertRule)
+class AlertRuleAdmin(SiteScopedAdminMixin, admin.ModelAdmin):
+    # Regras não pertencem a um site (o escopo é por localização/tipo/dispositivos);
+    # apenas a lista de dispositivos do formulário é limitada aos sites do usuário
+    site_lookup = None
+    list_display = ('name', 'display_condition', 'location', 'device_type', 'is_active', 'display_has_command', 'updated_at')
+    list_filter = ('is_active', 'metric', 'location')
+    search_fields = ('name',)
+    filter_horizontal = ('devices',)
+    fieldsets = (
+        ('Regra', {
+            'fields': ('name', 'is_active')
+        }),
+        ('Condição', {
+            'fields': ('metric', 'operator', 'threshold', 'duration_seconds')
+        }),
+        ('Escopo', {
+            'fields': ('location', 'device_type', 'devices')
+        }),
+        ('Ação ao Disparar', {
+            'fields': ('command_json',)
+        }),
+    )
+
+    def display_condition(self, obj): return obj.describe()
+    display_condition.short_description = 'Condição'
+
+    def display_has_command(self, obj): return bool(obj.command_json)
+    display_has_command.short_description = 'Envia Comando'
+    display_has_command.boolean = True
+
+
+@admin.register(Alert)
+class AlertAdmin(SiteScopedAdminMixin, ReplicaChangelistMixin, admin.ModelAdmin):
+    site_lookup = 'device__site'
+    list_display = (
+        'display_rule', 'display_device', 'display_status', 'value',
+        'started_at', 'fired_at', 'resolved_at', 'command_status',
+    )
+    list_filter = ('status', 'rule', 'fired_at')
+    search_fields = ('rule__name', 'device__device_id', 'device__name')
+    list_select_related = ('rule', 'device')
+    date_hierarchy = 'fired_at'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = [field.name for field in Alert._meta.fields]
+
+    # Gerados pelo motor de alertas na ingestão
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    class Media:
+        js = (
+            'admin/js/auto_refresh.js', # Caminho para o script de auto refresh
+        )
+
+    def display_rule(self, obj): return obj.rule.name
+    display_rule.short_description = 'Regra'
+    display_rule.admin_order_field = 'rule__name'
+
+    def display_device(self, obj): return obj.device.name or obj.device.device_id
+    display_device.short_description = 'Dispositivo'
+    display_device.admin_order_field = 'device__name'
+
+    def display_status(self, obj): return obj.get_status_display()
+    display_status.short_description = 'Status'
+    display_status.admin_order_field = 'status'
+
+
+# ==============================================================================
+# 7. ADMIN DAS AUTOMAÇÕES
+# ==============================================================================
+@admin.register(Automation)
+class AutomationAdmin(SiteScopedAdminMixin, admin.ModelAdmin):
+    site_lookup = 'source_device__site'
+    list_display = ('name', 'source_device', 'display_condition', 'target_device', 'is_active', 'last_fired_at')
+    list_filter = ('is_active', 'metric')
+    search_fields = ('name', 'source_device__device_id', 'target_device__device_id')
+    list_select_related = ('source_device', 'target_device')
+    autocomplete_fields = ('source_device', 'target_device')
+    readonly_fields = ('last_fired_at',)
+    fieldsets = (
+        ('Automação', {
+            'fields': ('name', 'is_active', 'last_fired_at')
+        }),
+        ('Quando', {
+            'fields': ('source_device', 'metric', 'operator', 'threshold')
+        }),
+        ('Então', {
+            'fields': ('target_device', 'command_json')
+        }),
+    )
+
+    def display_condition(self, obj): return obj.describe()
+    display_condition.short_description = 'Condição'
+
+
+# ==============================================================================
+# 8. ADMIN DOS SITES
+# ==============================================================================
+@admin.register(Site)
+class SiteAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug', 'display_database', 'display_devices')
+    search_fields = ('name', 'slug')
+    prepopulated_fields = {'slug': ('name',)}
+    filter_horizontal = ('users',)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).annotate(device_count=models.Count('devices'))
+        return scope_queryset(queryset, request.user, 'pk')
+
+    def display_database(self, obj): return obj.database or 'default'
+    display_database.short_description = 'Banco de Telemetria'
+    display_database.admin_order_field = 'database'
+
+    def display_devices(self, obj): return obj.device_count
+    display_devices.short_description = 'Dispositivos'
+    display_devices.admin_order_field = 'device_count'
+
+
+# ==============================================================================
+# 9. ADMIN DAS ENTREGAS DE COMANDOS (CICLO DE VIDA E RELATÓRIO DE LATÊNCIA)
+# ==============================================================================
+# Agrupamentos do relatório: parâmetro ?by= -> (campo, título da coluna)
+COMMAND_REPORT_GROUPS = {
+    'device': ('device__device_id', 'Dispositivo'),
+    'device_type': ('device__device_type', 'Tipo de Dispositivo'),
+    'location': ('device__location', 'Localização'),
+}
+
+
+@admin.register(CommandDelivery)
+class CommandDeliveryAdmin(SiteScopedAdminMixin, ReplicaChangelistMixin, admin.ModelAdmin):
+    site_lookup = 'device__site'
+    change_list_template = 'admin/devices/commanddelivery/change_list.html'
+    list_display = (
+        'display_device', 'source', 'created_at', 'display_delivery', 'display_ack', 'display_state',
+    )
+    list_filter = ('source', 'created_at', 'device__device_type')
+    search_fields = ('device__device_id', 'device__name', 'device__location')
+    list_select_related = ('device',)
+    date_hierarchy = 'created_at'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = [field.name for field in CommandDelivery._meta.fields]
+
+    # Registros gerados pelo envio dos comandos, pelo polling e pela confirmação dos ESPs
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    # --- RELATÓRIO DE LATÊNCIA (POR DISPOSITIVO, TIPO OU LOCALIZAÇÃO) ---
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path('report/', self.admin_site.admin_view(self.report_view), name='devices_commanddelivery_report'),
+        ]
+        return custom_urls + urls
+
+    def report_view(self, request):
+        by = request.GET.get('by') if request.GET.get('by') in COMMAND_REPORT_GROUPS else 'device'
+        try:
+            days = max(1, min(int(request.GET.get('days', 7)), 90))
+        except ValueError:
+            days = 7
+        group_field, group_title = COMMAND_REPORT_GROUPS[by]
+
+        queryset = scope_queryset(
+            CommandDelivery.objects.filter(created_at__gte=timezone.now() - timedelta(days=days)),
+            request.user, self.site_lookup,
+        )
+        # Piores primeiro: maior atraso médio de entrega
+        aggregated = queryset.values(group_field).annotate(
+            total=Count('pk'),
+            delivered=Count('delivered_at'),
+            acked=Count('acked_at'),
+            avg_delivery=Avg('delivery_seconds'),
+            max_delivery=Max('delivery_seconds'),
+            avg_ack=Avg('ack_seconds'),
+            max_ack=Max('ack_seconds'),
+        ).order_by(F('avg_delivery').desc(nulls_last=True))[:100]
+
+        with use_replica():
+            rows = [
+                {
+                    **row,
+                    'group': row[group_field] or '-',
+                    'delivered_pct': 100 * row['delivered'] / row['total'],
+                    'acked_pct': 100 * row['acked'] / row['total'],
+                }
+                for row in aggregated
+            ]
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Latência dos comandos",
+            'rows': rows,
+            'by': by,
+            'days': days,
+            'group_title': group_title,
+            'groups': [(key, title) for key, (_, title) in COMMAND_REPORT_GROUPS.items()],
+        }
+        return render(request, 'admin/devices/commanddelivery/report.html', context)
+    # --- FIM DO RELATÓRIO ---
+
+    class Media:
+        js = (
+            'admin/js/auto_refresh.js', # Caminho para o script de auto refresh
+        )
+
+    def display_device(self, obj): return obj.device.name or obj.device.device_id
+    display_device.short_description = 'Dispositivo'
+    display_device.admin_order_field = 'device__name'
+
+    def display_delivery(self, obj):
+        return f"{obj.delivery_seconds:.1f}s" if obj.delivery_seconds is not None else '-'
+    display_delivery.short_description = 'Até Entrega'
+    display_delivery.admin_order_field = 'delivery_seconds'
+
+    def display_ack(self, obj):
+        return f"{obj.ack_seconds:.1f}s" if obj.ack_seconds is not None else '-'
+    display_ack.short_description = 'Até Confirmação'
+    display_ack.admin_order_field = 'ack_seconds'
+
+    def display_state(self, obj):
+        if obj.acked_at:
+            return 'Confirmado'
+        return 'Entregue' if obj.delivered_at else 'Aguardando'
+    display_state.short_description = 'Situação'
+
+
+# ==============================================================================
+# 10. ADMIN DAS TRANSIÇÕES DE PRESENÇA (SOMENTE LEITURA)
+# ==============================================================================
+@admin.register(PresenceTransition)
+class PresenceTransitionAdmin(SiteScopedAdminMixin, ReplicaChangelistMixin, admin.ModelAdmin):
+    site_lookup = 'device__site'
+    list_display = ('display_device', 'from_state', 'to_state', 'at', 'display_previous')
+    list_filter = ('to_state', 'from_state', 'at', 'device__device_type')
+    search_fields = ('device__device_id', 'device__name', 'device__location')
+    list_select_related = ('device',)
+    date_hierarchy = 'at'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = [field.name for field in PresenceTransition._meta.fields]
+
+    # Registro somente de inclusão, gravado em lote pela tarefa check_device_status
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def display_device(self, obj): return obj.device.name or obj.device.device_id
+    display_device.short_description = 'Dispositivo'
+    display_device.admin_order_field = 'device__name'
+
+    def display_previous(self, obj):
+        if obj.previous_seconds is None:
+            return '-'
+        return str(timedelta(seconds=int(obj.previous_seconds)))
+    display_previous.short_description = 'Duração do Estado Anterior'
+    display_previous.admin_order_field = 'previous_seconds'
+
+
+# ==============================================================================
+# 11. ADMIN DA DISPONIBILIDADE DIÁRIA (SOMENTE LEITURA)
+# ==============================================================================
+@admin.register(DeviceAvailability)
+class DeviceAvailabilityAdmin(SiteScopedAdminMixin, ReplicaChangelistMixin, admin.ModelAdmin):
+    site_lookup = 'device__site'
+    list_display = ('display_device', 'date', 'display_online', 'display_offline', 'display_availability')
+    list_filter = ('date', 'device__device_type', 'device__location')
+    search_fields = ('device__device_id', 'device__name', 'device__location')
+    list_select_related = ('device', 'device__presence')
+    date_hierarchy = 'date'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = [field.name for field in DeviceAvailability._meta.fields]
+
+    # Somada pela máquina de estados de presença a cada transição e na virada do dia
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def _open_presence(self, obj):
+        # Dia corrente: inclui o trecho em aberto do estado atual
+        if obj.date == timezone.localdate():
+            return getattr(obj.device, 'presence', None)
+        return None
+
+    def display_device(self, obj): return obj.device.name or obj.device.device_id
+    display_device.short_description = 'Dispositivo'
+    display_device.admin_order_field = 'device__name'
+
+    def display_online(self, obj): return str(timedelta(seconds=int(obj.online_seconds)))
+    display_online.short_description = 'Online'
+    display_online.admin_order_field = 'online_seconds'
+
+    def display_offline(self, obj):
+        return str(timedelta(seconds=int(obj.offline_seconds + obj.flapping_seconds)))
+    display_offline.short_description = 'Offline / Instável'
+    display_offline.admin_order_field = 'offline_seconds'
+
+    def display_availability(self, obj):
+        percent = availability_percent(obj, self._open_presence(obj))
+        return f"{percent:.1f}%" if percent is not None else '-'
+    display_availability.short_description = 'Disponibilidade'
+
+
+# ==============================================================================
+# PÁGINA INICIAL DO ADMIN: RESUMO DA FROTA (devices/fleet.py)
+# ==============================================================================
+# Widgets acima da lista de apps do Jazzmin (online/offline, temperatura e tarefas do dia)
+admin.site.index_template = 'admin/devices/fleet_index.html'
@@ -0,0 +1,184 @@
+# iot_project/devices/alerts.py
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from datetime import datetime, timezone as dt_timezone
+import logging
+import operator
+
+from .models import Alert, AlertRule
+from core_system import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# MOTOR DE ALERTAS (AVALIAÇÃO INCREMENTAL A CADA LEITURA)
+# ==============================================================================
+# Chamado pela ingestão (devices/ingest.py) depois que as leituras foram
+# gravadas. Nenhuma consulta à telemetria: para cada par (regra, dispositivo) o
+# Redis guarda um hash pequeno com o estado da janela:
+#   since -> início (epoch) da sequência atual de leituras que atendem à condição
+#   last  -> epoch da última leitura avaliada (leituras repetidas/atrasadas são ignoradas)
+#   alert -> id do Alert aberto (FIRING), se houver
+# Custo por requisição: um HGETALL e um HSET por regra aplicável, em pipelines;
+# o banco só é usado ao disparar/resolver. As regras ficam em memória em cada
+# processo (ver devices/ingest.py).
+
+OPERATORS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+
+class CompiledRule:
+    """AlertRule pronta para avaliação (sem acesso ao banco)."""
+
+    __slots__ = ('pk', 'name', 'metric', 'compare', 'threshold', 'duration',
+                 'location', 'device_type', 'device_ids', 'has_command', 'version')
+
+    def __init__(self, rule, device_ids):
+        self.pk = rule.pk
+        self.name = rule.name
+        self.metric = rule.metric
+        self.compare = OPERATORS[rule.operator]
+        self.threshold = rule.threshold
+        self.duration = rule.duration_seconds
+        self.location = rule.location
+        self.device_type = rule.device_type
+        self.device_ids = device_ids
+        self.has_command = bool(rule.command_json)
+        self.version = int(rule.updated_at.timestamp())
+
+    def applies_to(self, device):
+        return (
+            (not self.location or self.location == device.location)
+            and (not self.device_type or self.device_type == device.device_type)
+            and (not self.device_ids or device.pk in self.device_ids)
+        )
+
+    def state_key(self, device_pk):
+        # A versão (updated_at) no nome da chave descarta o estado quando a regra é editada
+        return f'alerts:state:{self.pk}:{self.version}:{device_pk}'
+
+
+# Regras carregadas neste processo (recarregadas por devices/ingest.py quando a versão muda)
+_cache = {'rules': [], 'by_device': {}}
+
+
+def load_rules():
+    rules = list(AlertRule.objects.filter(is_active=True).prefetch_related('devices'))
+    _cache['rules'] = [
+        CompiledRule(rule, frozenset(device.pk for device in rule.devices.all()))
+        for rule in rules
+    ]
+    _cache['by_device'] = {}
+
+
+def rules_for_device(device):
+    profile = (device.pk, device.location, device.device_type)
+    rules = _cache['by_device'].get(profile)
+    if rules is None:
+        rules = _cache['by_device'][profile] = [rule for rule in _cache['rules'] if rule.applies_to(device)]
+    return rules
+
+
+def evaluate_rules(client, device, readings):
+    """Avalia as regras aplicáveis ao dispositivo com as leituras recém-gravadas (TelemetryData)."""
+    rules = rules_for_device(device)
+    if not rules:
+        return
+
+    readings = sorted(readings, key=lambda reading: reading.timestamp)
+    keys = [rule.state_key(device.pk) for rule in rules]
+
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(key)
+    states = pipe.execute()
+
+    pipe = client.pipeline(transaction=False)
+    for rule, key, state in zip(rules, keys, states):
+        new_state = advance(rule, device, state, readings)
+        if new_state is not None:
+            pipe.hset(key, mapping=new_state)
+            pipe.expire(key, settings.RULES_STATE_TTL_SECONDS)
+    pipe.execute()
+
+
+def advance(rule, device, state, readings):
+    """Aplica as leituras à janela de uma regra; devolve o novo estado (ou None se nada foi avaliado)."""
+    since = float(state[b'since']) if state.get(b'since') else None
+    last = float(state[b'last']) if state.get(b'last') else None
+    alert_id = int(state[b'alert']) if state.get(b'alert') else None
+    evaluated = False
+
+    for reading in readings:
+        value = reading.metric_value(rule.metric)
+        if value is None:
+            continue
+        ts = reading.timestamp.timestamp()
+        if last is not None and ts <= last:
+            continue
+        # Sem leituras por muito tempo: não dá para afirmar que a condição se manteve
+        if last is not None and ts - last > settings.ALERT_MAX_GAP_SECONDS:
+            since = None
+        last = ts
+        evaluated = True
+
+        if rule.compare(value, rule.threshold):
+            if since is None:
+                since = ts
+            if alert_id is None and ts - since >= rule.duration:
+                alert_id = fire(rule, device, reading, value, since)
+        else:
+            since = None
+            if alert_id is not None:
+                resolve(rule, alert_id, reading)
+                alert_id = None
+
+    if not evaluated:
+        return None
+    return {'since': since or '', 'last': last, 'alert': alert_id or ''}
+
+
+def fire(rule, device, reading, value, since):
+    alert = Alert.objects.create(
+        rule_id=rule.pk,
+        device=device,
+        value=value,
+        started_at=datetime.fromtimestamp(since, dt_timezone.utc),
+        fired_at=reading.timestamp,
+    )
+    logger.warning(f"Alerta '{rule.name}' disparado em {device.device_id}: {rule.metric}={value}.")
+    with metrics.record() as pipe:
+        metrics.ALERTS_FIRED.inc(pipe, rule=rule.name)
+
+    if rule.has_command:
+        transaction.on_commit(lambda: enqueue_alert_command(alert))
+    return alert.pk
+
+
+def resolve(rule, alert_id, reading):
+    Alert.objects.filter(pk=alert_id, status='FIRING').update(status='RESOLVED', resolved_at=reading.timestamp)
+    with metrics.record() as pipe:
+        metrics.ALERTS_RESOLVED.inc(pipe, rule=rule.name)
+
+
+def enqueue_alert_command(alert):
+    from .tasks import dispatch_alert_command
+
+    try:
+        dispatch_alert_command.delay(alert.pk)
+    except Exception as e:
+        # Broker fora do ar: o alerta fica registrado, sem o comando
+        logger.error(f"Não foi possível enfileirar o comando do alerta {alert.pk}: {e}")
+        Alert.objects.filter(pk=alert.pk).update(command_status='FAILED', command_error=str(e)[:1000])
+
+
+def resolve_open_alerts(rule_pk):
+    """Encerra os alertas abertos de uma regra desativada."""
+    Alert.objects.filter(rule_id=rule_pk, status='FIRING').update(status='RESOLVED', resolved_at=timezone.now())
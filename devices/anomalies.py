@@ -0,0 +1,139 @@
+# iot_project/devices/anomalies.py
+
+from django.conf import settings
+from collections import Counter
+import json
+import logging
+import math
+
+import redis
+
+from .models import TelemetryData
+from core_system import metrics
+from core_system.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# DETECÇÃO DE LEITURAS ANÔMALAS (ESTATÍSTICAS EM STREAMING POR DISPOSITIVO)
+# ==============================================================================
+# Executada na ingestão ANTES de gravar as leituras: o resultado vai direto em
+# TelemetryData.anomaly_flags, sem UPDATE posterior e sem varrer o histórico.
+#
+# Para cada (dispositivo, medida) o Redis guarda um estado compacto:
+#   ewma          -> média móvel exponencial (valor "esperado" da próxima leitura)
+#   n, mean, m2   -> Welford sobre o resíduo (leitura - ewma): desvio-padrão típico
+#                    do sensor; n é limitado a WINDOW para esquecer o passado distante
+#   last, repeat  -> último valor e quantas leituras seguidas ele se repetiu
+#   spikes        -> picos seguidos (a partir de SPIKE_MAX_RUN vira o novo patamar)
+#
+# Marcações (bits de TelemetryData.ANOMALY_*):
+#   RANGE -> fora da faixa física do sensor
+#   STUCK -> mesmo valor exato por STUCK_READINGS leituras (DHT travado)
+#   SPIKE -> desvio da EWMA maior que SPIKE_SIGMA desvios-padrão (e que SPIKE_MIN_DELTA)
+# Leituras marcadas não alimentam as estatísticas.
+
+STATE_KEY = 'anomalies:state:{device_pk}'
+
+
+def new_state():
+    return {'ewma': None, 'n': 0, 'mean': 0.0, 'm2': 0.0, 'last': None, 'repeat': 0, 'spikes': 0}
+
+
+def check_value(state, value, config, limits):
+    """Classifica uma leitura e atualiza o estado (no próprio dict). Devolve os bits de anomalia."""
+    if not limits['MIN'] <= value <= limits['MAX']:
+        return TelemetryData.ANOMALY_RANGE
+
+    flags = 0
+    state['repeat'] = state['repeat'] + 1 if value == state['last'] else 1
+    state['last'] = value
+    if state['repeat'] >= config['STUCK_READINGS']:
+        flags |= TelemetryData.ANOMALY_STUCK
+
+    if state['ewma'] is not None and state['n'] >= config['MIN_SAMPLES']:
+        std = math.sqrt(state['m2'] / (state['n'] - 1))
+        if abs(value - state['ewma']) > max(config['SPIKE_SIGMA'] * std, limits['SPIKE_MIN_DELTA']):
+            state['spikes'] += 1
+            if state['spikes'] < config['SPIKE_MAX_RUN']:
+                flags |= TelemetryData.ANOMALY_SPIKE
+            else:
+                # O "pico" persistiu: mudança real de patamar (ex: ar-condicionado ligado)
+                state['ewma'] = value
+                state['spikes'] = 0
+        else:
+            state['spikes'] = 0
+
+    if not flags:
+        update_statistics(state, value, config)
+    return flags
+
+
+def update_statistics(state, value, config):
+    if state['ewma'] is None:
+        state['ewma'] = value
+        return
+
+    residual = value - state['ewma']
+    if state['n'] >= config['WINDOW']:
+        # Janela cheia: reduz o peso do histórico antes de incluir o novo resíduo
+        state['m2'] *= (config['WINDOW'] - 2) / (config['WINDOW'] - 1)
+        state['n'] = config['WINDOW'] - 1
+    state['n'] += 1
+    delta = residual - state['mean']
+    state['mean'] += delta / state['n']
+    state['m2'] += delta * (residual - state['mean'])
+
+    alpha = config['EWMA_ALPHA']
+    state['ewma'] = alpha * value + (1 - alpha) * state['ewma']
+
+
+def flag_readings(device, readings):
+    """
+    Preenche anomaly_flags das leituras (TelemetryData ainda não gravadas) de um dispositivo.
+    Com o Redis indisponível as leituras seguem sem marcação.
+    """
+    if not settings.ANOMALY_DETECTION_ENABLED or device is None or not readings:
+        return
+
+    config = settings.ANOMALY_DETECTION
+    key = STATE_KEY.format(device_pk=device.pk)
+    try:
+        client = get_redis(settings.RULES_REDIS_URL)
+        stored = client.hgetall(key)
+    except redis.RedisError as e:
+        logger.warning(f"Detecção de anomalias desativada para {device.device_id}: Redis indisponível ({e}).")
+        return
+
+    states = {
+        metric: json.loads(stored[metric.encode()]) if metric.encode() in stored else new_state()
+        for metric in TelemetryData.ANOMALY_METRIC_SHIFT
+    }
+    found = Counter()
+
+    for reading in sorted(readings, key=lambda reading: reading.timestamp):
+        reading_flags = 0
+        for metric, shift in TelemetryData.ANOMALY_METRIC_SHIFT.items():
+            value = getattr(reading, metric)
+            if value is None:
+                continue
+            flags = check_value(states[metric], value, config, config['METRICS'][metric])
+            reading_flags |= flags << shift
+            for bit, kind in TelemetryData.ANOMALY_KINDS.items():
+                if flags & bit:
+                    found[(metric, kind)] += 1
+        reading.anomaly_flags = reading_flags
+
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(key, mapping={metric: json.dumps(state) for metric, state in states.items()})
+        pipe.expire(key, config['STATE_TTL_SECONDS'])
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Estado de anomalias de {device.device_id} não gravado: {e}")
+
+    if found:
+        with metrics.record() as pipe:
+            for (metric, kind), count in found.items():
+                metrics.TELEMETRY_ANOMALIES.inc(pipe, count, metric=metric, kind=kind)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class DevicesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'devices'
+
+    def ready(self):
+        # Sinais que invalidam as regras em cache (alertas e automações, devices/ingest.py)
+        from . import ingest  # noqa: F401
+        # Telemetria dos bancos de site ao excluir um dispositivo (devices/sites.py)
+        from . import sites  # noqa: F401
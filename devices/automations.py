@@ -0,0 +1,119 @@
+# iot_project/devices/automations.py
+
+from django.conf import settings
+from django.utils import timezone
+import json
+import logging
+
+from .alerts import OPERATORS
+from .dashboard import bump_state_version
+from .models import Automation, CommandDelivery, Device
+from core_system import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# AUTOMAÇÕES (LEITURA DO DISPOSITIVO A -> COMANDO PENDENTE NO DISPOSITIVO B)
+# ==============================================================================
+# Chamado pela ingestão (devices/ingest.py) com as leituras recém-gravadas.
+# As automações ativas ficam compiladas em memória, indexadas pelo dispositivo
+# de origem: um dispositivo sem automações não custa nada além do lookup no dict,
+# independente de quantas automações existam.
+#
+# O disparo acontece na borda (condição passou de falsa para verdadeira na
+# leitura mais recente); a condição da última leitura de cada automação fica no
+# Redis, em um hash por dispositivo de origem (um HMGET + um HSET por requisição).
+# O comando é gravado direto no pending_command do destino, sem passar pelo
+# Celery, e entregue na próxima consulta do ESP (GET /api/devices/<id>/).
+
+STATE_KEY = 'automations:state:{device_pk}'
+
+
+class CompiledAutomation:
+    """Automation pronta para avaliação (sem acesso ao banco)."""
+
+    __slots__ = ('pk', 'name', 'metric', 'compare', 'threshold', 'target_pk',
+                 'target_device_id', 'command', 'state_field')
+
+    def __init__(self, automation):
+        self.pk = automation.pk
+        self.name = automation.name
+        self.metric = automation.metric
+        self.compare = OPERATORS[automation.operator]
+        self.threshold = automation.threshold
+        self.target_pk = automation.target_device_id
+        self.target_device_id = automation.target_device.device_id
+        # Mesmo formato gravado pelo Celery (string JSON no pending_command)
+        self.command = json.dumps(automation.command_json)
+        # A versão (updated_at) no campo descarta o estado quando a automação é editada
+        self.state_field = f'{automation.pk}:{int(automation.updated_at.timestamp())}'
+
+
+# dispositivo de origem (pk) -> [CompiledAutomation]
+_index = {}
+
+
+def load_automations():
+    index = {}
+    for automation in Automation.objects.filter(is_active=True).select_related('target_device'):
+        index.setdefault(automation.source_device_id, []).append(CompiledAutomation(automation))
+    _index.clear()
+    _index.update(index)
+
+
+def run_automations(client, device, readings):
+    automations = _index.get(device.pk)
+    if not automations:
+        return
+
+    latest = max(readings, key=lambda reading: reading.timestamp)
+    key = STATE_KEY.format(device_pk=device.pk)
+    previous = client.hmget(key, [automation.state_field for automation in automations])
+
+    state = {}
+    fired = []
+    for automation, was_matching in zip(automations, previous):
+        value = latest.metric_value(automation.metric)
+        if value is None:
+            continue
+        matching = automation.compare(value, automation.threshold)
+        state[automation.state_field] = int(matching)
+        if matching and was_matching != b'1':
+            fired.append(automation)
+
+    # Estado gravado só depois dos comandos: se a gravação falhar, a próxima leitura tenta de novo
+    if fired:
+        fire(fired, latest)
+    if state:
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(key, mapping=state)
+        pipe.expire(key, settings.RULES_STATE_TTL_SECONDS)
+        pipe.execute()
+
+
+def fire(automations, reading):
+    now = timezone.now()
+    deliveries = CommandDelivery.objects.bulk_create([
+        CommandDelivery(device_id=automation.target_pk, source='automation', command=automation.command, created_at=now)
+        for automation in automations
+    ])
+    for automation, delivery in zip(automations, deliveries):
+        Device.objects.filter(pk=automation.target_pk).update(
+            pending_command=automation.command,
+            command_issued_at=now,
+            command_delivered_at=None,
+            command_run=None,
+            command_delivery=delivery,
+        )
+    Automation.objects.filter(pk__in=[automation.pk for automation in automations]).update(last_fired_at=now)
+
+    # O update() não passa pelo serializer: o cartão do destino no dashboard é invalidado aqui
+    for target_pk in {automation.target_pk for automation in automations}:
+        bump_state_version(Device(pk=target_pk))
+
+    with metrics.record() as metrics_pipe:
+        for automation in automations:
+            metrics.AUTOMATIONS_FIRED.inc(metrics_pipe, automation=automation.name)
+            metrics.AUTOMATION_REACTION.observe(metrics_pipe, max(0.0, (now - reading.timestamp).total_seconds()))
+            logger.info(f"Automação '{automation.name}': comando gravado em {automation.target_device_id}.")
@@ -0,0 +1,94 @@
+# iot_project/devices/bulk.py
+
+from django.db import connections
+import csv
+import io
+import json
+
+from .models import TelemetryData
+
+
+# ==============================================================================
+# INSERÇÃO EM MASSA DE TELEMETRIA (COPY NO POSTGRESQL, bulk_create NOS DEMAIS)
+# ==============================================================================
+# Usado pelo gerador de dados sintéticos e pelo importador de histórico.
+# As linhas são tuplas na ordem de TELEMETRY_COPY_COLUMNS, já com os ids (FK) do
+# dispositivo e do seu site resolvidos:
+#   (device_pk, site_pk, temperatura, umidade, relé (bool), ação do botão, raw_data (dict), timestamp aware)
+# O banco ('using') é o de telemetria do site (Device.telemetry_db): quem chama agrupa
+# as linhas por banco.
+
+TELEMETRY_COPY_COLUMNS = (
+    'device_id', 'site_id', 'temperature_celsius', 'humidity_percent', 'relay_state_D1',
+    'last_button_action', 'raw_data', 'timestamp',
+)
+
+
+def supports_copy(using='default'):
+    return connections[using].vendor == 'postgresql'
+
+
+def copy_telemetry(rows, using='default'):
+    """
+    Grava as linhas com um único COPY ... FROM STDIN (formato CSV) e devolve a quantidade.
+    None vira NULL; o JSON de raw_data é serializado aqui.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for device_pk, site_pk, temperature, humidity, relay, button, raw_data, timestamp in rows:
+        writer.writerow((
+            device_pk,
+            site_pk,
+            temperature,
+            humidity,
+            't' if relay else 'f',
+            button,
+            json.dumps(raw_data) if raw_data is not None else None,
+            timestamp.isoformat(),
+        ))
+        count += 1
+    if not count:
+        return 0
+
+    buffer.seek(0)
+    columns = ', '.join(f'"{column}"' for column in TELEMETRY_COPY_COLUMNS)
+    sql = f'COPY {TelemetryData._meta.db_table} ({columns}) FROM STDIN WITH (FORMAT csv)'
+
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, 'copy_expert'):
+            # psycopg2
+            raw_cursor.copy_expert(sql, buffer)
+        else:
+            # psycopg 3
+            with raw_cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+    return count
+
+
+def bulk_create_telemetry(rows, using='default', batch_size=5000):
+    """Alternativa ao COPY para bancos que não são PostgreSQL (ex: SQLite em desenvolvimento)."""
+    records = [
+        TelemetryData(
+            device_id=device_pk,
+            site_id=site_pk,
+            temperature_celsius=temperature,
+            humidity_percent=humidity,
+            relay_state_D1=relay,
+            last_button_action=button,
+            raw_data=raw_data,
+            timestamp=timestamp,
+        )
+        for device_pk, site_pk, temperature, humidity, relay, button, raw_data, timestamp in rows
+    ]
+    TelemetryData.objects.using(using).bulk_create(records, batch_size=batch_size)
+    return len(records)
+
+
+def insert_telemetry(rows, using='default', method='auto'):
+    """Grava um bloco de linhas com COPY ('copy'), bulk_create ('bulk') ou o melhor disponível ('auto')."""
+    if method == 'copy' or (method == 'auto' and supports_copy(using)):
+        return copy_telemetry(rows, using)
+    return bulk_create_telemetry(rows, using)
@@ -0,0 +1,78 @@
+# iot_project/devices/commands.py
+
+from django.db.models import F
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import CommandDelivery, TaskRun
+from core_system import metrics
+
+
+# ==============================================================================
+# CICLO DE VIDA DOS COMANDOS: GRAVADO -> ENTREGUE (GET) -> CONFIRMADO (PUT)
+# ==============================================================================
+# Cada comando gravado no pending_command ganha um CommandDelivery, apontado por
+# Device.command_delivery. A entrega e a confirmação atualizam essa linha pela PK
+# (um UPDATE cada, só na requisição em que acontecem) e alimentam os histogramas
+# por tipo e localização; o recorte por dispositivo fica no relatório do Admin.
+
+def open_command(device, command, source='api', run=None, created_at=None):
+    """Registra um novo comando pendente para o dispositivo e devolve o CommandDelivery."""
+    return CommandDelivery.objects.create(
+        device=device, run=run, source=source, command=command, created_at=created_at or timezone.now(),
+    )
+
+
+def _device_labels(device):
+    return {'device_type': device.device_type or '', 'location': device.location or ''}
+
+
+def record_command_delivery(device):
+    """
+    Contabiliza a entrega do comando pendente (command_delivered_at já preenchido pelo GET):
+    atualiza o CommandDelivery, os contadores do TaskRun de origem e os histogramas de atraso.
+    Usa device.command_run carregado via select_related (sem query extra).
+    """
+    delivered_at = device.command_delivered_at
+
+    with metrics.record() as pipe:
+        if device.command_issued_at:
+            delivery_seconds = max(0.0, (delivered_at - device.command_issued_at).total_seconds())
+            metrics.COMMAND_DELIVERY.observe(pipe, delivery_seconds, **_device_labels(device))
+            if device.command_delivery_id:
+                CommandDelivery.objects.filter(pk=device.command_delivery_id).update(
+                    delivered_at=delivered_at, delivery_seconds=delivery_seconds,
+                )
+
+        run = device.command_run
+        if run is not None:
+            TaskRun.objects.filter(pk=run.pk).update(
+                devices_delivered=F('devices_delivered') + 1,
+                first_delivered_at=Coalesce(F('first_delivered_at'), delivered_at),
+                last_delivered_at=Greatest(Coalesce(F('last_delivered_at'), delivered_at), delivered_at),
+            )
+            metrics.SCHEDULER_DELIVERY_LAG.observe(pipe, max(0.0, (delivered_at - run.scheduled_for).total_seconds()))
+
+
+def record_command_ack(device, acked_at):
+    """
+    Confirmação (PUT com last_command) do comando entregue: grava o instante no
+    CommandDelivery e observa os histogramas de confirmação e de ida e volta.
+    'device' traz os timestamps anteriores ao PUT. Confirmações repetidas são ignoradas.
+    """
+    if not device.command_delivery_id:
+        return
+    delivered_at = device.command_delivered_at
+    ack_seconds = max(0.0, (acked_at - delivered_at).total_seconds()) if delivered_at else None
+    acked = CommandDelivery.objects.filter(pk=device.command_delivery_id, acked_at__isnull=True).update(
+        acked_at=acked_at, ack_seconds=ack_seconds,
+    )
+    if not acked:
+        return
+
+    labels = _device_labels(device)
+    with metrics.record() as pipe:
+        if ack_seconds is not None:
+            metrics.COMMAND_ACK.observe(pipe, ack_seconds, **labels)
+        if device.command_issued_at:
+            metrics.COMMAND_ROUNDTRIP.observe(pipe, max(0.0, (acked_at - device.command_issued_at).total_seconds()), **labels)
@@ -0,0 +1,145 @@
+# iot_project/devices/dashboard.py
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+import logging
+import time
+import zlib
+
+import redis
+
+from .fleet import get_fleet_summary
+from .models import Device, Site, TelemetryData
+from .sites import scope_queryset, telemetry_objects, user_site_ids
+from core_system import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# CACHE DO DASHBOARD WEB (VERSÃO DE ESTADO POR DISPOSITIVO)
+# ==============================================================================
+# Cada aba aberta em /devices/dashboard/ recarrega a página a cada 30s. Com o cache
+# (django.core.cache, no Redis), o número de abas deixa de multiplicar as queries:
+#   1. Dados: a lista de dispositivos do escopo (sites do usuário + ?site=) fica
+#      DASHBOARD_DATA_CACHE_SECONDS no cache e é compartilhada por todas as abas.
+#   2. Cartões: o HTML de cada cartão (status, relé e última leitura) é guardado
+#      com a versão de estado do dispositivo na chave. A ingestão de telemetria
+#      incrementa a versão (bump_state_version); o status e o nome, que já vêm na
+#      linha do Device, também entram na chave. Só os cartões cuja chave mudou
+#      consultam a última leitura e são renderizados de novo.
+# O último heartbeat (rodapé do cartão) muda a cada consulta do ESP e fica fora do
+# cartão em cache. Com o Redis fora do ar, a página é montada sem cache.
+
+# Sem heartbeat por este tempo, o dispositivo passa a OFFLINE (texto do dashboard)
+TIMEOUT_MINUTES = settings.PRESENCE['OFFLINE_AFTER_SECONDS'] // 60
+CARD_TEMPLATE = 'devices/_device_card.html'
+VERSION_KEY = 'dashboard:version:{}'
+
+# Redis fora do ar: cache desligado por alguns segundos
+_disabled_until = 0.0
+REDIS_RETRY_SECONDS = 30
+
+
+def _cache_call(method, *args, default=None, **kwargs):
+    global _disabled_until
+
+    if not settings.DASHBOARD_CACHE_ENABLED or time.monotonic() < _disabled_until:
+        return default
+    try:
+        return getattr(cache, method)(*args, **kwargs)
+    except redis.RedisError as e:
+        _disabled_until = time.monotonic() + REDIS_RETRY_SECONDS
+        logger.warning(f"Cache do dashboard desativado por {REDIS_RETRY_SECONDS}s: falha no Redis ({e}).")
+        return default
+
+
+def bump_state_version(device):
+    """Chamado pela ingestão de telemetria: o próximo dashboard renderiza o cartão de novo."""
+    key = VERSION_KEY.format(device.pk)
+    try:
+        _cache_call('incr', key)
+    except ValueError:
+        # Versão ainda não existe (ou foi descartada): um valor novo, para não reaproveitar
+        # cartões gravados com uma versão anterior
+        _cache_call('set', key, time.time_ns(), timeout=None)
+
+
+def card_key(device, version):
+    return f"dashboard:card:{device.pk}:{version}:{int(device.is_active)}:{zlib.crc32(device.name.encode())}"
+
+
+# ==============================================================================
+# DADOS DA PÁGINA
+# ==============================================================================
+def load_dashboard(user, site_slug=None):
+    """
+    Sites visíveis, site selecionado, dispositivos do escopo (online primeiro, depois
+    por nome) e resumo da frota. Do cache quando outra aba do mesmo escopo já montou
+    a lista há pouco.
+    """
+    site_ids = user_site_ids(user)
+    scope = 'all' if site_ids is None else ','.join(str(pk) for pk in sorted(site_ids))
+    key = f"dashboard:data:{scope}:{site_slug or ''}"
+
+    data = _cache_call('get', key)
+    if data is None:
+        data = _build_dashboard(user, site_slug)
+        _cache_call('set', key, data, settings.DASHBOARD_DATA_CACHE_SECONDS)
+    return data
+
+
+def _build_dashboard(user, site_slug):
+    sites = list(scope_queryset(Site.objects.all(), user, 'pk'))
+    current_site = next((site for site in sites if site.slug == site_slug), None) if site_slug else None
+    devices = scope_queryset(Device.objects.select_related('site'), user)
+    if current_site is not None:
+        devices = devices.filter(site=current_site)
+    devices = list(devices)
+
+    # O is_active é mantido pela máquina de estados de presença (devices/presence.py).
+    # Ordena: online primeiro (True antes de False) e, depois, pelo nome
+    for device in devices:
+        device.is_online = device.is_active
+    devices.sort(key=lambda d: (-d.is_online, d.name))
+
+    return {
+        'sites': sites,
+        'current_site': current_site,
+        'devices': devices,
+        'summary': get_fleet_summary(user, current_site),
+    }
+
+
+# ==============================================================================
+# CARTÕES
+# ==============================================================================
+def attach_cards(devices):
+    """Preenche device.card_html: do cache se a chave não mudou, renderizado nos demais."""
+    version_keys = [VERSION_KEY.format(device.pk) for device in devices]
+    versions = _cache_call('get_many', version_keys, default={})
+    card_keys = [card_key(device, versions.get(key, 0)) for device, key in zip(devices, version_keys)]
+    cached = _cache_call('get_many', card_keys, default={})
+
+    rendered = {}
+    for device, key in zip(devices, card_keys):
+        html = cached.get(key)
+        if html is None:
+            # Apenas as colunas exibidas: atendida pelo índice (device, -timestamp) com INCLUDE.
+            # Leituras anômalas (anomaly_flags) são puladas; normalmente só a primeira linha é visitada.
+            # No banco de telemetria do site do dispositivo.
+            device.latest_telemetry = telemetry_objects(device.telemetry_db).filter(
+                device=device, anomaly_flags=0
+            ).only(*TelemetryData.DASHBOARD_FIELDS).order_by('-timestamp').first()
+            html = rendered[key] = render_to_string(CARD_TEMPLATE, {'device': device})
+        device.card_html = mark_safe(html)
+
+    if rendered:
+        _cache_call('set_many', rendered, settings.DASHBOARD_CARD_CACHE_SECONDS)
+    with metrics.record() as pipe:
+        if len(devices) > len(rendered):
+            metrics.DASHBOARD_CARDS.inc(pipe, len(devices) - len(rendered), result='cache')
+        if rendered:
+            metrics.DASHBOARD_CARDS.inc(pipe, len(rendered), result='render')
@@ -0,0 +1,135 @@
+# iot_project/devices/fleet.py
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+
+from .models import Device, FleetSummary, ScheduledTask
+from .sites import scope_queryset, telemetry_objects
+from core_system.db_router import site_aliases
+
+
+# ==============================================================================
+# RESUMO DA FROTA (TABELA RECALCULADA A CADA MINUTO)
+# ==============================================================================
+# Online/offline por site, localização e tipo e a temperatura média recente. O Admin,
+# o dashboard e a API (/api/fleet/summary/) leem as linhas de FleetSummary, que são
+# poucas (uma por combinação existente) qualquer que seja o tamanho da frota.
+# A tarefa refresh_fleet_summary recalcula tudo com duas agregações:
+#   1. Device agrupado por (site, localização, tipo), no banco;
+#   2. soma e contagem das temperaturas da janela recente por dispositivo, em cada
+#      banco de telemetria (índice em timestamp), distribuídas pelos grupos em Python
+#      (nos bancos de site não há a tabela Device para o JOIN).
+# Não é uma materialized view do PostgreSQL porque a telemetria pode estar em vários
+# bancos; a troca das linhas é feita em uma transação, como um REFRESH.
+
+def refresh_fleet_summary():
+    """Recalcula todas as linhas de FleetSummary. Retorna quantos grupos foram gravados."""
+    now = timezone.now()
+    since = now - timedelta(minutes=settings.FLEET_SUMMARY_TEMPERATURE_MINUTES)
+
+    groups = {}
+    for row in Device.objects.values('site_id', 'location', 'device_type').annotate(
+        total=Count('pk'), online=Count('pk', filter=Q(is_active=True)),
+    ):
+        key = (row['site_id'], row['location'], row['device_type'])
+        groups[key] = FleetSummary(
+            site_id=row['site_id'], location=row['location'], device_type=row['device_type'],
+            devices_total=row['total'], devices_online=row['online'], refreshed_at=now,
+        )
+
+    temperatures = {}
+    for using in [DEFAULT_DB_ALIAS, *site_aliases()]:
+        readings = telemetry_objects(using).filter(
+            timestamp__gte=since, anomaly_flags=0, temperature_celsius__isnull=False, device__isnull=False,
+        ).values('device_id').annotate(total=Sum('temperature_celsius'), count=Count('pk')).order_by()
+        for row in readings:
+            total, count = temperatures.get(row['device_id'], (0.0, 0))
+            temperatures[row['device_id']] = (total + row['total'], count + row['count'])
+
+    sums = {}
+    device_ids = list(temperatures)
+    for start in range(0, len(device_ids), 1000):
+        for pk, site_id, location, device_type in Device.objects.filter(
+            pk__in=device_ids[start:start + 1000]
+        ).values_list('pk', 'site_id', 'location', 'device_type'):
+            total, count = temperatures[pk]
+            group_total, group_count = sums.get((site_id, location, device_type), (0.0, 0))
+            sums[(site_id, location, device_type)] = (group_total + total, group_count + count)
+
+    for key, (total, count) in sums.items():
+        if key in groups:
+            groups[key].temperature_avg = total / count
+            groups[key].temperature_readings = count
+
+    with transaction.atomic():
+        FleetSummary.objects.all().delete()
+        FleetSummary.objects.bulk_create(groups.values())
+    return len(groups)
+
+
+# ==============================================================================
+# LEITURA (ADMIN, DASHBOARD E API)
+# ==============================================================================
+def get_fleet_summary(user, site=None):
+    """
+    Resumo para o usuário (apenas os sites dele; com site, um único site): totais,
+    por localização e por tipo. As tarefas do dia são contadas na hora (o número de
+    tarefas não cresce com a frota).
+    """
+    rows = scope_queryset(FleetSummary.objects.all(), user)
+    tasks = scope_queryset(ScheduledTask.objects.filter(status='PENDING'), user)
+    if site is not None:
+        rows = rows.filter(site=site)
+        tasks = tasks.filter(site=site)
+    rows = list(rows)
+    totals = _combine(rows, lambda row: None)
+
+    return {
+        'refreshed_at': min((row.refreshed_at for row in rows), default=None),
+        'totals': totals[0] if totals else {
+            'name': None, 'devices_total': 0, 'devices_online': 0, 'devices_offline': 0,
+            'temperature_avg': None, 'temperature_readings': 0,
+        },
+        'by_location': _combine(rows, lambda row: row.location),
+        'by_device_type': _combine(rows, lambda row: row.device_type),
+        'tasks_due_today': count_tasks_due_today(tasks),
+    }
+
+
+def _combine(rows, key):
+    """Soma as linhas por chave; a temperatura média é ponderada pelo número de leituras."""
+    combined = {}
+    for row in rows:
+        entry = combined.setdefault(key(row), {
+            'name': key(row), 'devices_total': 0, 'devices_online': 0, 'temperature_sum': 0.0, 'temperature_readings': 0,
+        })
+        entry['devices_total'] += row.devices_total
+        entry['devices_online'] += row.devices_online
+        if row.temperature_avg is not None:
+            entry['temperature_sum'] += row.temperature_avg * row.temperature_readings
+            entry['temperature_readings'] += row.temperature_readings
+
+    result = []
+    for entry in combined.values():
+        readings = entry.pop('temperature_readings')
+        total = entry.pop('temperature_sum')
+        entry['devices_offline'] = entry['devices_total'] - entry['devices_online']
+        entry['temperature_avg'] = round(total / readings, 1) if readings else None
+        entry['temperature_readings'] = readings
+        result.append(entry)
+    result.sort(key=lambda entry: (-entry['devices_total'], entry['name'] or ''))
+    return result
+
+
+def count_tasks_due_today(tasks):
+    """Tarefas pendentes com execução hoje: únicas com execution_time hoje e recorrentes do dia da semana."""
+    local_now = timezone.localtime()
+    start = timezone.make_aware(datetime.combine(local_now.date(), time.min))
+    return tasks.filter(
+        Q(is_recurrent=False, execution_time__gte=start, execution_time__lt=start + timedelta(days=1))
+        # Dias da semana com um dígito (1=Seg ... 7=Dom), como em check_scheduled_tasks
+        | Q(is_recurrent=True, recurrent_days__contains=str(local_now.weekday() + 1))
+    ).count()
@@ -0,0 +1,365 @@
+# iot_project/devices/importers.py
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import datetime, timedelta, timezone as dt_timezone
+import csv
+import json
+import logging
+import os
+import time
+import uuid
+
+from .bulk import insert_telemetry
+from .models import Device, Site, TelemetryImport
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# IMPORTAÇÃO DE HISTÓRICO DE TELEMETRIA (CSV / NDJSON)
+# ==============================================================================
+# Usado pelo comando 'import_telemetry' e pelo upload no Admin (em segundo plano).
+#
+# Colunas/chaves reconhecidas (apenas device_id e timestamp são obrigatórias):
+#   device_id, timestamp (ISO 8601 ou epoch em segundos), temperature_celsius,
+#   humidity_percent, relay_state_D1, last_button_action, raw_data (JSON)
+#
+# O arquivo é lido como bytes para que o deslocamento (offset) de cada bloco
+# gravado seja exato: o progresso salvo permite retomar a importação do ponto
+# onde parou. No CSV, campos entre aspas podem conter quebras de linha.
+#
+# As leituras vão para o banco de telemetria do site de cada dispositivo
+# (Site.database). Um bloco com dispositivos de sites em bancos diferentes é
+# gravado com uma transação por banco; se uma delas falhar, a retomada pelo
+# offset regrava as leituras já confirmadas nos outros bancos.
+
+FORMATS = ('csv', 'ndjson')
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y', 'sim', 's', 'on'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n', 'nao', 'não', 'off', ''}
+
+
+class ImportErrorLimit(Exception):
+    """Número de linhas inválidas excedeu o limite configurado."""
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return 'ndjson' if extension in ('.ndjson', '.jsonl', '.json') else 'csv'
+
+
+class _LineReader:
+    """Itera as linhas (decodificadas) de um arquivo binário, registrando o offset em bytes."""
+
+    def __init__(self, stream, offset=0):
+        self.stream = stream
+        self.offset = offset
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.stream.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode('utf-8-sig' if self.offset == len(line) else 'utf-8')
+
+
+class TelemetryImporter:
+    """
+    Lê registros de telemetria de um arquivo e grava em blocos (COPY no PostgreSQL).
+
+        importer = TelemetryImporter(stream, 'csv', chunk_size=50000)
+        importer.run(progress=print)
+
+    Cada bloco é gravado em uma transação própria; depois dela, on_checkpoint(offset, stats)
+    é chamado para que o progresso possa ser salvo e a importação retomada com start_offset.
+    """
+
+    def __init__(self, stream, file_format, chunk_size=50000, create_devices=False,
+                 max_errors=1000, start_offset=0, header=None, method='auto'):
+        if file_format not in FORMATS:
+            raise ValueError(f"Formato '{file_format}' não suportado (use {', '.join(FORMATS)}).")
+        self.stream = stream
+        self.file_format = file_format
+        self.chunk_size = chunk_size
+        self.create_devices = create_devices
+        self.max_errors = max_errors
+        self.start_offset = start_offset
+        self.header = header
+        self.method = method
+
+        # Mapas device_id -> (pk, pk do site) e site -> banco, carregados uma única vez (sem query por linha)
+        self.device_map = {
+            device_id: (device_pk, site_pk)
+            for device_id, device_pk, site_pk in Device.objects.values_list('device_id', 'pk', 'site_id')
+        }
+        self.site_databases = {
+            site_pk: database or DEFAULT_DB_ALIAS
+            for site_pk, database in Site.objects.values_list('pk', 'database')
+        }
+        self.default_tz = timezone.get_current_timezone()
+
+        self.stats = {'imported': 0, 'invalid': 0, 'unknown_devices': 0, 'created_devices': 0, 'chunks': 0}
+        self.errors = []
+
+    # --------------------------------------------------------------------------
+    # Leitura
+    # --------------------------------------------------------------------------
+    def records(self):
+        """Gera (registro como dict, offset em bytes após o registro)."""
+        if self.file_format == 'csv' and self.header is None:
+            # O cabeçalho é sempre lido do início do arquivo, mesmo ao retomar
+            self.stream.seek(0)
+            header_reader = _LineReader(self.stream)
+            self.header = [name.strip() for name in next(csv.reader(header_reader))]
+            if not self.start_offset:
+                self.start_offset = header_reader.offset
+
+        self.stream.seek(self.start_offset)
+        lines = _LineReader(self.stream, self.start_offset)
+
+        if self.file_format == 'csv':
+            for row in csv.reader(lines):
+                if row:
+                    yield dict(zip(self.header, row)), lines.offset
+        else:
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    record = {'__error__': f"JSON inválido: {e}"}
+                yield record, lines.offset
+
+    # --------------------------------------------------------------------------
+    # Conversão de um registro para a tupla de TELEMETRY_COPY_COLUMNS
+    # --------------------------------------------------------------------------
+    def convert(self, record):
+        if '__error__' in record:
+            raise ValueError(record['__error__'])
+        if not isinstance(record, dict):
+            raise ValueError("Registro não é um objeto.")
+
+        device_id = str(record.get('device_id') or '').strip()
+        if not device_id:
+            raise ValueError("device_id ausente.")
+        device = self.device_map.get(device_id)
+        if device is None:
+            device = self.resolve_unknown_device(device_id)
+            if device is None:
+                self.stats['unknown_devices'] += 1
+                raise ValueError(f"Dispositivo '{device_id}' não cadastrado.")
+
+        return (
+            *device,
+            self.parse_float(record.get('temperature_celsius')),
+            self.parse_float(record.get('humidity_percent')),
+            self.parse_bool(record.get('relay_state_D1')),
+            (record.get('last_button_action') or None),
+            self.parse_json(record.get('raw_data')),
+            self.parse_timestamp(record.get('timestamp')),
+        )
+
+    def resolve_unknown_device(self, device_id):
+        if not self.create_devices:
+            return None
+        device, created = Device.objects.get_or_create(device_id=device_id)
+        if created:
+            self.stats['created_devices'] += 1
+        self.device_map[device_id] = (device.pk, device.site_id)
+        return self.device_map[device_id]
+
+    @staticmethod
+    def parse_float(value):
+        if value is None or value == '':
+            return None
+        return float(value)
+
+    @staticmethod
+    def parse_bool(value):
+        if isinstance(value, bool):
+            return value
+        text = str(value if value is not None else '').strip().lower()
+        if text in TRUE_VALUES:
+            return True
+        if text in FALSE_VALUES:
+            return False
+        raise ValueError(f"relay_state_D1 inválido: {value!r}")
+
+    @staticmethod
+    def parse_json(value):
+        if value is None or value == '':
+            return None
+        if isinstance(value, (dict, list)):
+            return value
+        return json.loads(value)
+
+    def parse_timestamp(self, value):
+        if value is None or value == '':
+            raise ValueError("timestamp ausente.")
+        if isinstance(value, (int, float)) or str(value).replace('.', '', 1).isdigit():
+            return datetime.fromtimestamp(float(value), dt_timezone.utc)
+        parsed = parse_datetime(str(value).strip().replace(' ', 'T', 1))
+        if parsed is None:
+            raise ValueError(f"timestamp inválido: {value!r}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, self.default_tz)
+        return parsed
+
+    # --------------------------------------------------------------------------
+    # Execução
+    # --------------------------------------------------------------------------
+    def run(self, progress=None, on_checkpoint=None):
+        started = time.monotonic()
+        chunk = []
+        offset = self.start_offset
+
+        for line_number, (record, offset) in enumerate(self.records(), start=1):
+            try:
+                chunk.append(self.convert(record))
+            except (ValueError, TypeError) as e:
+                self.stats['invalid'] += 1
+                if len(self.errors) < 100:
+                    self.errors.append(f"registro {line_number} (offset {offset}): {e}")
+                if self.max_errors is not None and self.stats['invalid'] > self.max_errors:
+                    # Grava o bloco em andamento e o offset após este registro: a retomada
+                    # continua daqui, sem reler (e recontar) os registros inválidos já lidos
+                    self.flush(chunk, offset, started, progress, on_checkpoint)
+                    raise ImportErrorLimit(f"Mais de {self.max_errors} registros inválidos; importação interrompida.")
+
+            if len(chunk) >= self.chunk_size:
+                self.flush(chunk, offset, started, progress, on_checkpoint)
+                chunk = []
+
+        self.flush(chunk, offset, started, progress, on_checkpoint)
+        self.stats['elapsed'] = time.monotonic() - started
+        return self.stats
+
+    def flush(self, chunk, offset, started, progress, on_checkpoint):
+        if chunk:
+            by_database = {}
+            for row in chunk:
+                by_database.setdefault(self.site_databases.get(row[1], DEFAULT_DB_ALIAS), []).append(row)
+            for database, rows in by_database.items():
+                with transaction.atomic(using=database):
+                    self.stats['imported'] += insert_telemetry(rows, using=database, method=self.method)
+            self.stats['chunks'] += 1
+
+        # Progresso salvo somente após o commit do bloco
+        if on_checkpoint:
+            on_checkpoint(offset, self.stats)
+        if progress and chunk:
+            elapsed = time.monotonic() - started
+            rate = self.stats['imported'] / elapsed if elapsed else 0
+            progress(
+                f"  {self.stats['imported']} registros importados ({rate:,.0f}/s), "
+                f"{self.stats['invalid']} inválidos, offset {offset}"
+            )
+
+
+# ==============================================================================
+# IMPORTAÇÃO EM SEGUNDO PLANO (UPLOAD DO ADMIN -> TAREFA CELERY)
+# ==============================================================================
+# O Admin só grava o arquivo em TELEMETRY_IMPORT_DIR e cria um TelemetryImport; a
+# tarefa import_telemetry_file (fila 'maintenance') executa run_import. O progresso
+# (offset e contadores) é gravado após cada bloco, como o '.progress.json' do comando
+# import_telemetry, e resume_import reenfileira a importação a partir dele.
+
+def save_uploaded_file(uploaded_file):
+    """Grava o upload (em blocos, sem carregá-lo na memória) e devolve (caminho, tamanho)."""
+    directory = settings.TELEMETRY_IMPORT_DIR
+    os.makedirs(directory, exist_ok=True)
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    path = os.path.join(directory, f"{uuid.uuid4().hex}{extension}")
+    with open(path, 'wb') as f:
+        for chunk in uploaded_file.chunks():
+            f.write(chunk)
+    return path, os.path.getsize(path)
+
+
+def is_stalled(job, now=None):
+    """Em execução, mas sem bloco gravado há TELEMETRY_IMPORT_STALL_SECONDS (worker reiniciado)."""
+    now = now or timezone.now()
+    last_activity = job.updated_at or job.started_at
+    return (
+        job.status == 'RUNNING' and last_activity is not None
+        and now - last_activity > timedelta(seconds=settings.TELEMETRY_IMPORT_STALL_SECONDS)
+    )
+
+
+def resume_import(job):
+    """Reenfileira uma importação que falhou ou parou; continua do último bloco gravado."""
+    from .tasks import import_telemetry_file
+
+    if job.status == 'RUNNING' and not is_stalled(job):
+        return False
+    resumed = TelemetryImport.objects.filter(
+        pk=job.pk, status=job.status, updated_at=job.updated_at,
+    ).exclude(status='DONE').update(status='QUEUED', message='')
+    if resumed:
+        transaction.on_commit(lambda: import_telemetry_file.delay(job.pk))
+    return bool(resumed)
+
+
+def run_import(import_id):
+    """Importa o arquivo de um TelemetryImport a partir do offset salvo. Devolve o status final."""
+    now = timezone.now()
+    # Apenas um worker executa cada importação (a mensagem pode ser entregue de novo)
+    claimed = TelemetryImport.objects.filter(pk=import_id, status='QUEUED').update(
+        status='RUNNING', started_at=Coalesce('started_at', Value(now)), updated_at=now,
+    )
+    if not claimed:
+        return None
+    job = TelemetryImport.objects.get(pk=import_id)
+    previous = {'imported': job.imported, 'invalid': job.invalid, 'created_devices': job.created_devices}
+
+    def save_checkpoint(offset, stats):
+        TelemetryImport.objects.filter(pk=job.pk).update(
+            offset=offset, updated_at=timezone.now(),
+            **{field: previous[field] + stats[field] for field in previous},
+        )
+
+    def finish(status, message, errors):
+        TelemetryImport.objects.filter(pk=job.pk).update(
+            status=status, message=message, errors=(job.errors + errors)[:100], finished_at=timezone.now(),
+        )
+        return status
+
+    if not os.path.isfile(job.file_path):
+        return finish('FAILED', f"Arquivo '{job.file_path}' não encontrado no servidor.", [])
+
+    with open(job.file_path, 'rb') as stream:
+        importer = TelemetryImporter(
+            stream, job.file_format,
+            chunk_size=settings.TELEMETRY_IMPORT_CHUNK_SIZE,
+            create_devices=job.create_devices,
+            start_offset=job.offset,
+        )
+        try:
+            stats = importer.run(on_checkpoint=save_checkpoint)
+        except ImportErrorLimit as e:
+            return finish(
+                'FAILED',
+                f"{e} Os registros lidos até aqui estão salvos; use 'Retomar' para continuar após o último registro inválido.",
+                importer.errors,
+            )
+        except Exception as e:
+            logger.exception(f"Importação {job.pk} ({job.original_name}) interrompida.")
+            return finish('FAILED', f"Erro na importação: {e}. Use 'Retomar' para continuar do último bloco.", importer.errors)
+
+    os.remove(job.file_path)
+    rate = stats['imported'] / stats['elapsed'] if stats['elapsed'] else 0
+    return finish(
+        'DONE',
+        f"{previous['imported'] + stats['imported']} registros importados "
+        f"(nesta execução: {stats['imported']} em {stats['elapsed']:.1f}s, {rate:,.0f}/s).",
+        importer.errors,
+    )
@@ -0,0 +1,71 @@
+# iot_project/devices/ingest.py
+
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+import logging
+
+import redis
+
+from . import alerts, automations
+from .models import AlertRule, Automation
+from core_system.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# PROCESSAMENTO DAS LEITURAS RECÉM-GRAVADAS (AUTOMAÇÕES E ALERTAS)
+# ==============================================================================
+# Chamado pelo POST simples e pelo POST em lote de telemetria depois de gravar as
+# leituras. As regras (AlertRule e Automation) ficam compiladas em memória em cada
+# processo; um GET da versão no Redis por requisição indica se algum processo
+# alterou as regras (incrementada pelos sinais abaixo) e elas precisam ser recarregadas.
+# Falhas aqui são registradas no log e nunca fazem a ingestão falhar.
+
+RULES_VERSION_KEY = 'ingest:rules_version'
+
+_loaded = {'version': None, 'valid': False}
+
+
+def refresh_rules(client):
+    version = client.get(RULES_VERSION_KEY)
+    if not _loaded['valid'] or version != _loaded['version']:
+        alerts.load_rules()
+        automations.load_automations()
+        _loaded.update(version=version, valid=True)
+
+
+def process_readings(device, readings):
+    if device is None or not readings or not (settings.AUTOMATIONS_ENABLED or settings.ALERTS_ENABLED):
+        return
+    try:
+        client = get_redis(settings.RULES_REDIS_URL)
+        refresh_rules(client)
+        # Automações primeiro: o comando chega ao destino o quanto antes
+        if settings.AUTOMATIONS_ENABLED:
+            automations.run_automations(client, device, readings)
+        if settings.ALERTS_ENABLED:
+            alerts.evaluate_rules(client, device, readings)
+    except redis.RedisError as e:
+        logger.warning(f"Automações/alertas não avaliados para {device.device_id}: Redis indisponível ({e}).")
+    except Exception:
+        logger.exception(f"Erro ao avaliar automações/alertas de {device.device_id}.")
+
+
+# ==============================================================================
+# INVALIDAÇÃO DAS REGRAS EM CACHE (TODOS OS PROCESSOS)
+# ==============================================================================
+@receiver(post_save, sender=AlertRule)
+@receiver(post_delete, sender=AlertRule)
+@receiver(m2m_changed, sender=AlertRule.devices.through)
+@receiver(post_save, sender=Automation)
+@receiver(post_delete, sender=Automation)
+def bump_rules_version(sender, instance=None, **kwargs):
+    if isinstance(instance, AlertRule) and not instance.is_active:
+        alerts.resolve_open_alerts(instance.pk)
+    try:
+        get_redis(settings.RULES_REDIS_URL).incr(RULES_VERSION_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Não foi possível publicar a nova versão das regras: {e}")
+    _loaded['valid'] = False
@@ -0,0 +1,104 @@
+# iot_project/devices/management/commands/benchmark_db_connections.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.test import Client
+import time
+
+from core_system.db_pool import CONNECTION_MODES, apply_connection_mode
+from devices.models import Device
+
+
+# ==============================================================================
+# BENCHMARK DE CONEXÕES COM O BANCO NO ENDPOINT DE POLLING
+# ==============================================================================
+# Mede a latência do GET /api/devices/<id>/ (polling dos ESPs) em cada modo de
+# conexão (ver core_system/db_pool.py), no próprio processo e sem rede, repetindo
+# o ciclo de vida de uma requisição do Gunicorn: close_old_connections() no início
+# e no fim de cada requisição (fecha a conexão, a mantém ou a devolve ao pool).
+# A diferença entre os modos é o custo de abrir uma conexão (TCP + autenticação
+# + parâmetros da sessão) a cada requisição.
+#
+# Exemplos:
+#   python manage.py benchmark_db_connections
+#   python manage.py benchmark_db_connections --requests 2000 --modes none,pool
+#
+# Com DB_HOST apontando para o PgBouncer, inclua o modo 'pgbouncer'.
+
+BENCH_DEVICE_ID = 'BENCH_POLL'
+
+
+class Command(BaseCommand):
+    help = "Compara a latência do endpoint de polling com e sem pool/conexões persistentes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Requisições medidas por modo.")
+        parser.add_argument('--warmup', type=int, default=20, help="Requisições descartadas antes de medir.")
+        parser.add_argument('--modes', default='none,persistent,pool',
+                            help=f"Modos a comparar, separados por vírgula ({', '.join(CONNECTION_MODES)}).")
+        parser.add_argument('--device-id', default=BENCH_DEVICE_ID,
+                            help="Dispositivo usado no polling (criado se não existir).")
+
+    def handle(self, *args, **options):
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        invalid = [mode for mode in modes if mode not in CONNECTION_MODES]
+        if invalid:
+            raise CommandError(f"Modos inválidos: {', '.join(invalid)}.")
+        if connection.vendor != 'postgresql' and {'pool', 'pgbouncer'} & set(modes):
+            self.stderr.write("Pool e PgBouncer exigem PostgreSQL; nesses modos será usada conexão persistente.")
+
+        device, _ = Device.objects.get_or_create(device_id=options['device_id'])
+        client = Client()
+        url = f'/api/devices/{device.device_id}/'
+        headers = {'HTTP_AUTHORIZATION': f'Token {device.device_id}'}
+
+        original = {key: value for key, value in connection.settings_dict.items() if key != 'OPTIONS'}
+        original_options = dict(connection.settings_dict.get('OPTIONS', {}))
+        results = {}
+        try:
+            for mode in modes:
+                self.reset_connection()
+                apply_connection_mode(connection.settings_dict, mode, **settings.DB_CONNECTION_OPTIONS)
+                self.stdout.write(f"Modo '{mode}': {options['warmup']} de aquecimento + {options['requests']} medidas...")
+
+                for _ in range(options['warmup']):
+                    self.poll(client, url, headers)
+                timings = sorted(self.poll(client, url, headers) for _ in range(options['requests']))
+                results[mode] = {
+                    'p50_ms': timings[len(timings) // 2],
+                    'p95_ms': timings[int(len(timings) * 0.95) - 1],
+                    'avg_ms': sum(timings) / len(timings),
+                }
+        finally:
+            self.reset_connection()
+            connection.settings_dict.update(original)
+            connection.settings_dict['OPTIONS'] = original_options
+
+        self.print_results(results)
+
+    def reset_connection(self):
+        connection.close()
+        if hasattr(connection, 'close_pool'):
+            connection.close_pool()
+
+    def poll(self, client, url, headers):
+        """Uma requisição completa; devolve a latência em ms (do início da requisição até a resposta)."""
+        started = time.perf_counter()
+        close_old_connections()  # request_started
+        response = client.get(url, **headers)
+        elapsed = (time.perf_counter() - started) * 1000
+        close_old_connections()  # request_finished (após a resposta ser enviada)
+        if response.status_code != 200:
+            raise CommandError(f"GET {url} devolveu {response.status_code}: {response.content[:200]!r}")
+        return elapsed
+
+    def print_results(self, results):
+        baseline = results.get('none')
+        self.stdout.write(self.style.MIGRATE_HEADING("\n=== Latência do polling por modo de conexão ==="))
+        self.stdout.write(f"{'modo':<12} {'p50 (ms)':>10} {'p95 (ms)':>10} {'média (ms)':>11} {'economia/req (ms)':>18}")
+        for mode, result in results.items():
+            saved = f"{baseline['avg_ms'] - result['avg_ms']:>18.2f}" if baseline and mode != 'none' else f"{'-':>18}"
+            self.stdout.write(
+                f"{mode:<12} {result['p50_ms']:>10.2f} {result['p95_ms']:>10.2f} {result['avg_ms']:>11.2f} {saved}"
+            )
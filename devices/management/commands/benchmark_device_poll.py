@@ -0,0 +1,123 @@
+# iot_project/devices/management/commands/benchmark_device_poll.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+import json
+import time
+
+from devices.management.commands.simulate_fleet import percentile
+from devices.models import Device
+from devices.views import _drf_device_detail, device_poll
+
+
+# ==============================================================================
+# TESTE DE CARGA: CONSULTA DE COMANDOS COM E SEM O DRF
+# ==============================================================================
+# Chama as duas views de GET /api/devices/<id>/ no próprio processo (sem rede e
+# sem middlewares, para medir só a view) com --requests consultas cada, alternando
+# entre --devices dispositivos do benchmark (BENCH_P_*):
+#   - drf:  DeviceViewSet.retrieve (autenticação, get_object, save() e serializer);
+#   - fast: devices.views.device_poll (um UPDATE ... RETURNING e a resposta pronta).
+# Relata req/s, p50/p95 por requisição e queries por requisição de cada uma.
+#
+# Exemplos:
+#   python manage.py benchmark_device_poll
+#   python manage.py benchmark_device_poll --requests 5000 --devices 500
+#   python manage.py benchmark_device_poll --cleanup
+
+BENCH_PREFIX = 'BENCH_P_'
+
+
+class Command(BaseCommand):
+    help = "Compara a consulta de comandos do ESP pelo DRF e pelo caminho rápido (req/s, latência e queries)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help="Consultas por view.")
+        parser.add_argument('--devices', type=int, default=100, help="Dispositivos consultados em rodízio.")
+        parser.add_argument('--json', action='store_true', help="Imprime o relatório em JSON.")
+        parser.add_argument('--cleanup', action='store_true', help="Remove os dispositivos do benchmark e sai.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        if options['cleanup']:
+            self.cleanup()
+            return
+        if options['requests'] < 1 or options['devices'] < 1:
+            raise CommandError("--requests e --devices devem ser maiores que zero.")
+
+        device_ids = self.prepare(options['devices'])
+        factory = RequestFactory()
+
+        results = {}
+        for name, view in (('drf', _drf_device_detail), ('fast', device_poll)):
+            # Aquecimento: primeira execução de cada caminho (imports, caches do DRF)
+            self.run(view, factory, device_ids, len(device_ids))
+            results[name] = self.run(view, factory, device_ids, options['requests'])
+
+        self.print_report(results)
+
+    # --------------------------------------------------------------------------
+    # Preparação
+    # --------------------------------------------------------------------------
+    def prepare(self, count):
+        device_ids = [f"{BENCH_PREFIX}{i:05d}" for i in range(1, count + 1)]
+        Device.objects.bulk_create(
+            [Device(device_id=device_id, name=f"Benchmark {device_id}", device_type="Simulador", location="Benchmark")
+             for device_id in device_ids],
+            ignore_conflicts=True, batch_size=1000,
+        )
+        # Sem comando pendente: mede a consulta mais comum (nada a entregar)
+        Device.objects.filter(device_id__in=device_ids).update(pending_command=None, command_delivered_at=None)
+        return device_ids
+
+    def cleanup(self):
+        deleted, _ = Device.objects.filter(device_id__startswith=BENCH_PREFIX).delete()
+        self.stdout.write(self.style.SUCCESS(f"Benchmark removido ({deleted} objetos)."))
+
+    # --------------------------------------------------------------------------
+    # Medição
+    # --------------------------------------------------------------------------
+    def run(self, view, factory, device_ids, count):
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for i in range(count):
+                device_id = device_ids[i % len(device_ids)]
+                request = factory.get(f'/api/devices/{device_id}/', HTTP_AUTHORIZATION=f'Token {device_id}')
+                request_started = time.perf_counter()
+                response = view(request, device_id=device_id)
+                if hasattr(response, 'render'):
+                    response.render()
+                timings.append(time.perf_counter() - request_started)
+                if response.status_code != 200:
+                    raise CommandError(f"{device_id}: resposta {response.status_code}.")
+            elapsed = time.perf_counter() - started
+
+        timings.sort()
+        return {
+            'requests': count,
+            'req_per_s': count / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(timings, 50) * 1000,
+            'p95_ms': percentile(timings, 95) * 1000,
+            'queries_per_request': len(queries) / count,
+        }
+
+    # --------------------------------------------------------------------------
+    # Relatório
+    # --------------------------------------------------------------------------
+    def print_report(self, results):
+        if self.options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"\n{'view':<6} {'req':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8}")
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:<6} {row['requests']:>7} {row['req_per_s']:>9.0f} {row['p50_ms']:>8.2f} "
+                f"{row['p95_ms']:>8.2f} {row['queries_per_request']:>8.1f}"
+            )
+        gain = results['fast']['req_per_s'] / results['drf']['req_per_s'] if results['drf']['req_per_s'] else 0.0
+        style = self.style.SUCCESS if gain >= 1 else self.style.WARNING
+        self.stdout.write(style(f"Caminho rápido: {gain:.1f}x as requisições por segundo do DRF."))
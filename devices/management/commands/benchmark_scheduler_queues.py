@@ -0,0 +1,139 @@
+# iot_project/devices/management/commands/benchmark_scheduler_queues.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+import json
+import math
+import time
+
+from devices.management.commands.simulate_fleet import percentile
+from devices.models import Device, ScheduledTask, TaskRun
+from devices.tasks import get_queue_depths, process_scheduled_task, queue_probe
+
+
+# ==============================================================================
+# TESTE DE CARGA: LATÊNCIA DO TICK DURANTE UM ENVIO EM MASSA
+# ==============================================================================
+# Com os workers do docker-compose.yml em execução, mede quanto uma mensagem da
+# fila do agendador espera até ser executada (sonda devices.tasks.queue_probe,
+# uma por --interval segundos) em duas fases:
+#   1. repouso: nenhuma outra carga;
+#   2. envio: um comando para --devices dispositivos (BENCH_Q_*), dividido em lotes
+#      de SCHEDULER_DISPATCH_CHUNK dispositivos na fila 'commands'.
+# Com as filas dedicadas, o p95 da fase 2 deve ficar próximo ao da fase 1. Para
+# comparar com a fila única de antes, sonde a própria fila de comandos:
+#   python manage.py benchmark_scheduler_queues --probe-queue commands
+#
+# Exemplos:
+#   python manage.py benchmark_scheduler_queues
+#   python manage.py benchmark_scheduler_queues --devices 10000 --probes 60
+#   python manage.py benchmark_scheduler_queues --cleanup
+
+BENCH_PREFIX = 'BENCH_Q_'
+BENCH_TASK_NAME = 'Benchmark das filas do Celery'
+
+
+class Command(BaseCommand):
+    help = "Mede a latência da fila do agendador em repouso e durante o envio de um comando a milhares de dispositivos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=10000, help="Dispositivos que recebem o comando.")
+        parser.add_argument('--probes', type=int, default=30, help="Sondas por fase.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Intervalo entre as sondas (segundos).")
+        parser.add_argument('--probe-queue', default='scheduler', help="Fila sondada (padrão: a do agendador).")
+        parser.add_argument('--timeout', type=float, default=120, help="Espera máxima por uma sonda (segundos).")
+        parser.add_argument('--json', action='store_true', help="Imprime o relatório em JSON.")
+        parser.add_argument('--cleanup', action='store_true', help="Remove os dispositivos e a tarefa do benchmark e sai.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        if options['cleanup']:
+            self.cleanup()
+            return
+        if options['devices'] < 1:
+            raise CommandError("--devices deve ser maior que zero.")
+
+        task = self.prepare(options['devices'])
+
+        self.stdout.write(f"Fase 1 (repouso): {options['probes']} sondas na fila '{options['probe_queue']}'...")
+        idle = self.probe(options['probes'])
+
+        self.stdout.write(f"Fase 2 (envio para {options['devices']} dispositivos)...")
+        messages = self.enqueue_dispatch(task)
+        depths = get_queue_depths()
+        loaded = self.probe(options['probes'])
+
+        self.print_report({
+            'idle': self.summarize(idle),
+            'dispatch': self.summarize(loaded),
+        }, messages, depths)
+
+    # --------------------------------------------------------------------------
+    # Preparação
+    # --------------------------------------------------------------------------
+    def prepare(self, count):
+        device_ids = [f"{BENCH_PREFIX}{i:05d}" for i in range(1, count + 1)]
+        Device.objects.bulk_create(
+            [Device(device_id=device_id, name=f"Benchmark {device_id}", device_type="Simulador", location="Benchmark")
+             for device_id in device_ids],
+            ignore_conflicts=True, batch_size=1000,
+        )
+        # Tarefa já executada: não é pega pelo agendador, só pelos envios deste benchmark
+        task, _ = ScheduledTask.objects.get_or_create(
+            name=BENCH_TASK_NAME,
+            defaults={'command_json': {'benchmark': True}, 'execution_time': timezone.now(), 'status': 'EXECUTED'},
+        )
+        task.devices.set(Device.objects.filter(device_id__in=device_ids))
+        return task
+
+    def enqueue_dispatch(self, task):
+        device_pks = list(task.devices.values_list('pk', flat=True))
+        now = timezone.now()
+        run = TaskRun.objects.create(task=task, scheduled_for=now, enqueued_at=now)
+        # device_ids: mesmo caminho do reenvio de falhas (a tarefa do benchmark não fica PENDING)
+        process_scheduled_task.delay(task.pk, run.pk, device_pks)
+        # Uma mensagem por lote, além da própria process_scheduled_task
+        return 1 + math.ceil(len(device_pks) / max(1, settings.SCHEDULER_DISPATCH_CHUNK))
+
+    def cleanup(self):
+        ScheduledTask.objects.filter(name=BENCH_TASK_NAME).delete()
+        deleted, _ = Device.objects.filter(device_id__startswith=BENCH_PREFIX).delete()
+        self.stdout.write(self.style.SUCCESS(f"Benchmark removido ({deleted} objetos)."))
+
+    # --------------------------------------------------------------------------
+    # Sondas
+    # --------------------------------------------------------------------------
+    def probe(self, count):
+        results = []
+        for _ in range(count):
+            started = time.monotonic()
+            results.append(queue_probe.apply_async((time.time(),), queue=self.options['probe_queue'], priority=0))
+            time.sleep(max(0.0, self.options['interval'] - (time.monotonic() - started)))
+        return sorted(result.get(timeout=self.options['timeout']) for result in results)
+
+    def summarize(self, waits):
+        return {
+            'probes': len(waits),
+            'p50_ms': percentile(waits, 50) * 1000,
+            'p95_ms': percentile(waits, 95) * 1000,
+            'max_ms': waits[-1] * 1000 if waits else 0.0,
+        }
+
+    # --------------------------------------------------------------------------
+    # Relatório
+    # --------------------------------------------------------------------------
+    def print_report(self, phases, messages, depths):
+        if self.options['json']:
+            self.stdout.write(json.dumps({'messages': messages, 'queue_depths': depths, 'phases': phases}, indent=2))
+            return
+
+        self.stdout.write(f"\nMensagens de envio: {messages} | Filas após enfileirar: {depths}\n")
+        self.stdout.write(f"{'fase':<10} {'sondas':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+        for name, row in phases.items():
+            self.stdout.write(
+                f"{name:<10} {row['probes']:>7} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['max_ms']:>9.1f}"
+            )
+        ratio = phases['dispatch']['p95_ms'] / phases['idle']['p95_ms'] if phases['idle']['p95_ms'] else 0.0
+        style = self.style.SUCCESS if ratio <= 2 else self.style.WARNING
+        self.stdout.write(style(f"p95 durante o envio = {ratio:.1f}x o p95 em repouso."))
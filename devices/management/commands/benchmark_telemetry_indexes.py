@@ -0,0 +1,187 @@
+# iot_project/devices/management/commands/benchmark_telemetry_indexes.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import timedelta
+import time
+
+from devices.models import Device, TelemetryData
+
+
+# ==============================================================================
+# BENCHMARK DOS ÍNDICES DE TELEMETRIA (PLANOS ANTES/DEPOIS)
+# ==============================================================================
+# Executa os acessos mais frequentes à telemetria com EXPLAIN (ANALYZE, BUFFERS)
+# e mede a latência de cada um:
+#   - última leitura de um dispositivo (dashboard);
+#   - histórico de 24h de um dispositivo (mais recentes primeiro);
+#   - primeira página do Admin filtrada por dispositivo.
+#
+# Com --compare, repete as consultas no esquema "antes" (índice composto removido
+# e índice simples no device_id recriado) dentro de uma transação desfeita no final:
+# o banco não é alterado, mas a tabela fica bloqueada para escrita durante a medição
+# (use em um ambiente de teste).
+#
+# Exemplos (somente PostgreSQL):
+#   python manage.py benchmark_telemetry_indexes --generate 50000000 --devices 1000
+#   python manage.py benchmark_telemetry_indexes --compare --runs 20
+
+COMPOSITE_INDEX = 'telemetry_device_ts_desc'
+BENCH_PREFIX = 'BENCH_'
+
+
+class Command(BaseCommand):
+    help = "Compara os planos e a latência das consultas de telemetria com e sem o índice (device, -timestamp)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', type=int, default=0,
+                            help="Insere N linhas sintéticas (generate_series no servidor) antes de medir.")
+        parser.add_argument('--devices', type=int, default=1000,
+                            help="Dispositivos usados na geração (criados com prefixo BENCH_).")
+        parser.add_argument('--days', type=int, default=90,
+                            help="Período coberto pelas linhas geradas.")
+        parser.add_argument('--device-id', default=None,
+                            help="device_id consultado (padrão: o primeiro dispositivo com telemetria).")
+        parser.add_argument('--runs', type=int, default=10,
+                            help="Execuções de cada consulta para a latência (mediana e máximo).")
+        parser.add_argument('--compare', action='store_true',
+                            help="Mede também o esquema anterior (sem o índice composto), em transação desfeita.")
+        parser.add_argument('--no-plans', action='store_true',
+                            help="Mostra apenas as latências, sem os planos.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Este benchmark requer PostgreSQL (EXPLAIN ANALYZE, índices com INCLUDE).")
+
+        self.options = options
+        if options['generate']:
+            self.generate(options['generate'], options['devices'], options['days'])
+
+        device = self.pick_device(options['device_id'])
+        self.stdout.write(f"Dispositivo consultado: {device.device_id} (id={device.pk})")
+
+        after = self.run_suite(device)
+
+        if options['compare']:
+            before = self.run_before_schema(device)
+            self.print_comparison(before, after)
+
+    # --------------------------------------------------------------------------
+    # Geração dos dados
+    # --------------------------------------------------------------------------
+    def generate(self, rows, device_count, days):
+        """Insere 'rows' leituras distribuídas entre os dispositivos BENCH_ e os últimos 'days' dias."""
+        Device.objects.bulk_create(
+            [Device(device_id=f"{BENCH_PREFIX}{i:05d}", name=f"Benchmark {i:05d}", is_active=True)
+             for i in range(1, device_count + 1)],
+            ignore_conflicts=True,
+        )
+        device_pks = list(
+            Device.objects.filter(device_id__startswith=BENCH_PREFIX).order_by('pk').values_list('pk', flat=True)
+        )[:device_count]
+
+        table = TelemetryData._meta.db_table
+        span_seconds = days * 86400
+        now = timezone.now()
+        chunk = 5_000_000
+
+        self.stdout.write(f"Gerando {rows} linhas em {table} ({len(device_pks)} dispositivos, {days} dias)...")
+        started = time.monotonic()
+        for offset in range(0, rows, chunk):
+            count = min(chunk, rows - offset)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    INSERT INTO {table}
+                        (device_id, temperature_celsius, humidity_percent, "relay_state_D1", timestamp)
+                    SELECT
+                        (%s::bigint[])[1 + (g %% %s)],
+                        round((22 + 6 * random())::numeric, 1),
+                        round((45 + 30 * random())::numeric, 1),
+                        random() < 0.5,
+                        %s::timestamptz - (random() * %s) * interval '1 second'
+                    FROM generate_series(1, %s) AS g
+                    """,
+                    [device_pks, len(device_pks), now, span_seconds, count],
+                )
+            self.stdout.write(f"  {offset + count}/{rows} ({time.monotonic() - started:.0f}s)")
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {table}")
+        self.stdout.write(self.style.SUCCESS(f"Geração concluída em {time.monotonic() - started:.0f}s."))
+
+    def pick_device(self, device_id):
+        if device_id:
+            try:
+                return Device.objects.get(device_id=device_id)
+            except Device.DoesNotExist:
+                raise CommandError(f"Dispositivo '{device_id}' não encontrado.")
+
+        device_pk = TelemetryData.objects.exclude(device=None).values_list('device_id', flat=True).first()
+        if device_pk is None:
+            raise CommandError("Não há telemetria no banco. Use --generate N para criar dados.")
+        return Device.objects.get(pk=device_pk)
+
+    # --------------------------------------------------------------------------
+    # Consultas medidas (as mesmas do dashboard, da API e do Admin)
+    # --------------------------------------------------------------------------
+    def queries(self, device):
+        since = timezone.now() - timedelta(hours=24)
+        return [
+            ('ultima_leitura (dashboard)',
+             TelemetryData.objects.filter(device=device).only(*TelemetryData.DASHBOARD_FIELDS).order_by('-timestamp')[:1]),
+            ('historico_24h',
+             TelemetryData.objects.filter(device=device, timestamp__gte=since).order_by('-timestamp')[:500]),
+            ('admin_por_dispositivo',
+             TelemetryData.objects.filter(device=device).select_related('device').order_by('-timestamp')[:100]),
+        ]
+
+    def run_suite(self, device, label='depois'):
+        results = {}
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n=== Esquema {label.upper()} ==="))
+        for name, queryset in self.queries(device):
+            if not self.options['no_plans']:
+                plan = queryset.explain(analyze=True, buffers=True)
+                self.stdout.write(self.style.MIGRATE_LABEL(f"\n-- {name}"))
+                self.stdout.write(plan)
+
+            timings = []
+            for _ in range(self.options['runs']):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            results[name] = {'median_ms': timings[len(timings) // 2], 'max_ms': timings[-1]}
+            self.stdout.write(f"   {name}: mediana {results[name]['median_ms']:.2f} ms, máx {results[name]['max_ms']:.2f} ms")
+        return results
+
+    def run_before_schema(self, device):
+        """Recria o esquema anterior (índice simples em device_id) e desfaz tudo ao final."""
+        table = TelemetryData._meta.db_table
+        results = None
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    self.stdout.write("\nRecriando o esquema anterior (transação desfeita ao final)...")
+                    cursor.execute(f"DROP INDEX IF EXISTS {COMPOSITE_INDEX}")
+                    cursor.execute(f"CREATE INDEX bench_telemetry_device_id ON {table} (device_id)")
+                    cursor.execute(f"ANALYZE {table}")
+                results = self.run_suite(device, label='antes')
+                raise _Rollback()
+        except _Rollback:
+            pass
+        return results
+
+    def print_comparison(self, before, after):
+        self.stdout.write(self.style.MIGRATE_HEADING("\n=== Comparação (mediana) ==="))
+        self.stdout.write(f"{'consulta':<30} {'antes (ms)':>12} {'depois (ms)':>12} {'ganho':>8}")
+        for name, result in after.items():
+            old = before[name]['median_ms']
+            new = result['median_ms']
+            gain = old / new if new else float('inf')
+            self.stdout.write(f"{name:<30} {old:>12.2f} {new:>12.2f} {gain:>7.1f}x")
+
+
+class _Rollback(Exception):
+    """Força o rollback da transação do esquema 'antes'."""
@@ -0,0 +1,260 @@
+# iot_project/devices/management/commands/generate_telemetry.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+from datetime import datetime, time as dt_time, timedelta
+import math
+import multiprocessing
+import random
+import time
+
+from devices.bulk import insert_telemetry, supports_copy
+from devices.models import Device, ScheduledTask, Site, DAY_OF_WEEK_CHOICES
+
+
+# ==============================================================================
+# GERADOR DE TELEMETRIA SINTÉTICA (VOLUME PARA TESTES DE DESEMPENHO)
+# ==============================================================================
+# Cria N dispositivos e M dias de TelemetryData com:
+#   - temperatura e umidade seguindo uma curva diária (pico de calor às 15h,
+#     umidade inversa), variação de um dia para o outro e ruído;
+#   - acionamentos do relé mais frequentes durante o dia, parte deles pelo botão
+#     físico (last_button_action/raw_data iguais aos enviados pelo firmware);
+#   - opcionalmente, uma mistura de ScheduledTask únicas e recorrentes.
+#
+# No PostgreSQL as linhas entram via COPY em blocos; com --workers, os
+# dispositivos são divididos entre processos, cada um com a sua conexão.
+# Com --site, dispositivos e tarefas pertencem ao site e a telemetria vai para
+# o banco dele (Site.database), para testar o isolamento entre campi.
+#
+# Exemplos:
+#   python manage.py generate_telemetry --devices 100 --days 7
+#   python manage.py generate_telemetry --devices 2000 --days 90 --interval 30 --workers 8 --tasks 500
+#   python manage.py generate_telemetry --devices 500 --days 30 --prefix NORTE_ --site norte
+
+RELAY_ACTIONS = {
+    True: ('Botao Ligar RELE', 'ligar_rele'),
+    False: ('Botao Desligar RELE', 'desligar_rele'),
+}
+LOCATIONS = ('Sala', 'Cozinha', 'Quarto', 'Escritório', 'Laboratório', 'Garagem', 'Recepção', 'Depósito')
+DEVICE_TYPES = ('Rele Iluminação', 'Controle Ar', 'Sensor Temperatura')
+TASK_COMMANDS = (
+    {"action": "ligar_rele", "target": "rele_D1", "value": 1},
+    {"action": "desligar_rele", "target": "rele_D1", "value": 0},
+    {"action": "ligar_ar", "target": "ar-condicionado", "value": 1},
+    {"action": "ventilacao_ar", "target": "ar-condicionado", "value": 1},
+    {"action": "musica", "target": "buzzer", "value": 1},
+)
+
+
+class Command(BaseCommand):
+    help = "Gera dispositivos e telemetria sintética realista (e tarefas agendadas) para testes de volume."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=100, help="Número de dispositivos.")
+        parser.add_argument('--days', type=float, default=7, help="Dias de histórico até agora.")
+        parser.add_argument('--interval', type=int, default=60, help="Segundos entre leituras de cada dispositivo.")
+        parser.add_argument('--prefix', default='GEN_', help="Prefixo do device_id dos dispositivos gerados.")
+        parser.add_argument('--tasks', type=int, default=0, help="Número de ScheduledTask a gerar (70%% recorrentes).")
+        parser.add_argument('--method', choices=('auto', 'copy', 'bulk'), default='auto',
+                            help="COPY (PostgreSQL), bulk_create ou automático.")
+        parser.add_argument('--chunk-size', type=int, default=100000, help="Linhas por COPY/bulk_create.")
+        parser.add_argument('--workers', type=int, default=1, help="Processos geradores em paralelo.")
+        parser.add_argument('--seed', type=int, default=42, help="Semente dos números aleatórios (reprodutível).")
+        parser.add_argument('--site', help="Slug do site dos dispositivos e tarefas gerados.")
+
+    def handle(self, *args, **options):
+        if options['devices'] < 1 or options['days'] <= 0 or options['interval'] < 1:
+            raise CommandError("--devices, --days e --interval devem ser positivos.")
+        site = None
+        if options['site']:
+            site = Site.objects.filter(slug=options['site']).first()
+            if site is None:
+                raise CommandError(f"Site '{options['site']}' não encontrado.")
+        using = site.telemetry_db if site else DEFAULT_DB_ALIAS
+        if options['method'] == 'copy' and not supports_copy(using):
+            raise CommandError("--method copy requer PostgreSQL.")
+
+        device_pks = self.create_devices(options, site)
+        end = timezone.now().replace(microsecond=0)
+        start = end - timedelta(days=options['days'])
+        steps = int((end - start).total_seconds() // options['interval'])
+        total = steps * len(device_pks)
+
+        self.stdout.write(
+            f"Gerando {total} leituras: {len(device_pks)} dispositivos x {steps} leituras "
+            f"({options['days']} dias a cada {options['interval']}s), método {options['method']}, "
+            f"{options['workers']} processo(s)."
+        )
+
+        started = time.monotonic()
+        job_options = {key: options[key] for key in ('interval', 'chunk_size', 'method', 'seed')}
+        job_options.update(site_pk=site.pk if site else None, using=using)
+        jobs = [
+            (device_pks[i::options['workers']], start.timestamp(), steps, job_options)
+            for i in range(options['workers'])
+        ]
+        if options['workers'] > 1:
+            # Cada processo abre a sua própria conexão com o banco
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(options['workers']) as pool:
+                inserted = sum(pool.map(generate_for_devices, jobs))
+        else:
+            inserted = generate_for_devices(jobs[0], progress=self.stdout.write)
+        elapsed = time.monotonic() - started
+
+        Device.objects.filter(pk__in=device_pks).update(last_seen=end, is_active=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{inserted} leituras inseridas em {elapsed:.1f}s ({inserted / elapsed if elapsed else 0:,.0f} linhas/s)."
+        ))
+
+        if options['tasks']:
+            self.create_tasks(options['tasks'], device_pks, random.Random(options['seed']), site)
+
+    # --------------------------------------------------------------------------
+    # Dispositivos e tarefas
+    # --------------------------------------------------------------------------
+    def create_devices(self, options, site=None):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+        Device.objects.bulk_create(
+            [
+                Device(
+                    device_id=f"{prefix}{i:05d}",
+                    name=f"Dispositivo {prefix}{i:05d}",
+                    device_type=rng.choice(DEVICE_TYPES),
+                    location=rng.choice(LOCATIONS),
+                    site=site,
+                )
+                for i in range(1, options['devices'] + 1)
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        return list(
+            Device.objects.filter(device_id__startswith=prefix).order_by('device_id').values_list('pk', flat=True)
+        )[:options['devices']]
+
+    def create_tasks(self, count, device_pks, rng, site=None):
+        """Mistura de tarefas: 70% recorrentes (horário e dias aleatórios), 30% únicas (última e próxima semana)."""
+        now = timezone.now()
+        day_codes = [code for code, _ in DAY_OF_WEEK_CHOICES]
+        tasks = []
+        for i in range(count):
+            if rng.random() < 0.7:
+                tasks.append(ScheduledTask(
+                    name=f"Tarefa sintética recorrente {i + 1}",
+                    site=site,
+                    command_json=rng.choice(TASK_COMMANDS),
+                    is_recurrent=True,
+                    recurrent_time=dt_time(rng.randrange(24), rng.randrange(0, 60, 5)),
+                    recurrent_days=','.join(sorted(rng.sample(day_codes, rng.randint(1, 7)))),
+                ))
+            else:
+                # Únicas no passado entram como já executadas; as futuras ficam pendentes
+                execution_time = now + timedelta(minutes=rng.randint(-7 * 1440, 7 * 1440))
+                executed = execution_time <= now
+                tasks.append(ScheduledTask(
+                    name=f"Tarefa sintética única {i + 1}",
+                    site=site,
+                    command_json=rng.choice(TASK_COMMANDS),
+                    execution_time=execution_time,
+                    status='EXECUTED' if executed else 'PENDING',
+                    last_run_at=execution_time if executed else None,
+                ))
+        tasks = ScheduledTask.objects.bulk_create(tasks)
+
+        # Cada tarefa afeta de 1 a 50 dispositivos (algumas poucas, a frota inteira)
+        Through = ScheduledTask.devices.through
+        links = []
+        for task in tasks:
+            size = len(device_pks) if rng.random() < 0.02 else rng.randint(1, min(50, len(device_pks)))
+            links.extend(
+                Through(scheduledtask_id=task.pk, device_id=device_pk)
+                for device_pk in rng.sample(device_pks, size)
+            )
+        Through.objects.bulk_create(links, batch_size=5000)
+        self.stdout.write(self.style.SUCCESS(f"{len(tasks)} tarefas agendadas criadas ({len(links)} vínculos)."))
+
+
+# ==============================================================================
+# GERAÇÃO DAS LEITURAS (EXECUTADA EM CADA PROCESSO)
+# ==============================================================================
+def generate_for_devices(job, progress=None):
+    device_pks, start_epoch, steps, options = job
+    interval = options['interval']
+    chunk_size = options['chunk_size']
+    method = options['method']
+    site_pk = options['site_pk']
+    using = options['using']
+
+    # A curva diária depende só do instante: calculada uma vez para todos os dispositivos
+    tz = timezone.get_current_timezone()
+    timestamps = []
+    diurnal = []
+    for step in range(steps):
+        moment = datetime.fromtimestamp(start_epoch + step * interval, tz)
+        hour = moment.hour + moment.minute / 60
+        timestamps.append(moment)
+        # +1 às 15h, -1 às 3h
+        diurnal.append(math.sin(2 * math.pi * (hour - 9) / 24))
+
+    inserted = 0
+    started = time.monotonic()
+    chunk = []
+    for device_pk in device_pks:
+        for row in device_readings(device_pk, site_pk, timestamps, diurnal, interval, options['seed']):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                inserted += insert_telemetry(chunk, using=using, method=method)
+                chunk = []
+                if progress:
+                    elapsed = time.monotonic() - started
+                    progress(f"  {inserted} linhas ({inserted / elapsed:,.0f} linhas/s)")
+    if chunk:
+        inserted += insert_telemetry(chunk, using=using, method=method)
+    return inserted
+
+
+def device_readings(device_pk, site_pk, timestamps, diurnal, interval, seed):
+    """Leituras de um dispositivo, na ordem de TELEMETRY_COPY_COLUMNS."""
+    rng = random.Random(seed * 1_000_003 + device_pk)
+    gauss = rng.gauss
+    rand = rng.random
+
+    # Características do ambiente de cada dispositivo
+    base_temperature = rng.uniform(20, 26)
+    temperature_amplitude = rng.uniform(2, 6)
+    base_humidity = rng.uniform(50, 70)
+    humidity_amplitude = rng.uniform(5, 15)
+    # Em média, ~6 acionamentos do relé por dia (mais durante o dia)
+    toggle_probability = 6 * interval / 86400
+    readings_per_day = max(1, 86400 // interval)
+
+    relay = rand() < 0.5
+    day_offset = 0.0
+    for step, (timestamp, curve) in enumerate(zip(timestamps, diurnal)):
+        # Variação lenta de um dia para o outro (frentes frias/quentes)
+        if step % readings_per_day == 0:
+            day_offset = max(-4.0, min(4.0, day_offset + gauss(0, 1.0)))
+
+        temperature = base_temperature + day_offset + temperature_amplitude * curve + gauss(0, 0.3)
+        humidity = base_humidity - 0.8 * day_offset - humidity_amplitude * curve + gauss(0, 1.0)
+        humidity = max(5.0, min(100.0, humidity))
+
+        button = 'Nenhum'
+        raw_data = None
+        if rand() < toggle_probability * (1 + 0.8 * curve):
+            relay = not relay
+            # ~30% dos acionamentos vêm do botão físico
+            if rand() < 0.3:
+                button, action = RELAY_ACTIONS[relay]
+                raw_data = {
+                    'last_button_action': button,
+                    'last_executed_action': action,
+                    'last_executed_target': 'rele_D1',
+                }
+
+        yield (device_pk, site_pk, round(temperature, 1), round(humidity, 1), relay, button, raw_data, timestamp)
@@ -0,0 +1,113 @@
+# iot_project/devices/management/commands/import_telemetry.py
+
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+
+from devices.bulk import supports_copy
+from devices.importers import FORMATS, ImportErrorLimit, TelemetryImporter, detect_format
+
+
+# ==============================================================================
+# IMPORTAÇÃO DE HISTÓRICO DE TELEMETRIA (COPY FROM STDIN)
+# ==============================================================================
+# Importa um arquivo CSV (com cabeçalho) ou NDJSON em blocos. Cada bloco é gravado
+# com COPY (PostgreSQL) em uma transação própria e o progresso é salvo em
+# '<arquivo>.progress.json'; com --resume a importação continua do último bloco
+# gravado. O arquivo de progresso é removido ao final.
+#
+# Exemplos:
+#   python manage.py import_telemetry historico.csv
+#   python manage.py import_telemetry leituras.ndjson --create-devices --chunk-size 100000
+#   python manage.py import_telemetry historico.csv --resume
+#
+# CSV:    device_id,timestamp,temperature_celsius,humidity_percent,relay_state_D1,last_button_action,raw_data
+#         A113,2024-01-05T14:30:00-03:00,24.5,61,true,Nenhum,
+# NDJSON: {"device_id": "A113", "timestamp": 1704475800, "temperature_celsius": 24.5, "relay_state_D1": true}
+
+
+class Command(BaseCommand):
+    help = "Importa telemetria histórica de um arquivo CSV/NDJSON via COPY, em blocos retomáveis."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Arquivo CSV ou NDJSON.")
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help="Formato do arquivo (padrão: pela extensão; .ndjson/.jsonl = NDJSON).")
+        parser.add_argument('--chunk-size', type=int, default=50000, help="Registros por bloco (COPY + commit).")
+        parser.add_argument('--create-devices', action='store_true',
+                            help="Cadastra os device_id desconhecidos (padrão: o registro é rejeitado).")
+        parser.add_argument('--max-errors', type=int, default=1000,
+                            help="Interrompe após N registros inválidos.")
+        parser.add_argument('--resume', action='store_true',
+                            help="Continua a partir do progresso salvo da execução anterior.")
+        parser.add_argument('--checkpoint', default=None,
+                            help="Arquivo de progresso (padrão: <arquivo>.progress.json).")
+        parser.add_argument('--method', choices=('auto', 'copy', 'bulk'), default='auto',
+                            help="COPY (PostgreSQL), bulk_create ou automático.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f"Arquivo '{path}' não encontrado.")
+        if options['method'] == 'copy' and not supports_copy():
+            raise CommandError("--method copy requer PostgreSQL.")
+
+        file_format = options['format'] or detect_format(path)
+        checkpoint_path = options['checkpoint'] or f"{path}.progress.json"
+        size = os.path.getsize(path)
+
+        start_offset = 0
+        previously_imported = 0
+        if options['resume'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                checkpoint = json.load(f)
+            if checkpoint.get('size') != size:
+                raise CommandError("O arquivo mudou desde a última execução (tamanho diferente); não é possível retomar.")
+            start_offset = checkpoint['offset']
+            previously_imported = checkpoint.get('imported', 0)
+            self.stdout.write(f"Retomando a partir do byte {start_offset} ({previously_imported} registros já importados).")
+
+        def save_checkpoint(offset, stats):
+            with open(checkpoint_path, 'w') as f:
+                json.dump({'path': path, 'size': size, 'offset': offset,
+                           'imported': previously_imported + stats['imported']}, f)
+
+        with open(path, 'rb') as stream:
+            def progress(message):
+                self.stdout.write(f"{message} [{100 * stream.tell() / size if size else 100:.1f}%]")
+
+            importer = TelemetryImporter(
+                stream, file_format,
+                chunk_size=options['chunk_size'],
+                create_devices=options['create_devices'],
+                max_errors=options['max_errors'],
+                start_offset=start_offset,
+                method=options['method'],
+            )
+            self.stdout.write(f"Importando {path} ({file_format}, {size} bytes)...")
+            try:
+                stats = importer.run(progress=progress, on_checkpoint=save_checkpoint)
+            except ImportErrorLimit as e:
+                self.print_errors(importer.errors)
+                raise CommandError(
+                    f"{e} Os registros lidos até aqui estão salvos; use --resume para continuar após o último registro inválido."
+                )
+
+        self.print_errors(importer.errors)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        rate = stats['imported'] / stats['elapsed'] if stats['elapsed'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['imported']} registros importados em {stats['elapsed']:.1f}s ({rate:,.0f}/s), "
+            f"{stats['chunks']} blocos, {stats['invalid']} inválidos "
+            f"({stats['unknown_devices']} de dispositivos desconhecidos), "
+            f"{stats['created_devices']} dispositivos criados."
+            + (f" Total com a execução anterior: {previously_imported + stats['imported']}." if previously_imported else '')
+        ))
+
+    def print_errors(self, errors):
+        for error in errors[:20]:
+            self.stderr.write(f"  {error}")
+        if len(errors) > 20:
+            self.stderr.write(f"  ... e mais {len(errors) - 20} erros.")
@@ -0,0 +1,333 @@
+# iot_project/devices/management/commands/simulate_fleet.py
+
+from django.core.management.base import BaseCommand, CommandError
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import math
+import random
+import time
+
+import requests
+
+from devices.models import Device
+
+
+# ==============================================================================
+# SIMULADOR DE FROTA (CARGA DE ESPs VIRTUAIS)
+# ==============================================================================
+# Cada ESP virtual executa o mesmo protocolo do firmware:
+#   1. POST /api/telemetry/ (ou /api/telemetry/batch/)  -> endpoint 'telemetry'/'batch'
+#   2. GET  /api/devices/<id>/                          -> endpoint 'poll'
+#   3. PUT  /api/devices/<id>/ (confirmação do comando) -> endpoint 'ack'
+#
+# As requisições HTTP (bloqueantes) rodam em um pool de threads, coordenadas
+# por um loop asyncio. As queries por endpoint vêm do cabeçalho X-DB-Query-Count
+# (ligue QUERY_COUNT_HEADER=True no servidor).
+#
+# Exemplos:
+#   python manage.py simulate_fleet --devices 200 --duration 120 --create-devices
+#   python manage.py simulate_fleet --scenario trafego_gravado.jsonl --speed 10
+#
+# Formato do arquivo de cenário (JSONL, uma requisição por linha):
+#   {"t": 0.0, "device_id": "SIM_0001", "op": "telemetry", "body": {"temperature_celsius": 24}}
+#   {"t": 1.5, "device_id": "SIM_0001", "op": "poll"}
+#   {"t": 2.0, "device_id": "SIM_0001", "op": "ack", "body": {"last_command": "ligar_rele"}}
+# 't' é o instante (segundos desde o início) e 'op' um dos endpoints acima.
+
+QUERY_COUNT_HEADER = 'X-DB-Query-Count'
+
+
+class FleetStats:
+    """Acumula latência, status e queries de cada requisição, agrupados por endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.queries = defaultdict(list)
+
+    def record(self, endpoint, latency, ok, query_count):
+        self.latencies[endpoint].append(latency)
+        if not ok:
+            self.errors[endpoint] += 1
+        if query_count is not None:
+            self.queries[endpoint].append(query_count)
+
+    def report(self, elapsed):
+        rows = []
+        for endpoint in sorted(self.latencies):
+            values = sorted(self.latencies[endpoint])
+            queries = self.queries[endpoint]
+            rows.append({
+                'endpoint': endpoint,
+                'requests': len(values),
+                'errors': self.errors[endpoint],
+                'rps': len(values) / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'max_ms': values[-1] * 1000,
+                'avg_queries': sum(queries) / len(queries) if queries else None,
+                'max_queries': max(queries) if queries else None,
+            })
+        return rows
+
+
+def percentile(sorted_values, pct):
+    """Percentil pelo método nearest-rank (lista já ordenada)."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(0, min(rank, len(sorted_values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = "Simula N dispositivos ESP contra um servidor e mede latência, vazão e queries por endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="URL base do servidor.")
+        parser.add_argument('--devices', type=int, default=10, help="Número de ESPs virtuais.")
+        parser.add_argument('--duration', type=float, default=60, help="Duração da simulação (segundos).")
+        parser.add_argument('--prefix', default='SIM_', help="Prefixo do device_id (e token) dos ESPs virtuais.")
+        parser.add_argument('--telemetry-interval', type=float, default=60, help="Intervalo entre envios de telemetria (segundos).")
+        parser.add_argument('--poll-interval', type=float, default=10, help="Intervalo de consulta de comandos (segundos).")
+        parser.add_argument('--honor-hint', action='store_true', help="Usa o 'next_poll_in' devolvido pelo servidor.")
+        parser.add_argument('--batch-size', type=int, default=0, help="Se > 0, envia a telemetria em lotes desse tamanho (/api/telemetry/batch/).")
+        parser.add_argument('--command-every', type=float, default=0, help="Se > 0, grava um comando pendente em um ESP aleatório a cada N segundos.")
+        parser.add_argument('--concurrency', type=int, default=64, help="Máximo de requisições simultâneas (threads HTTP).")
+        parser.add_argument('--create-devices', action='store_true', help="Cria os Devices virtuais no banco antes de começar.")
+        parser.add_argument('--scenario', help="Arquivo JSONL com tráfego gravado para reproduzir (ignora a simulação de protocolo).")
+        parser.add_argument('--speed', type=float, default=1.0, help="Multiplicador de velocidade da reprodução do cenário.")
+        parser.add_argument('--json', action='store_true', help="Imprime o relatório em JSON.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.base_url = options['url'].rstrip('/')
+        self.stats = FleetStats()
+        self.executor = ThreadPoolExecutor(max_workers=options['concurrency'])
+        self.sessions = {}
+
+        if options['scenario']:
+            events = self.load_scenario(options['scenario'])
+            device_ids = sorted({event['device_id'] for event in events})
+        else:
+            events = None
+            device_ids = [f"{options['prefix']}{i:04d}" for i in range(1, options['devices'] + 1)]
+
+        if options['create_devices']:
+            self.create_devices(device_ids)
+
+        started = time.monotonic()
+        try:
+            if events is not None:
+                asyncio.run(self.replay(events))
+            else:
+                asyncio.run(self.simulate(device_ids))
+        finally:
+            self.executor.shutdown(wait=True)
+        elapsed = time.monotonic() - started
+
+        self.print_report(self.stats.report(elapsed), elapsed)
+
+    # --------------------------------------------------------------------------
+    # Preparação
+    # --------------------------------------------------------------------------
+    def create_devices(self, device_ids):
+        Device.objects.bulk_create(
+            [Device(device_id=device_id, name=f"Simulado {device_id}", device_type="Simulador", location="Simulação")
+             for device_id in device_ids],
+            ignore_conflicts=True,
+            batch_size=1000,
+        )
+        self.stdout.write(f"{len(device_ids)} dispositivos virtuais garantidos no banco.")
+
+    def load_scenario(self, path):
+        events = []
+        try:
+            with open(path, encoding='utf-8') as scenario_file:
+                for line_number, line in enumerate(scenario_file, start=1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event.get('op') not in ('telemetry', 'batch', 'poll', 'ack') or 'device_id' not in event:
+                        raise CommandError(f"Linha {line_number}: evento inválido ({line}).")
+                    events.append(event)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Não foi possível ler o cenário '{path}': {e}")
+
+        events.sort(key=lambda event: event.get('t', 0))
+        return events
+
+    # --------------------------------------------------------------------------
+    # Requisições
+    # --------------------------------------------------------------------------
+    def request(self, device_id, endpoint, method, path, body=None):
+        """Executa uma requisição (bloqueante) e registra latência/status/queries."""
+        session = self.sessions.get(device_id)
+        if session is None:
+            session = self.sessions[device_id] = requests.Session()
+            session.headers['Authorization'] = f'Token {device_id}'
+
+        started = time.perf_counter()
+        try:
+            response = session.request(method, f"{self.base_url}{path}", json=body, timeout=30)
+        except requests.RequestException:
+            self.stats.record(endpoint, time.perf_counter() - started, False, None)
+            return None
+        latency = time.perf_counter() - started
+
+        query_count = response.headers.get(QUERY_COUNT_HEADER)
+        self.stats.record(endpoint, latency, response.ok, int(query_count) if query_count else None)
+        return response
+
+    async def call(self, device_id, endpoint, method, path, body=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.request, device_id, endpoint, method, path, body)
+
+    async def send_telemetry(self, device_id, readings):
+        if self.options['batch_size'] > 0:
+            await self.call(device_id, 'batch', 'POST', '/api/telemetry/batch/', {'readings': readings})
+        else:
+            await self.call(device_id, 'telemetry', 'POST', '/api/telemetry/', readings[-1])
+
+    async def poll(self, device_id):
+        """GET de comandos; confirma (PUT) se houver comando pendente. Retorna o next_poll_in."""
+        response = await self.call(device_id, 'poll', 'GET', f'/api/devices/{device_id}/')
+        if response is None or not response.ok:
+            return None
+
+        try:
+            data = response.json()
+        except ValueError:
+            return None
+
+        if data.get('status') == 'command_pending':
+            command = data.get('command') or {}
+            action = command.get('action', 'comando') if isinstance(command, dict) else 'comando'
+            await self.call(
+                device_id, 'ack', 'PUT', f'/api/devices/{device_id}/',
+                {'last_command': action, 'pending_command': None}
+            )
+        return data.get('next_poll_in')
+
+    # --------------------------------------------------------------------------
+    # Simulação do protocolo
+    # --------------------------------------------------------------------------
+    async def simulate(self, device_ids):
+        deadline = time.monotonic() + self.options['duration']
+        tasks = [self.run_device(device_id, deadline) for device_id in device_ids]
+        if self.options['command_every'] > 0:
+            tasks.append(self.issue_commands(device_ids, deadline))
+        await asyncio.gather(*tasks)
+
+    async def run_device(self, device_id, deadline):
+        telemetry_interval = self.options['telemetry_interval']
+        poll_interval = self.options['poll_interval']
+        batch_size = max(1, self.options['batch_size'])
+
+        # Começos espalhados: dispositivos reais não ligam todos no mesmo instante
+        now = time.monotonic()
+        next_reading = now + random.uniform(0, telemetry_interval / batch_size)
+        next_poll = now + random.uniform(0, poll_interval)
+        readings = []
+
+        while True:
+            wake_at = min(next_reading, next_poll)
+            if wake_at >= deadline:
+                break
+            await asyncio.sleep(max(0.0, wake_at - time.monotonic()))
+            now = time.monotonic()
+
+            if now >= next_reading:
+                readings.append(self.fake_reading(len(readings), batch_size))
+                if len(readings) >= batch_size:
+                    await self.send_telemetry(device_id, readings)
+                    readings = []
+                next_reading += telemetry_interval / batch_size
+
+            if now >= next_poll:
+                hint = await self.poll(device_id)
+                interval = hint if (self.options['honor_hint'] and hint) else poll_interval
+                next_poll = time.monotonic() + interval
+
+    def fake_reading(self, index, batch_size):
+        reading = {
+            'temperature_celsius': round(random.gauss(24, 2), 1),
+            'humidity_percent': round(random.gauss(60, 5), 1),
+            'relay_state_D1': random.random() < 0.5,
+            'last_button_action': 'Nenhum',
+        }
+        if self.options['batch_size'] > 0:
+            # Idade aproximada da leitura no momento do envio do lote
+            reading['age_ms'] = int((batch_size - 1 - index) * self.options['telemetry_interval'] / batch_size * 1000)
+        return reading
+
+    async def issue_commands(self, device_ids, deadline):
+        """Grava comandos pendentes para exercitar o caminho poll -> ack."""
+        loop = asyncio.get_running_loop()
+        command = {'action': 'ligar_rele', 'target': 'rele_D1', 'value': 1}
+        while time.monotonic() + self.options['command_every'] < deadline:
+            await asyncio.sleep(self.options['command_every'])
+            device_id = random.choice(device_ids)
+            await loop.run_in_executor(
+                self.executor,
+                lambda: Device.objects.filter(device_id=device_id).update(pending_command=command)
+            )
+
+    # --------------------------------------------------------------------------
+    # Reprodução de cenário gravado
+    # --------------------------------------------------------------------------
+    async def replay(self, events):
+        started = time.monotonic()
+        speed = self.options['speed']
+        pending = []
+
+        for event in events:
+            delay = started + event.get('t', 0) / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            pending.append(asyncio.create_task(self.replay_event(event)))
+
+        await asyncio.gather(*pending)
+
+    async def replay_event(self, event):
+        device_id = event['device_id']
+        body = event.get('body')
+        op = event['op']
+
+        if op == 'telemetry':
+            await self.call(device_id, 'telemetry', 'POST', '/api/telemetry/', body or {})
+        elif op == 'batch':
+            await self.call(device_id, 'batch', 'POST', '/api/telemetry/batch/', body or {'readings': []})
+        elif op == 'poll':
+            await self.call(device_id, 'poll', 'GET', f'/api/devices/{device_id}/')
+        else:
+            await self.call(device_id, 'ack', 'PUT', f'/api/devices/{device_id}/',
+                            body or {'last_command': 'replay', 'pending_command': None})
+
+    # --------------------------------------------------------------------------
+    # Relatório
+    # --------------------------------------------------------------------------
+    def print_report(self, rows, elapsed):
+        if self.options['json']:
+            self.stdout.write(json.dumps({'elapsed_seconds': elapsed, 'endpoints': rows}, indent=2))
+            return
+
+        total = sum(row['requests'] for row in rows)
+        self.stdout.write(f"\nDuração: {elapsed:.1f}s | Requisições: {total} | Vazão total: {total / elapsed if elapsed else 0:.1f} req/s\n")
+        self.stdout.write(
+            f"{'endpoint':<10} {'reqs':>7} {'erros':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'max ms':>8} {'queries':>8}"
+        )
+        for row in rows:
+            queries = f"{row['avg_queries']:.1f}" if row['avg_queries'] is not None else 'n/d'
+            self.stdout.write(
+                f"{row['endpoint']:<10} {row['requests']:>7} {row['errors']:>6} {row['rps']:>8.1f} "
+                f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f} {queries:>8}"
+            )
+        if not any(row['avg_queries'] is not None for row in rows):
+            self.stdout.write(self.style.WARNING(
+                "Queries por endpoint indisponíveis: habilite QUERY_COUNT_HEADER=True no servidor."
+            ))
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0007_alter_device_device_id_alter_device_device_type_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='command_delivered_at',
+            field=models.DateTimeField(blank=True, help_text='Quando o dispositivo recebeu o comando pendente em uma consulta (GET)', null=True, verbose_name='Comando Entregue em'),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='command_issued_at',
+            field=models.DateTimeField(blank=True, help_text='Quando o comando pendente foi gravado para o dispositivo', null=True, verbose_name='Comando Enviado em'),
+        ),
+        migrations.CreateModel(
+            name='TaskRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('QUEUED', 'Enfileirada'), ('RUNNING', 'Em execução'), ('SUCCESS', 'Sucesso'), ('PARTIAL', 'Parcial'), ('FAILED', 'Falhou'), ('SKIPPED', 'Ignorada')], default='QUEUED', max_length=20, verbose_name='Status')),
+                ('scheduled_for', models.DateTimeField(help_text='Horário previsto da execução', verbose_name='Agendada para')),
+                ('enqueued_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Enfileirada em')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Iniciada em')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finalizada em')),
+                ('first_delivered_at', models.DateTimeField(blank=True, null=True, verbose_name='Primeira Entrega')),
+                ('last_delivered_at', models.DateTimeField(blank=True, null=True, verbose_name='Última Entrega')),
+                ('devices_total', models.PositiveIntegerField(default=0, verbose_name='Dispositivos')),
+                ('devices_failed', models.PositiveIntegerField(default=0, verbose_name='Falhas')),
+                ('devices_delivered', models.PositiveIntegerField(default=0, verbose_name='Entregues')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='devices.scheduledtask', verbose_name='Tarefa')),
+            ],
+            options={
+                'verbose_name': 'Execução de Tarefa',
+                'verbose_name_plural': 'Execuções de Tarefas',
+                'ordering': ['-scheduled_for'],
+            },
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='command_run',
+            field=models.ForeignKey(blank=True, help_text='Execução de tarefa agendada que gerou o comando pendente (se houver)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='devices.taskrun', verbose_name='Execução de Origem'),
+        ),
+    ]
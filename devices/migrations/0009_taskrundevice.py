@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0008_taskrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskrun',
+            name='retry_of',
+            field=models.ForeignKey(blank=True, help_text='Execução original cujos dispositivos com falha foram reenviados nesta execução', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='retries', to='devices.taskrun', verbose_name='Reenvio de'),
+        ),
+        migrations.CreateModel(
+            name='TaskRunDevice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('outcome', models.CharField(choices=[('SUCCESS', 'Sucesso'), ('FAILED', 'Falhou')], max_length=10, verbose_name='Resultado')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Status HTTP')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Erro')),
+                ('dispatched_at', models.DateTimeField(verbose_name='Enviado em')),
+                ('duration_ms', models.PositiveIntegerField(default=0, verbose_name='Duração (ms)')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='task_results', to='devices.device', verbose_name='Dispositivo')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='device_results', to='devices.taskrun', verbose_name='Execução')),
+            ],
+            options={
+                'verbose_name': 'Resultado por Dispositivo',
+                'verbose_name_plural': 'Resultados por Dispositivo',
+                'indexes': [models.Index(fields=['run', 'outcome'], name='taskrundevice_run_outcome')],
+                'constraints': [models.UniqueConstraint(fields=('run', 'device'), name='unique_taskrun_device')],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:22
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+# Índice simples criado pelo Django para o FK device (mesmo nome em todos os bancos)
+DEVICE_FK_INDEX = 'devices_telemetrydata_device_id_7947a43b'
+
+
+class AddIndexConcurrentlyOnPostgres(AddIndexConcurrently):
+    """CREATE INDEX CONCURRENTLY no PostgreSQL; nos demais bancos (ex: SQLite local), um AddIndex comum."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+def _concurrently(schema_editor):
+    return ' CONCURRENTLY' if schema_editor.connection.vendor == 'postgresql' else ''
+
+
+def drop_device_fk_index(apps, schema_editor):
+    schema_editor.execute(
+        f"DROP INDEX{_concurrently(schema_editor)} IF EXISTS {schema_editor.quote_name(DEVICE_FK_INDEX)}"
+    )
+
+
+def create_device_fk_index(apps, schema_editor):
+    schema_editor.execute(
+        f"CREATE INDEX{_concurrently(schema_editor)} IF NOT EXISTS {schema_editor.quote_name(DEVICE_FK_INDEX)} "
+        f"ON {schema_editor.quote_name('devices_telemetrydata')} ({schema_editor.quote_name('device_id')})"
+    )
+
+
+class Migration(migrations.Migration):
+    # A telemetria tem dezenas de milhões de linhas: os índices são criados e removidos
+    # com CONCURRENTLY (sem bloquear as escritas dos ESPs), o que exige rodar fora de
+    # uma transação. Se o CREATE INDEX CONCURRENTLY falhar, o PostgreSQL deixa um índice
+    # INVALID: remova-o (DROP INDEX CONCURRENTLY) antes de rodar a migração de novo.
+    atomic = False
+
+    dependencies = [
+        ('devices', '0009_taskrundevice'),
+    ]
+
+    operations = [
+        # Cria o índice composto antes de remover o índice simples do FK,
+        # para que as buscas por dispositivo nunca fiquem sem índice.
+        AddIndexConcurrentlyOnPostgres(
+            model_name='telemetrydata',
+            index=models.Index(fields=['device', '-timestamp'], include=('id', 'temperature_celsius', 'humidity_percent', 'relay_state_D1', 'last_button_action'), name='telemetry_device_ts_desc'),
+        ),
+        # No estado, o FK passa a db_index=False; no banco, o índice antigo é removido
+        # com DROP INDEX CONCURRENTLY em vez do ALTER do AlterField.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(
+                    drop_device_fk_index, create_device_fk_index, hints={'model_name': 'telemetrydata'},
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='telemetrydata',
+                    name='device',
+                    field=models.ForeignKey(blank=True, db_index=False, help_text='Dispositivo que enviou este registro', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='telemetry_records', to='devices.device', verbose_name='Dispositivo'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0010_telemetry_device_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Nome da Regra')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Ativa')),
+                ('metric', models.CharField(choices=[('temperature_celsius', 'Temperatura (°C)'), ('humidity_percent', 'Umidade (%)')], max_length=30, verbose_name='Medida')),
+                ('operator', models.CharField(choices=[('gt', '>'), ('gte', '>='), ('lt', '<'), ('lte', '<=')], max_length=3, verbose_name='Operador')),
+                ('threshold', models.FloatField(verbose_name='Limite')),
+                ('duration_seconds', models.PositiveIntegerField(default=0, help_text='Tempo contínuo em que a condição deve se manter para disparar (0 = na primeira leitura)', verbose_name='Duração (segundos)')),
+                ('location', models.CharField(blank=True, default='', help_text='Apenas dispositivos desta localização (vazio = todas)', max_length=100, verbose_name='Localização')),
+                ('device_type', models.CharField(blank=True, default='', help_text='Apenas dispositivos deste tipo (vazio = todos)', max_length=100, verbose_name='Tipo de Dispositivo')),
+                ('command_json', models.JSONField(blank=True, help_text='Comando enviado ao dispositivo que disparou o alerta. Exemplo: {"value": 0, "action": "desligar_rele", "target": "rele_D1"}', null=True, verbose_name='Comando ao Disparar')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('devices', models.ManyToManyField(blank=True, help_text='Apenas estes dispositivos (vazio = todos os que atendem aos filtros acima)', related_name='alert_rules', to='devices.device', verbose_name='Dispositivos')),
+            ],
+            options={
+                'verbose_name': 'Regra de Alerta',
+                'verbose_name_plural': 'Regras de Alerta',
+            },
+        ),
+        migrations.CreateModel(
+            name='Alert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('FIRING', 'Disparado'), ('RESOLVED', 'Resolvido')], default='FIRING', max_length=10, verbose_name='Status')),
+                ('value', models.FloatField(help_text='Leitura que disparou o alerta', verbose_name='Valor')),
+                ('started_at', models.DateTimeField(help_text='Primeira leitura da sequência que disparou o alerta', verbose_name='Condição desde')),
+                ('fired_at', models.DateTimeField(verbose_name='Disparado em')),
+                ('resolved_at', models.DateTimeField(blank=True, null=True, verbose_name='Resolvido em')),
+                ('command_status', models.CharField(blank=True, default='', max_length=10, verbose_name='Comando')),
+                ('command_sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Comando enviado em')),
+                ('command_error', models.TextField(blank=True, default='', verbose_name='Erro do comando')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='devices.device', verbose_name='Dispositivo')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='devices.alertrule', verbose_name='Regra')),
+            ],
+            options={
+                'verbose_name': 'Alerta',
+                'verbose_name_plural': 'Alertas',
+                'ordering': ['-fired_at'],
+                'indexes': [models.Index(fields=['status', '-fired_at'], name='alert_status_fired')],
+            },
+        ),
+    ]
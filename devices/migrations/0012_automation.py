@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0011_alertrule_alert'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Automation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Nome da Automação')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Ativa')),
+                ('metric', models.CharField(choices=[('temperature_celsius', 'Temperatura (°C)'), ('humidity_percent', 'Umidade (%)')], max_length=30, verbose_name='Medida')),
+                ('operator', models.CharField(choices=[('gt', '>'), ('gte', '>='), ('lt', '<'), ('lte', '<=')], max_length=3, verbose_name='Operador')),
+                ('threshold', models.FloatField(verbose_name='Limite')),
+                ('command_json', models.JSONField(help_text='Comando gravado no dispositivo de destino. Exemplo: {"value": 1, "action": "ligar_rele", "target": "rele_D1"}', verbose_name='Comando JSON')),
+                ('last_fired_at', models.DateTimeField(blank=True, null=True, verbose_name='Último Disparo')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('source_device', models.ForeignKey(help_text='Dispositivo cujas leituras disparam a automação', on_delete=django.db.models.deletion.CASCADE, related_name='automations_as_source', to='devices.device', verbose_name='Dispositivo de Origem')),
+                ('target_device', models.ForeignKey(help_text='Dispositivo que recebe o comando', on_delete=django.db.models.deletion.CASCADE, related_name='automations_as_target', to='devices.device', verbose_name='Dispositivo de Destino')),
+            ],
+            options={
+                'verbose_name': 'Automação',
+                'verbose_name_plural': 'Automações',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0012_automation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telemetrydata',
+            name='anomaly_flags',
+            field=models.SmallIntegerField(db_default=0, default=0, help_text='Leitura suspeita (sensor travado, fora da faixa ou pico); 0 = normal', verbose_name='Anomalias'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0013_telemetrydata_anomaly_flags'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Sem FOREIGN KEY: a telemetria de um site pode ficar em outro banco (Site.database).
+        # A partir daqui, só o ORM evita leituras órfãs ao excluir um Device (SET_NULL no
+        # 'default' e o pre_delete devices.sites.detach_site_telemetry nos bancos de site).
+        migrations.AlterField(
+            model_name='telemetrydata',
+            name='device',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, help_text='Dispositivo que enviou este registro', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='telemetry_records', to='devices.device', verbose_name='Dispositivo'),
+        ),
+        migrations.CreateModel(
+            name='Site',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Nome')),
+                ('slug', models.SlugField(help_text='Usado na URL do dashboard (?site=) e nas tarefas do Celery Beat', unique=True, verbose_name='Identificador')),
+                ('database', models.CharField(blank=True, default='', help_text='Alias do banco próprio da telemetria deste site (DB_SITE_HOSTS, ex: site_norte); vazio = banco principal. Leituras já gravadas não são movidas ao alterar.', max_length=50, verbose_name='Banco de Telemetria')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('users', models.ManyToManyField(blank=True, help_text='Usuários do Admin que administram este site (superusuários veem todos)', related_name='sites', to=settings.AUTH_USER_MODEL, verbose_name='Operadores')),
+            ],
+            options={
+                'verbose_name': 'Site',
+                'verbose_name_plural': 'Sites',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='site',
+            field=models.ForeignKey(blank=True, help_text='Campus/unidade ao qual o dispositivo pertence', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='devices', to='devices.site', verbose_name='Site'),
+        ),
+        migrations.AddField(
+            model_name='scheduledtask',
+            name='site',
+            field=models.ForeignKey(blank=True, help_text='Se informado, a tarefa só envia o comando aos dispositivos deste site', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='scheduled_tasks', to='devices.site', verbose_name='Site'),
+        ),
+        migrations.AddField(
+            model_name='telemetrydata',
+            name='site',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, help_text='Site do dispositivo quando a leitura foi recebida', null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='devices.site', verbose_name='Site'),
+        ),
+        migrations.AddIndex(
+            model_name='telemetrydata',
+            index=models.Index(fields=['site', '-timestamp'], name='telemetry_site_ts_desc'),
+        ),
+    ]
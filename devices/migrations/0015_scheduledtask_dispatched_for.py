@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 22:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0014_site'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledtask',
+            name='dispatched_for',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Horário previsto da última ocorrência enfileirada pelo agendador.', null=True, verbose_name='Ocorrência Enfileirada'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:03
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0015_scheduledtask_dispatched_for'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskrun',
+            name='chunks_done',
+            field=models.PositiveIntegerField(default=0, verbose_name='Lotes Concluídos'),
+        ),
+        migrations.AddField(
+            model_name='taskrun',
+            name='chunks_total',
+            field=models.PositiveIntegerField(default=0, verbose_name='Lotes'),
+        ),
+        migrations.CreateModel(
+            name='TaskRunChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(verbose_name='Lote')),
+                ('device_ids', models.JSONField(help_text='PKs dos dispositivos deste lote', verbose_name='Dispositivos')),
+                ('status', models.CharField(choices=[('PENDING', 'Pendente'), ('RUNNING', 'Em execução'), ('DONE', 'Concluído')], default='PENDING', max_length=10, verbose_name='Status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Tentativas')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Atualizado em')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='devices.taskrun', verbose_name='Execução')),
+            ],
+            options={
+                'verbose_name': 'Lote de Envio',
+                'verbose_name_plural': 'Lotes de Envio',
+                'ordering': ['run', 'index'],
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='taskrunchunk_status_updated')],
+                'constraints': [models.UniqueConstraint(fields=('run', 'index'), name='unique_taskrun_chunk')],
+            },
+        ),
+    ]
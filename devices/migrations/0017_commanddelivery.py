@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0016_taskrunchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommandDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('task', 'Tarefa agendada'), ('automation', 'Automação'), ('api', 'API / Alerta')], default='api', max_length=20, verbose_name='Origem')),
+                ('command', models.JSONField(blank=True, null=True, verbose_name='Comando')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Gravado em')),
+                ('delivered_at', models.DateTimeField(blank=True, null=True, verbose_name='Entregue em')),
+                ('acked_at', models.DateTimeField(blank=True, null=True, verbose_name='Confirmado em')),
+                ('delivery_seconds', models.FloatField(blank=True, null=True, verbose_name='Atraso até Entrega (s)')),
+                ('ack_seconds', models.FloatField(blank=True, help_text='Da entrega (GET) até a confirmação (PUT)', null=True, verbose_name='Atraso até Confirmação (s)')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='command_deliveries', to='devices.device', verbose_name='Dispositivo')),
+                ('run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='devices.taskrun', verbose_name='Execução de Origem')),
+            ],
+            options={
+                'verbose_name': 'Entrega de Comando',
+                'verbose_name_plural': 'Entregas de Comandos',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='command_delivery',
+            field=models.ForeignKey(blank=True, help_text='Registro do ciclo de vida (gravado -> entregue -> confirmado) do comando pendente', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='devices.commanddelivery', verbose_name='Ciclo do Comando'),
+        ),
+        migrations.AddIndex(
+            model_name='commanddelivery',
+            index=models.Index(fields=['device', '-created_at'], name='cmddelivery_device_created'),
+        ),
+        migrations.AddIndex(
+            model_name='commanddelivery',
+            index=models.Index(fields=['-created_at'], name='cmddelivery_created_desc'),
+        ),
+    ]
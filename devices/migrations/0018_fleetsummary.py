@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:21
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0017_commanddelivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FleetSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('location', models.CharField(blank=True, default='', max_length=100, verbose_name='Localização')),
+                ('device_type', models.CharField(blank=True, default='', max_length=100, verbose_name='Tipo de Dispositivo')),
+                ('devices_total', models.PositiveIntegerField(default=0, verbose_name='Dispositivos')),
+                ('devices_online', models.PositiveIntegerField(default=0, verbose_name='Online')),
+                ('temperature_avg', models.FloatField(blank=True, help_text='Leituras não anômalas da janela FLEET_SUMMARY_TEMPERATURE_MINUTES', null=True, verbose_name='Temperatura Média (°C)')),
+                ('temperature_readings', models.PositiveIntegerField(default=0, verbose_name='Leituras de Temperatura')),
+                ('refreshed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Atualizado em')),
+                ('site', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='devices.site', verbose_name='Site')),
+            ],
+            options={
+                'verbose_name': 'Resumo da Frota',
+                'verbose_name_plural': 'Resumos da Frota',
+                'ordering': ['location', 'device_type'],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0018_fleetsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DevicePresence',
+            fields=[
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='presence', serialize=False, to='devices.device', verbose_name='Dispositivo')),
+                ('state', models.CharField(choices=[('ONLINE', 'Online'), ('OFFLINE', 'Offline'), ('FLAPPING', 'Instável')], default='OFFLINE', max_length=10, verbose_name='Estado')),
+                ('since', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Desde')),
+                ('recovering_since', models.DateTimeField(blank=True, null=True, verbose_name='Retornando desde')),
+                ('penalty', models.FloatField(default=0.0, verbose_name='Penalidade')),
+                ('penalty_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Penalidade calculada em')),
+                ('accounted_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Contabilizado até')),
+            ],
+            options={
+                'verbose_name': 'Presença do Dispositivo',
+                'verbose_name_plural': 'Presença dos Dispositivos',
+                'indexes': [models.Index(fields=['state'], name='presence_state')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DeviceAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Dia')),
+                ('online_seconds', models.FloatField(default=0.0, verbose_name='Online (s)')),
+                ('offline_seconds', models.FloatField(default=0.0, verbose_name='Offline (s)')),
+                ('flapping_seconds', models.FloatField(default=0.0, verbose_name='Instável (s)')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='devices.device', verbose_name='Dispositivo')),
+            ],
+            options={
+                'verbose_name': 'Disponibilidade Diária',
+                'verbose_name_plural': 'Disponibilidade Diária',
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['-date'], name='availability_date_desc')],
+                'constraints': [models.UniqueConstraint(fields=('device', 'date'), name='unique_availability_device_date')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PresenceTransition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_state', models.CharField(choices=[('ONLINE', 'Online'), ('OFFLINE', 'Offline'), ('FLAPPING', 'Instável')], max_length=10, verbose_name='De')),
+                ('to_state', models.CharField(choices=[('ONLINE', 'Online'), ('OFFLINE', 'Offline'), ('FLAPPING', 'Instável')], max_length=10, verbose_name='Para')),
+                ('at', models.DateTimeField(help_text='Último heartbeat (saída) ou retorno dos heartbeats (volta)', verbose_name='Em')),
+                ('previous_seconds', models.FloatField(blank=True, null=True, verbose_name='Duração do Estado Anterior (s)')),
+                ('recorded_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Registrado em')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='presence_transitions', to='devices.device', verbose_name='Dispositivo')),
+            ],
+            options={
+                'verbose_name': 'Transição de Presença',
+                'verbose_name_plural': 'Transições de Presença',
+                'ordering': ['-at'],
+                'indexes': [models.Index(fields=['device', '-at'], name='presence_trans_device_at'), models.Index(fields=['-at'], name='presence_trans_at_desc')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0019_device_presence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelemetryImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_name', models.CharField(max_length=255, verbose_name='Arquivo')),
+                ('file_path', models.CharField(help_text='Cópia do upload em TELEMETRY_IMPORT_DIR (removida ao concluir)', max_length=500, verbose_name='Caminho no Servidor')),
+                ('file_format', models.CharField(max_length=10, verbose_name='Formato')),
+                ('file_size', models.PositiveBigIntegerField(default=0, verbose_name='Tamanho (bytes)')),
+                ('create_devices', models.BooleanField(default=False, verbose_name='Cadastrar dispositivos desconhecidos')),
+                ('status', models.CharField(choices=[('QUEUED', 'Enfileirada'), ('RUNNING', 'Em execução'), ('DONE', 'Concluída'), ('FAILED', 'Falhou')], default='QUEUED', max_length=20, verbose_name='Status')),
+                ('message', models.TextField(blank=True, default='', verbose_name='Mensagem')),
+                ('errors', models.JSONField(blank=True, default=list, help_text='Primeiros registros rejeitados (até 100)', verbose_name='Registros Inválidos')),
+                ('offset', models.PositiveBigIntegerField(default=0, verbose_name='Byte Atual')),
+                ('imported', models.PositiveBigIntegerField(default=0, verbose_name='Importados')),
+                ('invalid', models.PositiveIntegerField(default=0, verbose_name='Inválidos')),
+                ('created_devices', models.PositiveIntegerField(default=0, verbose_name='Dispositivos Criados')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Enviada em')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Iniciada em')),
+                ('updated_at', models.DateTimeField(blank=True, null=True, verbose_name='Último Bloco em')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finalizada em')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Enviado por')),
+            ],
+            options={
+                'verbose_name': 'Importação de Telemetria',
+                'verbose_name_plural': 'Importações de Telemetria',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -1,9 +1,12 @@
 # iot_project/devices/models.py
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 import json
 
+from core_system.db_router import site_aliases
+
 DAY_OF_WEEK_CHOICES = (
     ('1', 'Segunda-feira'),
     ('2', 'Terça-feira'),
@@ -48,6 +51,15 @@ class Device(models.Model):
         default="Desconhecido",
         help_text="Localização física do dispositivo"
     )
+    site = models.ForeignKey(
+        'Site',
+        verbose_name='Site',
+        on_delete=models.PROTECT,
+        related_name='devices',
+        null=True,
+        blank=True,
+        help_text="Campus/unidade ao qual o dispositivo pertence"
+    )
     
     # Dados de Status e Conexão
     ip_address = models.GenericIPAddressField(
@@ -87,6 +99,38 @@ class Device(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Rastreamento da entrega do comando pendente (agendado -> enviado -> entregue)
+    command_run = models.ForeignKey(
+        'TaskRun',
+        verbose_name='Execução de Origem',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True,
+        help_text="Execução de tarefa agendada que gerou o comando pendente (se houver)"
+    )
+    command_issued_at = models.DateTimeField(
+        'Comando Enviado em',
+        null=True,
+        blank=True,
+        help_text="Quando o comando pendente foi gravado para o dispositivo"
+    )
+    command_delivered_at = models.DateTimeField(
+        'Comando Entregue em',
+        null=True,
+        blank=True,
+        help_text="Quando o dispositivo recebeu o comando pendente em uma consulta (GET)"
+    )
+    command_delivery = models.ForeignKey(
+        'CommandDelivery',
+        verbose_name='Ciclo do Comando',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True,
+        help_text="Registro do ciclo de vida (gravado -> entregue -> confirmado) do comando pendente"
+    )
+
     # --- ATRIBUTOS DE AUTENTICAÇÃO NECESSÁRIOS PARA DJANGO/DRF ---
     @property
     def is_authenticated(self):
@@ -99,6 +143,11 @@ class Device(models.Model):
         return False
     # -----------------------------------------------------------
 
+    @property
+    def telemetry_db(self):
+        """Banco que guarda a telemetria do dispositivo (o do site, se tiver um próprio)."""
+        return self.site.telemetry_db if self.site_id else DEFAULT_DB_ALIAS
+
     def __str__(self):
         return f"[{self.device_id}] {self.name} ({self.location})"
     
@@ -114,6 +163,12 @@ class TelemetryData(models.Model):
     """
     Armazena os dados de telemetria (sensores e estado) enviados por um Device.
     """
+    # Sem FOREIGN KEY no banco (db_constraint=False): a telemetria de um site pode ficar
+    # em um banco próprio (Site.database), onde os dispositivos e sites não existem.
+    # Sem a constraint, nada no banco impede leituras órfãs: ao excluir um Device, o
+    # SET_NULL do Django cuida do 'default' e o sinal devices.sites.detach_site_telemetry
+    # (pre_delete) dos bancos de site. Exclusões que não passam pelo ORM (SQL direto)
+    # deixam leituras apontando para um dispositivo inexistente.
     device = models.ForeignKey(
         Device, 
         verbose_name='Dispositivo',
@@ -121,8 +176,24 @@ class TelemetryData(models.Model):
         related_name='telemetry_records',
         null=True,
         blank=True,
+        # Sem índice próprio: o índice composto (device, -timestamp) já atende buscas por dispositivo
+        db_index=False,
+        db_constraint=False,
         help_text="Dispositivo que enviou este registro"
     )
+    # Site do dispositivo no momento da leitura (copiado na ingestão, sem JOIN para filtrar)
+    site = models.ForeignKey(
+        'Site',
+        verbose_name='Site',
+        on_delete=models.DO_NOTHING,
+        related_name='+',
+        null=True,
+        blank=True,
+        # Atendido pelo índice composto (site, -timestamp)
+        db_index=False,
+        db_constraint=False,
+        help_text="Site do dispositivo quando a leitura foi recebida"
+    )
     
     # Telemetria Principal
     temperature_celsius = models.FloatField(
@@ -150,6 +221,16 @@ class TelemetryData(models.Model):
         help_text="Ação local acionada por botão (se houver)"
     )
 
+    # Qualidade da leitura (devices/anomalies.py): 0 = normal; bits ANOMALY_* deslocados por medida.
+    # db_default permite gravar sem a coluna (COPY do importador) e, sem CHECK (>= 0), o
+    # ADD COLUMN não precisa varrer a tabela.
+    anomaly_flags = models.SmallIntegerField(
+        'Anomalias',
+        default=0,
+        db_default=0,
+        help_text="Leitura suspeita (sensor travado, fora da faixa ou pico); 0 = normal"
+    )
+
     # Dados brutos adicionais
     raw_data = models.JSONField(
         'Dados Brutos', 
@@ -166,6 +247,32 @@ class TelemetryData(models.Model):
         help_text="Timestamp do registro (quando foi recebido)"
     )
     
+    # Colunas lidas pelo dashboard (cobertas pelo índice telemetry_device_ts_desc)
+    DASHBOARD_FIELDS = (
+        'device', 'timestamp', 'temperature_celsius', 'humidity_percent', 'relay_state_D1', 'last_button_action',
+    )
+
+    # Tipos de anomalia (bits) e deslocamento de cada medida em anomaly_flags
+    ANOMALY_STUCK = 1
+    ANOMALY_RANGE = 2
+    ANOMALY_SPIKE = 4
+    ANOMALY_KINDS = {ANOMALY_STUCK: 'travado', ANOMALY_RANGE: 'fora da faixa', ANOMALY_SPIKE: 'pico'}
+    ANOMALY_METRIC_SHIFT = {'temperature_celsius': 0, 'humidity_percent': 3}
+
+    def metric_value(self, metric):
+        """Valor da medida, ou None se ausente ou marcado como anômalo."""
+        if (self.anomaly_flags >> self.ANOMALY_METRIC_SHIFT[metric]) & 0b111:
+            return None
+        return getattr(self, metric)
+
+    def anomaly_labels(self):
+        labels = []
+        for metric, shift in self.ANOMALY_METRIC_SHIFT.items():
+            for bit, kind in self.ANOMALY_KINDS.items():
+                if self.anomaly_flags & (bit << shift):
+                    labels.append(f"{self._meta.get_field(metric).verbose_name}: {kind}")
+        return labels
+
     def __str__(self):
         device_name = self.device.name if self.device and self.device.name else "DISPOSITIVO DESCONHECIDO"
         return f"{device_name} - {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
@@ -174,6 +281,18 @@ class TelemetryData(models.Model):
         verbose_name = "Dado de Telemetria"
         verbose_name_plural = "Dados de Telemetria"
         ordering = ['-timestamp'] # Ordena do mais recente para o mais antigo
+        indexes = [
+            # "Dispositivo X, mais recentes primeiro": última leitura do dashboard, histórico
+            # por dispositivo e filtro do Admin. Os valores exibidos no dashboard vão no INCLUDE
+            # (PostgreSQL), junto com o id exigido pelo ORM, permitindo Index Only Scan sem visitar a tabela.
+            models.Index(
+                fields=['device', '-timestamp'],
+                name='telemetry_device_ts_desc',
+                include=['id', 'temperature_celsius', 'humidity_percent', 'relay_state_D1', 'last_button_action'],
+            ),
+            # Listagem do Admin filtrada por site, mais recentes primeiro
+            models.Index(fields=['site', '-timestamp'], name='telemetry_site_ts_desc'),
+        ]
 
 # ==============================================================================
 # 3. MODELO SCHEDULEDTASK (COMANDOS AGENDADOS)
@@ -200,6 +319,15 @@ class ScheduledTask(models.Model):
         related_name='scheduled_tasks',
         help_text="Dispositivos que receberão este comando"
     )
+    site = models.ForeignKey(
+        'Site',
+        verbose_name='Site',
+        on_delete=models.PROTECT,
+        related_name='scheduled_tasks',
+        null=True,
+        blank=True,
+        help_text="Se informado, a tarefa só envia o comando aos dispositivos deste site"
+    )
 
     # Comando a ser enviado (JSON, exemplo: {"action": "ligar_rele", "target": "rele_D1", "value": 1})
     command_json = models.JSONField('Comando JSON', help_text='Comando a ser enviado (JSON). Exemplo: {"value": 0, "action": "ligar_rele", "target": "rele_D1"}') 
@@ -239,6 +367,13 @@ class ScheduledTask(models.Model):
         null=True, blank=True,
         help_text="Hora da última execução bem-sucedida desta tarefa."
     )
+    # Ocorrência (horário previsto) já enfileirada pelo agendador. Gravada com um UPDATE
+    # condicional antes de enfileirar: com várias instâncias do agendador, só uma consegue.
+    dispatched_for = models.DateTimeField(
+        'Ocorrência Enfileirada',
+        null=True, blank=True, editable=False,
+        help_text="Horário previsto da última ocorrência enfileirada pelo agendador."
+    )
 
     status = models.CharField(
         max_length=50, 
@@ -254,4 +389,643 @@ class ScheduledTask(models.Model):
 
     class Meta:
         verbose_name = "Tarefa Agendada"
-        verbose_name_plural = "Tarefas Agendadas"
\ No newline at end of file
+        verbose_name_plural = "Tarefas Agendadas"
+
+
+# ==============================================================================
+# 4. MODELO TASKRUN (HISTÓRICO DE EXECUÇÕES DAS TAREFAS AGENDADAS)
+# ==============================================================================
+class TaskRun(models.Model):
+    """
+    Registra cada disparo de uma ScheduledTask com os instantes de cada etapa:
+    agendado -> enfileirado (Celery Beat) -> iniciado/finalizado (Worker) -> entregue (GET do ESP).
+    """
+    RUN_STATUS = [
+        ('QUEUED', 'Enfileirada'),
+        ('RUNNING', 'Em execução'),
+        ('SUCCESS', 'Sucesso'),
+        ('PARTIAL', 'Parcial'),
+        ('FAILED', 'Falhou'),
+        ('SKIPPED', 'Ignorada'),
+    ]
+
+    task = models.ForeignKey(
+        ScheduledTask,
+        verbose_name='Tarefa',
+        on_delete=models.CASCADE,
+        related_name='runs',
+    )
+    status = models.CharField('Status', max_length=20, choices=RUN_STATUS, default='QUEUED')
+    retry_of = models.ForeignKey(
+        'self',
+        verbose_name='Reenvio de',
+        on_delete=models.SET_NULL,
+        related_name='retries',
+        null=True,
+        blank=True,
+        help_text="Execução original cujos dispositivos com falha foram reenviados nesta execução"
+    )
+
+    # Linha do tempo da execução
+    scheduled_for = models.DateTimeField('Agendada para', help_text="Horário previsto da execução")
+    enqueued_at = models.DateTimeField('Enfileirada em', default=timezone.now)
+    started_at = models.DateTimeField('Iniciada em', null=True, blank=True)
+    finished_at = models.DateTimeField('Finalizada em', null=True, blank=True)
+    first_delivered_at = models.DateTimeField('Primeira Entrega', null=True, blank=True)
+    last_delivered_at = models.DateTimeField('Última Entrega', null=True, blank=True)
+
+    # Contadores por dispositivo
+    devices_total = models.PositiveIntegerField('Dispositivos', default=0)
+    devices_failed = models.PositiveIntegerField('Falhas', default=0)
+    devices_delivered = models.PositiveIntegerField('Entregues', default=0)
+
+    # Progresso do envio em lotes (TaskRunChunk)
+    chunks_total = models.PositiveIntegerField('Lotes', default=0)
+    chunks_done = models.PositiveIntegerField('Lotes Concluídos', default=0)
+
+    def __str__(self):
+        return f"{self.task.name} @ {timezone.localtime(self.scheduled_for).strftime('%Y-%m-%d %H:%M')} ({self.status})"
+
+    # --- ATRASOS DE CADA ETAPA (timedelta ou None) ---
+    @property
+    def dispatch_lag(self):
+        """Atraso entre o horário agendado e o enfileiramento pelo Celery Beat."""
+        return self.enqueued_at - self.scheduled_for
+
+    @property
+    def queue_wait(self):
+        """Tempo na fila do Celery até um worker iniciar a execução."""
+        return self.started_at - self.enqueued_at if self.started_at else None
+
+    @property
+    def duration(self):
+        """Tempo gasto pelo worker enviando o comando a todos os dispositivos."""
+        return self.finished_at - self.started_at if self.started_at and self.finished_at else None
+
+    @property
+    def delivery_lag(self):
+        """Atraso entre o horário agendado e a última entrega a um dispositivo."""
+        return self.last_delivered_at - self.scheduled_for if self.last_delivered_at else None
+
+    class Meta:
+        verbose_name = "Execução de Tarefa"
+        verbose_name_plural = "Execuções de Tarefas"
+        ordering = ['-scheduled_for']
+
+
+# ==============================================================================
+# 5. MODELO TASKRUNDEVICE (RESULTADO DE UMA EXECUÇÃO POR DISPOSITIVO)
+# ==============================================================================
+class TaskRunDevice(models.Model):
+    """
+    Resultado do envio do comando de uma execução (TaskRun) para um dispositivo.
+    Registro somente de inserção: gravado em lote ao final de cada TaskRunChunk; um
+    reenvio cria um novo TaskRun com as suas próprias linhas.
+    """
+    OUTCOME_CHOICES = [
+        ('SUCCESS', 'Sucesso'),
+        ('FAILED', 'Falhou'),
+    ]
+
+    run = models.ForeignKey(
+        TaskRun,
+        verbose_name='Execução',
+        on_delete=models.CASCADE,
+        related_name='device_results',
+    )
+    device = models.ForeignKey(
+        Device,
+        verbose_name='Dispositivo',
+        on_delete=models.CASCADE,
+        related_name='task_results',
+    )
+    outcome = models.CharField('Resultado', max_length=10, choices=OUTCOME_CHOICES)
+    status_code = models.PositiveSmallIntegerField('Status HTTP', null=True, blank=True)
+    error = models.TextField('Erro', blank=True, default='')
+    dispatched_at = models.DateTimeField('Enviado em')
+    duration_ms = models.PositiveIntegerField('Duração (ms)', default=0)
+
+    def __str__(self):
+        return f"{self.device_id}: {self.outcome}"
+
+    class Meta:
+        verbose_name = "Resultado por Dispositivo"
+        verbose_name_plural = "Resultados por Dispositivo"
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'device'], name='unique_taskrun_device'),
+        ]
+        indexes = [
+            # Seleção dos dispositivos com falha de uma execução (ação de reenvio)
+            models.Index(fields=['run', 'outcome'], name='taskrundevice_run_outcome'),
+        ]
+
+
+class TaskRunChunk(models.Model):
+    """
+    Lote de dispositivos de uma execução (TaskRun), enviado por uma subtarefa própria
+    do Celery (devices.tasks.dispatch_chunk). Os TaskRunDevice são gravados em blocos
+    durante o envio (a cada CHUNK_RESULTS_FLUSH_SIZE dispositivos e a cada pulso); após a queda
+    de um worker, apenas os lotes não concluídos são reenfileirados (devices.tasks.resume_stalled_chunks)
+    e só os dispositivos sem resultado gravado recebem o comando de novo.
+    """
+    CHUNK_STATUS = [
+        ('PENDING', 'Pendente'),
+        ('RUNNING', 'Em execução'),
+        ('DONE', 'Concluído'),
+    ]
+
+    run = models.ForeignKey(
+        TaskRun,
+        verbose_name='Execução',
+        on_delete=models.CASCADE,
+        related_name='chunks',
+    )
+    index = models.PositiveIntegerField('Lote')
+    device_ids = models.JSONField('Dispositivos', help_text="PKs dos dispositivos deste lote")
+    status = models.CharField('Status', max_length=10, choices=CHUNK_STATUS, default='PENDING')
+    attempts = models.PositiveSmallIntegerField('Tentativas', default=0)
+    # Pulso do worker durante o envio; parado há mais de SCHEDULER_CHUNK_STALL_SECONDS = lote abandonado
+    updated_at = models.DateTimeField('Atualizado em', default=timezone.now)
+
+    def __str__(self):
+        return f"Execução {self.run_id}, lote {self.index} ({self.status})"
+
+    class Meta:
+        verbose_name = "Lote de Envio"
+        verbose_name_plural = "Lotes de Envio"
+        ordering = ['run', 'index']
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'index'], name='unique_taskrun_chunk'),
+        ]
+        indexes = [
+            # Varredura dos lotes abandonados (status != DONE e sem pulso recente)
+            models.Index(fields=['status', 'updated_at'], name='taskrunchunk_status_updated'),
+        ]
+
+
+# ==============================================================================
+# 6. MODELOS ALERTRULE / ALERT (ALERTAS AVALIADOS NA INGESTÃO)
+# ==============================================================================
+class AlertRule(models.Model):
+    """
+    Regra de alerta por limite, ex: "temperatura > 30 °C por 5 minutos nos dispositivos da Sala".
+    Avaliada a cada leitura recebida (devices/alerts.py); opcionalmente envia um comando
+    ao dispositivo que disparou o alerta (ex: desligar o relé).
+    """
+    METRIC_CHOICES = [
+        ('temperature_celsius', 'Temperatura (°C)'),
+        ('humidity_percent', 'Umidade (%)'),
+    ]
+    OPERATOR_CHOICES = [
+        ('gt', '>'),
+        ('gte', '>='),
+        ('lt', '<'),
+        ('lte', '<='),
+    ]
+
+    name = models.CharField('Nome da Regra', max_length=255)
+    is_active = models.BooleanField('Ativa', default=True)
+
+    # Condição
+    metric = models.CharField('Medida', max_length=30, choices=METRIC_CHOICES)
+    operator = models.CharField('Operador', max_length=3, choices=OPERATOR_CHOICES)
+    threshold = models.FloatField('Limite')
+    duration_seconds = models.PositiveIntegerField(
+        'Duração (segundos)',
+        default=0,
+        help_text="Tempo contínuo em que a condição deve se manter para disparar (0 = na primeira leitura)"
+    )
+
+    # Escopo (campos vazios = todos)
+    location = models.CharField('Localização', max_length=100, blank=True, default='',
+                                help_text="Apenas dispositivos desta localização (vazio = todas)")
+    device_type = models.CharField('Tipo de Dispositivo', max_length=100, blank=True, default='',
+                                   help_text="Apenas dispositivos deste tipo (vazio = todos)")
+    devices = models.ManyToManyField(
+        Device,
+        verbose_name='Dispositivos',
+        related_name='alert_rules',
+        blank=True,
+        help_text="Apenas estes dispositivos (vazio = todos os que atendem aos filtros acima)"
+    )
+
+    # Ação opcional ao disparar
+    command_json = models.JSONField(
+        'Comando ao Disparar',
+        null=True, blank=True,
+        help_text='Comando enviado ao dispositivo que disparou o alerta. Exemplo: {"value": 0, "action": "desligar_rele", "target": "rele_D1"}'
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Alterar a regra reinicia o estado das janelas (ver alerts.CompiledRule.state_key)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def describe(self):
+        condition = f"{self.get_metric_display()} {self.get_operator_display()} {self.threshold:g}"
+        if self.duration_seconds:
+            condition += f" por {self.duration_seconds}s"
+        return condition
+
+    def __str__(self):
+        return f"{self.name} ({self.describe()})"
+
+    class Meta:
+        verbose_name = "Regra de Alerta"
+        verbose_name_plural = "Regras de Alerta"
+
+
+class Alert(models.Model):
+    """
+    Ocorrência de uma AlertRule em um dispositivo: aberta ao disparar (FIRING) e
+    encerrada (RESOLVED) na primeira leitura em que a condição deixa de valer.
+    """
+    STATUS_CHOICES = [
+        ('FIRING', 'Disparado'),
+        ('RESOLVED', 'Resolvido'),
+    ]
+
+    rule = models.ForeignKey(AlertRule, verbose_name='Regra', on_delete=models.CASCADE, related_name='alerts')
+    device = models.ForeignKey(Device, verbose_name='Dispositivo', on_delete=models.CASCADE, related_name='alerts')
+    status = models.CharField('Status', max_length=10, choices=STATUS_CHOICES, default='FIRING')
+    value = models.FloatField('Valor', help_text="Leitura que disparou o alerta")
+    started_at = models.DateTimeField('Condição desde', help_text="Primeira leitura da sequência que disparou o alerta")
+    fired_at = models.DateTimeField('Disparado em')
+    resolved_at = models.DateTimeField('Resolvido em', null=True, blank=True)
+
+    # Resultado do comando da regra (se houver), enviado pelo Celery
+    command_status = models.CharField('Comando', max_length=10, blank=True, default='')
+    command_sent_at = models.DateTimeField('Comando enviado em', null=True, blank=True)
+    command_error = models.TextField('Erro do comando', blank=True, default='')
+
+    def __str__(self):
+        return f"{self.rule.name} - {self.device_id} ({self.status})"
+
+    class Meta:
+        verbose_name = "Alerta"
+        verbose_name_plural = "Alertas"
+        ordering = ['-fired_at']
+        indexes = [
+            models.Index(fields=['status', '-fired_at'], name='alert_status_fired'),
+        ]
+
+
+# ==============================================================================
+# 7. MODELO AUTOMATION (REAÇÃO A LEITURAS: DISPOSITIVO A -> COMANDO EM B)
+# ==============================================================================
+class Automation(models.Model):
+    """
+    Automação do tipo "se a umidade do dispositivo A > 70, ligar o relé do dispositivo B".
+    Avaliada na ingestão das leituras de A (devices/automations.py): quando a condição
+    passa a valer, o comando é gravado diretamente no pending_command de B.
+    """
+    name = models.CharField('Nome da Automação', max_length=255)
+    is_active = models.BooleanField('Ativa', default=True)
+
+    # Gatilho
+    source_device = models.ForeignKey(
+        Device,
+        verbose_name='Dispositivo de Origem',
+        on_delete=models.CASCADE,
+        related_name='automations_as_source',
+        help_text="Dispositivo cujas leituras disparam a automação"
+    )
+    metric = models.CharField('Medida', max_length=30, choices=AlertRule.METRIC_CHOICES)
+    operator = models.CharField('Operador', max_length=3, choices=AlertRule.OPERATOR_CHOICES)
+    threshold = models.FloatField('Limite')
+
+    # Ação
+    target_device = models.ForeignKey(
+        Device,
+        verbose_name='Dispositivo de Destino',
+        on_delete=models.CASCADE,
+        related_name='automations_as_target',
+        help_text="Dispositivo que recebe o comando"
+    )
+    command_json = models.JSONField(
+        'Comando JSON',
+        help_text='Comando gravado no dispositivo de destino. Exemplo: {"value": 1, "action": "ligar_rele", "target": "rele_D1"}'
+    )
+
+    last_fired_at = models.DateTimeField('Último Disparo', null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def describe(self):
+        return f"{self.get_metric_display()} {self.get_operator_display()} {self.threshold:g}"
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = "Automação"
+        verbose_name_plural = "Automações"
+
+
+# ==============================================================================
+# 8. MODELO SITE (CAMPUS/UNIDADE: ISOLAMENTO ENTRE LOCAIS DA MESMA INSTALAÇÃO)
+# ==============================================================================
+class Site(models.Model):
+    """
+    Campus ou unidade atendida pela instalação. Dispositivos, tarefas agendadas e
+    telemetria pertencem a um site; usuários do Admin associados a sites só
+    enxergam os dados deles (devices/sites.py).
+    """
+    name = models.CharField('Nome', max_length=100, unique=True)
+    slug = models.SlugField('Identificador', max_length=50, unique=True,
+                            help_text="Usado na URL do dashboard (?site=) e nas tarefas do Celery Beat")
+    database = models.CharField(
+        'Banco de Telemetria',
+        max_length=50,
+        blank=True,
+        default='',
+        help_text="Alias do banco próprio da telemetria deste site (DB_SITE_HOSTS, ex: site_norte); "
+                  "vazio = banco principal. Leituras já gravadas não são movidas ao alterar."
+    )
+    users = models.ManyToManyField(
+        User,
+        verbose_name='Operadores',
+        related_name='sites',
+        blank=True,
+        help_text="Usuários do Admin que administram este site (superusuários veem todos)"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def telemetry_db(self):
+        return self.database or DEFAULT_DB_ALIAS
+
+    def clean(self):
+        if self.database and self.database not in site_aliases():
+            raise ValidationError({'database': f"Banco '{self.database}' não configurado em DB_SITE_HOSTS."})
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = "Site"
+        verbose_name_plural = "Sites"
+        ordering = ['name']
+
+
+# ==============================================================================
+# 9. MODELO COMMANDDELIVERY (CICLO DE VIDA DE CADA COMANDO)
+# ==============================================================================
+class CommandDelivery(models.Model):
+    """
+    Um comando gravado no pending_command de um dispositivo e os instantes do seu ciclo:
+    gravado (PATCH do Celery ou automação) -> entregue (primeiro GET que o recebe) ->
+    confirmado (PUT do ESP com last_command). Os atrasos ficam em segundos para que o
+    relatório do Admin agregue por dispositivo, tipo e localização no próprio banco.
+    """
+    SOURCE_CHOICES = [
+        ('task', 'Tarefa agendada'),
+        ('automation', 'Automação'),
+        ('api', 'API / Alerta'),
+    ]
+
+    device = models.ForeignKey(
+        Device,
+        verbose_name='Dispositivo',
+        on_delete=models.CASCADE,
+        related_name='command_deliveries',
+    )
+    run = models.ForeignKey(
+        TaskRun,
+        verbose_name='Execução de Origem',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True,
+    )
+    source = models.CharField('Origem', max_length=20, choices=SOURCE_CHOICES, default='api')
+    command = models.JSONField('Comando', null=True, blank=True)
+
+    created_at = models.DateTimeField('Gravado em', default=timezone.now)
+    delivered_at = models.DateTimeField('Entregue em', null=True, blank=True)
+    acked_at = models.DateTimeField('Confirmado em', null=True, blank=True)
+    delivery_seconds = models.FloatField('Atraso até Entrega (s)', null=True, blank=True)
+    ack_seconds = models.FloatField('Atraso até Confirmação (s)', null=True, blank=True,
+                                    help_text="Da entrega (GET) até a confirmação (PUT)")
+
+    def __str__(self):
+        return f"{self.device_id} @ {timezone.localtime(self.created_at).strftime('%Y-%m-%d %H:%M:%S')}"
+
+    class Meta:
+        verbose_name = "Entrega de Comando"
+        verbose_name_plural = "Entregas de Comandos"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['device', '-created_at'], name='cmddelivery_device_created'),
+            # Relatório por período (agregação por dispositivo, tipo e localização)
+            models.Index(fields=['-created_at'], name='cmddelivery_created_desc'),
+        ]
+
+
+
+# ==============================================================================
+# 10. MODELO FLEETSUMMARY (RESUMO DA FROTA, RECALCULADO PELO CELERY BEAT)
+# ==============================================================================
+class FleetSummary(models.Model):
+    """
+    Visão geral da frota por site, localização e tipo de dispositivo: quantos estão
+    online/offline e a temperatura média recente. Recalculada a cada minuto pela
+    tarefa refresh_fleet_summary (devices/fleet.py); o Admin, o dashboard e a API
+    leem só estas linhas, sem varrer Device e TelemetryData.
+    """
+    site = models.ForeignKey(
+        Site,
+        verbose_name='Site',
+        on_delete=models.CASCADE,
+        related_name='+',
+        null=True,
+        blank=True,
+    )
+    location = models.CharField('Localização', max_length=100, blank=True, default='')
+    device_type = models.CharField('Tipo de Dispositivo', max_length=100, blank=True, default='')
+    devices_total = models.PositiveIntegerField('Dispositivos', default=0)
+    devices_online = models.PositiveIntegerField('Online', default=0)
+    temperature_avg = models.FloatField('Temperatura Média (°C)', null=True, blank=True,
+                                        help_text="Leituras não anômalas da janela FLEET_SUMMARY_TEMPERATURE_MINUTES")
+    temperature_readings = models.PositiveIntegerField('Leituras de Temperatura', default=0)
+    refreshed_at = models.DateTimeField('Atualizado em', default=timezone.now)
+
+    @property
+    def devices_offline(self):
+        return self.devices_total - self.devices_online
+
+    def __str__(self):
+        return f"{self.location or '-'} / {self.device_type or '-'}"
+
+    class Meta:
+        verbose_name = "Resumo da Frota"
+        verbose_name_plural = "Resumos da Frota"
+        ordering = ['location', 'device_type']
+
+
+# ==============================================================================
+# 11. PRESENÇA DOS DISPOSITIVOS (MÁQUINA DE ESTADOS, TRANSIÇÕES E DISPONIBILIDADE)
+# ==============================================================================
+PRESENCE_STATES = [
+    ('ONLINE', 'Online'),
+    ('OFFLINE', 'Offline'),
+    ('FLAPPING', 'Instável'),
+]
+
+
+class DevicePresence(models.Model):
+    """
+    Estado de presença de um dispositivo, mantido pela tarefa check_device_status
+    (devices/presence.py). Fica fora do Device para que a avaliação a cada minuto não
+    dispute as linhas atualizadas a cada consulta dos ESPs; o Device.is_active é a
+    cópia do estado (True apenas em ONLINE).
+    """
+    device = models.OneToOneField(
+        Device,
+        verbose_name='Dispositivo',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='presence',
+    )
+    state = models.CharField('Estado', max_length=10, choices=PRESENCE_STATES, default='OFFLINE')
+    since = models.DateTimeField('Desde', default=timezone.now)
+    # Heartbeats recentes de um dispositivo OFFLINE: vira ONLINE só após PRESENCE['ONLINE_HOLD_SECONDS']
+    recovering_since = models.DateTimeField('Retornando desde', null=True, blank=True)
+    # Amortecimento: cada transição soma uma penalidade, que decai pela metade a cada meia-vida
+    penalty = models.FloatField('Penalidade', default=0.0)
+    penalty_at = models.DateTimeField('Penalidade calculada em', default=timezone.now)
+    # Início do trecho do estado atual ainda não somado em DeviceAvailability
+    accounted_at = models.DateTimeField('Contabilizado até', default=timezone.now)
+
+    def __str__(self):
+        return f"{self.device_id}: {self.state}"
+
+    class Meta:
+        verbose_name = "Presença do Dispositivo"
+        verbose_name_plural = "Presença dos Dispositivos"
+        indexes = [
+            models.Index(fields=['state'], name='presence_state'),
+        ]
+
+
+class PresenceTransition(models.Model):
+    """Registro (somente inclusão) de cada mudança de estado de presença, gravado em lote."""
+    device = models.ForeignKey(
+        Device,
+        verbose_name='Dispositivo',
+        on_delete=models.CASCADE,
+        related_name='presence_transitions',
+    )
+    from_state = models.CharField('De', max_length=10, choices=PRESENCE_STATES)
+    to_state = models.CharField('Para', max_length=10, choices=PRESENCE_STATES)
+    at = models.DateTimeField('Em', help_text="Último heartbeat (saída) ou retorno dos heartbeats (volta)")
+    previous_seconds = models.FloatField('Duração do Estado Anterior (s)', null=True, blank=True)
+    recorded_at = models.DateTimeField('Registrado em', default=timezone.now)
+
+    def __str__(self):
+        return f"{self.device_id}: {self.from_state} -> {self.to_state}"
+
+    class Meta:
+        verbose_name = "Transição de Presença"
+        verbose_name_plural = "Transições de Presença"
+        ordering = ['-at']
+        indexes = [
+            models.Index(fields=['device', '-at'], name='presence_trans_device_at'),
+            models.Index(fields=['-at'], name='presence_trans_at_desc'),
+        ]
+
+
+class DeviceAvailability(models.Model):
+    """
+    Segundos em cada estado por dispositivo e dia (horário local). Somados a cada
+    transição e na virada do dia, sem reler a telemetria; o trecho em aberto do estado
+    atual entra só na consulta (devices/presence.py: open_seconds).
+    """
+    device = models.ForeignKey(
+        Device,
+        verbose_name='Dispositivo',
+        on_delete=models.CASCADE,
+        related_name='availability',
+    )
+    date = models.DateField('Dia')
+    online_seconds = models.FloatField('Online (s)', default=0.0)
+    offline_seconds = models.FloatField('Offline (s)', default=0.0)
+    flapping_seconds = models.FloatField('Instável (s)', default=0.0)
+
+    STATE_FIELDS = {'ONLINE': 'online_seconds', 'OFFLINE': 'offline_seconds', 'FLAPPING': 'flapping_seconds'}
+
+    def __str__(self):
+        return f"{self.device_id} @ {self.date}"
+
+    class Meta:
+        verbose_name = "Disponibilidade Diária"
+        verbose_name_plural = "Disponibilidade Diária"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'date'], name='unique_availability_device_date'),
+        ]
+        indexes = [
+            models.Index(fields=['-date'], name='availability_date_desc'),
+        ]
+
+
+# ==============================================================================
+# 12. MODELO TELEMETRYIMPORT (IMPORTAÇÃO DE HISTÓRICO ENVIADA PELO ADMIN)
+# ==============================================================================
+class TelemetryImport(models.Model):
+    """
+    Arquivo CSV/NDJSON enviado pelo Admin e importado em segundo plano pela tarefa
+    import_telemetry_file (fila 'maintenance'). O offset e os contadores são gravados
+    após cada bloco confirmado: o Admin mostra o progresso e a importação pode ser
+    retomada do último bloco (devices/importers.py: run_import).
+    """
+    IMPORT_STATUS = [
+        ('QUEUED', 'Enfileirada'),
+        ('RUNNING', 'Em execução'),
+        ('DONE', 'Concluída'),
+        ('FAILED', 'Falhou'),
+    ]
+
+    original_name = models.CharField('Arquivo', max_length=255)
+    file_path = models.CharField('Caminho no Servidor', max_length=500,
+                                 help_text="Cópia do upload em TELEMETRY_IMPORT_DIR (removida ao concluir)")
+    file_format = models.CharField('Formato', max_length=10)
+    file_size = models.PositiveBigIntegerField('Tamanho (bytes)', default=0)
+    create_devices = models.BooleanField('Cadastrar dispositivos desconhecidos', default=False)
+    created_by = models.ForeignKey(
+        User,
+        verbose_name='Enviado por',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True,
+    )
+
+    status = models.CharField('Status', max_length=20, choices=IMPORT_STATUS, default='QUEUED')
+    message = models.TextField('Mensagem', blank=True, default='')
+    errors = models.JSONField('Registros Inválidos', default=list, blank=True,
+                              help_text="Primeiros registros rejeitados (até 100)")
+
+    # Progresso: gravado a cada bloco confirmado (ponto de retomada)
+    offset = models.PositiveBigIntegerField('Byte Atual', default=0)
+    imported = models.PositiveBigIntegerField('Importados', default=0)
+    invalid = models.PositiveIntegerField('Inválidos', default=0)
+    created_devices = models.PositiveIntegerField('Dispositivos Criados', default=0)
+
+    created_at = models.DateTimeField('Enviada em', default=timezone.now)
+    started_at = models.DateTimeField('Iniciada em', null=True, blank=True)
+    updated_at = models.DateTimeField('Último Bloco em', null=True, blank=True)
+    finished_at = models.DateTimeField('Finalizada em', null=True, blank=True)
+
+    @property
+    def progress_percent(self):
+        if self.status == 'DONE':
+            return 100.0
+        return 100 * self.offset / self.file_size if self.file_size else 0.0
+
+    def __str__(self):
+        return f"{self.original_name} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "Importação de Telemetria"
+        verbose_name_plural = "Importações de Telemetria"
+        ordering = ['-created_at']
@@ -0,0 +1,100 @@
+# iot_project/devices/polling.py
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
+import os
+import random
+
+from .models import ScheduledTask
+
+
+# ==============================================================================
+# INTERVALO ADAPTATIVO DE CONSULTA (next_poll_in)
+# ==============================================================================
+def compute_next_poll_in(device, now=None, task_due_soon=None):
+    """
+    Calcula em quantos segundos o ESP deve consultar comandos novamente.
+
+    - Curto quando há uma ScheduledTask prestes a disparar para o dispositivo;
+    - Longo durante a madrugada ou quando o servidor está sob carga;
+    - Com jitter aleatório para que os dispositivos não consultem todos juntos.
+
+    task_due_soon: resultado já obtido na mesma query do heartbeat (caminho rápido do GET);
+    se None, é consultado aqui.
+    """
+    config = settings.DEVICE_POLL
+    now = now or timezone.now()
+    local_now = timezone.localtime(now)
+
+    # 1. Intervalo base: padrão de dia, mais longo de madrugada
+    if _is_night(local_now.hour, config['NIGHT_START_HOUR'], config['NIGHT_END_HOUR']):
+        interval = config['NIGHT_SECONDS']
+    else:
+        interval = config['DEFAULT_SECONDS']
+
+    # 2. Servidor sob carga: alonga proporcionalmente (até LOAD_MAX_FACTOR vezes)
+    load = _server_load()
+    if load > config['LOAD_THRESHOLD']:
+        interval *= min(load / config['LOAD_THRESHOLD'], config['LOAD_MAX_FACTOR'])
+
+    # 3. Tarefa agendada prestes a disparar: consulta com frequência para não atrasar o comando
+    if task_due_soon is None:
+        task_due_soon = due_soon_tasks(now, config['DUE_SOON_WINDOW_SECONDS']).filter(devices=device).exists()
+    if task_due_soon:
+        interval = min(interval, config['DUE_SOON_SECONDS'])
+
+    # 4. Jitter (+/- JITTER) para espalhar a carga da frota
+    jitter = config['JITTER']
+    interval *= random.uniform(1 - jitter, 1 + jitter)
+
+    return int(round(max(config['MIN_SECONDS'], min(interval, config['MAX_SECONDS']))))
+
+
+def _is_night(hour, start_hour, end_hour):
+    """Verifica se a hora local está na janela noturna (que pode atravessar a meia-noite)."""
+    if start_hour <= end_hour:
+        return start_hour <= hour < end_hour
+    return hour >= start_hour or hour < end_hour
+
+
+def _server_load():
+    """Carga média do último minuto normalizada pelo número de CPUs (1.0 = CPUs ocupadas)."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        # os.getloadavg não existe em todas as plataformas (ex: Windows)
+        return 0.0
+
+
+def due_soon_tasks(now, window_seconds):
+    """
+    ScheduledTasks PENDENTES que disparam dentro da janela (recorrentes: no dia da semana
+    local de hoje e ainda não executadas hoje). Inclui o último minuto, pois o agendador
+    (Celery Beat) roda a cada 60 segundos. Filtro inteiro no banco: também é usado como
+    subconsulta EXISTS no UPDATE ... RETURNING da consulta do ESP (devices/views.py).
+    """
+    local_now = timezone.localtime(now)
+    window_start = now - timedelta(seconds=60)
+    window_end = now + timedelta(seconds=window_seconds)
+
+    # Janela equivalente em horário local para as tarefas recorrentes (TimeField)
+    start_time = timezone.localtime(window_start).time()
+    end_time = timezone.localtime(window_end).time()
+    if start_time <= end_time:
+        recurrent_window = Q(recurrent_time__gte=start_time, recurrent_time__lte=end_time)
+    else:
+        # A janela atravessa a meia-noite
+        recurrent_window = Q(recurrent_time__gte=start_time) | Q(recurrent_time__lte=end_time)
+
+    return ScheduledTask.objects.filter(
+        status='PENDING',
+    ).filter(
+        Q(is_recurrent=False, execution_time__gte=window_start, execution_time__lte=window_end) |
+        # Dias de um dígito (1=Segunda ... 7=Domingo) separados por vírgula
+        (Q(is_recurrent=True, recurrent_days__contains=str(local_now.weekday() + 1)) & recurrent_window)
+    ).exclude(
+        # Recorrentes que já rodaram hoje não disparam de novo
+        is_recurrent=True, last_run_at__date=local_now.date()
+    )
@@ -0,0 +1,237 @@
+# iot_project/devices/presence.py
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+import logging
+
+from .models import Device, DeviceAvailability, DevicePresence, PresenceTransition
+from core_system import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# MÁQUINA DE ESTADOS DE PRESENÇA (AVALIADA A CADA MINUTO PELO CELERY BEAT)
+# ==============================================================================
+#   ONLINE   -> OFFLINE : sem heartbeat há OFFLINE_AFTER_SECONDS (a transição fica no
+#                         instante do último heartbeat)
+#   OFFLINE  -> ONLINE  : heartbeats recentes (FRESH_SECONDS) por ONLINE_HOLD_SECONDS;
+#                         um retorno mais curto não gera transição (histerese)
+#   qualquer -> INSTÁVEL: a transição levaria a penalidade acima de FLAP_SUPPRESS
+#   INSTÁVEL -> ONLINE/OFFLINE: penalidade abaixo de FLAP_REUSE (conforme o último heartbeat)
+#
+# As requisições dos ESPs só atualizam o last_seen: um Wi-Fi ruim não gera mais uma
+# escrita no is_active a cada queda e retorno. Em cada execução, as transições vão
+# para PresenceTransition em um único INSERT em lote e o is_active em um UPDATE por
+# estado. Só são lidos os dispositivos que podem mudar de estado.
+#
+# A disponibilidade diária (DeviceAvailability) recebe a duração de cada estado
+# encerrado, dividida nos dias (horário local) que ele atravessa; na primeira execução
+# após a meia-noite, o trecho do dia anterior dos estados ainda em aberto também é
+# somado. O trecho em aberto do dia atual entra apenas na consulta (open_seconds).
+
+STATE_FIELDS = DeviceAvailability.STATE_FIELDS
+PRESENCE_FIELDS = ['state', 'since', 'recovering_since', 'penalty', 'penalty_at', 'accounted_at']
+BATCH_SIZE = 1000
+
+
+def evaluate_presence(now=None):
+    """Aplica as transições pendentes. Retorna quantas transições foram registradas."""
+    now = now or timezone.now()
+    config = settings.PRESENCE
+    offline_threshold = now - timedelta(seconds=config['OFFLINE_AFTER_SECONDS'])
+    fresh_threshold = now - timedelta(seconds=config['FRESH_SECONDS'])
+    hold = timedelta(seconds=config['ONLINE_HOLD_SECONDS'])
+
+    _create_missing(now)
+    _close_previous_days(now)
+
+    with transaction.atomic():
+        # Com várias instâncias (Redis fora do ar, sem claim_tick), cada linha é avaliada por uma só
+        candidates = DevicePresence.objects.select_related('device').only(
+            *PRESENCE_FIELDS, 'device__last_seen'
+        ).select_for_update(skip_locked=True, of=('self',)).filter(
+            Q(state='ONLINE', device__last_seen__lt=offline_threshold)
+            | Q(state='OFFLINE', device__last_seen__gte=fresh_threshold)
+            | Q(recovering_since__isnull=False)
+            | Q(state='FLAPPING')
+        )
+
+        changed, transitions, deltas = [], [], {}
+        for presence in candidates:
+            last_seen = presence.device.last_seen
+            fresh = last_seen >= fresh_threshold
+            penalty = decayed_penalty(presence, now)
+
+            if presence.state == 'ONLINE':
+                target, at = 'OFFLINE', max(last_seen, presence.since)
+            elif presence.state == 'OFFLINE':
+                if not fresh:
+                    # Voltou e caiu de novo antes de ONLINE_HOLD_SECONDS: nenhuma transição
+                    presence.recovering_since = None
+                    changed.append(presence)
+                    continue
+                if presence.recovering_since is None:
+                    presence.recovering_since = now
+                    changed.append(presence)
+                    continue
+                if now - presence.recovering_since < hold:
+                    continue
+                target, at = 'ONLINE', presence.recovering_since
+            else:
+                if penalty >= config['FLAP_REUSE']:
+                    continue
+                target, at = ('ONLINE' if fresh else 'OFFLINE'), now
+
+            if presence.state != 'FLAPPING':
+                penalty += config['FLAP_PENALTY']
+                if penalty >= config['FLAP_SUPPRESS']:
+                    target = 'FLAPPING'
+            transitions.append(_transition(presence, target, at, now, penalty, deltas))
+            changed.append(presence)
+
+        PresenceTransition.objects.bulk_create(transitions, batch_size=BATCH_SIZE)
+        DevicePresence.objects.bulk_update(changed, PRESENCE_FIELDS, batch_size=BATCH_SIZE)
+        # Device.is_active: cópia do estado (True apenas em ONLINE), um UPDATE por valor
+        online = [transition.device_id for transition in transitions if transition.to_state == 'ONLINE']
+        offline = [transition.device_id for transition in transitions if transition.to_state != 'ONLINE']
+        if online:
+            Device.objects.filter(pk__in=online).update(is_active=True)
+        if offline:
+            Device.objects.filter(pk__in=offline).update(is_active=False)
+        _save_availability(deltas)
+
+    with metrics.record() as pipe:
+        for transition in transitions:
+            metrics.PRESENCE_TRANSITIONS.inc(pipe, to_state=transition.to_state)
+        counts = dict(DevicePresence.objects.values_list('state').annotate(count=Count('pk')).order_by())
+        for state in STATE_FIELDS:
+            metrics.DEVICE_PRESENCE.set(pipe, counts.get(state, 0), state=state)
+
+    if transitions:
+        logger.info(
+            f"Presença: {len(transitions)} transições "
+            f"({len(online)} online, {len(offline)} offline/instáveis)."
+        )
+    return len(transitions)
+
+
+def decayed_penalty(presence, now):
+    """Penalidade de amortecimento no instante now (meia-vida FLAP_HALF_LIFE_SECONDS)."""
+    elapsed = max(0.0, (now - presence.penalty_at).total_seconds())
+    return presence.penalty * 0.5 ** (elapsed / settings.PRESENCE['FLAP_HALF_LIFE_SECONDS'])
+
+
+def _transition(presence, target, at, now, penalty, deltas):
+    _credit(deltas, presence, at)
+    transition = PresenceTransition(
+        device_id=presence.device_id,
+        from_state=presence.state,
+        to_state=target,
+        at=at,
+        previous_seconds=max(0.0, (at - presence.since).total_seconds()),
+        recorded_at=now,
+    )
+    presence.state = target
+    presence.since = at
+    presence.recovering_since = None
+    presence.penalty = penalty
+    presence.penalty_at = now
+    return transition
+
+
+def _create_missing(now):
+    # Dispositivos novos (ou anteriores à máquina de estados): começam pelo is_active atual
+    missing = Device.objects.filter(presence__isnull=True).values_list('pk', 'is_active')
+    DevicePresence.objects.bulk_create(
+        [
+            DevicePresence(device_id=pk, state='ONLINE' if is_active else 'OFFLINE',
+                           since=now, penalty_at=now, accounted_at=now)
+            for pk, is_active in missing
+        ],
+        batch_size=BATCH_SIZE, ignore_conflicts=True,
+    )
+
+
+# ==============================================================================
+# DISPONIBILIDADE DIÁRIA (SOMADA A CADA TRANSIÇÃO E NA VIRADA DO DIA)
+# ==============================================================================
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _credit(deltas, presence, until):
+    """Soma em deltas o trecho [accounted_at, until) do estado atual, dividido por dia."""
+    start = presence.accounted_at
+    field = STATE_FIELDS[presence.state]
+    while start < until:
+        day = timezone.localtime(start).date()
+        end = min(until, _day_start(day + timedelta(days=1)))
+        entry = deltas.setdefault((presence.device_id, day), dict.fromkeys(STATE_FIELDS.values(), 0.0))
+        entry[field] += (end - start).total_seconds()
+        start = end
+    presence.accounted_at = max(presence.accounted_at, until)
+
+
+def _close_previous_days(now):
+    # Uma vez por dia, em lotes: fecha nos dias anteriores os estados ainda em aberto
+    today_start = _day_start(timezone.localtime(now).date())
+    while True:
+        with transaction.atomic():
+            batch = list(
+                DevicePresence.objects.only('state', 'accounted_at')
+                .select_for_update(skip_locked=True)
+                .filter(accounted_at__lt=today_start)[:BATCH_SIZE]
+            )
+            if not batch:
+                return
+            deltas = {}
+            for presence in batch:
+                _credit(deltas, presence, today_start)
+            DevicePresence.objects.bulk_update(batch, ['accounted_at'])
+            _save_availability(deltas)
+
+
+def _save_availability(deltas):
+    keys = list(deltas)
+    for start in range(0, len(keys), BATCH_SIZE):
+        chunk = keys[start:start + BATCH_SIZE]
+        existing = {
+            (row.device_id, row.date): row
+            for row in DeviceAvailability.objects.filter(
+                device_id__in={device_id for device_id, _ in chunk},
+                date__in={day for _, day in chunk},
+            )
+        }
+        created, updated = [], []
+        for key in chunk:
+            row = existing.get(key)
+            if row is None:
+                created.append(DeviceAvailability(device_id=key[0], date=key[1], **deltas[key]))
+                continue
+            for field, seconds in deltas[key].items():
+                setattr(row, field, getattr(row, field) + seconds)
+            updated.append(row)
+        DeviceAvailability.objects.bulk_create(created)
+        DeviceAvailability.objects.bulk_update(updated, list(STATE_FIELDS.values()))
+
+
+def open_seconds(presence, day, now=None):
+    """(estado, segundos) do trecho em aberto do estado atual que cai no dia informado."""
+    now = now or timezone.now()
+    start = max(presence.accounted_at, _day_start(day))
+    end = min(now, _day_start(day + timedelta(days=1)))
+    return presence.state, max(0.0, (end - start).total_seconds())
+
+
+def availability_percent(row, presence=None, now=None):
+    """Percentual do dia em ONLINE, incluindo o trecho em aberto se a presença for informada."""
+    seconds = {field: getattr(row, field) for field in STATE_FIELDS.values()}
+    if presence is not None:
+        state, extra = open_seconds(presence, row.date, now)
+        seconds[STATE_FIELDS[state]] += extra
+    total = sum(seconds.values())
+    return 100 * seconds['online_seconds'] / total if total else None
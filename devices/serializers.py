@@ -1,18 +1,31 @@
 # iot_project/devices/serializers.py
 
 from rest_framework import serializers
-from .models import Device, TelemetryData
+from .models import Device, TelemetryData, TaskRun
+from .anomalies import flag_readings
+from .commands import open_command
+from .dashboard import bump_state_version
+from .ingest import process_readings
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
+from datetime import datetime, timedelta, timezone as dt_timezone
 import json 
 
 # Serializer para o modelo Device
 class DeviceSerializer(serializers.ModelSerializer):
+    # Execução (TaskRun) que originou o comando, enviada pelo Celery junto com o pending_command
+    command_run = serializers.PrimaryKeyRelatedField(
+        queryset=TaskRun.objects.select_related('task'), write_only=True, required=False, allow_null=True
+    )
+
     class Meta:
         model = Device
         # Incluímos todos os campos principais que o ESP8266/Celery irá interagir
         fields = [
             'device_id', 'name', 'device_type', 'location', 'ip_address', 
-            'is_active', 'pending_command', 'last_command', 'last_seen'
+            'is_active', 'pending_command', 'last_command', 'last_seen',
+            'command_run'
         ]
         read_only_fields = ['last_seen'] # last_seen será preenchido pelo Django/API
 
@@ -28,6 +41,27 @@ class DeviceSerializer(serializers.ModelSerializer):
             'last_command': {'required': False},
         }
 
+    def validate_command_run(self, run):
+        # Uma execução só pode gerar comandos nos dispositivos do site da tarefa
+        # (tarefa sem site = todos os sites)
+        if run is not None and run.task.site_id and run.task.site_id != self.instance.site_id:
+            raise serializers.ValidationError("Execução de uma tarefa de outro site.")
+        return run
+
+    def update(self, instance, validated_data):
+        # Novo comando pendente: registra quando foi gravado e zera a entrega anterior
+        if validated_data.get('pending_command'):
+            validated_data['command_issued_at'] = timezone.now()
+            validated_data['command_delivered_at'] = None
+            validated_data.setdefault('command_run', None)
+            validated_data['command_delivery'] = open_command(
+                instance, validated_data['pending_command'],
+                source='task' if validated_data['command_run'] else 'api',
+                run=validated_data['command_run'],
+                created_at=validated_data['command_issued_at'],
+            )
+        return super().update(instance, validated_data)
+
 # Serializer para o modelo TelemetryData
 class TelemetryDataSerializer(serializers.ModelSerializer):
     # Campos do Device para serem enviados junto com a Telemetria (POST)
@@ -54,28 +88,127 @@ class TelemetryDataSerializer(serializers.ModelSerializer):
         device_type = validated_data.pop('device_type', None)
         device_location = validated_data.pop('location', None)
         
-        telemetry_record = TelemetryData.objects.create(device=device_instance, **validated_data)
-        
-        update_fields = ['last_seen', 'ip_address']
+        telemetry_record = TelemetryData(device=device_instance, site_id=device_instance.site_id, **validated_data)
+        # Marca leituras suspeitas (sensor travado, fora da faixa, pico) antes de gravar
+        flag_readings(device_instance, [telemetry_record])
+        # No banco de telemetria do site do dispositivo (o principal, se o site não tiver um próprio)
+        telemetry_record.save(using=device_instance.telemetry_db)
         
-        # Verifica e atualiza apenas se o valor for enviado e for diferente do valor atual
-        if device_name is not None and device_instance.name != device_name:
-            device_instance.name = device_name
-            update_fields.append('name')
-            
-        if device_type is not None and device_instance.device_type != device_type:
-            device_instance.device_type = device_type
-            update_fields.append('device_type')
-            
-        if device_location is not None and device_instance.location != device_location:
-            device_instance.location = device_location
-            update_fields.append('location')
-
-        # Atualiza o last_seen do dispositivo e o IP
-        device_instance.last_seen = timezone.now()
-        device_instance.ip_address = self.context['request'].META.get('REMOTE_ADDR') 
- 
-        device_instance.save(update_fields=update_fields)
+        update_device_checkin(
+            device_instance, self.context['request'],
+            device_name, device_type, device_location
+        )
+
+        # Cartão do dispositivo no dashboard renderizado de novo com a nova leitura
+        bump_state_version(device_instance)
+
+        # Automações e regras de alerta avaliadas com a nova leitura (estado no Redis)
+        process_readings(device_instance, [telemetry_record])
 
         return telemetry_record
+
+
+def update_device_checkin(device_instance, request, device_name=None, device_type=None, device_location=None):
+    """
+    Atualiza o last_seen/IP do Device e, se enviados e diferentes, os dados cadastrais
+    (nome, tipo e localização). Compartilhado pelo POST simples e pelo POST em lote.
+    """
+    update_fields = ['last_seen', 'ip_address']
     
+    # Verifica e atualiza apenas se o valor for enviado e for diferente do valor atual
+    if device_name is not None and device_instance.name != device_name:
+        device_instance.name = device_name
+        update_fields.append('name')
+        
+    if device_type is not None and device_instance.device_type != device_type:
+        device_instance.device_type = device_type
+        update_fields.append('device_type')
+        
+    if device_location is not None and device_instance.location != device_location:
+        device_instance.location = device_location
+        update_fields.append('location')
+
+    # Atualiza o last_seen do dispositivo e o IP
+    device_instance.last_seen = timezone.now()
+    device_instance.ip_address = request.META.get('REMOTE_ADDR') 
+
+    device_instance.save(update_fields=update_fields)
+
+
+# ==============================================================================
+# TELEMETRIA EM LOTE (STORE-AND-FORWARD DO ESP)
+# ==============================================================================
+# Serializer de uma leitura individual dentro do lote
+class TelemetryReadingSerializer(serializers.ModelSerializer):
+    # O ESP informa quando a leitura foi feita de uma das formas abaixo:
+    #   ts     -> epoch (segundos, UTC) quando o relógio via NTP já está sincronizado
+    #   age_ms -> "idade" da leitura em milissegundos no momento do envio
+    # Sem nenhum dos dois, vale o horário de recebimento.
+    ts = serializers.IntegerField(write_only=True, required=False, min_value=0, max_value=2**32)
+    age_ms = serializers.IntegerField(write_only=True, required=False, min_value=0)
+
+    class Meta:
+        model = TelemetryData
+        fields = [
+            'temperature_celsius', 'humidity_percent',
+            'relay_state_D1', 'last_button_action', 'raw_data',
+            'ts', 'age_ms',
+        ]
+
+    def validate(self, attrs):
+        received_at = self.context['received_at']
+        ts = attrs.pop('ts', None)
+        age_ms = attrs.pop('age_ms', None)
+
+        if ts is not None:
+            timestamp = datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+        elif age_ms is not None:
+            timestamp = received_at - timedelta(milliseconds=age_ms)
+        else:
+            timestamp = received_at
+
+        # Relógio do ESP adiantado: nunca grava leituras "no futuro"
+        attrs['timestamp'] = min(timestamp, received_at)
+        return attrs
+
+
+# Serializer do lote completo (POST /api/telemetry/batch/)
+class TelemetryBatchSerializer(serializers.Serializer):
+    # Dados cadastrais do Device, enviados uma única vez por lote
+    name = serializers.CharField(required=False)
+    device_type = serializers.CharField(required=False)
+    location = serializers.CharField(required=False)
+    # Lote vazio ou acima de TELEMETRY_BATCH_MAX_SIZE: recusado antes de validar cada leitura
+    readings = TelemetryReadingSerializer(many=True, allow_empty=False, max_length=settings.TELEMETRY_BATCH_MAX_SIZE)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Horário de referência único para todas as leituras do lote
+        self.context.setdefault('received_at', timezone.now())
+
+    def create(self, validated_data):
+        request = self.context['request']
+        device_instance = request.user
+
+        records = [
+            TelemetryData(device=device_instance, site_id=device_instance.site_id, **reading)
+            for reading in validated_data['readings']
+        ]
+        flag_readings(device_instance, records)
+
+        # Todas as leituras e o check-in do Device em uma única transação (com a telemetria
+        # em um banco de site, o check-in no principal é um UPDATE isolado logo após o INSERT)
+        telemetry_db = device_instance.telemetry_db
+        with transaction.atomic(using=telemetry_db):
+            TelemetryData.objects.using(telemetry_db).bulk_create(records)
+            update_device_checkin(
+                device_instance, request,
+                validated_data.get('name'),
+                validated_data.get('device_type'),
+                validated_data.get('location'),
+            )
+
+        bump_state_version(device_instance)
+        process_readings(device_instance, records)
+
+        return records
@@ -0,0 +1,61 @@
+# iot_project/devices/sites.py
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from .models import Device, TelemetryData
+from core_system.db_router import site_aliases
+
+
+# ==============================================================================
+# ESCOPO POR SITE (QUEM ENXERGA O QUÊ)
+# ==============================================================================
+# Usuários associados a um ou mais sites (Site.users) só enxergam os dispositivos,
+# tarefas, execuções, alertas e telemetria desses sites no Admin e no dashboard.
+# Apenas superusuários (e o token mestre do Celery) enxergam todos os sites; um
+# usuário sem site associado, ou anônimo, não enxerga nenhum. O token de um
+# dispositivo (core_system/authentication.py) fica restrito ao site do dispositivo.
+
+def user_site_ids(user):
+    """Ids dos sites visíveis para o usuário, ou None se ele enxerga todos (superusuários)."""
+    if isinstance(user, Device):
+        return {user.site_id} if user.site_id else set()
+    if user is None or not user.is_authenticated:
+        return set()
+    if getattr(user, 'is_superuser', False):
+        return None
+    if not hasattr(user, '_site_ids'):
+        # Calculado uma vez por requisição (o request.user é o mesmo objeto)
+        user._site_ids = set(user.sites.values_list('pk', flat=True)) if hasattr(user, 'sites') else set()
+    return user._site_ids
+
+
+def scope_queryset(queryset, user, lookup='site'):
+    """Filtra o queryset pelos sites do usuário; lookup é o caminho até o site (ex: 'task__site')."""
+    site_ids = user_site_ids(user)
+    if site_ids is None:
+        return queryset
+    return queryset.filter(**{f'{lookup}__in': site_ids})
+
+
+# ==============================================================================
+# TELEMETRIA NOS BANCOS DE SITE
+# ==============================================================================
+def telemetry_objects(using=DEFAULT_DB_ALIAS):
+    """
+    Queryset de TelemetryData no banco informado (ex: device.telemetry_db).
+    No 'default' o banco fica a cargo do roteador, que pode enviar a leitura a uma réplica.
+    """
+    if using == DEFAULT_DB_ALIAS:
+        return TelemetryData.objects.all()
+    return TelemetryData.objects.using(using)
+
+
+@receiver(pre_delete, sender=Device)
+def detach_site_telemetry(sender, instance, **kwargs):
+    # O SET_NULL do Django só alcança a telemetria do 'default'; nos bancos de site é feito aqui.
+    # Sem FOREIGN KEY (TelemetryData.device usa db_constraint=False), esta é a única proteção
+    # contra leituras órfãs nesses bancos
+    for alias in site_aliases():
+        TelemetryData.objects.using(alias).filter(device_id=instance.pk).update(device=None)
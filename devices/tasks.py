@@ -1,11 +1,20 @@
 # iot_project/devices/tasks.py
 
-from celery import shared_task
+from celery import chord, shared_task, current_app
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Mod
 from django.utils import timezone
-from datetime import timedelta
-from .models import Device, ScheduledTask
+from datetime import datetime, timedelta
+from . import fleet, importers, presence
+from .models import Alert, Device, ScheduledTask, Site, TaskRun, TaskRunChunk, TaskRunDevice
+from core_system import metrics
+from core_system.redis_client import get_redis
+import redis
 import requests
 import json
+import time
 from decouple import config
 import logging
 
@@ -18,82 +27,203 @@ BASE_API_URL = "http://web:8000/api/devices"
 
 CELERY_AUTH_TOKEN = config('CELERY_API_TOKEN', default='CELERY_TOKEN_MISSING')
 
+# Intervalo entre os pulsos de um lote em envio (bem abaixo de SCHEDULER_CHUNK_STALL_SECONDS)
+CHUNK_HEARTBEAT_SECONDS = 30
+# Resultados (TaskRunDevice) acumulados antes de cada INSERT em lote; também gravados a cada pulso
+CHUNK_RESULTS_FLUSH_SIZE = 50
+
 
 # ==============================================================================
 # TAREFA PRINCIPAL: PROCESSA E ENVIA O COMANDO PARA O DISPOSITIVO
 # ==============================================================================
+# O envio é dividido em lotes de SCHEDULER_DISPATCH_CHUNK dispositivos (TaskRunChunk),
+# cada um em uma subtarefa do Celery (chord): os lotes rodam em paralelo em todos os
+# workers da fila 'commands' e finalize_task_run fecha a execução quando o último
+# termina. Se um worker cair no meio, só os lotes não concluídos são reenviados
+# (resume_stalled_chunks, chamada pelo Celery Beat).
+
 @shared_task
-def process_scheduled_task(task_id):
+def process_scheduled_task(task_id, run_id=None, device_ids=None):
     """
-    Busca o ScheduledTask pelo ID, envia o comando via API para todos os devices associados
-    e atualiza o status/histórico (last_run_at).
+    Busca o ScheduledTask pelo ID, divide os devices associados em lotes e enfileira
+    o envio do comando (dispatch_chunk) para cada lote; o status/histórico (last_run_at,
+    TaskRun e TaskRunDevice da execução) é atualizado por finalize_task_run.
+    Se device_ids for informado (reenvio), envia apenas para esses dispositivos.
     """
+    started_at = timezone.now()
+
     try:
         task = ScheduledTask.objects.get(pk=task_id)
     except ScheduledTask.DoesNotExist:
         logger.error(f"Tarefa agendada com ID {task_id} não encontrada.")
         return
 
-    # Só processa se a tarefa estiver PENDENTE.
-    if task.status != 'PENDING' and task.is_recurrent == False:
-        logger.warning(f"Tarefa {task.pk} ('{task.name}') não está PENDENTE. Pulando execução.")
+    # Execução sem TaskRun (chamada manual): registra a partir de agora
+    run = TaskRun.objects.filter(pk=run_id).first() if run_id else None
+    if run is None:
+        run = TaskRun.objects.create(task=task, scheduled_for=started_at, enqueued_at=started_at)
+
+    with transaction.atomic():
+        # Reivindica a execução antes de criar os lotes: uma mensagem entregue de novo (ou
+        # enfileirada em dobro) não encontra mais a execução em QUEUED e não recria os lotes
+        claimed = TaskRun.objects.filter(pk=run.pk, status='QUEUED').update(status='RUNNING', started_at=started_at)
+        if not claimed:
+            logger.warning(f"Execução {run.pk} da tarefa {task.pk} já processada por outro worker. Ignorando.")
+            return
+
+        # Só processa se a tarefa estiver PENDENTE (o reenvio dos que falharam é sempre permitido).
+        if task.status != 'PENDING' and task.is_recurrent == False and device_ids is None:
+            logger.warning(f"Tarefa {task.pk} ('{task.name}') não está PENDENTE. Pulando execução.")
+            TaskRun.objects.filter(pk=run.pk).update(status='SKIPPED', finished_at=timezone.now())
+            return
+
+        # Reenvio: apenas os dispositivos que falharam na execução original
+        devices = task.devices.all()
+        if task.site_id:
+            # Dispositivo transferido para outro site depois de a tarefa ser criada não recebe mais o comando
+            devices = devices.filter(site_id=task.site_id)
+        if device_ids is not None:
+            devices = devices.filter(pk__in=device_ids)
+        device_pks = list(devices.order_by('pk').values_list('pk', flat=True))
+
+        # Lotes e totais no mesmo commit da reivindicação: se o worker cair antes, a execução
+        # continua em QUEUED e a mensagem entregue de novo a processa do início
+        chunk_size = max(1, settings.SCHEDULER_DISPATCH_CHUNK)
+        chunks = TaskRunChunk.objects.bulk_create([
+            TaskRunChunk(run=run, index=index, device_ids=device_pks[start:start + chunk_size], updated_at=started_at)
+            for index, start in enumerate(range(0, len(device_pks), chunk_size))
+        ])
+        TaskRun.objects.filter(pk=run.pk).update(devices_total=len(device_pks), chunks_total=len(chunks))
+
+    with metrics.record() as pipe:
+        metrics.SCHEDULER_QUEUE_WAIT.observe(pipe, max(0.0, (started_at - run.enqueued_at).total_seconds()))
+
+    logger.info(
+        f"Execução {run.pk} da tarefa {task.pk}: {len(device_pks)} dispositivos em {len(chunks)} lotes, "
+        f"espera na fila {(started_at - run.enqueued_at).total_seconds():.1f}s."
+    )
+
+    if not chunks:
+        # Nenhum dispositivo: fecha a execução sem passar pelo Celery
+        return finalize_task_run(run.pk)
+    enqueue_chunks(run.pk, [chunk.pk for chunk in chunks])
+
+
+def enqueue_chunks(run_id, chunk_ids):
+    """Enfileira os lotes em paralelo (group) com finalize_task_run ao final (chord)."""
+    chord(dispatch_chunk.si(chunk_id) for chunk_id in chunk_ids)(finalize_task_run.si(run_id))
+
+
+@shared_task
+def dispatch_chunk(chunk_id):
+    """
+    Envia o comando aos dispositivos de um lote e grava os seus TaskRunDevice.
+    Idempotente: um lote já concluído (ou em execução com pulso recente) é ignorado,
+    e dispositivos que já têm resultado nesta execução não recebem o comando de novo.
+    """
+    now = timezone.now()
+    stalled_before = now - timedelta(seconds=settings.SCHEDULER_CHUNK_STALL_SECONDS)
+    # Reivindica o lote: a mesma mensagem entregue duas vezes não envia o comando em dobro
+    claimed = TaskRunChunk.objects.filter(pk=chunk_id).filter(
+        Q(status='PENDING') | Q(status='RUNNING', updated_at__lt=stalled_before)
+    ).update(status='RUNNING', attempts=F('attempts') + 1, updated_at=now)
+    if not claimed:
+        logger.info(f"Lote {chunk_id} já concluído ou em execução em outro worker.")
         return
 
+    chunk = TaskRunChunk.objects.select_related('run__task').get(pk=chunk_id)
+    run, task = chunk.run, chunk.run.task
+
     # 1. Prepara o comando (Dict do JSONField) e o converte para STRING para o CharField.
     command_data = task.command_json
     # O Celery envia a string JSON para o campo CharField 'pending_command' do Device
     command_data_json_string = json.dumps(command_data) 
     
     # 2. Payload final: Dicionário Python que será serializado pelo requests
-    payload_to_send = {'pending_command': command_data_json_string}
-    
-    all_success = True
+    # 'command_run' vincula o comando a esta execução para medir a entrega ao ESP
+    payload_to_send = {'pending_command': command_data_json_string, 'command_run': run.pk}
+
+    # Retomada de um lote interrompido: pula os dispositivos que já têm resultado
+    already_sent = TaskRunDevice.objects.filter(run_id=run.pk, device_id__in=chunk.device_ids).values_list('device_id', flat=True)
+    devices = list(Device.objects.filter(pk__in=chunk.device_ids).exclude(pk__in=list(already_sent)).order_by('pk'))
+
+    # Resultados (TaskRunDevice) gravados em lote a cada CHUNK_RESULTS_FLUSH_SIZE dispositivos
+    # e a cada pulso: se o worker cair no meio do lote, a retomada (already_sent) só reenvia
+    # o comando aos dispositivos do último bloco ainda não gravado
+    pending = []
+    sent_count = failed_count = 0
+    last_beat = time.monotonic()
     
-    # Itera sobre todos os dispositivos associados à tarefa
-    for device in task.devices.all():
-        try:
-            # Tenta enviar o comando para o dispositivo (PATCH no registro do Device)
-            device_api_url = f"{BASE_API_URL}/{device.device_id}/"
-            
-            # Cabeçalhos: Autenticação + Content-Type explícito
-            headers = {
-                'Authorization': f'Token {CELERY_AUTH_TOKEN}',
-                'Content-Type': 'application/json' 
-            }
+    # Itera sobre os dispositivos do lote
+    with metrics.record() as pipe:
+        for device in devices:
+            result = dispatch_command(task, device, payload_to_send)
+            result.run_id = run.pk
+            pending.append(result)
+            sent_count += 1
+            failed_count += result.outcome == 'FAILED'
+            metrics.SCHEDULER_DEVICE_DISPATCH.observe(
+                pipe, result.duration_ms / 1000, outcome='ok' if result.outcome == 'SUCCESS' else 'failed'
+            )
+            # Pulso: mantém o lote fora da varredura de lotes abandonados
+            beat = time.monotonic() - last_beat > CHUNK_HEARTBEAT_SECONDS
+            if beat or len(pending) >= CHUNK_RESULTS_FLUSH_SIZE:
+                _save_chunk_results(pending)
+                pending = []
+            if beat:
+                TaskRunChunk.objects.filter(pk=chunk.pk).update(updated_at=timezone.now())
+                last_beat = time.monotonic()
+
+    # Conclusão do lote: só quem muda RUNNING -> DONE conta o lote na execução (um lote
+    # reivindicado por dois workers não é contado duas vezes)
+    with transaction.atomic():
+        _save_chunk_results(pending)
+        done = TaskRunChunk.objects.filter(pk=chunk.pk, status='RUNNING').update(status='DONE', updated_at=timezone.now())
+        if done:
+            TaskRun.objects.filter(pk=run.pk).update(chunks_done=F('chunks_done') + 1)
+
+    logger.info(f"Execução {run.pk}, lote {chunk.index}: {sent_count} dispositivos ({failed_count} falhas).")
+
+
+def _save_chunk_results(results):
+    # ignore_conflicts: um lote reivindicado de novo enquanto o worker anterior ainda
+    # envia pode ter gravado os mesmos dispositivos (unique_taskrun_device)
+    if results:
+        TaskRunDevice.objects.bulk_create(results, ignore_conflicts=True)
 
-            try:
-                # 3. Faz a requisição PATCH usando data=json.dumps(payload)
-                response = requests.patch(
-                    device_api_url, 
-                    data=json.dumps(payload_to_send), # Enviando o JSON serializado
-                    headers=headers, 
-                    timeout=10
-                ) 
-            
-                # 4. Verifica o status da resposta
-                if response.status_code == 200:
-                    logger.info(f"Comando '{task.name}' enviado para {device.device_id}. Status: OK.")
-                else:
-                    # Loga o status e a resposta inteira para debug (mesmo que seja HTML)
-                    logger.error(f"Falha ao enviar comando para {device.device_id}. Status: {response.status_code}. Resposta: {response.text}") 
-                    # Mude o status da tarefa para 'FALHOU'
-                    task.status = 'FAILED'
-                    task.save()
-                    all_success = False
-            
-            except requests.RequestException as e:
-                logger.error(f"Erro de rede ao enviar comando para {device.device_id}: {e}")
-                # Mude o status da tarefa para 'FALHOU' se houver erro de rede
-                task.status = 'FAILED'
-                task.save()
-                all_success = False 
-        
-        except Exception as e:
-            logger.error(f"Erro inesperado ao processar a tarefa {task.pk} para o dispositivo {device.device_id}: {e}")
-            all_success = False
 
-    # 5. Atualiza o status e o histórico da tarefa
-    if all_success:
+@shared_task
+def finalize_task_run(run_id):
+    """
+    Fecha a execução quando todos os lotes terminaram: status do TaskRun, status e
+    last_run_at da tarefa e métricas. Chamada pelo chord (possivelmente mais de uma
+    vez, após uma retomada); só a primeira chamada com os lotes completos tem efeito.
+    """
+    run = TaskRun.objects.select_related('task').filter(pk=run_id).first()
+    if run is None or run.status != 'RUNNING' or run.chunks_done < run.chunks_total:
+        return
+
+    task = run.task
+    failed_count = run.device_results.filter(outcome='FAILED').count()
+    finished_at = timezone.now()
+    if failed_count == 0:
+        run_status = 'SUCCESS'
+    elif failed_count < run.devices_total:
+        run_status = 'PARTIAL'
+    else:
+        run_status = 'FAILED'
+
+    # 5. Fecha o registro da execução (TaskRun); a condição impede fechar duas vezes
+    closed = TaskRun.objects.filter(pk=run.pk, status='RUNNING').update(
+        status=run_status,
+        finished_at=finished_at,
+        devices_failed=failed_count,
+    )
+    if not closed:
+        return
+
+    # 6. Atualiza o status e o histórico da tarefa
+    if failed_count == 0:
         # Tarefas únicas: marca como executada. Tarefas recorrentes: mantêm PENDING.
         if not task.is_recurrent:
             task.status = 'EXECUTED'
@@ -105,6 +235,7 @@ def process_scheduled_task(task_id):
         
     else:
         # Falha: se única, marca como FAILED. Se recorrente, atualiza last_run_at para evitar re-execução hoje.
+        # Os dispositivos com falha ficam em TaskRunDevice e podem ser reenviados pelo Admin.
         if not task.is_recurrent:
             task.status = 'FAILED'
             task.save(update_fields=['status'])
@@ -114,34 +245,193 @@ def process_scheduled_task(task_id):
             task.save(update_fields=['last_run_at'])
             logger.error(f"Tarefa recorrente {task.pk} ('{task.name}') falhou, mas o last_run_at foi atualizado para evitar re-execução hoje.")
 
+    with metrics.record() as pipe:
+        metrics.SCHEDULER_RUNS.inc(pipe, status=run_status)
+        metrics.SCHEDULER_RUN_DURATION.observe(pipe, (finished_at - run.started_at).total_seconds())
+
+    logger.info(
+        f"Execução {run.pk} da tarefa {task.pk}: {run_status}. "
+        f"Atraso de enfileiramento {(run.enqueued_at - run.scheduled_for).total_seconds():.1f}s, "
+        f"espera na fila {(run.started_at - run.enqueued_at).total_seconds():.1f}s, "
+        f"envio {(finished_at - run.started_at).total_seconds():.1f}s para {run.devices_total} dispositivos "
+        f"em {run.chunks_total} lotes ({failed_count} falhas)."
+    )
+
+
+@shared_task
+def resume_stalled_chunks():
+    """
+    Reenfileira os lotes não concluídos e sem pulso há mais de SCHEDULER_CHUNK_STALL_SECONDS
+    (worker reiniciado, mensagem perdida). Chamada periodicamente pelo Celery Beat.
+    """
+    now = timezone.now()
+    if not claim_tick('resume-chunks', timezone.localtime(now)):
+        return 0
+    stalled = TaskRunChunk.objects.exclude(status='DONE').filter(
+        updated_at__lt=now - timedelta(seconds=settings.SCHEDULER_CHUNK_STALL_SECONDS)
+    )
+    chunks_by_run = {}
+    for chunk_id, run_id in stalled.values_list('pk', 'run_id'):
+        chunks_by_run.setdefault(run_id, []).append(chunk_id)
+    if not chunks_by_run:
+        return 0
+
+    # Renova o pulso dos lotes pendentes para não reenfileirá-los de novo na próxima varredura
+    all_ids = [chunk_id for chunk_ids in chunks_by_run.values() for chunk_id in chunk_ids]
+    TaskRunChunk.objects.filter(pk__in=all_ids, status='PENDING').update(updated_at=now)
+    for run_id, chunk_ids in chunks_by_run.items():
+        logger.warning(f"Execução {run_id}: retomando {len(chunk_ids)} lote(s) não concluído(s).")
+        enqueue_chunks(run_id, chunk_ids)
+    return len(all_ids)
+
+
+def dispatch_command(task, device, payload):
+    """
+    Envia o comando (PATCH no registro do Device) e devolve o resultado como um
+    TaskRunDevice ainda não salvo (sem run_id). 'task' (ScheduledTask ou AlertRule)
+    é usada apenas nos logs.
+    """
+    dispatched_at = timezone.now()
+    started = time.perf_counter()
+    result = TaskRunDevice(device=device, outcome='FAILED', dispatched_at=dispatched_at)
+
+    try:
+        # Tenta enviar o comando para o dispositivo (PATCH no registro do Device)
+        device_api_url = f"{BASE_API_URL}/{device.device_id}/"
+        
+        # Cabeçalhos: Autenticação + Content-Type explícito
+        headers = {
+            'Authorization': f'Token {CELERY_AUTH_TOKEN}',
+            'Content-Type': 'application/json' 
+        }
+
+        try:
+            # 3. Faz a requisição PATCH usando data=json.dumps(payload)
+            response = requests.patch(
+                device_api_url, 
+                data=json.dumps(payload), # Enviando o JSON serializado
+                headers=headers, 
+                timeout=10
+            ) 
+            result.status_code = response.status_code
+        
+            # 4. Verifica o status da resposta
+            if response.status_code == 200:
+                logger.info(f"Comando '{task.name}' enviado para {device.device_id}. Status: OK.")
+                result.outcome = 'SUCCESS'
+            else:
+                # Loga o status e a resposta inteira para debug (mesmo que seja HTML)
+                logger.error(f"Falha ao enviar comando para {device.device_id}. Status: {response.status_code}. Resposta: {response.text}") 
+                result.error = response.text[:1000]
+        
+        except requests.RequestException as e:
+            logger.error(f"Erro de rede ao enviar comando para {device.device_id}: {e}")
+            result.error = str(e)
+    
+    except Exception as e:
+        logger.error(f"Erro inesperado ao processar a tarefa {task.pk} para o dispositivo {device.device_id}: {e}")
+        result.error = str(e)
+
+    result.duration_ms = int((time.perf_counter() - started) * 1000)
+    return result
+
+
+def retry_failed_devices(run):
+    """
+    Cria um novo TaskRun (retry_of=run) e enfileira o reenvio apenas para os
+    dispositivos que falharam em 'run'. Retorna o novo TaskRun ou None se não houver falhas.
+    """
+    failed_ids = list(
+        run.device_results.filter(outcome='FAILED').values_list('device_id', flat=True)
+    )
+    if not failed_ids:
+        return None
+
+    now = timezone.now()
+    retry_run = TaskRun.objects.create(task_id=run.task_id, retry_of=run, scheduled_for=now, enqueued_at=now)
+    try:
+        process_scheduled_task.delay(run.task_id, retry_run.pk, failed_ids)
+    except Exception:
+        # Broker indisponível: não deixa um TaskRun órfão na fila 'QUEUED'
+        retry_run.delete()
+        raise
+    logger.info(f"Execução {run.pk}: reenvio de {len(failed_ids)} dispositivos com falha enfileirado (execução {retry_run.pk}).")
+    return retry_run
+
+
+# ==============================================================================
+# COMANDO DISPARADO POR UM ALERTA (devices/alerts.py)
+# ==============================================================================
+@shared_task
+def dispatch_alert_command(alert_id):
+    """Envia o comando da regra ao dispositivo que disparou o alerta e registra o resultado no Alert."""
+    alert = Alert.objects.select_related('rule', 'device').filter(pk=alert_id).first()
+    if alert is None or not alert.rule.command_json:
+        return
+
+    payload = {'pending_command': json.dumps(alert.rule.command_json)}
+    result = dispatch_command(alert.rule, alert.device, payload)
+    Alert.objects.filter(pk=alert.pk).update(
+        command_status=result.outcome,
+        command_sent_at=result.dispatched_at,
+        command_error=result.error,
+    )
+
 
 # ==============================================================================
 # TAREFA AGENDADORA: CHAMADA PELO CELERY BEAT A CADA MINUTO
 # ==============================================================================
+# Pode haver mais de uma instância do Celery Beat (sem ponto único de falha):
+#   - o primeiro tick de cada minuto marca uma chave no Redis (SET NX) e os ticks
+#     repetidos das outras instâncias terminam sem consultar o banco;
+#   - cada ocorrência de uma tarefa é reivindicada com um UPDATE condicional em
+#     ScheduledTask.dispatched_for antes de ser enfileirada. Essa é a garantia de
+#     que nada é enviado duas vezes, mesmo com o Redis fora do ar ou ticks atrasados.
+# O tick distribui o trabalho em tarefas do Celery por site e por shard
+# (SCHEDULER_SHARDS, pk % N), que rodam em paralelo nos workers.
+
 @shared_task
-def check_scheduled_tasks():
+def check_scheduled_tasks(site=None, shard=None):
     """
     Verifica no banco de dados por tarefas agendadas que estão prontas para execução.
+    Chamada pelo Beat sem argumentos: enfileira uma verificação para cada site (slug;
+    '' = tarefas sem site) e shard, e processa ela mesma as tarefas sem site do shard 0.
     """
     now = timezone.now()
     
     # 1. Obtém a HORA ATUAL LOCAL (America/Sao_Paulo) arredondada para o minuto (HH:MM:00)
     # É crucial usar a hora com o fuso horário ativo (TIME_ZONE)
     local_now = timezone.localtime(now) 
+
+    is_tick = site is None
+    if is_tick:
+        if not claim_tick('scheduled-tasks', local_now):
+            return 0
+        for slug in [''] + list(Site.objects.values_list('slug', flat=True)):
+            for index in range(settings.SCHEDULER_SHARDS):
+                if slug or index:
+                    check_scheduled_tasks.delay(site=slug, shard=index)
+        site, shard = '', 0
+
+    site_tasks = ScheduledTask.objects.filter(site__slug=site) if site else ScheduledTask.objects.filter(site__isnull=True)
+    if settings.SCHEDULER_SHARDS > 1:
+        site_tasks = site_tasks.annotate(shard=Mod('id', settings.SCHEDULER_SHARDS)).filter(shard=shard)
     current_time_str = local_now.strftime('%H:%M:00')
     
     # Obtém o dia da semana atual (0=Segunda, 6=Domingo) + 1
     current_day_of_week_str = str(local_now.weekday() + 1)
     
-    # 1. Filtra por tarefas de agendamento ÚNICO
-    unique_tasks = ScheduledTask.objects.filter(
+    # 1. Filtra por tarefas de agendamento ÚNICO (ainda não enfileiradas)
+    unique_tasks = site_tasks.filter(
         is_recurrent=False,
         status='PENDING',
         execution_time__lte=now
+    ).exclude(
+        dispatched_for=F('execution_time')
     ).distinct()
 
     # 2. Filtra por tarefas de agendamento RECORRENTE (Usando string de tempo para consulta ORM)
-    recurrent_tasks_candidates = ScheduledTask.objects.filter(
+    recurrent_tasks_candidates = site_tasks.filter(
         is_recurrent=True,
         status='PENDING',
         # Compara a hora agendada (TimeField) com a string de tempo (HH:MM:00)
@@ -149,6 +439,9 @@ def check_scheduled_tasks():
     ).exclude(
         # Exclui tarefas que já rodaram HOJE.
         last_run_at__date=local_now.date() 
+    ).exclude(
+        # ... ou que já foram enfileiradas hoje e ainda aguardam o worker
+        dispatched_for__date=local_now.date()
     )
     
     tasks_to_run = list(unique_tasks)
@@ -162,38 +455,137 @@ def check_scheduled_tasks():
         if current_day_of_week_str in recurrent_days_list:
             tasks_to_run.append(task)
 
-    logger.warning(f"[{local_now.strftime('%H:%M:%S')}] Encontradas {len(tasks_to_run)} tarefas prontas para rodar.")
+    logger.info(
+        f"[{local_now.strftime('%H:%M:%S')}] Encontradas {len(tasks_to_run)} tarefas prontas para rodar"
+        f"{f' no site {site}' if site else ''}{f' (shard {shard})' if settings.SCHEDULER_SHARDS > 1 else ''}."
+    )
 
-    # Enfileira as tarefas para o Celery Worker
+    # Enfileira as tarefas para o Celery Worker, registrando cada execução (TaskRun)
     run_count = 0
-    for task in tasks_to_run:
-        task_type = 'única' if not task.is_recurrent else 'recorrente'
-        logger.warning(f" -> Tarefa {task_type} {task.pk} ('{task.name}') enfileirada para execução.")
-        process_scheduled_task.delay(task.pk)
-        run_count += 1
+    with metrics.record() as pipe:
+        for task in tasks_to_run:
+            task_type = 'única' if not task.is_recurrent else 'recorrente'
+            scheduled_for = get_scheduled_for(task, local_now)
+
+            # Reivindica a ocorrência: se outra instância já a enfileirou, nenhuma linha é alterada
+            claimed = ScheduledTask.objects.filter(pk=task.pk).exclude(
+                dispatched_for=scheduled_for
+            ).update(dispatched_for=scheduled_for)
+            if not claimed:
+                metrics.SCHEDULER_DUPLICATES_SKIPPED.inc(pipe, kind='task')
+                logger.info(f" -> Tarefa {task_type} {task.pk} ('{task.name}') já enfileirada por outra instância.")
+                continue
+
+            enqueued_at = timezone.now()
+            run = TaskRun.objects.create(task=task, scheduled_for=scheduled_for, enqueued_at=enqueued_at)
+
+            lag_seconds = (enqueued_at - scheduled_for).total_seconds()
+            logger.info(f" -> Tarefa {task_type} {task.pk} ('{task.name}') enfileirada para execução (atraso de {lag_seconds:.1f}s).")
+            metrics.SCHEDULER_DISPATCH_LAG.observe(pipe, max(0.0, lag_seconds), kind='recurrent' if task.is_recurrent else 'unique')
+
+            try:
+                process_scheduled_task.delay(task.pk, run.pk)
+            except Exception:
+                # Broker indisponível: devolve a ocorrência para o próximo tick e não deixa TaskRun órfão
+                ScheduledTask.objects.filter(pk=task.pk).update(dispatched_for=task.dispatched_for)
+                run.delete()
+                raise
+            run_count += 1
+
+        # Profundidade da fila do broker no momento do tick (uma vez por minuto, não por site/shard)
+        if is_tick:
+            for queue_name, depth in get_queue_depths().items():
+                metrics.CELERY_QUEUE_DEPTH.set(pipe, depth, queue=queue_name)
 
     return run_count
 
 
+def claim_tick(name, local_now):
+    """
+    True para a primeira instância do Beat que dispara o tick 'name' neste minuto.
+    Sem o Redis, todas seguem adiante (a reivindicação no banco evita os envios duplicados).
+    """
+    key = f"scheduler:tick:{name}:{local_now.strftime('%Y%m%d%H%M')}"
+    try:
+        first = get_redis(settings.REDIS_URL).set(key, 1, nx=True, ex=120)
+    except redis.RedisError as e:
+        logger.warning(f"Tick '{name}' sem deduplicação: Redis indisponível ({e}).")
+        return True
+    if not first:
+        with metrics.record() as pipe:
+            metrics.SCHEDULER_DUPLICATES_SKIPPED.inc(pipe, kind='tick')
+        logger.info(f"Tick '{name}' de {local_now.strftime('%H:%M')} já processado por outra instância do Beat.")
+    return bool(first)
+
+
+def get_scheduled_for(task, local_now):
+    """Horário previsto da execução: execution_time (única) ou recurrent_time de hoje (recorrente)."""
+    if not task.is_recurrent:
+        return task.execution_time
+    return timezone.make_aware(datetime.combine(local_now.date(), task.recurrent_time))
+
+
+def get_queue_names():
+    """Filas usadas pelas tarefas: a padrão e as de CELERY_TASK_ROUTES."""
+    routes = current_app.conf.task_routes or {}
+    names = {current_app.conf.task_default_queue}
+    names.update(route['queue'] for route in routes.values() if 'queue' in route)
+    return sorted(names)
+
+
+def get_queue_depths():
+    """Número de mensagens aguardando em cada fila do Celery (0 se o broker não responder)."""
+    depths = {}
+    queue_names = get_queue_names()
+    try:
+        with current_app.connection_for_read() as connection:
+            channel = connection.default_channel
+            for queue_name in queue_names:
+                depths[queue_name] = channel.queue_declare(queue=queue_name, passive=True).message_count
+    except Exception as e:
+        logger.warning(f"Não foi possível medir a profundidade das filas: {e}")
+    return depths
+
+
 @shared_task
 def check_device_status():
     """
-    Verifica se algum dispositivo está inativo (sem heartbeat) e atualiza seu status.
-    Esta tarefa deve ser executada a cada minuto pelo Celery Beat para garantir a precisão do status.
+    Avalia a presença dos dispositivos (ONLINE/OFFLINE/INSTÁVEL, devices/presence.py) a
+    partir do último heartbeat e atualiza o is_active, o registro de transições e a
+    disponibilidade diária. Executada a cada minuto pelo Celery Beat.
     """
     now = timezone.now()
-    timeout_minutes = 5
-    timeout_threshold = now - timedelta(minutes=timeout_minutes)
-    
-    # Busca dispositivos ativos que não foram vistos após o limite de tempo
-    inactive_devices = Device.objects.filter(
-        is_active=True,
-        last_seen__lte=timeout_threshold
-    )
-    
-    inactivated_count = inactive_devices.update(is_active=False)
-    
-    if inactivated_count > 0:
-        logger.warning(f"Total de {inactivated_count} dispositivos inativados por timeout.")
-        
-    return inactivated_count
\ No newline at end of file
+    # Com várias instâncias do Beat basta uma avaliação por minuto
+    if not claim_tick('device-status', timezone.localtime(now)):
+        return
+    return presence.evaluate_presence(now)
+
+
+# ==============================================================================
+# RESUMO DA FROTA (ADMIN, DASHBOARD E API)
+# ==============================================================================
+@shared_task
+def refresh_fleet_summary():
+    """Recalcula a tabela FleetSummary (devices/fleet.py). Executada a cada minuto pelo Celery Beat."""
+    if not claim_tick('fleet-summary', timezone.localtime()):
+        return
+    return fleet.refresh_fleet_summary()
+
+
+# ==============================================================================
+# IMPORTAÇÃO DE HISTÓRICO ENVIADA PELO ADMIN
+# ==============================================================================
+# Sem rota em CELERY_TASK_ROUTES: fila padrão 'maintenance', longe dos envios de comando
+@shared_task
+def import_telemetry_file(import_id):
+    """Importa o arquivo de um TelemetryImport a partir do último bloco gravado (devices/importers.py)."""
+    return importers.run_import(import_id)
+
+
+# ==============================================================================
+# SONDA DE LATÊNCIA DAS FILAS (benchmark_scheduler_queues)
+# ==============================================================================
+@shared_task
+def queue_probe(sent_at):
+    """Tarefa vazia: devolve quantos segundos a mensagem esperou na fila até ser executada."""
+    return max(0.0, time.time() - sent_at)
\ No newline at end of file
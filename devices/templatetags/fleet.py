@@ -0,0 +1,13 @@
+# iot_project/devices/templatetags/fleet.py
+
+from django import template
+
+from devices.fleet import get_fleet_summary
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def fleet_summary(context):
+    """Resumo da frota dos sites do usuário logado (widgets da página inicial do Admin)."""
+    return get_fleet_summary(context['request'].user)
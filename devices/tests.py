@@ -1,3 +1,1143 @@
-from django.test import TestCase
+# iot_project/devices/tests.py
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import F
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from datetime import datetime, timedelta, timezone as dt_timezone
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+import redis
+
+from . import alerts, automations, views as devices_views
+from .anomalies import flag_readings
+from .bulk import insert_telemetry
+from .importers import ImportErrorLimit, TelemetryImporter, resume_import, run_import
+from .models import (
+    Alert, AlertRule, Automation, CommandDelivery, Device, DeviceAvailability, DevicePresence, PresenceTransition,
+    ScheduledTask, Site, TaskRun, TaskRunChunk, TelemetryData, TelemetryImport,
+)
+from .presence import _credit, availability_percent, evaluate_presence, open_seconds
+from .sites import user_site_ids
+from .tasks import check_scheduled_tasks, dispatch_chunk, process_scheduled_task
+from core_system import ratelimit
+from core_system.authentication import CELERY_MASTER_TOKEN, CeleryUser
+from core_system.middleware import RequestMetricsMiddleware
+from core_system.testing import assert_query_budget
+
+
+# ==============================================================================
+# BASE: DISPOSITIVO AUTENTICADO PELO PRÓPRIO TOKEN (device_id)
+# ==============================================================================
+# Cache em memória: os testes não dependem do Redis (dashboard, métricas e limites
+# de requisição já funcionam sem ele)
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class DeviceAPITestCase(TestCase):
+    device_id = 'ESP_TESTE_01'
+
+    def setUp(self):
+        self.device = Device.objects.create(
+            device_id=self.device_id, name='Sensor de Teste', device_type='ESP8266', location='Laboratório',
+        )
+
+    def auth(self, token=None):
+        return {'HTTP_AUTHORIZATION': f'Token {token or self.device_id}'}
+
+    def post_json(self, path, data, **extra):
+        return self.client.post(path, json.dumps(data), content_type='application/json', **extra)
+
+
+# ==============================================================================
+# 1. TELEMETRIA EM LOTE (POST /api/telemetry/batch/)
+# ==============================================================================
+class TelemetryBatchTests(DeviceAPITestCase):
+    path = '/api/telemetry/batch/'
+
+    def post_batch(self, readings, **fields):
+        return self.post_json(self.path, {'readings': readings, **fields}, **self.auth())
+
+    def test_horario_das_leituras(self):
+        ts = int((timezone.now() - timedelta(hours=2)).timestamp())
+        response = self.post_batch([
+            {'temperature_celsius': 20.0},                  # sem horário: recebimento
+            {'temperature_celsius': 21.0, 'age_ms': 90000},  # 90s antes do recebimento
+            {'temperature_celsius': 22.0, 'ts': ts},         # epoch do NTP
+            {'temperature_celsius': 23.0, 'ts': 2**32},      # relógio adiantado: limitado ao recebimento
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['received'], 4)
+
+        timestamps = dict(
+            TelemetryData.objects.filter(device=self.device).values_list('temperature_celsius', 'timestamp')
+        )
+        received_at = timestamps[20.0]
+        self.assertEqual(timestamps[21.0], received_at - timedelta(milliseconds=90000))
+        self.assertEqual(timestamps[22.0], datetime.fromtimestamp(ts, tz=dt_timezone.utc))
+        self.assertEqual(timestamps[23.0], received_at)
+
+    def test_lote_vazio(self):
+        response = self.post_batch([])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('readings', response.json())
+        self.assertFalse(TelemetryData.objects.exists())
+
+    def test_lote_acima_do_maximo(self):
+        # Leituras inválidas: o tamanho é recusado antes da validação de cada leitura
+        readings = [{'temperature_celsius': 'x'}] * (settings.TELEMETRY_BATCH_MAX_SIZE + 1)
+        response = self.post_batch(readings)
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['readings']
+        self.assertEqual(list(errors), ['non_field_errors'])
+        self.assertIn(str(settings.TELEMETRY_BATCH_MAX_SIZE), errors['non_field_errors'][0])
+        self.assertFalse(TelemetryData.objects.exists())
+
+    def test_check_in_do_dispositivo(self):
+        Device.objects.filter(pk=self.device.pk).update(last_seen=timezone.now() - timedelta(hours=1))
+        response = self.post_batch([{'temperature_celsius': 20.0}], name='Sensor Renomeado', location='Estufa')
+        self.assertEqual(response.status_code, 201)
+
+        self.device.refresh_from_db()
+        self.assertGreater(self.device.last_seen, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.device.ip_address, '127.0.0.1')
+        self.assertEqual(self.device.name, 'Sensor Renomeado')
+        self.assertEqual(self.device.location, 'Estufa')
+        self.assertEqual(self.device.device_type, 'ESP8266')
+
+    def test_token_invalido(self):
+        response = self.post_json(self.path, {'readings': [{'temperature_celsius': 20.0}]}, **self.auth('ESP_INEXISTENTE'))
+        self.assertIn(response.status_code, (401, 403))
+        self.assertFalse(TelemetryData.objects.exists())
+
+
+# ==============================================================================
+# 2. ORÇAMENTO DE QUERIES DOS ENDPOINTS QUENTES (REQUEST_BUDGETS)
+# ==============================================================================
+class QueryBudgetTests(DeviceAPITestCase):
+
+    def test_post_de_telemetria(self):
+        with assert_query_budget('telemetry-post', 'POST'):
+            response = self.post_json('/api/telemetry/', {'temperature_celsius': 21.5, 'humidity_percent': 40.0}, **self.auth())
+        self.assertEqual(response.status_code, 201)
+
+    def test_post_em_lote(self):
+        readings = [{'temperature_celsius': 20.0 + i, 'age_ms': i * 1000} for i in range(50)]
+        with assert_query_budget('telemetry-batch', 'POST'):
+            response = self.post_json('/api/telemetry/batch/', {'readings': readings}, **self.auth())
+        self.assertEqual(response.status_code, 201)
+
+    def test_get_de_comandos(self):
+        for fast_path in (True, False):
+            with self.subTest(fast_path=fast_path), self.settings(DEVICE_POLL_FAST_PATH=fast_path):
+                with assert_query_budget('device-detail', 'GET'):
+                    response = self.client.get(f'/api/devices/{self.device_id}/', **self.auth())
+                self.assertEqual(response.status_code, 200)
+
+    def test_put_de_confirmacao(self):
+        with assert_query_budget('device-detail', 'PUT'):
+            response = self.client.put(
+                f'/api/devices/{self.device_id}/', json.dumps({'last_command': 'ligar_rele'}),
+                content_type='application/json', **self.auth(),
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_orcamento_excedido(self):
+        budget = settings.REQUEST_BUDGETS['PUT device-detail']['queries']
+        with self.assertRaisesMessage(AssertionError, f"orçamento de {budget}"):
+            with assert_query_budget('device-detail', 'PUT'):
+                for _ in range(budget + 1):
+                    Device.objects.count()
+
+
+# ==============================================================================
+# 3. IMPORTAÇÃO DE HISTÓRICO PELO ADMIN (EM SEGUNDO PLANO)
+# ==============================================================================
+@override_settings(CACHES=LOCAL_CACHES, TELEMETRY_IMPORT_CHUNK_SIZE=2)
+class TelemetryImportTests(TestCase):
+    csv_content = (
+        "device_id,timestamp,temperature_celsius\n"
+        "ESP_IMPORT,2026-01-05T14:30:00-03:00,24.5\n"
+        "ESP_IMPORT,2026-01-05T14:31:00-03:00,24.6\n"
+        "ESP_DESCONHECIDO,2026-01-05T14:32:00-03:00,24.7\n"
+        "ESP_IMPORT,2026-01-05T14:33:00-03:00,24.8\n"
+        "ESP_IMPORT,2026-01-05T14:34:00-03:00,24.9\n"
+    )
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.enterContext(override_settings(TELEMETRY_IMPORT_DIR=self.directory.name))
+        self.device = Device.objects.create(device_id='ESP_IMPORT', name='Importação')
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'senha')
+        self.client.force_login(self.admin)
+
+    def upload(self):
+        # A tarefa é enfileirada no commit; aqui o on_commit não a envia ao Celery
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post(
+                reverse('admin:devices_telemetrydata_import'),
+                {'file': SimpleUploadedFile('historico.csv', self.csv_content.encode()), 'file_format': 'auto'},
+            )
+        job = TelemetryImport.objects.get()
+        self.assertRedirects(response, reverse('admin:devices_telemetryimport_change', args=[job.pk]))
+        self.assertEqual(len(callbacks), 1)
+        return job
+
+    def test_upload_enfileira_e_importa_no_worker(self):
+        job = self.upload()
+        self.assertEqual(job.status, 'QUEUED')
+        self.assertFalse(TelemetryData.objects.exists())
+        self.assertTrue(os.path.isfile(job.file_path))
+
+        self.assertEqual(run_import(job.pk), 'DONE')
+        job.refresh_from_db()
+        self.assertEqual((job.imported, job.invalid, job.offset), (4, 1, job.file_size))
+        self.assertEqual(len(job.errors), 1)
+        self.assertFalse(os.path.exists(job.file_path))
+        self.assertEqual(TelemetryData.objects.filter(device=self.device).count(), 4)
+        # Mensagem repetida pelo broker: a importação não roda duas vezes
+        self.assertIsNone(run_import(job.pk))
+
+        response = self.client.get(reverse('admin:devices_telemetryimport_changelist'))
+        self.assertContains(response, '100.0%')
+
+    def test_retomada_a_partir_do_ultimo_bloco(self):
+        job = self.upload()
+        # Worker caiu após o primeiro bloco (2 registros): parada sem bloco gravado há muito tempo
+        first_block = self.csv_content.index('ESP_DESCONHECIDO')
+        run_import(job.pk)
+        TelemetryData.objects.all().delete()
+        stalled_at = timezone.now() - timedelta(seconds=settings.TELEMETRY_IMPORT_STALL_SECONDS + 1)
+        TelemetryImport.objects.filter(pk=job.pk).update(
+            status='RUNNING', offset=first_block, imported=2, invalid=0, errors=[], updated_at=stalled_at,
+        )
+        with open(job.file_path, 'wb') as f:
+            f.write(self.csv_content.encode())
+
+        job.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.assertTrue(resume_import(job))
+        self.assertEqual(len(callbacks), 1)
+
+        self.assertEqual(run_import(job.pk), 'DONE')
+        job.refresh_from_db()
+        self.assertEqual((job.imported, job.invalid), (4, 1))
+        # Apenas os registros após o offset salvo foram gravados nesta execução
+        self.assertEqual(TelemetryData.objects.count(), 2)
+
+    def test_excecao_no_meio_retoma_sem_duplicar(self):
+        job = self.upload()
+        calls = []
+
+        def fail_second_block(rows, **kwargs):
+            calls.append(len(rows))
+            if len(calls) == 2:
+                raise OSError('conexão perdida')
+            return insert_telemetry(rows, **kwargs)
+
+        with mock.patch('devices.importers.insert_telemetry', side_effect=fail_second_block):
+            with self.assertLogs('devices.importers', 'ERROR'):
+                self.assertEqual(run_import(job.pk), 'FAILED')
+        job.refresh_from_db()
+        # Só o primeiro bloco foi gravado; o offset aponta para o fim dele
+        self.assertEqual((job.imported, job.offset), (2, self.csv_content.index('ESP_DESCONHECIDO')))
+        self.assertEqual(TelemetryData.objects.count(), 2)
+
+        with self.captureOnCommitCallbacks(execute=False):
+            self.assertTrue(resume_import(job))
+        self.assertEqual(run_import(job.pk), 'DONE')
+        job.refresh_from_db()
+        self.assertEqual((job.imported, job.invalid), (4, 1))
+        self.assertEqual(TelemetryData.objects.count(), 4)
+        self.assertEqual(TelemetryData.objects.values('timestamp').distinct().count(), 4)
+
+    def test_limite_de_erros_grava_o_offset_do_ultimo_registro(self):
+        checkpoints = []
+        importer = TelemetryImporter(io.BytesIO(self.csv_content.encode()), 'csv', chunk_size=10, max_errors=0)
+        with self.assertRaises(ImportErrorLimit):
+            importer.run(on_checkpoint=lambda offset, stats: checkpoints.append((offset, dict(stats))))
+        # Os válidos anteriores e o offset após o registro inválido foram gravados
+        after_invalid = self.csv_content.index('ESP_IMPORT,2026-01-05T14:33')
+        self.assertEqual(checkpoints[-1][0], after_invalid)
+        self.assertEqual(checkpoints[-1][1]['imported'], 2)
+
+        # A retomada não relê o registro inválido
+        resumed = TelemetryImporter(
+            io.BytesIO(self.csv_content.encode()), 'csv', chunk_size=10, max_errors=0, start_offset=after_invalid,
+        )
+        stats = resumed.run()
+        self.assertEqual((stats['imported'], stats['invalid']), (2, 0))
+        self.assertEqual(TelemetryData.objects.count(), 4)
+
+    def test_em_execucao_nao_e_retomada(self):
+        job = self.upload()
+        TelemetryImport.objects.filter(pk=job.pk).update(status='RUNNING', updated_at=timezone.now())
+        job.refresh_from_db()
+        self.assertFalse(resume_import(job))
+
+
+# ==============================================================================
+# 4. ENVIO DE UM LOTE DE COMANDOS (dispatch_chunk)
+# ==============================================================================
+class WorkerCrash(BaseException):
+    """Queda do worker no meio do lote (não é capturada por dispatch_command)."""
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class DispatchChunkTests(TestCase):
+
+    def setUp(self):
+        self.devices = [Device.objects.create(device_id=f'ESP_LOTE_{i}', name=f'Lote {i}') for i in range(3)]
+        task = ScheduledTask.objects.create(
+            name='Ligar relé', command_json={'action': 'ligar_rele'}, execution_time=timezone.now(),
+        )
+        now = timezone.now()
+        self.run = TaskRun.objects.create(task=task, scheduled_for=now, status='RUNNING', chunks_total=1)
+        self.chunk = TaskRunChunk.objects.create(
+            run=self.run, index=0, device_ids=[device.pk for device in self.devices], updated_at=now,
+        )
+        self.ok = mock.Mock(status_code=200, text='')
+
+    def patch_requests(self, side_effect):
+        return mock.patch('devices.tasks.requests.patch', side_effect=side_effect)
+
+    @mock.patch('devices.tasks.CHUNK_RESULTS_FLUSH_SIZE', 2)
+    def test_retomada_nao_reenvia_aos_dispositivos_ja_atendidos(self):
+        with self.patch_requests([self.ok, self.ok, WorkerCrash()]) as patched:
+            with self.assertRaises(WorkerCrash):
+                dispatch_chunk(self.chunk.pk)
+        self.assertEqual(patched.call_count, 3)
+        # O bloco dos dois primeiros envios foi gravado antes da queda
+        self.assertCountEqual(
+            self.run.device_results.values_list('device_id', flat=True), [self.devices[0].pk, self.devices[1].pk]
+        )
+
+        # Lote abandonado: retomado por outro worker
+        TaskRunChunk.objects.filter(pk=self.chunk.pk).update(
+            updated_at=timezone.now() - timedelta(seconds=settings.SCHEDULER_CHUNK_STALL_SECONDS + 1)
+        )
+        with self.patch_requests([self.ok]) as patched:
+            dispatch_chunk(self.chunk.pk)
+        sent_to = [call.args[0].rstrip('/').rsplit('/', 1)[-1] for call in patched.call_args_list]
+        self.assertEqual(sent_to, ['ESP_LOTE_2'])
+        self.assertEqual(self.run.device_results.count(), 3)
+
+        self.chunk.refresh_from_db()
+        self.run.refresh_from_db()
+        self.assertEqual(self.chunk.status, 'DONE')
+        self.assertEqual(self.run.chunks_done, 1)
+
+    def test_mensagem_repetida_nao_recria_os_lotes(self):
+        task = ScheduledTask.objects.create(
+            name='Desligar relé', command_json={'action': 'desligar_rele'}, execution_time=timezone.now(),
+        )
+        task.devices.set(self.devices)
+        run = TaskRun.objects.create(task=task, scheduled_for=timezone.now(), enqueued_at=timezone.now())
+
+        with mock.patch('devices.tasks.enqueue_chunks') as enqueue:
+            process_scheduled_task(task.pk, run.pk)
+            # Mensagem entregue de novo pelo broker (ou enfileirada em dobro)
+            with self.assertLogs('devices.tasks', 'WARNING'):
+                process_scheduled_task(task.pk, run.pk)
+        self.assertEqual(enqueue.call_count, 1)
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.devices_total, run.chunks_total), ('RUNNING', 3, run.chunks.count()))
+
+    def test_lote_concluido_por_outro_worker_nao_conta_duas_vezes(self):
+        def finished_elsewhere(*args, **kwargs):
+            # Enquanto este worker envia, o lote é concluído pelo worker que o reivindicou de novo
+            if TaskRunChunk.objects.filter(pk=self.chunk.pk, status='RUNNING').update(status='DONE'):
+                TaskRun.objects.filter(pk=self.run.pk).update(chunks_done=F('chunks_done') + 1)
+            return self.ok
+
+        with self.patch_requests(finished_elsewhere):
+            dispatch_chunk(self.chunk.pk)
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.chunks_done, 1)
+
+
+# ==============================================================================
+# 5. LIMITE DE REQUISIÇÕES POR DISPOSITIVO (core_system/ratelimit.py)
+# ==============================================================================
+# Relógio controlado pelo teste e camada do Redis substituída (_take_shared)
+@override_settings(
+    DEVICE_RATE_LIMITS={'default': {'rate': 1.0, 'burst': 3}, 'Simulador': {'rate': 20.0, 'burst': 200}},
+    DEVICE_RATE_LIMIT_LOCAL_MAX_KEYS=3,
+)
+class RateLimitTests(SimpleTestCase):
+
+    def setUp(self):
+        ratelimit._local_buckets.clear()
+        ratelimit._device_types.clear()
+        self.addCleanup(ratelimit._local_buckets.clear)
+        self.addCleanup(ratelimit._device_types.clear)
+        self.now = 1000.0
+        self.enterContext(mock.patch('core_system.ratelimit.time.monotonic', side_effect=lambda: self.now))
+        self.shared = self.enterContext(mock.patch('core_system.ratelimit._take_shared', return_value=0.0))
+
+    def take(self, token, count=1):
+        return [ratelimit.check(token) for _ in range(count)]
+
+    def test_rajada_e_reposicao(self):
+        self.assertEqual(self.take('ESP_A', 3), [None, None, None])
+        self.assertEqual(ratelimit.check('ESP_A'), (1.0, 'local'))
+
+        self.now += 1.5
+        self.assertIsNone(ratelimit.check('ESP_A'))
+        self.assertEqual(ratelimit.check('ESP_A'), (0.5, 'local'))
+
+        # Parado por muito tempo: volta só até o burst
+        self.now += 100
+        self.assertEqual(self.take('ESP_A', 3), [None, None, None])
+        self.assertEqual(ratelimit.check('ESP_A')[1], 'local')
+
+    def test_limite_pelo_device_type(self):
+        ratelimit.remember_device_type('ESP_SIM', 'Simulador')
+        self.assertEqual(self.take('ESP_SIM', 200), [None] * 200)
+        self.assertEqual(ratelimit.check('ESP_SIM'), (0.05, 'local'))
+
+    def test_recusa_do_redis_bloqueia_localmente(self):
+        self.shared.return_value = 5.0
+        self.assertEqual(ratelimit.check('ESP_A'), (5.0, 'redis'))
+        self.assertEqual(self.shared.call_count, 1)
+
+        # Até o Retry-After, recusado sem consultar o Redis (mesmo com fichas locais)
+        self.now += 2
+        self.assertEqual(ratelimit.check('ESP_A'), (3.0, 'local'))
+        self.assertEqual(self.shared.call_count, 1)
+
+        self.now += 3
+        self.shared.return_value = 0.0
+        self.assertIsNone(ratelimit.check('ESP_A'))
+        self.assertEqual(self.shared.call_count, 2)
+
+    def test_arredondamento_do_retry_after(self):
+        for seconds, header in ((0.0, '1'), (0.01, '1'), (1.0, '1'), (1.2, '2'), (29.5, '30')):
+            with self.subTest(seconds=seconds):
+                self.assertEqual(ratelimit.retry_after_header(seconds), header)
+
+    def test_descarta_baldes_ociosos_no_limite_de_chaves(self):
+        self.take('ESP_A')
+        self.take('ESP_B')
+        self.now += 5
+        self.take('ESP_C', 3)  # esvaziado agora: não é ocioso
+        self.take('ESP_D')
+        self.assertEqual(set(ratelimit._local_buckets), {'ESP_C', 'ESP_D'})
+
+    def test_recomeca_se_nenhum_balde_estiver_ocioso(self):
+        for token in ('ESP_A', 'ESP_B', 'ESP_C'):
+            self.take(token, 3)
+        self.take('ESP_D')
+        self.assertEqual(set(ratelimit._local_buckets), {'ESP_D'})
+
+
+# ==============================================================================
+# 6. CONSULTA DE COMANDOS: CAMINHO RÁPIDO x DRF (GET /api/devices/<id>/)
+# ==============================================================================
+class DevicePollTests(DeviceAPITestCase):
+    other_device_id = 'ESP_TESTE_02'
+
+    def setUp(self):
+        super().setUp()
+        self.other = Device.objects.create(
+            device_id=self.other_device_id, name='Sensor de Teste', device_type='ESP8266', location='Laboratório',
+        )
+        # Horário e jitter fixos: as duas views devem produzir exatamente a mesma resposta
+        self.now = timezone.now().replace(microsecond=123456)
+        self.enterContext(mock.patch('django.utils.timezone.now', return_value=self.now))
+        self.enterContext(mock.patch('devices.polling.random.uniform', return_value=1.0))
+        self.enterContext(mock.patch('devices.polling._server_load', return_value=0.0))
+
+    def send_command(self, device_id):
+        response = self.client.patch(
+            f'/api/devices/{device_id}/', json.dumps({'pending_command': json.dumps({'action': 'ligar_rele'})}),
+            content_type='application/json', **self.auth(CELERY_MASTER_TOKEN),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def poll(self, device_id, fast_path):
+        with self.settings(DEVICE_POLL_FAST_PATH=fast_path):
+            response = self.client.get(f'/api/devices/{device_id}/', **self.auth(device_id))
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        self.assertEqual(body.pop('device_id'), device_id)
+        return body
+
+    def state(self, device):
+        device.refresh_from_db()
+        delivery = CommandDelivery.objects.filter(pk=device.command_delivery_id).first()
+        return (
+            device.last_seen, device.ip_address, device.command_delivered_at,
+            delivery and delivery.delivered_at, delivery and delivery.delivery_seconds,
+        )
+
+    def test_mesma_resposta_e_mesmas_escritas(self):
+        for with_command in (False, True):
+            with self.subTest(with_command=with_command):
+                if with_command:
+                    self.send_command(self.device_id)
+                    self.send_command(self.other_device_id)
+                fast = self.poll(self.device_id, fast_path=True)
+                drf = self.poll(self.other_device_id, fast_path=False)
+                self.assertEqual(fast, drf)
+                self.assertEqual(fast['status'], 'command_pending' if with_command else 'no_command')
+                self.assertEqual(self.state(self.device), self.state(self.other))
+                self.assertEqual(self.device.last_seen, self.now)
+                self.assertEqual(self.device.command_delivered_at, self.now if with_command else None)
+
+    def test_segunda_consulta_nao_registra_nova_entrega(self):
+        self.send_command(self.device_id)
+        self.poll(self.device_id, fast_path=True)
+        delivered = self.state(self.device)[2:]
+
+        later = self.now + timedelta(seconds=10)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.poll(self.device_id, fast_path=True)
+        self.assertEqual(self.state(self.device)[2:], delivered)
+        self.assertEqual(self.device.last_seen, later)
+
+    def test_uma_query_no_caminho_rapido(self):
+        # Heartbeat, comando pendente e tarefa prestes a disparar no mesmo UPDATE ... RETURNING
+        with self.settings(DEVICE_POLL_FAST_PATH=True), self.assertNumQueries(1):
+            response = self.client.get(f'/api/devices/{self.device_id}/', **self.auth())
+        self.assertEqual(response.status_code, 200)
+
+    def test_tarefa_prestes_a_disparar(self):
+        due_soon = settings.DEVICE_POLL['DUE_SOON_SECONDS']
+        normal = {self.poll(self.device_id, fast_path=True)['next_poll_in']}
+        self.assertNotIn(due_soon, normal)
+
+        local_now = timezone.localtime(self.now)
+        command = {'action': 'ligar_rele'}
+        recurrent = ScheduledTask.objects.create(
+            name='Recorrente', command_json=command, execution_time=self.now, is_recurrent=True,
+            recurrent_time=(local_now + timedelta(minutes=1)).time().replace(microsecond=0),
+            recurrent_days=str(local_now.weekday() + 1),
+        )
+        unique = ScheduledTask.objects.create(
+            name='Única', command_json=command, execution_time=self.now + timedelta(minutes=10),
+        )
+        # Tarefa de outro dispositivo não encurta o intervalo (EXISTS correlacionado ao ESP da consulta)
+        recurrent.devices.set([self.other])
+        self.assertEqual(self.poll(self.device_id, fast_path=True)['next_poll_in'], min(normal))
+        for fast_path in (True, False):
+            with self.subTest(fast_path=fast_path):
+                self.assertEqual(self.poll(self.other_device_id, fast_path)['next_poll_in'], due_soon)
+
+        # Única fora da janela; recorrente já executada hoje
+        unique.devices.set([self.device])
+        ScheduledTask.objects.filter(pk=recurrent.pk).update(last_run_at=self.now)
+        for fast_path in (True, False):
+            with self.subTest(fast_path=fast_path):
+                self.assertEqual(self.poll(self.device_id, fast_path)['next_poll_in'], min(normal))
+                self.assertEqual(self.poll(self.other_device_id, fast_path)['next_poll_in'], min(normal))
+
+        ScheduledTask.objects.filter(pk=unique.pk).update(execution_time=self.now + timedelta(seconds=30))
+        for fast_path in (True, False):
+            with self.subTest(fast_path=fast_path):
+                self.assertEqual(self.poll(self.device_id, fast_path)['next_poll_in'], due_soon)
+
+    def test_desvios_para_o_drf(self):
+        drf_view = mock.Mock(wraps=devices_views._drf_device_detail)
+        path = f'/api/devices/{self.device_id}/'
+        cases = [
+            ('PUT do ESP', lambda: self.client.put(
+                path, json.dumps({'last_command': 'ligar_rele'}), content_type='application/json', **self.auth()), 200),
+            ('dispositivo inexistente', lambda: self.client.get(
+                '/api/devices/ESP_INEXISTENTE/', **self.auth('ESP_INEXISTENTE')), (401, 403)),
+            ('token de outro dispositivo', lambda: self.client.get(path, **self.auth(self.other_device_id)), 404),
+            ('token do Celery', lambda: self.client.get(path, **self.auth(CELERY_MASTER_TOKEN)), 200),
+            ('sem token', lambda: self.client.get(path), (401, 403, 404)),
+        ]
+        with mock.patch('devices.views._drf_device_detail', drf_view):
+            for name, request, expected in cases:
+                with self.subTest(name):
+                    drf_view.reset_mock()
+                    response = request()
+                    self.assertIn(response.status_code, expected if isinstance(expected, tuple) else (expected,))
+                    self.assertEqual(drf_view.call_count, 1)
+
+
+# ==============================================================================
+# 7. PRESENÇA DOS DISPOSITIVOS (devices/presence.py)
+# ==============================================================================
+PRESENCE_TEST = {
+    'OFFLINE_AFTER_SECONDS': 300,
+    'FRESH_SECONDS': 60,
+    'ONLINE_HOLD_SECONDS': 60,
+    'FLAP_PENALTY': 1000,
+    'FLAP_SUPPRESS': 2500,
+    'FLAP_REUSE': 750,
+    'FLAP_HALF_LIFE_SECONDS': 900,
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES, PRESENCE=PRESENCE_TEST)
+class PresenceTests(TestCase):
+
+    def setUp(self):
+        # Meio-dia local: as avaliações do teste não cruzam a meia-noite
+        self.t0 = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+        self.device = Device.objects.create(device_id='ESP_PRESENCA', name='Presença', is_active=False, last_seen=self.t0)
+
+    def heartbeat(self, at):
+        Device.objects.filter(pk=self.device.pk).update(last_seen=at)
+
+    def evaluate(self, at):
+        transitions = evaluate_presence(at)
+        self.device.refresh_from_db()
+        return transitions, DevicePresence.objects.get(device=self.device)
+
+    def start(self, state, penalty=0.0, since=None):
+        since = since or self.t0
+        return DevicePresence.objects.create(
+            device=self.device, state=state, since=since, penalty=penalty, penalty_at=since, accounted_at=since,
+        )
+
+    # --- OFFLINE -> ONLINE: HISTERESE (ONLINE_HOLD_SECONDS) ---
+    def test_retorno_so_vira_online_apos_o_hold(self):
+        self.heartbeat(self.t0 - timedelta(hours=1))
+        _, presence = self.evaluate(self.t0)
+        self.assertEqual(presence.state, 'OFFLINE')
+
+        back = self.t0 + timedelta(minutes=10)
+        self.heartbeat(back)
+        transitions, presence = self.evaluate(back)
+        self.assertEqual((transitions, presence.state, presence.recovering_since), (0, 'OFFLINE', back))
+
+        self.heartbeat(back + timedelta(seconds=30))
+        transitions, presence = self.evaluate(back + timedelta(seconds=30))
+        self.assertEqual((transitions, presence.state), (0, 'OFFLINE'))
+        self.assertFalse(self.device.is_active)
+
+        self.heartbeat(back + timedelta(seconds=60))
+        transitions, presence = self.evaluate(back + timedelta(seconds=60))
+        self.assertEqual((transitions, presence.state), (1, 'ONLINE'))
+        self.assertTrue(self.device.is_active)
+        # A transição fica no início do retorno, não no fim do hold
+        transition = PresenceTransition.objects.get(device=self.device)
+        self.assertEqual((transition.from_state, transition.to_state, transition.at), ('OFFLINE', 'ONLINE', back))
+        self.assertEqual(presence.penalty, PRESENCE_TEST['FLAP_PENALTY'])
+
+    def test_retorno_curto_nao_gera_transicao(self):
+        self.start('OFFLINE')
+        back = self.t0 + timedelta(minutes=10)
+        self.heartbeat(back)
+        self.evaluate(back)
+
+        # Caiu de novo antes do hold: o retorno é descartado
+        transitions, presence = self.evaluate(back + timedelta(seconds=90))
+        self.assertEqual((transitions, presence.state, presence.recovering_since), (0, 'OFFLINE', None))
+        self.assertFalse(PresenceTransition.objects.exists())
+
+    # --- AMORTECIMENTO: FLAP_SUPPRESS E FLAP_REUSE ---
+    def test_penalidade_acima_do_suppress_vira_instavel(self):
+        now = self.t0 + timedelta(minutes=10)
+        for penalty, expected in ((1400, 'OFFLINE'), (1600, 'FLAPPING')):
+            with self.subTest(penalty=penalty):
+                DevicePresence.objects.filter(device=self.device).delete()
+                self.start('ONLINE', penalty=penalty, since=now)
+                transitions, presence = self.evaluate(now)
+                self.assertEqual((transitions, presence.state), (1, expected))
+                self.assertAlmostEqual(presence.penalty, penalty + PRESENCE_TEST['FLAP_PENALTY'])
+                self.assertFalse(self.device.is_active)
+
+    def test_instavel_so_sai_abaixo_do_reuse(self):
+        self.start('FLAPPING', penalty=1600)
+        fresh = {True: 'ONLINE', False: 'OFFLINE'}
+
+        # Uma meia-vida: 800, ainda acima do FLAP_REUSE (750)
+        at = self.t0 + timedelta(seconds=900)
+        self.heartbeat(at)
+        transitions, presence = self.evaluate(at)
+        self.assertEqual((transitions, presence.state), (0, 'FLAPPING'))
+
+        for heartbeat, expected in fresh.items():
+            with self.subTest(heartbeat=heartbeat):
+                DevicePresence.objects.filter(device=self.device).update(state='FLAPPING', penalty=1600, penalty_at=self.t0)
+                at = self.t0 + timedelta(seconds=1000)  # 1600 * 0.5 ** (1000 / 900) ~ 742
+                self.heartbeat(at if heartbeat else self.t0)
+                transitions, presence = self.evaluate(at)
+                self.assertEqual((transitions, presence.state), (1, expected))
+                self.assertEqual(self.device.is_active, heartbeat)
+                # Sair do estado instável não soma penalidade
+                self.assertLess(presence.penalty, PRESENCE_TEST['FLAP_REUSE'])
+
+    # --- DISPONIBILIDADE: DIVISÃO NA MEIA-NOITE (HORÁRIO LOCAL) ---
+    def test_credito_dividido_na_meia_noite(self):
+        midnight = timezone.make_aware(datetime.combine(self.t0.date() + timedelta(days=1), datetime.min.time()))
+        presence = DevicePresence(device=self.device, state='ONLINE', accounted_at=midnight - timedelta(minutes=30))
+
+        deltas = {}
+        _credit(deltas, presence, midnight + timedelta(minutes=45))
+        self.assertEqual(deltas[(self.device.pk, self.t0.date())]['online_seconds'], 1800)
+        self.assertEqual(deltas[(self.device.pk, midnight.date())]['online_seconds'], 2700)
+        self.assertEqual(deltas[(self.device.pk, midnight.date())]['offline_seconds'], 0)
+        self.assertEqual(presence.accounted_at, midnight + timedelta(minutes=45))
+
+    def test_virada_do_dia_fecha_o_dia_anterior(self):
+        midnight = timezone.make_aware(datetime.combine(self.t0.date() + timedelta(days=1), datetime.min.time()))
+        self.start('OFFLINE', since=midnight - timedelta(hours=1))
+        self.heartbeat(midnight - timedelta(hours=2))
+
+        _, presence = self.evaluate(midnight + timedelta(minutes=5))
+        self.assertEqual(presence.accounted_at, midnight)
+        row = DeviceAvailability.objects.get(device=self.device, date=self.t0.date())
+        self.assertEqual((row.online_seconds, row.offline_seconds), (0, 3600))
+        # O dia corrente só conta o trecho em aberto na consulta
+        self.assertFalse(DeviceAvailability.objects.filter(date=midnight.date()).exists())
+        self.assertEqual(open_seconds(presence, midnight.date(), midnight + timedelta(minutes=5)), ('OFFLINE', 300))
+
+
+    def test_estados_atravessando_a_meia_noite(self):
+        midnight = timezone.make_aware(datetime.combine(self.t0.date() + timedelta(days=1), datetime.min.time()))
+        today, tomorrow = self.t0.date(), midnight.date()
+        self.start('ONLINE', since=midnight - timedelta(hours=2))
+
+        # Último heartbeat às 23:50: OFFLINE a partir dele
+        self.heartbeat(midnight - timedelta(minutes=10))
+        transitions, presence = self.evaluate(midnight - timedelta(minutes=2))
+        self.assertEqual((transitions, presence.state), (1, 'OFFLINE'))
+
+        # Volta às 00:20: a primeira avaliação do dia fecha o OFFLINE de ontem até a meia-noite
+        back = midnight + timedelta(minutes=20)
+        self.heartbeat(back)
+        self.evaluate(back)
+        self.heartbeat(back + timedelta(seconds=60))
+        transitions, presence = self.evaluate(back + timedelta(seconds=60))
+        self.assertEqual((transitions, presence.state, presence.accounted_at), (1, 'ONLINE', back))
+
+        rows = {row.date: row for row in DeviceAvailability.objects.filter(device=self.device)}
+        self.assertEqual(set(rows), {today, tomorrow})
+        # Ontem: ONLINE 22:00-23:50 e OFFLINE 23:50-00:00
+        self.assertEqual((rows[today].online_seconds, rows[today].offline_seconds), (6600, 600))
+        self.assertAlmostEqual(availability_percent(rows[today]), 100 * 6600 / 7200)
+        # Hoje: OFFLINE 00:00-00:20; o ONLINE em aberto só entra na consulta
+        self.assertEqual((rows[tomorrow].online_seconds, rows[tomorrow].offline_seconds), (0, 1200))
+        now = midnight + timedelta(hours=1, minutes=20)
+        self.assertEqual(open_seconds(presence, tomorrow, now), ('ONLINE', 3600))
+        self.assertAlmostEqual(availability_percent(rows[tomorrow], presence, now), 75.0)
+        self.assertEqual(availability_percent(rows[tomorrow]), 0.0)
+
+# ==============================================================================
+# 8. MÉTRICAS (/metrics E RÓTULOS DAS REQUISIÇÕES)
+# ==============================================================================
+@override_settings(CACHES=LOCAL_CACHES)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.enterContext(mock.patch('core_system.views.render_metrics', return_value='iot_up 1\n'))
+
+    def test_sem_token_so_responde_em_debug(self):
+        with self.settings(METRICS_TOKEN='', DEBUG=False):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with self.settings(METRICS_TOKEN='', DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_token_obrigatorio(self):
+        with self.settings(METRICS_TOKEN='segredo', DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer errado').status_code, 403)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'iot_up 1\n')
+
+    def test_recusa_do_limite_rotulada_pela_rota(self):
+        # O 429 sai antes da resolução da URL: o rótulo ainda é o da rota, não 'unresolved'
+        factory = RequestFactory()
+        view_name = RequestMetricsMiddleware.view_name
+        self.assertEqual(view_name(factory.get('/api/devices/ESP_TESTE_01/')), 'device-detail')
+        self.assertEqual(view_name(factory.post('/api/telemetry/batch/')), 'telemetry-batch')
+        self.assertEqual(view_name(factory.get('/nao-existe/')), 'unresolved')
+
+        with mock.patch('core_system.middleware.metrics.HTTP_REQUESTS.inc') as requests_total, \
+                mock.patch('core_system.ratelimit.check', return_value=(3.0, 'local')):
+            response = self.client.get('/api/devices/ESP_TESTE_01/', HTTP_AUTHORIZATION='Token ESP_TESTE_01')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(requests_total.call_args.kwargs['view'], 'device-detail')
+        self.assertEqual(requests_total.call_args.kwargs['status'], 429)
+
+
+# ==============================================================================
+# 9. MOTOR DE ALERTAS (devices/alerts.py)
+# ==============================================================================
+class FakeRedis:
+    """Hashes do Redis em memória, com os comandos usados por alerts e automations."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.values = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hmget(self, key, fields):
+        return [self.hashes.get(key, {}).get(field.encode()) for field in fields]
+
+    def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update(
+            {field.encode(): str(value).encode() for field, value in mapping.items()}
+        )
+
+    def expire(self, key, seconds):
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class AlertRuleTests(TestCase):
+
+    def setUp(self):
+        self.device = Device.objects.create(device_id='ESP_ALERTA', name='Alerta')
+        self.client_redis = FakeRedis()
+        # Regras compiladas ficam no módulo: descartadas ao fim de cada teste
+        self.addCleanup(alerts._cache.update, rules=[], by_device={})
+        self.start = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+
+    def rule(self, **fields):
+        rule = AlertRule.objects.create(**{
+            'name': 'Temperatura alta', 'metric': 'temperature_celsius', 'operator': 'gt',
+            'threshold': 30, 'duration_seconds': 300, **fields,
+        })
+        alerts.load_rules()
+        return rule
+
+    def feed(self, *readings):
+        """Leituras (segundos após self.start, temperatura), avaliadas em uma requisição."""
+        alerts.evaluate_rules(self.client_redis, self.device, [
+            TelemetryData(device=self.device, temperature_celsius=value, timestamp=self.start + timedelta(seconds=offset))
+            for offset, value in readings
+        ])
+
+    def test_dispara_apos_a_duracao(self):
+        rule = self.rule()
+        self.feed((0, 31), (120, 32))
+        self.feed((240, 31.5))
+        self.assertFalse(Alert.objects.exists())
+
+        self.feed((300, 33))
+        alert = Alert.objects.get()
+        self.assertEqual((alert.rule_id, alert.status, alert.value), (rule.pk, 'FIRING', 33))
+        self.assertEqual(alert.started_at, self.start)
+        self.assertEqual(alert.fired_at, self.start + timedelta(seconds=300))
+
+    def test_leitura_abaixo_do_limite_reinicia_a_janela(self):
+        self.rule()
+        self.feed((0, 31), (200, 29), (240, 31))
+        self.feed((480, 32))
+        self.assertFalse(Alert.objects.exists())
+        self.feed((540, 32))
+        self.assertEqual(Alert.objects.get().started_at, self.start + timedelta(seconds=240))
+
+    def test_resolve_quando_o_valor_volta(self):
+        self.rule(duration_seconds=0)
+        self.feed((0, 35))
+        self.feed((60, 28))
+        alert = Alert.objects.get()
+        self.assertEqual(alert.status, 'RESOLVED')
+        self.assertEqual(alert.resolved_at, self.start + timedelta(seconds=60))
+
+        # Nova ocorrência, em um novo Alert
+        self.feed((120, 36))
+        self.assertEqual(list(Alert.objects.order_by('fired_at').values_list('status', flat=True)), ['RESOLVED', 'FIRING'])
+
+    def test_leituras_repetidas_nao_duplicam_o_alerta(self):
+        self.rule(duration_seconds=0)
+        self.feed((0, 35), (30, 36))
+        self.feed((60, 37))
+        # Reenvio de leituras já avaliadas (ex: lote repetido pelo ESP)
+        self.feed((0, 35), (30, 36), (60, 37))
+        self.assertEqual(Alert.objects.count(), 1)
+
+    def test_comando_enfileirado_apos_o_commit(self):
+        self.rule(duration_seconds=0, command_json={'action': 'desligar_rele'})
+        with mock.patch('devices.tasks.dispatch_alert_command.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                self.feed((0, 35))
+                delay.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+        delay.assert_called_once_with(Alert.objects.get().pk)
+
+    def test_broker_fora_do_ar_marca_o_comando_como_falho(self):
+        self.rule(duration_seconds=0, command_json={'action': 'desligar_rele'})
+        with mock.patch('devices.tasks.dispatch_alert_command.delay', side_effect=ConnectionError('broker')):
+            with self.assertLogs('devices.alerts', 'ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.feed((0, 35))
+        alert = Alert.objects.get()
+        self.assertEqual((alert.status, alert.command_status, alert.command_error), ('FIRING', 'FAILED', 'broker'))
+
+
+# ==============================================================================
+# 10. AUTOMAÇÕES NA BORDA (devices/automations.py)
+# ==============================================================================
+class AutomationTests(TestCase):
+
+    def setUp(self):
+        self.source = Device.objects.create(device_id='ESP_SENSOR', name='Sensor')
+        self.target = Device.objects.create(device_id='ESP_RELE', name='Relé')
+        self.automation = Automation.objects.create(
+            name='Umidade alta liga o relé', source_device=self.source, metric='humidity_percent',
+            operator='gt', threshold=70, target_device=self.target, command_json={'action': 'ligar_rele'},
+        )
+        automations.load_automations()
+        self.addCleanup(automations._index.clear)
+        self.client_redis = FakeRedis()
+        self.start = timezone.now() - timedelta(hours=1)
+        self.bump = self.enterContext(mock.patch('devices.automations.bump_state_version'))
+
+    def feed(self, offset, humidity):
+        automations.run_automations(self.client_redis, self.source, [
+            TelemetryData(device=self.source, humidity_percent=humidity, timestamp=self.start + timedelta(seconds=offset)),
+        ])
+        return CommandDelivery.objects.filter(device=self.target, source='automation').count()
+
+    def test_dispara_somente_na_borda_de_subida(self):
+        self.assertEqual(self.feed(0, 65), 0)
+        self.assertEqual(self.feed(60, 75), 1)
+        # Condição mantida: nenhum comando novo
+        self.assertEqual(self.feed(120, 80), 1)
+        self.assertEqual(self.feed(180, 72), 1)
+
+        self.target.refresh_from_db()
+        self.assertEqual(json.loads(self.target.pending_command), {'action': 'ligar_rele'})
+        self.assertEqual(self.target.command_delivery.source, 'automation')
+        self.assertEqual([call.args[0].pk for call in self.bump.call_args_list], [self.target.pk])
+
+        # A condição deixa de valer e volta: dispara de novo
+        self.assertEqual(self.feed(240, 60), 1)
+        self.assertEqual(self.feed(300, 71), 2)
+        self.assertEqual(self.bump.call_count, 2)
+
+    def test_primeira_leitura_ja_na_condicao_dispara(self):
+        self.assertEqual(self.feed(0, 90), 1)
+        self.assertEqual(self.feed(60, 90), 1)
+
+
+# ==============================================================================
+# 11. DETECÇÃO DE LEITURAS ANÔMALAS (devices/anomalies.py)
+# ==============================================================================
+ANOMALY_TEST = {
+    **settings.ANOMALY_DETECTION,
+    'STUCK_READINGS': 5,
+    'MIN_SAMPLES': 10,
+    'SPIKE_MAX_RUN': 3,
+}
+STUCK, RANGE, SPIKE = TelemetryData.ANOMALY_STUCK, TelemetryData.ANOMALY_RANGE, TelemetryData.ANOMALY_SPIKE
+HUMIDITY_SHIFT = TelemetryData.ANOMALY_METRIC_SHIFT['humidity_percent']
+
+
+@override_settings(ANOMALY_DETECTION_ENABLED=True, ANOMALY_DETECTION=ANOMALY_TEST)
+class AnomalyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.device = Device(pk=1, device_id='ESP_ANOMALIA')
+        self.redis = FakeRedis()
+        self.enterContext(mock.patch('devices.anomalies.get_redis', return_value=self.redis))
+        self.start = timezone.now() - timedelta(hours=1)
+        self.count = 0
+
+    def flags(self, *temperatures, humidity=None):
+        """Uma requisição com as leituras dadas; devolve o anomaly_flags de cada uma."""
+        readings = []
+        for temperature in temperatures:
+            self.count += 1
+            readings.append(TelemetryData(
+                temperature_celsius=temperature, humidity_percent=humidity,
+                timestamp=self.start + timedelta(seconds=30 * self.count),
+            ))
+        flag_readings(self.device, readings)
+        return [reading.anomaly_flags for reading in readings]
+
+    @staticmethod
+    def noise(count):
+        # Valores entre 21.4 e 22.6, sem repetição consecutiva
+        return [22 + 0.3 * ((i * 7) % 5 - 2) for i in range(count)]
+
+    def test_pico_ignorado_no_aquecimento(self):
+        self.assertEqual(self.flags(*self.noise(5), 40.0), [0] * 6)
+
+    def test_pico_apos_o_aquecimento(self):
+        # Estado guardado no Redis entre as requisições
+        self.assertEqual(self.flags(*self.noise(15)), [0] * 15)
+        self.assertEqual(self.flags(40.0, 22.0), [SPIKE, 0])
+        # Pico marcado não entra nas estatísticas
+        reading = TelemetryData(temperature_celsius=40.0, anomaly_flags=SPIKE)
+        self.assertIsNone(reading.metric_value('temperature_celsius'))
+
+    def test_pico_persistente_vira_novo_patamar(self):
+        self.flags(*self.noise(15))
+        self.assertEqual(self.flags(30.0, 30.1, 30.2, 30.0), [SPIKE, SPIKE, 0, 0])
+
+    def test_fora_da_faixa(self):
+        self.assertEqual(self.flags(85.0, -41.0, 22.0), [RANGE, RANGE, 0])
+        self.assertEqual(self.flags(22.3, humidity=120.0), [RANGE << HUMIDITY_SHIFT])
+        self.assertEqual(self.flags(90.0, humidity=-1.0), [RANGE | RANGE << HUMIDITY_SHIFT])
+
+    def test_sensor_travado(self):
+        self.assertEqual(self.flags(*[23.5] * 7), [0, 0, 0, 0, STUCK, STUCK, STUCK])
+        # Um valor diferente encerra a sequência
+        self.assertEqual(self.flags(23.6, 23.6), [0, 0])
+
+    def test_redis_fora_do_ar_nao_marca(self):
+        with mock.patch('devices.anomalies.get_redis', side_effect=redis.ConnectionError('recusado')):
+            with self.assertLogs('devices.anomalies', 'WARNING'):
+                self.assertEqual(self.flags(85.0), [0])
+
+
+# ==============================================================================
+# 12. ESCOPO POR SITE (devices/sites.py)
+# ==============================================================================
+class SiteScopeTests(DeviceAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.norte = Site.objects.create(name='Norte', slug='norte')
+        self.sul = Site.objects.create(name='Sul', slug='sul')
+        Device.objects.filter(pk=self.device.pk).update(site=self.norte)
+        self.device.refresh_from_db()
+        self.other = Device.objects.create(device_id='ESP_SUL', name='Sul', site=self.sul)
+
+    def run_for(self, site):
+        task = ScheduledTask.objects.create(
+            name=f'Tarefa {site}', command_json={'action': 'ligar_rele'}, execution_time=timezone.now(), site=site,
+        )
+        return TaskRun.objects.create(task=task, scheduled_for=timezone.now(), status='RUNNING')
+
+    def test_todos_os_sites_somente_para_superusuarios(self):
+        operator = User.objects.create_user('operador', is_staff=True)
+        self.assertEqual(user_site_ids(operator), set())
+        self.norte.users.add(operator)
+        self.assertEqual(user_site_ids(User.objects.get(pk=operator.pk)), {self.norte.pk})
+
+        self.assertIsNone(user_site_ids(User.objects.create_superuser('admin', 'admin@example.com', 'senha')))
+        self.assertIsNone(user_site_ids(CeleryUser()))
+        self.assertEqual(user_site_ids(AnonymousUser()), set())
+        self.assertEqual(user_site_ids(self.device), {self.norte.pk})
+
+    def test_dashboard_exige_login_e_filtra_pelo_site(self):
+        response = self.client.get('/devices/dashboard/')
+        self.assertRedirects(response, f"{reverse('admin:login')}?next=/devices/dashboard/")
+
+        operator = User.objects.create_user('operador', is_staff=True)
+        self.client.force_login(operator)
+        self.assertEqual(list(self.client.get('/devices/dashboard/').context['devices']), [])
+
+        self.sul.users.add(operator)
+        self.assertEqual(list(self.client.get('/devices/dashboard/').context['devices']), [self.other])
+
+    def test_execucao_de_outro_site_recusada(self):
+        data = {'pending_command': json.dumps({'action': 'ligar_rele'}), 'command_run': self.run_for(self.sul).pk}
+        response = self.client.patch(
+            f'/api/devices/{self.device_id}/', json.dumps(data),
+            content_type='application/json', **self.auth(CELERY_MASTER_TOKEN),
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('command_run', response.json())
+
+        # Pelo token do próprio dispositivo também
+        response = self.client.put(
+            f'/api/devices/{self.device_id}/', json.dumps(data), content_type='application/json', **self.auth(),
+        )
+        self.assertEqual(response.status_code, 400)
+        self.device.refresh_from_db()
+        self.assertIsNone(self.device.pending_command)
+
+        for site in (self.norte, None):
+            data['command_run'] = self.run_for(site).pk
+            response = self.client.patch(
+                f'/api/devices/{self.device_id}/', json.dumps(data),
+                content_type='application/json', **self.auth(CELERY_MASTER_TOKEN),
+            )
+            self.assertEqual(response.status_code, 200)
+
+
+# ==============================================================================
+# 13. VERIFICAÇÃO DAS TAREFAS AGENDADAS (check_scheduled_tasks)
+# ==============================================================================
+@override_settings(SCHEDULER_SHARDS=1)
+class CheckScheduledTasksTests(TestCase):
+
+    def setUp(self):
+        # Quarta-feira, 10:00:30 no horário local
+        self.now = timezone.make_aware(datetime(2026, 3, 4, 10, 0, 30))
+        self.enterContext(mock.patch('django.utils.timezone.now', return_value=self.now))
+        self.enterContext(mock.patch('devices.tasks.get_queue_depths', return_value={}))
+        self.delay = self.enterContext(mock.patch('devices.tasks.process_scheduled_task.delay'))
+        self.redis = FakeRedis()
+        self.enterContext(mock.patch('devices.tasks.get_redis', return_value=self.redis))
+
+        command = {'action': 'ligar_rele'}
+        self.unique = ScheduledTask.objects.create(
+            name='Única', command_json=command, execution_time=self.now - timedelta(minutes=1),
+        )
+        self.recurrent = ScheduledTask.objects.create(
+            name='Recorrente', command_json=command, execution_time=self.now, is_recurrent=True,
+            recurrent_time=datetime(2026, 3, 4, 10, 0).time(), recurrent_days='1,2,3,4,5',
+        )
+
+    def dispatched(self):
+        return sorted(call.args[0] for call in self.delay.call_args_list)
+
+    def test_tick_repetido_ignorado_pela_deduplicacao(self):
+        self.assertEqual(check_scheduled_tasks(), 2)
+        # Segunda instância do Beat no mesmo minuto
+        self.assertEqual(check_scheduled_tasks(), 0)
+        self.assertEqual(self.dispatched(), [self.unique.pk, self.recurrent.pk])
+        self.assertEqual(TaskRun.objects.count(), 2)
+
+    def test_sem_redis_a_reivindicacao_no_banco_evita_o_envio_duplicado(self):
+        with mock.patch('devices.tasks.get_redis', side_effect=redis.ConnectionError('recusado')):
+            with self.assertLogs('devices.tasks', 'WARNING'):
+                self.assertEqual(check_scheduled_tasks(), 2)
+                self.assertEqual(check_scheduled_tasks(), 0)
+        self.assertEqual(self.dispatched(), [self.unique.pk, self.recurrent.pk])
+        self.assertEqual(
+            sorted(TaskRun.objects.values_list('task_id', 'scheduled_for')),
+            [(self.unique.pk, self.unique.execution_time),
+             (self.recurrent.pk, timezone.make_aware(datetime(2026, 3, 4, 10, 0)))],
+        )
+
+    def test_verificacao_concorrente_reivindica_cada_tarefa_uma_vez(self):
+        # Sem o Redis, uma segunda verificação roda enquanto a primeira enfileira a tarefa
+        # única: a recorrente já foi lida pela primeira, mas é enfileirada só pela segunda
+        def concurrent_check(task_pk, run_pk):
+            if self.delay.call_count == 1:
+                self.assertEqual(check_scheduled_tasks(), 1)
+
+        self.delay.side_effect = concurrent_check
+        with mock.patch('devices.tasks.get_redis', side_effect=redis.ConnectionError('recusado')):
+            with self.assertLogs('devices.tasks', 'INFO') as logs:
+                self.assertEqual(check_scheduled_tasks(), 1)
+        self.assertEqual(self.dispatched(), [self.unique.pk, self.recurrent.pk])
+        self.assertEqual(TaskRun.objects.count(), 2)
+        self.assertTrue(any('já enfileirada por outra instância' in line for line in logs.output))
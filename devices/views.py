@@ -3,16 +3,31 @@ from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAdminUser
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.shortcuts import render 
-from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+import json
 
-from .models import Device, TelemetryData
-from .serializers import DeviceSerializer, TelemetryDataSerializer
-from core_system.authentication import TokenAuthentication
+from .models import Device, ScheduledTask, Site, TelemetryData
+from .serializers import DeviceSerializer, TelemetryDataSerializer, TelemetryBatchSerializer
+from .polling import compute_next_poll_in, due_soon_tasks
+from .commands import record_command_ack, record_command_delivery
+from .dashboard import TIMEOUT_MINUTES, attach_cards, load_dashboard
+from .fleet import get_fleet_summary
+from .sites import scope_queryset
+from core_system import ratelimit
+from core_system.authentication import TokenAuthentication, CeleryUser
+from core_system.db_router import replica_reads
 from django.db.models import F
+from django.db.models.expressions import RawSQL
 from decouple import config
 
 # ==============================================================================
@@ -38,14 +53,13 @@ class DeviceViewSet(viewsets.ModelViewSet):
         # Lógica de segurança: O dispositivo só pode ver o próprio registro,
         # A MENOS QUE seja o Celery Worker (Token Mestre) ou Admin.
 
-        if self.request.user is None and self.request.auth is not None:
-             # Se o self.request.user é None, mas a autenticação foi bem-sucedida,
-             # significa que o Token Mestre foi usado.
+        if isinstance(self.request.user, CeleryUser):
+             # O Token Mestre autentica como CeleryUser (ver core_system.authentication)
              return Device.objects.all()
 
         # Dispositivo Individual: Só pode ver e modificar o próprio registro.
         if self.request.user and isinstance(self.request.user, Device):
-            return Device.objects.filter(pk=self.request.user.pk)
+            return Device.objects.filter(pk=self.request.user.pk).select_related('command_run')
         
         return Device.objects.none() # Nenhuma outra requisição deve ter acesso.
 
@@ -54,15 +68,20 @@ class DeviceViewSet(viewsets.ModelViewSet):
         device = self.get_object()
         
         # 1. ATUALIZAÇÃO DO STATUS: OCORRE APENAS SE HOUVE COMUNICAÇÃO
+        # (o is_active fica com a máquina de estados de presença, devices/presence.py)
         device.last_seen = timezone.now()
         device.ip_address = request.META.get('REMOTE_ADDR')
-        
-        # Reativa se estava inativo, pois acabou de se comunicar
-        if not device.is_active:
-             device.is_active = True
-             print(f"Dispositivo {device.device_id} reativado com sucesso.")
+
+        # Primeira consulta que recebe o comando pendente: registra a entrega
+        command_delivered = bool(device.pending_command) and device.command_delivered_at is None
+        if command_delivered:
+            device.command_delivered_at = device.last_seen
             
-        device.save()
+        # Sem o is_active: não sobrescreve uma transição gravada pela tarefa de presença
+        device.save(update_fields=['last_seen', 'ip_address', 'command_delivered_at'])
+
+        if command_delivered:
+            record_command_delivery(device)
         
         # 2. Prepara a resposta (o restante é o mesmo)
         response_data = {
@@ -77,6 +96,9 @@ class DeviceViewSet(viewsets.ModelViewSet):
         if device.pending_command:
             response_data["status"] = "command_pending"
             response_data["command"] = device.pending_command
+
+        # 4. Sugestão do servidor para a próxima consulta (segundos)
+        response_data["next_poll_in"] = compute_next_poll_in(device)
             
         return Response(response_data)
     
@@ -104,6 +126,12 @@ class DeviceViewSet(viewsets.ModelViewSet):
         instance = self.get_object()
         serializer = self.get_serializer(instance, data=request.data, partial=True)
 
+        # Confirmação do comando pelo próprio ESP: last_command sem um novo pending_command
+        acking = (
+            isinstance(request.user, Device) and 'last_command' in request.data
+            and not request.data.get('pending_command') and instance.command_delivery_id
+        )
+
         # --- PONTO CRÍTICO DE DEBUG ---
         if not serializer.is_valid():
             # **Imprime o erro de validação detalhado no log do Docker Web**
@@ -113,6 +141,8 @@ class DeviceViewSet(viewsets.ModelViewSet):
         # -----------------------------
 
         self.perform_update(serializer)
+        if acking:
+            record_command_ack(instance, timezone.now())
 
         if getattr(instance, '_prefetched_objects_cache', None):
             # Se 'prefetch_related' foi usado, recarregue a instância
@@ -120,6 +150,92 @@ class DeviceViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.data)
 
+# ==============================================================================
+# 1.1 CONSULTA DE COMANDOS SEM O DRF (GET /api/devices/<id>/ DO PRÓPRIO ESP)
+# ==============================================================================
+# É a requisição mais frequente do sistema (cada ESP a cada ~10s). Em vez de passar
+# por negociação de conteúdo, autenticação, get_queryset/get_object e device.save()
+# de todas as colunas, um único UPDATE ... RETURNING registra o heartbeat, marca a
+# entrega do comando pendente e devolve o que a resposta precisa, inclusive se há
+# uma tarefa agendada prestes a disparar (EXISTS no RETURNING). O contrato (URL,
+# token e JSON) é o mesmo do DeviceViewSet.retrieve; os demais métodos e os GETs de
+# outros clientes (ex: Celery, token de outro dispositivo) continuam no DRF.
+
+_drf_device_detail = DeviceViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+})
+
+_device_table = Device._meta.db_table
+POLL_SQL = f"""
+    UPDATE {_device_table}
+    SET last_seen = %s, ip_address = %s,
+        command_delivered_at = CASE
+            WHEN pending_command IS NOT NULL AND command_delivered_at IS NULL THEN %s
+            ELSE command_delivered_at END
+    WHERE device_id = %s
+    RETURNING id, device_id, device_type, location, pending_command,
+              command_run_id, command_issued_at, command_delivered_at, command_delivery_id,
+              EXISTS ({{}}) AS task_due_soon
+"""
+
+
+def _due_soon_sql(now):
+    """Subconsulta (SQL, parâmetros) das tarefas prestes a disparar do dispositivo atualizado."""
+    links = ScheduledTask.devices.through.objects.filter(
+        # Correlacionada com a linha do UPDATE
+        device_id=RawSQL(f'{_device_table}.id', ()),
+        scheduledtask__in=due_soon_tasks(now, settings.DEVICE_POLL['DUE_SOON_WINDOW_SECONDS']),
+    ).values('pk')
+    return links.query.sql_with_params()
+
+
+@csrf_exempt
+def device_poll(request, device_id):
+    """GET do ESP: uma query para o heartbeat e o comando pendente; o resto segue para o DRF."""
+    auth_type, _, token = request.headers.get('Authorization', '').partition(' ')
+    if (request.method != 'GET' or not settings.DEVICE_POLL_FAST_PATH
+            or auth_type.lower() != 'token' or token.strip() != device_id):
+        return _drf_device_detail(request, device_id=device_id)
+
+    now = timezone.now()
+    ip_address = request.META.get('REMOTE_ADDR')
+    # raw() converte as colunas devolvidas (datas, JSON) como em uma consulta comum
+    due_soon_sql, due_soon_params = _due_soon_sql(now)
+    rows = list(Device.objects.db_manager(DEFAULT_DB_ALIAS).raw(
+        POLL_SQL.format(due_soon_sql), [now, ip_address, now, device_id, *due_soon_params],
+    ))
+    if not rows:
+        # Token inexistente: mesma resposta de erro da autenticação do DRF
+        return _drf_device_detail(request, device_id=device_id)
+    device = rows[0]
+    device.last_seen = now
+    device.ip_address = ip_address
+    ratelimit.remember_device_type(device_id, device.device_type)
+
+    # Primeira consulta que recebe o comando pendente: registra a entrega
+    if device.pending_command and device.command_delivered_at == now:
+        record_command_delivery(device)
+
+    return HttpResponse(encode_poll_response(device), content_type='application/json')
+
+
+def encode_poll_response(device):
+    """JSON da resposta (mesmos campos e formato de datas do DeviceViewSet.retrieve)."""
+    last_seen = device.last_seen.isoformat()
+    if last_seen.endswith('+00:00'):
+        last_seen = last_seen[:-6] + 'Z'
+    response_data = {
+        "device_id": device.device_id,
+        "status": "command_pending" if device.pending_command else "no_command",
+        "last_seen": last_seen,
+        "ip_address": device.ip_address,
+        "pending_command": device.pending_command,
+    }
+    if device.pending_command:
+        response_data["command"] = device.pending_command
+    response_data["next_poll_in"] = compute_next_poll_in(device, task_due_soon=bool(device.task_due_soon))
+    return json.dumps(response_data, ensure_ascii=False, separators=(',', ':')).encode()
+
 
 # ==============================================================================
 # 2. VIEWSET PARA RECEBER TELEMETRIA (Autenticado pelo Token do ESP)
@@ -152,46 +268,65 @@ class TelemetryDataViewSet(viewsets.ModelViewSet):
             status=status.HTTP_201_CREATED, 
             headers=headers
         )
+
+    # POST em lote (store-and-forward): o ESP acumula leituras enquanto está
+    # offline ou até encher o buffer e envia tudo em uma única requisição.
+    def batch(self, request, *args, **kwargs):
+        serializer = TelemetryBatchSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        records = serializer.save()
+
+        return Response(
+            {
+                "message": "Lote de telemetria recebido e processado com sucesso.",
+                "received": len(records),
+            },
+            status=status.HTTP_201_CREATED
+        )
     
 
+# ==============================================================================
+# 3. RESUMO DA FROTA (GET /api/fleet/summary/[?site=<slug>], OPERADORES DO ADMIN)
+# ==============================================================================
+class FleetSummaryView(APIView):
+    """
+    Online/offline e temperatura média por localização e por tipo, e tarefas do dia,
+    lidos da tabela FleetSummary (devices/fleet.py). Sessão do Admin, usuários staff;
+    cada usuário vê apenas os próprios sites.
+    """
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        site = None
+        if request.query_params.get('site'):
+            site = get_object_or_404(scope_queryset(Site.objects.all(), request.user, 'pk'),
+                                     slug=request.query_params['site'])
+        return Response(get_fleet_summary(request.user, site))
+
+
 # Lógica para a Interface Web (Visualização)
+@login_required(login_url='admin:login')
+@replica_reads
 def device_dashboard(request):
     """
     Exibe uma lista de dispositivos, seus dados mais recentes e status.
     Esta é a view principal para o dashboard web.
+    As leituras vão para a réplica (se configurada); o status vem da máquina de estados de presença.
+    Exige login (o do Admin); mostra apenas os sites do usuário (devices/sites.py) e,
+    com ?site=<slug>, um único site.
+    Dados e cartões vêm do cache quando nada mudou (devices/dashboard.py).
     """
-    
-    # 1. Pré-processamento e Sincronização de Status
-    timeout_minutes = 5
-    timeout_threshold = timezone.now() - timedelta(minutes=timeout_minutes)
-
-    devices_list = []
-    
-    for device in Device.objects.all():
-        
-        # Replicando a lógica de inativação do Admin para o Dashboard
-        if device.last_seen < timeout_threshold and device.is_active:
-             device.is_active = False
-             device.save(update_fields=['is_active']) 
-        
-        # Define as propriedades dinâmicas usadas no template e para ordenação local
-        device.is_online = device.is_active
-        device.latest_telemetry = TelemetryData.objects.filter(device=device).order_by('-timestamp').first()
-        
-        devices_list.append(device)
+    data = load_dashboard(request.user, request.GET.get('site'))
+    # Só os cartões alterados desde a última renderização consultam a telemetria
+    attach_cards(data['devices'])
 
-    # 2. ORDENAÇÃO FINAL (Em memória, pois as propriedades dinâmicas foram adicionadas)
-    # Ordena: 
-    #   a) Por is_online (False=0, True=1). O sinal de menos (-) inverte, colocando True (1) primeiro.
-    #   b) Secundariamente, pelo nome.
-    
-    # Usamos uma função lambda com key para ordenar com base nas propriedades adicionadas ao objeto
-    devices_list.sort(key=lambda d: (-d.is_online, d.name))
-    
-    
     context = {
-        'devices': devices_list,
-        'timeout_minutes': timeout_minutes,
+        'devices': data['devices'],
+        'timeout_minutes': TIMEOUT_MINUTES,
+        'sites': data['sites'],
+        'current_site': data['current_site'],
+        'summary': data['summary'],
     }
 
     return render(request, 'devices/dashboard.html', context)
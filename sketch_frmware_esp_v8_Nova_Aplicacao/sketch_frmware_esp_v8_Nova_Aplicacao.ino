@@ -8,8 +8,11 @@
   1. Conexão com rede Wi-Fi.
   2. Leitura de sensores DHT11.
   3. Envio de dados de telemetria (temperatura, umidade, estado de relé)
-     para o servidor Django.
-  4. Verificação periódica de comandos pendentes no servidor Django.
+     para o servidor Django, com store-and-forward: as leituras são
+     acumuladas em um buffer circular na RAM (com transbordo para a LittleFS)
+     e enviadas em lote quando o buffer enche ou quando a conexão volta.
+  4. Verificação periódica de comandos pendentes no servidor Django, no
+     intervalo sugerido pelo servidor (campo `next_poll_in` da resposta).
   5. Execução de comandos recebidos, como:
      - Acionamento de relés.
      - Envio de sinais infravermelho (IR) para ar-condicionado.
@@ -29,6 +32,10 @@
 // Processamento de dados JSON para comunicação com a API
 #include <ArduinoJson.h>
 
+// Sistema de arquivos da flash (transbordo do buffer de telemetria) e relógio (NTP)
+#include <LittleFS.h>
+#include <time.h>
+
 // Sensores e periféricos
 #include <DHT.h> // Sensor de temperatura e umidade
 #include <IRremoteESP8266.h> // Transmissor infravermelho
@@ -98,15 +105,56 @@ String lastExecutedTarget = "Nenhum";
 // Variáveis para controle de tempo (timers)
 // O uso de `unsigned long` e `millis()` evita a paralisação do código com `delay()`.
 unsigned long lastSendMillis = 0;
-const unsigned long sendInterval = 60000; // Intervalo para enviar dados (60 segundos ou 10 minutos (600000) para produção)
+const unsigned long sendInterval = 60000; // Intervalo para registrar uma leitura no buffer (60 segundos ou 10 minutos (600000) para produção)
 unsigned long lastCheckCommandMillis = 0;
-const unsigned long checkCommandInterval = 10000; // Intervalo para checar comandos (10 segundos)
+unsigned long checkCommandInterval = 10000; // Intervalo para checar comandos (10 segundos até o servidor sugerir outro)
+const unsigned long minCheckCommandInterval = 2000;   // Limites para o intervalo sugerido pelo servidor
+const unsigned long maxCheckCommandInterval = 300000;
 unsigned long lastLedMillis = 0;
 const unsigned long ledInterval = 500; // Intervalo para piscar o LED (0.5 segundos) 
 
 // Variáveis (flag) de controle de estado para envio de dados
 bool shouldSendDataNow = LOW;
 
+// --- STORE-AND-FORWARD (BUFFER DE TELEMETRIA) ---
+// As leituras ficam em um buffer circular na RAM e são enviadas em lote
+// (POST /api/telemetry/batch/). Se o servidor/Wi-Fi estiver fora e o buffer
+// encher, o conteúdo é transbordado para um arquivo NDJSON na LittleFS.
+#define TELEMETRY_BUFFER_SIZE 20          // Capacidade do buffer circular (leituras)
+#define TELEMETRY_FLUSH_THRESHOLD 10      // Envia o lote ao atingir este número de leituras
+#define TELEMETRY_SPOOL_FILE "/telemetry.ndjson"  // Arquivo de transbordo
+#define TELEMETRY_SPOOL_OFFSET_FILE "/telemetry.off" // Posição já enviada do arquivo
+#define TELEMETRY_SPOOL_MAX_BYTES 262144  // Tamanho máximo do arquivo de transbordo (256 KB)
+#define BOOT_COUNTER_FILE "/boot.cnt"     // Contador de boots (valida o `millis()` das leituras)
+
+// Uma leitura de telemetria capturada (campos de texto com tamanho fixo para economizar heap)
+struct TelemetryReading {
+    uint32_t bootId;          // Boot em que a leitura foi feita
+    uint32_t capturedMillis;  // millis() no momento da leitura
+    uint32_t epoch;           // Horário (epoch UTC) via NTP; 0 se o relógio não sincronizou
+    int16_t temperature;
+    int16_t humidity;
+    bool relayState;
+    char buttonAction[32];
+    char executedAction[24];
+    char executedTarget[24];
+};
+
+TelemetryReading telemetryBuffer[TELEMETRY_BUFFER_SIZE];
+uint8_t bufferHead = 0;   // Índice da leitura mais antiga
+uint8_t bufferCount = 0;  // Quantidade de leituras no buffer
+TelemetryReading batchReadings[TELEMETRY_BUFFER_SIZE]; // Área de trabalho para montar um lote
+
+uint32_t bootId = 0;
+uint32_t spoolOffset = 0;     // Bytes do arquivo de transbordo já confirmados pelo servidor
+bool spoolHasData = false;    // Há leituras no arquivo de transbordo
+bool wasConnected = false;    // Detecta a volta da conexão Wi-Fi
+bool flushRequested = false;  // Envio imediato (mudança de estado: botão/comando)
+unsigned long lastFlushAttemptMillis = 0;
+const unsigned long flushRetryInterval = 30000; // Espera mínima entre tentativas após uma falha (30 segundos)
+const unsigned long flushMaxInterval = 600000;  // Envia o que houver no buffer pelo menos a cada 10 minutos
+bool lastFlushFailed = false;
+
 // Variáveis de flag para interrupção (volatile pois são modificadas em ISRs)
 volatile bool btnLigarPressed = LOW;
 volatile bool btnDesligarPressed = LOW;
@@ -216,60 +264,281 @@ void addAuthHeader(HTTPClient& http) {
 }
 
 /**
- * @brief Envia dados de sensores e estado para o servidor Django via requisição POST.
+ * @brief Lê (e incrementa) o contador de boots persistido na LittleFS.
+ * O `millis()` reinicia a cada boot; com o bootId sabemos se a idade de uma
+ * leitura ainda pode ser calculada a partir dele.
  */
-void sendDataToDjango() {
-  if (WiFi.status() == WL_CONNECTED) {
-    WiFiClient client;
-    HTTPClient http;
+void loadBootId() {
+  File f = LittleFS.open(BOOT_COUNTER_FILE, "r");
+  if (f) {
+    bootId = f.parseInt();
+    f.close();
+  }
+  bootId++;
 
-    String postUrl = String(djangoTelemetryUrl);
-    http.begin(client, postUrl);
-    http.addHeader("Content-Type", "application/json");
-    addAuthHeader(http);
+  f = LittleFS.open(BOOT_COUNTER_FILE, "w");
+  if (f) {
+    f.print(bootId);
+    f.close();
+  }
 
-    StaticJsonDocument<400> doc; // Aumentado para acomodar raw_data, caso necessário
+  // Retoma a posição do arquivo de transbordo já enviada antes do reboot
+  f = LittleFS.open(TELEMETRY_SPOOL_OFFSET_FILE, "r");
+  if (f) {
+    spoolOffset = f.parseInt();
+    f.close();
+  }
+  spoolHasData = LittleFS.exists(TELEMETRY_SPOOL_FILE);
+}
 
-    // Envio os dados básicos (o Django irá atualizar se houver mudança)
-    doc["name"] = txtname;
-    doc["device_type"] = txtdevice_type;
-    doc["location"] = txtnlocation;
+/**
+ * @brief Retorna o horário atual (epoch UTC) ou 0 se o NTP ainda não sincronizou.
+ */
+uint32_t currentEpoch() {
+  time_t now = time(nullptr);
+  return (now > 1600000000) ? (uint32_t)now : 0; // Antes de 2020 = relógio não sincronizado
+}
+
+/**
+ * @brief Salva a posição já enviada do arquivo de transbordo.
+ */
+void saveSpoolOffset() {
+  File f = LittleFS.open(TELEMETRY_SPOOL_OFFSET_FILE, "w");
+  if (f) {
+    f.print(spoolOffset);
+    f.close();
+  }
+}
+
+/**
+ * @brief Grava as leituras do buffer da RAM no arquivo de transbordo (NDJSON) e esvazia o buffer.
+ * Se o arquivo atingir o tamanho máximo, as leituras excedentes são descartadas.
+ */
+void spillBufferToFlash() {
+  File f = LittleFS.open(TELEMETRY_SPOOL_FILE, "a");
+  if (!f) {
+    Serial.println("Erro ao abrir o arquivo de transbordo. Leituras descartadas.");
+    bufferCount = 0;
+    return;
+  }
+
+  uint8_t dropped = 0;
+  for (uint8_t i = 0; i < bufferCount; i++) {
+    const TelemetryReading& r = telemetryBuffer[(bufferHead + i) % TELEMETRY_BUFFER_SIZE];
+
+    if (f.size() >= TELEMETRY_SPOOL_MAX_BYTES) {
+      dropped++;
+      continue;
+    }
+
+    StaticJsonDocument<256> line;
+    line["b"] = r.bootId;
+    line["m"] = r.capturedMillis;
+    line["e"] = r.epoch;
+    line["t"] = r.temperature;
+    line["h"] = r.humidity;
+    line["r"] = r.relayState;
+    line["a"] = r.buttonAction;
+    line["xa"] = r.executedAction;
+    line["xt"] = r.executedTarget;
+    serializeJson(line, f);
+    f.print('\n');
+  }
+  f.close();
+  spoolHasData = true;
+
+  Serial.printf("Buffer transbordado para a flash (%d leituras, %d descartadas).\n", bufferCount - dropped, dropped);
+  bufferHead = 0;
+  bufferCount = 0;
+}
+
+/**
+ * @brief Captura o estado atual (sensores, relé e ações) em uma leitura do buffer circular.
+ * Se o buffer estiver cheio (servidor/Wi-Fi fora), ele é transbordado para a flash antes.
+ */
+void captureReading() {
+  if (bufferCount == TELEMETRY_BUFFER_SIZE) {
+    spillBufferToFlash();
+  }
+
+  TelemetryReading& r = telemetryBuffer[(bufferHead + bufferCount) % TELEMETRY_BUFFER_SIZE];
+  r.bootId = bootId;
+  r.capturedMillis = millis();
+  r.epoch = currentEpoch();
+  r.temperature = temperature;
+  r.humidity = humidity;
+  r.relayState = rele1.state;
+  strlcpy(r.buttonAction, lastButtonAction.c_str(), sizeof(r.buttonAction));
+  strlcpy(r.executedAction, lastExecutedAction.c_str(), sizeof(r.executedAction));
+  strlcpy(r.executedTarget, lastExecutedTarget.c_str(), sizeof(r.executedTarget));
+  bufferCount++;
+
+  // AS AÇÕES JÁ FORAM REGISTRADAS NA LEITURA: LIMPA AS VARIÁVEIS
+  lastButtonAction = "Nenhum";
+  lastExecutedAction = "Nenhum";
+  lastExecutedTarget = "Nenhum";
+}
+
+/**
+ * @brief Envia um lote de leituras para o servidor Django (POST /api/telemetry/batch/).
+ * @param readings Array de leituras.
+ * @param count Quantidade de leituras no array.
+ * @return true se o servidor confirmou o recebimento (HTTP 2xx).
+ */
+bool postTelemetryBatch(const TelemetryReading readings[], uint8_t count) {
+  WiFiClient client;
+  HTTPClient http;
+
+  String postUrl = String(djangoTelemetryUrl) + "batch/";
+  http.begin(client, postUrl);
+  http.addHeader("Content-Type", "application/json");
+  addAuthHeader(http);
+
+  DynamicJsonDocument doc(512 + count * 320);
+
+  // Envio os dados básicos uma única vez por lote (o Django irá atualizar se houver mudança)
+  doc["name"] = txtname;
+  doc["device_type"] = txtdevice_type;
+  doc["location"] = txtnlocation;
+
+  JsonArray readingsArray = doc.createNestedArray("readings");
+  for (uint8_t i = 0; i < count; i++) {
+    const TelemetryReading& r = readings[i];
+    JsonObject item = readingsArray.createNestedObject();
 
     // Dados de Telemetria
-    doc["temperature_celsius"] = temperature; 
-    doc["humidity_percent"] = humidity;      
-    doc["relay_state_D1"] = rele1.state;
-    doc["last_button_action"] = lastButtonAction;
-    
-    // Adicionar dados brutos (Ações locais e remotas)
-    JsonObject raw_data_obj = doc.createNestedObject("raw_data");
-    raw_data_obj["last_button_action"] = lastButtonAction;
-    raw_data_obj["last_executed_action"] = lastExecutedAction;
-    raw_data_obj["last_executed_target"] = lastExecutedTarget;
-
-    String jsonString;
-    serializeJson(doc, jsonString);
-
-    Serial.print("Enviando dados: ");
-    Serial.println(jsonString);
-
-    int httpResponseCode = http.POST(jsonString);
-
-    if (httpResponseCode > 0) {
-      Serial.printf("HTTP Response code (POST): %d\n", httpResponseCode);
-      Serial.println(http.getString());
-      // LIMPA AS VARIÁVEIS DE AÇÃO APÓS O ENVIO BEM-SUCEDIDO
-      lastButtonAction = "Nenhum";
-      lastExecutedAction = "Nenhum";
-      lastExecutedTarget = "Nenhum";
-    } else {
-      Serial.printf("Error code (POST): %d\n", httpResponseCode);
-      Serial.printf("HTTP Error (POST): %s\n", http.errorToString(httpResponseCode).c_str());
+    item["temperature_celsius"] = r.temperature;
+    item["humidity_percent"] = r.humidity;
+    item["relay_state_D1"] = r.relayState;
+    item["last_button_action"] = r.buttonAction;
+
+    // Momento da leitura: epoch (NTP) ou idade calculada pelo millis() do mesmo boot
+    if (r.epoch > 0) {
+      item["ts"] = r.epoch;
+    } else if (r.bootId == bootId) {
+      item["age_ms"] = millis() - r.capturedMillis;
     }
-    http.end();
+
+    // Adicionar dados brutos (Ações locais e remotas)
+    JsonObject raw_data_obj = item.createNestedObject("raw_data");
+    raw_data_obj["last_button_action"] = r.buttonAction;
+    raw_data_obj["last_executed_action"] = r.executedAction;
+    raw_data_obj["last_executed_target"] = r.executedTarget;
+  }
+
+  String jsonString;
+  serializeJson(doc, jsonString);
+
+  Serial.printf("Enviando lote de telemetria (%d leituras).\n", count);
+
+  int httpResponseCode = http.POST(jsonString);
+  bool success = httpResponseCode >= 200 && httpResponseCode < 300;
+
+  if (httpResponseCode > 0) {
+    Serial.printf("HTTP Response code (POST): %d\n", httpResponseCode);
+    Serial.println(http.getString());
   } else {
-    Serial.println("Wi-Fi não conectado, não foi possível enviar dados.");
+    Serial.printf("Error code (POST): %d\n", httpResponseCode);
+    Serial.printf("HTTP Error (POST): %s\n", http.errorToString(httpResponseCode).c_str());
   }
+  http.end();
+
+  return success;
+}
+
+/**
+ * @brief Envia o conteúdo do arquivo de transbordo em lotes, a partir da última posição confirmada.
+ * @return true se o arquivo foi totalmente enviado (ou não existe).
+ */
+bool flushSpoolFile() {
+  if (!spoolHasData) {
+    return true;
+  }
+
+  File f = LittleFS.open(TELEMETRY_SPOOL_FILE, "r");
+  if (!f) {
+    return false;
+  }
+
+  while (true) {
+    f.seek(spoolOffset, SeekSet);
+
+    uint8_t count = 0;
+    while (count < TELEMETRY_BUFFER_SIZE && f.available()) {
+      String line = f.readStringUntil('\n');
+      StaticJsonDocument<256> lineDoc;
+      if (deserializeJson(lineDoc, line)) { continue; } // Linha corrompida: ignora
+
+      TelemetryReading& r = batchReadings[count++];
+      r.bootId = lineDoc["b"];
+      r.capturedMillis = lineDoc["m"];
+      r.epoch = lineDoc["e"];
+      r.temperature = lineDoc["t"];
+      r.humidity = lineDoc["h"];
+      r.relayState = lineDoc["r"];
+      strlcpy(r.buttonAction, lineDoc["a"] | "Nenhum", sizeof(r.buttonAction));
+      strlcpy(r.executedAction, lineDoc["xa"] | "Nenhum", sizeof(r.executedAction));
+      strlcpy(r.executedTarget, lineDoc["xt"] | "Nenhum", sizeof(r.executedTarget));
+    }
+    uint32_t nextOffset = f.position();
+
+    if (count > 0 && !postTelemetryBatch(batchReadings, count)) {
+      f.close();
+      return false;
+    }
+
+    spoolOffset = nextOffset;
+    saveSpoolOffset();
+
+    if (!f.available()) { break; }
+  }
+  f.close();
+
+  // Arquivo totalmente enviado: remove o transbordo e zera a posição
+  LittleFS.remove(TELEMETRY_SPOOL_FILE);
+  spoolHasData = false;
+  spoolOffset = 0;
+  saveSpoolOffset();
+  return true;
+}
+
+/**
+ * @brief Envia todas as leituras pendentes (primeiro as da flash, depois as da RAM).
+ * As leituras só são removidas após a confirmação do servidor.
+ */
+void flushTelemetry() {
+  if (WiFi.status() != WL_CONNECTED) {
+    Serial.println("Wi-Fi não conectado, leituras mantidas no buffer.");
+    lastFlushFailed = true;
+    return;
+  }
+
+  lastFlushAttemptMillis = millis();
+
+  // 1. Leituras mais antigas (transbordadas para a flash)
+  if (!flushSpoolFile()) {
+    lastFlushFailed = true;
+    return;
+  }
+
+  // 2. Leituras do buffer da RAM, em ordem cronológica
+  if (bufferCount > 0) {
+    uint8_t count = bufferCount;
+    for (uint8_t i = 0; i < count; i++) {
+      batchReadings[i] = telemetryBuffer[(bufferHead + i) % TELEMETRY_BUFFER_SIZE];
+    }
+
+    if (!postTelemetryBatch(batchReadings, count)) {
+      lastFlushFailed = true;
+      return;
+    }
+
+    // Remove apenas as leituras enviadas (novas leituras podem ter entrado no buffer)
+    bufferHead = (bufferHead + count) % TELEMETRY_BUFFER_SIZE;
+    bufferCount -= count;
+  }
+
+  lastFlushFailed = false;
 }
 
 /**
@@ -340,10 +609,16 @@ void receiveCommandsFromDjango() {
       if (httpResponseCode > 0) {
         String payload = http.getString();
 
-        StaticJsonDocument<400> doc;
+        StaticJsonDocument<512> doc;
         DeserializationError error = deserializeJson(doc, payload);
 
-        if (error) { return; }
+        if (error) { http.end(); return; }
+
+        // Intervalo sugerido pelo servidor para a próxima consulta (segundos)
+        if (doc.containsKey("next_poll_in")) {
+          unsigned long nextPollMillis = doc["next_poll_in"].as<unsigned long>() * 1000UL;
+          checkCommandInterval = constrain(nextPollMillis, minCheckCommandInterval, maxCheckCommandInterval);
+        }
 
         const char* status = doc["status"];
 
@@ -545,8 +820,19 @@ void tocarMelodia(int melody_and_durations[], int arraySize) {
 void setup() {
   Serial.begin(115200);
   delay(10);
+
+  // Inicializa a flash (transbordo do buffer de telemetria)
+  if (!LittleFS.begin()) {
+    Serial.println("Erro ao montar a LittleFS. O transbordo para a flash ficará indisponível.");
+  }
+  loadBootId();
+
   connectWiFi();
-  sendDataToDjango(); // Primeiro envio para registrar o IP e o Device no Django
+  configTime(0, 0, "pool.ntp.org", "time.nist.gov"); // Relógio em UTC para o timestamp das leituras
+  wasConnected = true;
+
+  captureReading();
+  flushTelemetry(); // Primeiro envio para registrar o IP e o Device no Django
 
   conf_GPIO_init();
   dht.begin();
@@ -576,12 +862,33 @@ void loop() {
     piscaLed();
   }
 
-  // Envia dados se o tempo sendInterval tiver passado OU se o estado foi alterado.
+  // Registra uma leitura se o tempo sendInterval tiver passado OU se o estado foi alterado.
   if ((currentMillis - lastSendMillis) >= sendInterval || shouldSendDataNow == HIGH) {
     //lastSendMillis = currentMillis; // Reseta o timer principal
     lastSendMillis = millis();
-    shouldSendDataNow = LOW; // Reseta a flag após o envio
-    sendDataToDjango();    
+    if (shouldSendDataNow == HIGH) {
+      flushRequested = true; // Mudança de estado: envia sem esperar o buffer encher
+    }
+    shouldSendDataNow = LOW; // Reseta a flag após o registro
+    captureReading();
+  }
+
+  // Envia o lote quando: houve mudança de estado, a conexão voltou, o buffer
+  // atingiu o limite ou o intervalo máximo passou. Após uma falha, respeita
+  // o intervalo de nova tentativa para não bloquear o loop.
+  bool connected = (WiFi.status() == WL_CONNECTED);
+  bool linkRestored = connected && !wasConnected;
+  wasConnected = connected;
+
+  bool hasPending = bufferCount > 0 || spoolHasData;
+  bool canRetry = !lastFlushFailed || (currentMillis - lastFlushAttemptMillis) >= flushRetryInterval;
+  bool flushDue = flushRequested || linkRestored
+                  || bufferCount >= TELEMETRY_FLUSH_THRESHOLD
+                  || (currentMillis - lastFlushAttemptMillis) >= flushMaxInterval;
+
+  if (connected && hasPending && flushDue && (canRetry || linkRestored)) {
+    flushRequested = false;
+    flushTelemetry();
   }
 
   // Verifica comandos do servidor em um intervalo específico
@@ -11,7 +11,9 @@
         '/admin/devices/telemetrydata/', // Lista de TelemetryData
         '/admin/devices/scheduledtask/', // Lista de ScheduledTask
         '/devices/dashboard/',           // Dashboard Web
-        '/admin/devices/device/',        // Lista de Device (Importante para garantir o heartbeat lá também)
+        '/admin/devices/device/',        // Lista de Device
+        '/admin/devices/taskrun/',       // Histórico de execuções das tarefas
+        '/admin/devices/alert/',         // Alertas disparados
     ];
 
     // 2. Definir os caminhos que NÃO DEVEM disparar o refresh (Páginas de Form)
@@ -28,13 +30,34 @@
         
         console.log(`Auto Refresh ativado: Recarregando a página a cada ${refreshInterval / 1000} segundos.`);
         
-        // Função para recarregar a página
+        // Não recarrega se o usuário estiver interagindo com a listagem
+        // (linhas selecionadas para uma ação ou digitando na busca/filtros)
+        function userIsInteracting() {
+            const selectedRows = document.querySelectorAll('input.action-select:checked').length > 0;
+            const active = document.activeElement;
+            const typing = active && ['INPUT', 'SELECT', 'TEXTAREA'].includes(active.tagName);
+            return selectedRows || typing;
+        }
+
+        // Função para recarregar a página (apenas com a aba visível: abas em segundo
+        // plano não geram consultas ao banco)
         function autoRefresh() {
+            if (document.visibilityState !== 'visible' || userIsInteracting()) {
+                return;
+            }
             window.location.reload(); 
         }
 
         // Configura o intervalo de tempo para a atualização
-        setInterval(autoRefresh, refreshInterval);
+        let timer = setInterval(autoRefresh, refreshInterval);
+
+        // Ao voltar para a aba, reinicia a contagem em vez de recarregar imediatamente
+        document.addEventListener('visibilitychange', function() {
+            if (document.visibilityState === 'visible') {
+                clearInterval(timer);
+                timer = setInterval(autoRefresh, refreshInterval);
+            }
+        });
     } else {
         console.log("Auto Refresh Desativado. Motivo: Página de formulário ou caminho não listado.");
     }